@@ -0,0 +1,53 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:33
+
+from django.db import DatabaseError, migrations, transaction
+
+TRIGRAM_INDEXES = {
+    'address_item_title_trgm': ('address_item', 'title'),
+    'address_item_sip_trgm': ('address_item', 'sip'),
+    'address_syncgroup_title_trgm': ('address_syncgroup', 'title'),
+}
+
+
+def add_trigram_indexes(apps, schema_editor):
+    """icontains-lookups in postgres use UPPER(field) LIKE UPPER(%s)"""
+    if 'postgres' not in schema_editor.connection.vendor:
+        return
+
+    try:
+        with transaction.atomic():
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except DatabaseError:  # no permission, index will not be used
+        return
+
+    for name, (table, column) in TRIGRAM_INDEXES.items():
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS {} ON {} USING gin (UPPER({}) gin_trgm_ops)'.format(name, table, column)
+        )
+
+
+def remove_trigram_indexes(apps, schema_editor):
+    if 'postgres' not in schema_editor.connection.vendor:
+        return
+
+    for name in TRIGRAM_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('address', '0022_merge_addressbook_groups'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='item',
+            index_together={('title', 'id')},
+        ),
+        migrations.AlterIndexTogether(
+            name='syncgroup',
+            index_together={('address_book', 'title')},
+        ),
+        migrations.RunPython(add_trigram_indexes, remove_trigram_indexes),
+    ]
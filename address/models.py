@@ -1,13 +1,15 @@
+import logging
 import re
 from collections import defaultdict
 from datetime import date
-from typing import Tuple, List, Union
+from time import monotonic
+from typing import Dict, Tuple, List, Union
 from xml.etree.ElementTree import ParseError
 
 from django.utils.translation import gettext_lazy as _
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
 from django.utils.timezone import now
 from mptt.managers import TreeManager
@@ -20,12 +22,14 @@ from mptt.models import MPTTModel, TreeForeignKey
 from shared.exceptions import format_exception
 from shared.serializers import ExcelCreateFileSerializer
 from shared.utils import (
-    maybe_update_or_create,
     maybe_update,
     partial_update,
     partial_update_or_create,
+    update_changed_fields,
 )
 
+logger = logging.getLogger(__name__)
+
 
 def new_key():
     import uuid
@@ -88,6 +92,8 @@ class AddressBook(models.Model):
         self.is_syncing = False
 
     def sync_source(self, source: 'Source'):
+        start = monotonic()
+
         if source.prefix:
             group = Group.objects.get_or_create_by_path(
                 None,
@@ -100,14 +106,17 @@ class AddressBook(models.Model):
                 address_book=self, source=source, parent=None, defaults=dict(title=source.prefix)
             )[0]
 
+        fetch_time = 0.0
+        changes = {}
         try:
             if source.nested_items:
                 root, children, items = source.get_items()
             else:
                 items = source.get_items()
                 children = []
+            fetch_time = monotonic() - start
 
-            self._sync_item_recursive(group, children, items)
+            changes = self._sync_item_recursive(group, children, items)
         except (ResponseError, AuthenticationError, ParseError) as e:
             source.sync_errors = format_exception(e)
         except Exception as e:
@@ -119,12 +128,31 @@ class AddressBook(models.Model):
         source.last_sync = now()
         source.save()
 
-    def _sync_item_recursive(self, to_group, sub_group_items, items, flatten_groups=False, delete_other=True):
+        logger.info(
+            'Synced address book %s source %s (%s) in %.2fs (fetch %.2fs): %s',
+            self.pk,
+            source.pk,
+            source.type,
+            monotonic() - start,
+            fetch_time,
+            changes or source.sync_errors,
+        )
+        return changes
 
-        valid_items = set()
+    def _sync_item_recursive(self, to_group, sub_group_items, items, flatten_groups=False, delete_other=True):
+        """
+        Apply items and groups from source to the stored groups. Items are compared to the
+        stored items by (group, external id) and changed using bulk operations, and the group
+        tree is rebuilt once. Returns number of changes
+        """
+        source = to_group.source
+
+        valid_items: Dict[Tuple[int, str], dict] = {}
         valid_groups = {to_group.pk}
+        item_groups = {to_group.pk: to_group}
+        changes = {'groups': 0, 'created': 0, 'updated': 0, 'deleted': 0}
 
-        existing_group_map = {g.external_id_str: g for g in Group.objects.filter(address_book=self, source=to_group.source)}
+        existing_group_map = {g.external_id_str: g for g in Group.objects.filter(address_book=self, source=source)}
 
         def _recurse(group, children, items):
 
@@ -133,14 +161,14 @@ class AddressBook(models.Model):
                 if not any([item.get('sip'), item.get('h323'), item.get('h323_e164')]):
                     continue
 
-                obj, created = maybe_update_or_create(Item, external_id_str=str(item.get('id') or ''), group=group, defaults={
+                values = {
                     'title': (item.get('name') or item.get('title') or '')[:255],
                     'sip': item.get('sip') or '',
                     'h323': item.get('h323') or '',
                     'h323_e164': item.get('h323_e164') or '',
-                })
-
-                valid_items.add(obj.id)
+                }
+                values['title'] = values['title'] or values['sip'] or values['h323'] or values['h323_e164']
+                valid_items[(group.pk, str(item.get('id') or ''))] = values
 
             for subgroup, subchildren, subitems in children:
                 if flatten_groups:
@@ -150,32 +178,73 @@ class AddressBook(models.Model):
                 cur_group = existing_group_map.get(str(subgroup.get('id') or ''))
                 defaults = dict(title=(subgroup.get('name') or subgroup.get('title') or '')[:255], parent=group)
                 if not cur_group:
-                    cur_group = maybe_update_or_create(Group,
-                                                         address_book=self, source=to_group.source,
-                                                         external_id_str=str(subgroup.get('id') or ''),
-                                                         defaults=defaults,
-                                                         )[0]
-                else:
-                    maybe_update(cur_group, defaults)
+                    cur_group = Group.objects.create(
+                        address_book=self,
+                        source=source,
+                        external_id_str=str(subgroup.get('id') or ''),
+                        **defaults,
+                    )
+                    existing_group_map[cur_group.external_id_str] = cur_group
+                    changes['groups'] += 1
+                elif maybe_update(cur_group, defaults):
+                    changes['groups'] += 1
 
                 valid_groups.add(cur_group.id)
+                item_groups[cur_group.id] = cur_group
                 _recurse(cur_group, subchildren, subitems)
 
-        _recurse(to_group, sub_group_items, items)
-
-        if delete_other:
-            if to_group.parent_id and to_group.parent.source_id != to_group.source_id:
-                raise ValueError('Cant sync to subgroup and delete other')
-            Item.objects.filter(group__source=to_group.source).exclude(pk__in=valid_items).delete()
-
-            parents = (
-                to_group.get_ancestors(include_self=True)
-                .filter(source=to_group.source)
-                .values_list('id', flat=True)
-            )
-            Group.objects.filter(source=to_group.source).exclude(pk__in=parents).exclude(
-                pk__in=valid_groups
-            ).delete()
+        if delete_other and to_group.parent_id and to_group.parent.source_id != to_group.source_id:
+            raise ValueError('Cant sync to subgroup and delete other')
+
+        parents = set(
+            to_group.get_ancestors(include_self=True)
+            .filter(source=source)
+            .values_list('id', flat=True)
+        )
+
+        with transaction.atomic():
+            with Group.objects.delay_mptt_updates():
+                _recurse(to_group, sub_group_items, items)
+
+                if delete_other:
+                    changes['groups'] += Group.objects.filter(source=source).exclude(pk__in=parents).exclude(
+                        pk__in=valid_groups
+                    ).delete()[1].get(Group._meta.label, 0)
+
+            existing_items: Dict[Tuple[int, str], Item] = {}
+            delete_ids = []
+            for obj in Item.objects.filter(group__source=source):
+                if (obj.group_id, obj.external_id_str) in existing_items:
+                    delete_ids.append(obj.pk)  # duplicate
+                else:
+                    existing_items[(obj.group_id, obj.external_id_str)] = obj
+
+            new_items = []
+            changed_items = []
+            for (group_id, external_id_str), values in valid_items.items():
+                obj = existing_items.pop((group_id, external_id_str), None)
+                if obj is None:
+                    new_items.append(Item(
+                        group_id=group_id,
+                        customer_id=item_groups[group_id].customer_id,
+                        external_id_str=external_id_str,
+                        **values,
+                    ))
+                elif update_changed_fields(obj, values):
+                    changed_items.append(obj)
+
+            Item.objects.bulk_create(new_items, batch_size=500)
+            Item.objects.bulk_update(changed_items, ['title', 'sip', 'h323', 'h323_e164'], batch_size=500)
+
+            if delete_other:
+                delete_ids.extend(obj.pk for obj in existing_items.values())
+                for i in range(0, len(delete_ids), 500):
+                    Item.objects.filter(pk__in=delete_ids[i:i + 500]).delete()
+                changes['deleted'] = len(delete_ids)
+
+        changes['created'] = len(new_items)
+        changes['updated'] = len(changed_items)
+        return changes
 
     def try_merge_groups(self):
         try:
@@ -310,9 +379,8 @@ class AddressBook(models.Model):
         if search_group_root:
             all_groups.append(search_group_root.id)
 
-        for parent in parent_groups:
-
-            descendants = parent.get_descendants(include_self=True)
+        if parent_groups:
+            descendants = SyncGroup.objects.get_queryset_descendants(parent_groups, include_self=True)
             all_groups.extend(descendants.values_list('id', flat=True))
 
         groups = SyncGroup.objects.filter(
@@ -343,43 +411,47 @@ class AddressBook(models.Model):
         return groups_without_root.order_by('title'), items.order_by('title')
 
     def limit_search(self, value, group_id=None, limit=20, last_id=None, offset=0):
-
+        """
+        Get a page of search results, groups first. last_id is the ext_id of the last
+        result of the previous page. Results are sorted by (title, id) to be able to
+        continue directly after it without going through the previous pages
+        """
         groups, items = self.search(value, group_id=group_id)
+        groups = groups.order_by('title', 'pk')
+        items = items.order_by('title', 'pk')
 
         limit = int(limit)
 
-        result = ([], [])
+        if last_id:
+            try:
+                groups, items = self._get_search_page_after(groups, items, last_id)
+            except (ValueError, IndexError):
+                return [], []
+        elif offset:
+            group_count = groups.count()
+            groups = groups[offset:]
+            items = items[max(0, offset - group_count):]
 
-        find_id = last_id or None
+        result_groups = list(groups[:limit])
+        if len(result_groups) >= limit:
+            return result_groups, []
 
-        i = 0
-        for group in groups:
-            i += 1
+        return result_groups, list(items[:limit - len(result_groups)])
 
-            if find_id is not None:
-                if group.ext_id == find_id:
-                    offset = i - 1
-                    find_id = None
-                continue
-            elif i - offset >= limit:
-                break
+    @staticmethod
+    def _get_search_page_after(groups, items, last_id):
 
-            result[0].append(group)
+        kind, pk = str(last_id).split('-', 1)
+        pk = int(pk)
 
-        for item in items:
-            i += 1
+        if kind == 'g':
+            title = groups.filter(pk=pk).values_list('title', flat=True)[0]
+            return groups.filter(Q(title__gt=title) | Q(title=title, pk__gt=pk)), items
+        elif kind == 'i':
+            title = items.filter(pk=pk).values_list('title', flat=True)[0]
+            return groups.none(), items.filter(Q(title__gt=title) | Q(title=title, pk__gt=pk))
 
-            if find_id is not None:
-                if item.ext_id == find_id:
-                    offset = i - 1
-                    find_id = None
-                continue
-            elif i - offset > limit:
-                break
-
-            result[1].append(item)
-
-        return result
+        raise ValueError('Invalid id: {}'.format(last_id))
 
     def copy(self, new_title=None, link_manual=True):
 
@@ -739,6 +811,9 @@ class SyncGroup(MPTTModel):
 
     separator = ' > '
 
+    class Meta:
+        index_together = (('address_book', 'title'),)
+
     @property
     def name_paths(self):
         current = self
@@ -885,6 +960,9 @@ class Item(models.Model):
     external_id_str = models.CharField(max_length=128, db_index=True, blank=True, editable=False)
     external_id = models.PositiveIntegerField(db_index=True, null=True, blank=True, editable=False)
 
+    class Meta:
+        index_together = (('title', 'id'),)
+
     @property
     def ext_id(self):
         "used for endpoint search result"
@@ -1,4 +1,6 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from address.models import AddressBook, Group, Item, SyncGroup
 from address.tests.test_sync import AddressBookTestBase
@@ -121,6 +123,45 @@ class SearchTest(AddressBookTestBase):
 
         self.book.limit_search('', self.subgroup.sync_group_id, limit=5, last_id=6)
 
+    def test_limit_pages(self):
+        for i in range(5):
+            Group.objects.create(title='Sub {}'.format(i % 2), parent=self.group, customer=self.customer)
+        for i in range(23):
+            Item.objects.create(group=self.subgroup, title='Paged {}'.format(i % 4), sip='paged{}@example.org'.format(i))
+
+        def _get_all(value, group_id=None):
+            groups, items = self.book.search(value, group_id)
+            return [g.ext_id for g in groups.order_by('title', 'pk')] + [i.ext_id for i in items.order_by('title', 'pk')]
+
+        def _get_pages(value, group_id=None, limit=7):
+            result = []
+            last_id = None
+            for _i in range(20):
+                with CaptureQueriesContext(connection) as queries:
+                    groups, items = self.book.limit_search(value, group_id, limit=limit, last_id=last_id)
+                self.assertLessEqual(len(queries), 8)  # independent of position and book size
+                page = [g.ext_id for g in groups] + [i.ext_id for i in items]
+                self.assertLessEqual(len(page), limit)
+                result.extend(page)
+                if len(page) < limit:
+                    return result
+                last_id = page[-1]
+            self.fail('Too many pages')
+
+        for value in ('', 'paged', 'sub', 'nr 1'):
+            all_results = _get_all(value)
+            self.assertEqual(_get_pages(value), all_results, value)
+            self.assertEqual(len(set(all_results)), len(all_results))
+
+        group_id = self.group.sync_group_id
+        self.assertEqual(_get_pages('', group_id, limit=3), _get_all('', group_id))
+        self.assertEqual(len(_get_pages('paged', group_id, limit=5)), 23)
+
+        groups, items = self.book.limit_search('', group_id, limit=3, last_id='i-0')
+        self.assertEqual((groups, items), ([], []))
+        groups, items = self.book.limit_search('', group_id, limit=3, last_id='invalid')
+        self.assertEqual((groups, items), ([], []))
+
     def test_tms_search(self):
 
         book = self.book
@@ -1,6 +1,8 @@
 from typing import Type
 
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from address.models import AddressBook, Group, Item, EPMSource, CMSUserSource, ManualSource, CMSCoSpaceSource, \
     VCSSource, ManualLinkSource, Source
@@ -127,3 +129,64 @@ class SyncTestCase(AddressBookTestBase):
 
     def test_sync_seevia(self):
         pass  # TODO
+
+
+class IncrementalSyncTestCase(AddressBookTestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.source = EPMSource.objects.create(address_book=self.book)
+        self.root = Group.objects.create(address_book=self.book, source=self.source, title='Synced')
+        self.book.is_syncing = True
+
+    def _get_snapshot(self, count=300, skip=(), rename=()):
+        def _items(prefix, ids):
+            return [
+                {'id': '{}{}'.format(prefix, i), 'name': 'Renamed' if i in rename else 'Item {}'.format(i),
+                 'sip': '{}{}@example.org'.format(prefix, i)}
+                for i in ids if i not in skip
+            ]
+
+        children = [
+            ({'id': 'g1', 'name': 'Group 1'}, [
+                ({'id': 'g2', 'name': 'Group 2'}, [], _items('c', range(150, count))),
+            ], []),
+        ]
+        return children, _items('r', range(150))
+
+    def _sync(self, *args, **kwargs):
+        children, items = self._get_snapshot(*args, **kwargs)
+        with CaptureQueriesContext(connection) as queries:
+            changes = self.book._sync_item_recursive(self.root, children, items)
+        return changes, len(queries)
+
+    def test_sync(self):
+        changes, _queries = self._sync()
+        self.assertEqual(changes['created'], 300)
+        self.assertEqual(changes['groups'], 2)
+
+        items = Item.objects.filter(group__source=self.source)
+        self.assertEqual(items.count(), 300)
+        self.assertEqual(set(items.values_list('customer', flat=True)), {self.customer.pk})
+
+        group2 = Group.objects.get(source=self.source, title='Group 2')
+        self.assertEqual(group2.get_ancestors().filter(source=self.source).count(), 2)
+        self.assertEqual(Item.objects.filter(group__in=self.root.get_descendants(include_self=True)).count(), 300)
+
+        # unchanged. no writes
+        changes, queries = self._sync()
+        self.assertEqual(changes, {'groups': 0, 'created': 0, 'updated': 0, 'deleted': 0})
+        self.assertLess(queries, 15)
+
+        changes, _queries = self._sync(count=310, skip={1, 2, 200}, rename={3, 250})
+        self.assertEqual(changes, {'groups': 0, 'created': 10, 'updated': 2, 'deleted': 3})
+        self.assertEqual(items.count(), 307)
+        self.assertEqual(items.filter(group=group2).count(), 159)
+        self.assertEqual(items.filter(title='Renamed').count(), 2)
+
+        self.book._sync_item_recursive(self.root, [], [])
+        self.assertFalse(items.exists())
+        self.assertEqual(Group.objects.filter(source=self.source).count(), 1)
+
+        # other sources are left untouched
+        self.assertTrue(Item.objects.filter(pk=self.item.pk).exists())
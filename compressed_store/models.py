@@ -100,6 +100,34 @@ class CompressedStoreManager(FastCountManager, CompressedContentMixin, models.Ma
         obj.save(force_insert=True)
         return obj
 
+    def store_many(self, items):
+        """
+        Store multiple objects using a single insert. Each item is a dict with the same
+        arguments as store(). Objects will only get a pk if the database backend supports it
+        """
+        objs = []
+        for item in items:
+            item = dict(item)
+            content = item.pop('content')
+            data, extra = self._split_extra(
+                ts_created=item.pop('ts_created', None) or localtime(),
+                **self._get_create_kwargs(content, **item))
+
+            obj = self.model(**data)
+            obj.content = content
+            obj.extra = extra
+            objs.append(obj)
+
+        if not objs:
+            return objs
+
+        if connections[self.db].features.can_return_ids_from_bulk_insert:
+            return self.bulk_create(objs)
+
+        for obj in objs:
+            obj.save(force_insert=True)
+        return objs
+
     def _get_archive_qs(self, ts_start=None, ts_stop=None, qs=None):
         if (ts_start, ts_stop, qs) == (None, None, None):
             raise ValueError('Filter is required')
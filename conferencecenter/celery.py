@@ -36,6 +36,8 @@ def get_task_routes():
         'endpoint.tasks.run_slow_task',
         'endpoint.tasks.update_all_endpoint_status',
         'endpoint.tasks.update_all_data',
+        'statistics.tasks.update_stats_rollup',
+        'room_analytics.tasks.clean_sensor_values',
     ]
 
     sync_tasks = [
@@ -59,6 +61,10 @@ def get_task_routes():
 
     cdr_tasks = [
         'statistics.tasks.handle_acano_cdr',
+        'statistics.tasks.drain_acano_cdr_stream',
+        'statistics.tasks.drain_pexip_event_stream',
+        'statistics.tasks.drain_cdr_streams',
+        'statistics.tasks.reconcile_live_call_state',
         'statistics.tasks.handle_pexip_cdr',
         'endpoint.tasks.handle_endpoint_event',
     ]
@@ -281,6 +287,14 @@ CELERYBEAT_SCHEDULE = {
                 'expires': 1 * 60 - 1,
             },
         },
+        'clean_sensor_values': {
+            'task': 'room_analytics.tasks.clean_sensor_values',
+            'schedule': timedelta(minutes=30),
+            'args': (),
+            'options': {
+                'expires': 30 * 60 - 1,
+            },
+        },
         'poll_ews': {
             'task': 'exchange.tasks.poll_ews',
             'schedule': timedelta(minutes=3),
@@ -297,6 +311,22 @@ CELERYBEAT_SCHEDULE = {
                 'expires': 3 * 60 - 1,
             },
         },
+        'drain_cdr_streams': {
+            'task': 'statistics.tasks.drain_cdr_streams',
+            'schedule': timedelta(seconds=10),
+            'args': (),
+            'options': {
+                'expires': 10 - 1,
+            },
+        },
+        'reconcile_live_call_state': {
+            'task': 'statistics.tasks.reconcile_live_call_state',
+            'schedule': timedelta(minutes=1),
+            'args': (),
+            'options': {
+                'expires': 60 - 1,
+            },
+        },
     }
 
 if not settings.CELERY_DISABLE_BEAT:
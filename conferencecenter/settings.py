@@ -61,6 +61,8 @@ EPM_PROXY_PORT_INTERVAL = [11000, 11500]
 EPM_PROXY_SERVER_PORT = int(env('MIVIDAS_PROXY_PORT') or 2222)
 EPM_PROXY_HOST = env('EPM_PROXY_HOST') or 'proxyserver'
 EPM_PROXY_AUTHORIZED_KEYS = env('EPM_PROXY_AUTHORIZED_KEYS') or '/home/epmproxy/.ssh/authorized_keys'
+EPM_STATUS_CONCURRENCY = int(env('EPM_STATUS_CONCURRENCY') or 50)  # Max number of endpoints polled for status at the same time
+EPM_STATUS_CUSTOMER_CONCURRENCY = int(env('EPM_STATUS_CUSTOMER_CONCURRENCY') or 20)  # Max per customer. Lowered automatically for slow or unreachable endpoints
 
 # EPM Security
 EPM_EVENT_CUSTOMER_SECRET = False  # Require customer secret key in event urls
@@ -138,6 +140,18 @@ CELERY_BROKER_TRANSPORT_OPTIONS = {
 }
 
 ASYNC_CDR_HANDLING = True  # Process cdr events from pexip/acano/endpoint using celery
+CDR_BATCH_HANDLING = env('CDR_BATCH_HANDLING', '') in ('1', 'true', 'True', 'yes')  # Buffer acano/pexip cdr events in redis streams and parse in batches
+CDR_BATCH_SIZE = int(env('CDR_BATCH_SIZE') or 500)  # Max number of cdr payloads per batch
+CDR_BATCH_PARTITIONS = int(env('CDR_BATCH_PARTITIONS') or 8)  # Number of pexip event streams, handled in parallel
+STATS_ROLLUP = env('STATS_ROLLUP', '') in ('1', 'true', 'True', 'yes')  # Maintain hourly call statistics and use them for dashboard graphs
+SENSOR_VALUE_RETENTION_DAYS = int(env('SENSOR_VALUE_RETENTION_DAYS') or 0)  # Delete raw room analytics sensor values older than this, 5 minute/hourly aggregates are kept. 0 = keep all
+LIVE_CALL_STATE = env('LIVE_CALL_STATE', '') in ('1', 'true', 'True', 'yes')  # Keep active calls/participants in redis for call control views and status counts
+
+# External API connections
+HTTP_POOL_HOSTS = int(env('HTTP_POOL_HOSTS') or 1000)  # Max number of hosts with kept-alive connections per process
+HTTP_POOL_MAXSIZE = int(env('HTTP_POOL_MAXSIZE') or 10)  # Max kept-alive connections per host
+HTTP_POOL_BLOCK = env('HTTP_POOL_BLOCK', '') in ('1', 'true', 'True', 'yes')  # Wait for a free connection instead of opening extra ones
+HTTP_POOL_IDLE_SECONDS = int(env('HTTP_POOL_IDLE_SECONDS') or 60)  # Close kept-alive connections after this time
 
 # Misc settings
 EXTENDED_API_KEYS = [k.strip() for k in env('EXTENDED_API_KEYS', '').split(',')]  # api keys with extra permissions
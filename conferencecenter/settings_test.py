@@ -1,5 +1,6 @@
 import django
 import os.path
+import tempfile
 
 os.environ.setdefault('FLAGS', 'core:enable_core,core:enable_epm,core:enable_analytics')
 os.environ.setdefault(
@@ -38,6 +39,11 @@ if os.path.exists('/tmp/'):
 else:
     TMP = os.path.dirname(os.path.abspath(__file__))
 
+# Keep uploaded files and compressed logs from test runs out of the source tree
+TEST_FILES_DIR = tempfile.mkdtemp(prefix='core_test_files_', dir=TMP)
+MEDIA_ROOT = os.path.join(TEST_FILES_DIR, 'media')
+LOG_DIR = os.path.join(TEST_FILES_DIR, 'cdrdata')
+
 if os.environ.get('SQLITE') == '1':
     DATABASES = {
         # 'default': {
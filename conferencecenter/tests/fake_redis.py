@@ -0,0 +1,168 @@
+def as_bytes(value):
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+class FakeRedis:
+    """In-memory subset of redis commands, for tests of code using a redis connection directly"""
+
+    def __init__(self):
+        self.data = {}
+        self.last_stream_id = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def exists(self, *names):
+        return sum(as_bytes(name) in self.data for name in names)
+
+    def set(self, name, value, ex=None, nx=False):
+        if nx and as_bytes(name) in self.data:
+            return None
+        self.data[as_bytes(name)] = as_bytes(value)
+        return True
+
+    def expire(self, name, time):
+        return as_bytes(name) in self.data
+
+    def delete(self, *names):
+        return sum(self.data.pop(as_bytes(name), None) is not None for name in names)
+
+    def _get(self, name, default):
+        return self.data.setdefault(as_bytes(name), default)
+
+    def _cleanup(self, name):
+        if not self.data.get(as_bytes(name)):
+            self.data.pop(as_bytes(name), None)
+
+    def hset(self, name, key, value):
+        self._get(name, {})[as_bytes(key)] = as_bytes(value)
+
+    def hincrby(self, name, key, amount=1):
+        value = int(self._get(name, {}).get(as_bytes(key), 0)) + amount
+        self.hset(name, key, value)
+        return value
+
+    def hsetnx(self, name, key, value):
+        self._get(name, {}).setdefault(as_bytes(key), as_bytes(value))
+
+    def hget(self, name, key):
+        return self.data.get(as_bytes(name), {}).get(as_bytes(key))
+
+    def hgetall(self, name):
+        return dict(self.data.get(as_bytes(name), {}))
+
+    def hmget(self, name, keys):
+        return [self.hget(name, key) for key in keys]
+
+    def hdel(self, name, *keys):
+        result = sum(self._get(name, {}).pop(as_bytes(key), None) is not None for key in keys)
+        self._cleanup(name)
+        return result
+
+    def sadd(self, name, *values):
+        self._get(name, set()).update(as_bytes(v) for v in values)
+
+    def srem(self, name, *values):
+        self._get(name, set()).difference_update(as_bytes(v) for v in values)
+        self._cleanup(name)
+
+    def smembers(self, name):
+        return set(self.data.get(as_bytes(name), set()))
+
+    def zadd(self, name, mapping):
+        self._get(name, {}).update((as_bytes(k), float(v)) for k, v in mapping.items())
+
+    def zrem(self, name, *values):
+        result = sum(self._get(name, {}).pop(as_bytes(v), None) is not None for v in values)
+        self._cleanup(name)
+        return result
+
+    def zscore(self, name, value):
+        return self.data.get(as_bytes(name), {}).get(as_bytes(value))
+
+    def zcard(self, name):
+        return len(self.data.get(as_bytes(name), {}))
+
+    def zcount(self, name, min, max):
+        def _score(value, default):
+            value = str(value)
+            if value in ('-inf', '+inf'):
+                return default, False
+            return float(value.lstrip('(')), value.startswith('(')
+
+        (low, low_open), (high, high_open) = _score(min, float('-inf')), _score(max, float('inf'))
+        return sum(
+            1 for v in self.data.get(as_bytes(name), {}).values()
+            if (low < v if low_open else low <= v) and (v < high if high_open else v <= high)
+        )
+
+    def zrange(self, name, start, end, withscores=False):
+        members = sorted(self.data.get(as_bytes(name), {}).items(), key=lambda item: (item[1], item[0]))
+        members = members[start:None if end == -1 else end + 1]
+        if withscores:
+            return members
+        return [k for k, _v in members]
+
+    def xadd(self, name, fields, maxlen=None, approximate=True):
+        stream = self._get(name, {})
+        self.last_stream_id += 1
+        entry_id = as_bytes('{}-0'.format(self.last_stream_id))
+        stream[entry_id] = {as_bytes(k): as_bytes(v) for k, v in fields.items()}
+        return entry_id
+
+    def xrange(self, name, count=None):
+        return list(self.data.get(as_bytes(name), {}).items())[:count]
+
+    def xdel(self, name, *ids):
+        result = sum(self._get(name, {}).pop(as_bytes(i), None) is not None for i in ids)
+        self._cleanup(name)
+        return result
+
+    def xlen(self, name):
+        return len(self.data.get(as_bytes(name), {}))
+
+    def lock(self, name, timeout=None):
+        return FakeLock(self, as_bytes(name))
+
+
+class FakeLock:
+
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+
+    def acquire(self, blocking=True):
+        if self.name in self.connection.data:
+            return False
+        self.connection.data[self.name] = b'1'
+        return True
+
+    def reacquire(self):
+        from redis.exceptions import LockNotOwnedError
+
+        if self.name not in self.connection.data:
+            raise LockNotOwnedError()
+
+    def release(self):
+        from redis.exceptions import LockNotOwnedError
+
+        if self.connection.data.pop(self.name, None) is None:
+            raise LockNotOwnedError()
+
+
+class FakePipeline:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.commands = []
+
+    def __getattr__(self, name):
+        def _queue(*args, **kwargs):
+            self.commands.append((getattr(self.connection, name), args, kwargs))
+            return self
+        return _queue
+
+    def execute(self):
+        result = [fn(*args, **kwargs) for fn, args, kwargs in self.commands]
+        self.commands = []
+        return result
@@ -0,0 +1,183 @@
+import logging
+import re
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from customer.models import CustomerMatch  # noqa
+
+logger = logging.getLogger(__name__)
+
+# Patterns which can't be safely merged into a combined alternation, e.g. numbered
+# backreferences, conditional groups or global inline flags that must be at the start
+UNMERGEABLE_RE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(|\(\?[aiLmsux]+\)')
+
+MAX_BAND_SIZE = 500
+
+
+class _TrieNode:
+    __slots__ = ('children', 'ordinals')
+
+    def __init__(self):
+        self.children: Dict[str, '_TrieNode'] = {}
+        self.ordinals: List[int] = []
+
+
+class _Trie:
+    "Character trie returning the ordinals of all stored keys that are a prefix of a needle"
+
+    def __init__(self):
+        self.root = _TrieNode()
+
+    def add(self, key: str, ordinal: int):
+        node = self.root
+        for c in key:
+            node = node.children.setdefault(c, _TrieNode())
+        node.ordinals.append(ordinal)
+
+    def iter_prefixes_of(self, needle: Iterable[str]):
+        node = self.root
+        for c in needle:
+            node = node.children.get(c)
+            if node is None:
+                return
+            yield from node.ordinals
+
+
+class _RegexpBand:
+    "Combined alternation of regexps. First matching alternative wins, i.e. lowest ordinal"
+
+    def __init__(self, items: Sequence[Tuple[int, str]]):
+        self.min_ordinal = items[0][0]
+        self.group_ordinals: Dict[int, int] = {}
+
+        if len(items) == 1:  # use pattern as is to keep group numbering intact
+            self.regexp = re.compile(items[0][1], re.IGNORECASE)
+            return
+
+        parts = ['(?P<_m{}>{})'.format(ordinal, pattern) for ordinal, pattern in items]
+        self.regexp = re.compile('|'.join(parts), re.IGNORECASE)
+        for name, index in self.regexp.groupindex.items():
+            if name.startswith('_m'):
+                self.group_ordinals[index] = int(name[2:])
+
+    def match(self, needle: str) -> Optional[int]:
+        m = self.regexp.match(needle)
+        if not m:
+            return None
+        if not self.group_ordinals:
+            return self.min_ordinal
+        # outer named group closes last, so lastindex points to the wrapping alternative
+        return self.group_ordinals[m.lastindex]
+
+
+class CustomerMatchIndex:
+    """
+    Compiled lookup of an ordered list of CustomerMatch rules. Returns the same match as
+    looping over the rules and calling CustomerMatch.match(), but prefix/suffix rules are
+    resolved using tries and regexps are merged into a few combined patterns per priority
+    """
+
+    def __init__(self, matchers: Sequence['CustomerMatch']):
+        self.matchers = list(matchers)
+
+        self.prefixes = _Trie()
+        self.suffixes = _Trie()
+        self.requirements: Dict[int, Tuple[bool, bool, bool]] = {}
+        self.bands: List[_RegexpBand] = []
+
+        regexps: List[Tuple[int, int, str]] = []
+
+        for ordinal, matcher in enumerate(self.matchers):
+            if matcher.regexp_match:
+                regexps.append((matcher.priority, ordinal, matcher.regexp_match))
+                continue
+
+            prefix = (matcher.prefix_match or '').lower()
+            suffix = (matcher.suffix_match or '').lower()
+            if not prefix and not suffix:
+                continue
+
+            if prefix:
+                self.prefixes.add(prefix, ordinal)
+            if suffix:
+                self.suffixes.add(suffix[::-1], ordinal)
+            self.requirements[ordinal] = (bool(prefix), bool(suffix), matcher.match_mode == matcher.EITHER)
+
+        self._build_bands(regexps)
+
+    def _build_bands(self, regexps: List[Tuple[int, int, str]]):
+
+        band: List[Tuple[int, str]] = []
+        cur_priority = None
+
+        def _flush():
+            if band:
+                self.bands.extend(self._compile_band(band))
+            band.clear()
+
+        for priority, ordinal, pattern in regexps:
+            if priority != cur_priority or len(band) >= MAX_BAND_SIZE:
+                _flush()
+                cur_priority = priority
+
+            if UNMERGEABLE_RE.search(pattern):
+                _flush()
+                self.bands.extend(self._compile_band([(ordinal, pattern)]))
+                continue
+            band.append((ordinal, pattern))
+
+        _flush()
+
+    @staticmethod
+    def _compile_band(items: Sequence[Tuple[int, str]]) -> List[_RegexpBand]:
+        try:
+            return [_RegexpBand(list(items))]
+        except (re.error, ValueError, RecursionError):
+            if len(items) == 1:
+                logger.warning('Invalid regexp for customer match ordinal %s: %s', items[0][0], items[0][1])
+                return []
+
+        result = []
+        for item in items:
+            result.extend(CustomerMatchIndex._compile_band([item]))
+        return result
+
+    def _get_prefix_suffix_ordinal(self, needle: str) -> Optional[int]:
+
+        prefix_ordinals = set(self.prefixes.iter_prefixes_of(needle))
+        suffix_ordinals = set(self.suffixes.iter_prefixes_of(reversed(needle)))
+
+        best = None
+        for ordinal in prefix_ordinals | suffix_ordinals:
+            if best is not None and ordinal > best:
+                continue
+
+            has_prefix, has_suffix, either = self.requirements[ordinal]
+            prefix_ok = ordinal in prefix_ordinals
+            suffix_ok = ordinal in suffix_ordinals
+
+            if either:
+                matched = prefix_ok or suffix_ok
+            else:
+                matched = (prefix_ok or not has_prefix) and (suffix_ok or not has_suffix)
+
+            if matched:
+                best = ordinal
+
+        return best
+
+    def get_match(self, needle: str) -> Optional['CustomerMatch']:
+        needle = needle.lower()
+
+        best = self._get_prefix_suffix_ordinal(needle)
+
+        for band in self.bands:
+            if best is not None and band.min_ordinal > best:
+                break
+            ordinal = band.match(needle)
+            if ordinal is not None and (best is None or ordinal < best):
+                best = ordinal
+
+        if best is None:
+            return None
+        return self.matchers[best]
@@ -3,7 +3,7 @@ import uuid
 from collections import defaultdict
 from random import choice
 from time import time
-from typing import Union
+from typing import Optional, Union
 from urllib.parse import parse_qsl
 import typing
 from cacheout import fifo_memoize
@@ -16,6 +16,7 @@ from django.utils.translation import ugettext_lazy as _
 import reversion
 from sentry_sdk import capture_exception
 
+from customer.match_index import CustomerMatchIndex
 from provider.exceptions import InvalidKey, NotFound
 from django.conf import settings
 import logging
@@ -571,12 +572,10 @@ class CustomerMatchManager(models.Manager):
     @staticmethod
     @fifo_memoize(128, 10)
     def _real_match_from_text(text, cluster_id):
-        for matcher in MatchCache.get().matchers:
-            if cluster_id and cluster_id != matcher.cluster_id:
-                continue
-            if matcher.match(text):
-                logger.debug('Matched text %s to match %s', text, matcher.pk)
-                return matcher
+        matcher = MatchCache.get().get_index(cluster_id).get_match(text)
+        if matcher:
+            logger.debug('Matched text %s to match %s', text, matcher.pk)
+            return matcher
 
     def match_customer_from_tag(self, tag, cluster):
         result = self.get_match_from_tag(tag, cluster=cluster)
@@ -707,6 +706,8 @@ class MatchCache:
         self.tenant_cluster_map = tenant_cluster_map
         self.matchers = matchers
         self.expire = expire or time() + 10
+        self._indexes = {}
+        self._matchers_by_id = None
 
     @classmethod
     def get(cls):
@@ -727,6 +728,19 @@ class MatchCache:
     def match_tenant(cls, tenant):
         return cls.get().tenant_map.get(tenant)
 
+    def get_matcher(self, match_id) -> Optional['CustomerMatch']:
+        if self._matchers_by_id is None:
+            self._matchers_by_id = {m.pk: m for m in self.matchers}
+        return self._matchers_by_id.get(match_id)
+
+    def get_index(self, cluster_id=None) -> 'CustomerMatchIndex':
+        "compiled index of matchers for cluster, or all clusters if cluster_id is empty"
+        cluster_id = cluster_id or None
+        if cluster_id not in self._indexes:
+            matchers = [m for m in self.matchers if not cluster_id or m.cluster_id == cluster_id]
+            self._indexes[cluster_id] = CustomerMatchIndex(matchers)
+        return self._indexes[cluster_id]
+
     @classmethod
     def update(cls):
         customers = {c.pk: c for c in Customer.objects.all()}
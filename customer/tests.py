@@ -74,4 +74,71 @@ class MatcherTestCase(TestCase):
         self.assertEqual(getattr(match, 'customer_id', None), None)
         self.assertEqual(getattr(match, 'tenant_id', None), '1234')
 
+    def test_match_regexp(self):
+        match = CustomerMatch.objects.get_match_from_text('room.regexp@example.regsuffix', cluster=self.cluster)
+        self.assertEqual(getattr(match, 'customer_id', None), self.customers[0].id)
+
 
+def get_synthetic_matchers(count):
+    "Unsaved matchers of all kinds, ordered by priority"
+    matchers = []
+    for i in range(count):
+        kind = i % 5
+        if kind == 0:
+            m = CustomerMatch(prefix_match='p{}.'.format(i))
+        elif kind == 1:
+            m = CustomerMatch(suffix_match='@s{}.example.org'.format(i))
+        elif kind == 2:
+            m = CustomerMatch(prefix_match='b{}'.format(i), suffix_match='.org')
+        elif kind == 3:
+            m = CustomerMatch(prefix_match='e{}'.format(i), suffix_match='.e{}'.format(i), match_mode=CustomerMatch.EITHER)
+        else:
+            m = CustomerMatch(regexp_match=r'r{}[0-9]+@.*'.format(i))
+        m.pk = i + 1
+        m.priority = 10 - (i % 3)
+        matchers.append(m)
+    matchers.sort(key=lambda m: (m.priority, m.pk))
+    return matchers
+
+
+def get_synthetic_needles(count, samples=100):
+    "Texts matching some of the matchers from get_synthetic_matchers(count)"
+    result = ['nomatch@example.org', 'b2.example.org', 'x.e3', '(invalid']
+    for i in range(0, count, max(1, count // samples)):
+        result.extend([
+            'p{}.room@example.org'.format(i),
+            'room@s{}.example.org'.format(i),
+            'b{}room@example.org'.format(i),
+            'e{}@example.com'.format(i),
+            'room.e{}'.format(i),
+            'R{}123@example.org'.format(i),
+        ])
+    return result
+
+
+class MatchIndexTestCase(TestCase):
+
+    def test_same_result_as_loop(self):
+        from customer.match_index import CustomerMatchIndex
+
+        matchers = get_synthetic_matchers(200)
+        matchers.append(CustomerMatch(pk=9999, priority=20, regexp_match=r'(a)\1@.*'))
+        matchers.append(CustomerMatch(pk=10000, priority=20, regexp_match=r'(?i)aa@.*'))
+
+        index = CustomerMatchIndex(matchers)
+        for needle in get_synthetic_needles(200) + ['aa@example.org']:
+            needle = needle.lower()
+            expected = next((m for m in matchers if m.match(needle)), None)
+            self.assertEqual(index.get_match(needle), expected, needle)
+
+    def test_many_rules(self):
+        from customer.match_index import CustomerMatchIndex
+
+        matchers = get_synthetic_matchers(10000)
+        needles = [n.lower() for n in get_synthetic_needles(10000, samples=5)]
+
+        index = CustomerMatchIndex(matchers)
+        self.assertEqual(
+            [index.get_match(n) for n in needles],
+            [next((m for m in matchers if m.match(n)), None) for n in needles],
+        )
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastore', '0045_add_accessmethod_secret'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conference',
+            name='sync_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=32),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='enduser',
+            name='sync_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=32),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastore', '0046_add_sync_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='providersync',
+            name='last_forced_sync',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
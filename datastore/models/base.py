@@ -13,6 +13,7 @@ class ProviderSync(models.Model):
 
     last_full_sync = models.DateTimeField(null=True)
     last_incremental_sync = models.DateTimeField(null=True)
+    last_forced_sync = models.DateTimeField(null=True)  # full sync ignoring sync hashes
 
     users_last_sync = models.DateTimeField(null=True)
     cospaces_last_sync = models.DateTimeField(null=True)
@@ -176,6 +176,7 @@ class Conference(models.Model):
     is_active = models.BooleanField(default=True, editable=False)
 
     full_data = models.TextField(blank=True, editable=False)  # for external policy response
+    sync_hash = models.CharField(max_length=32, blank=True, editable=False)  # remote data + local overrides
 
     objects = ConferenceManager()
 
@@ -344,6 +345,7 @@ class EndUser(models.Model):
 
     ts_created = models.DateTimeField(auto_now_add=True, editable=False)
     last_synced = models.DateTimeField(default=now, editable=False)
+    sync_hash = models.CharField(max_length=32, blank=True, editable=False)  # remote data + local overrides
 
     objects = EndUserManager()
 
@@ -455,13 +457,19 @@ class ConferenceAutoParticipant(models.Model):
         unique_together = (('pid', 'provider'), ('guid', 'provider'))
 
 
-def clear_cache(sender, **kwargs):
+def clear_cache(sender, instance=None, **kwargs):
 
     from customer.models import CustomerMatchManager
     CustomerMatchManager._pexip_get_conference.cache.clear()
     CustomerMatchManager._pexip_get_local_alias.cache.clear()
     CustomerMatchManager._real_match_from_text.cache.clear()
 
+    if instance is not None:
+        from policy.decision_cache import invalidate_conference_map
+
+        conference_id = instance.pk if sender is Conference else instance.conference_id
+        invalidate_conference_map(instance.provider_id, [conference_id])
+
 
 models.signals.post_save.connect(clear_cache, sender=Conference)
 models.signals.post_save.connect(clear_cache, sender=ConferenceAlias)
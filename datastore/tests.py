@@ -1,8 +1,13 @@
 
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.utils.timezone import now
+
 from conferencecenter.tests.base import ConferenceBaseTest
 from datastore import models
 from datastore.utils.acano import sync_all_acano
-from datastore.utils.pexip import sync_all_pexip
+from datastore.utils.pexip import FORCED_SYNC_INTERVAL, sync_all_pexip
 
 
 class DataStoreTestCase(ConferenceBaseTest):
@@ -16,11 +21,20 @@ class DataStoreTestCase(ConferenceBaseTest):
         self.assertEqual(models.acano.User.objects.count(), 3)
         self.assertEqual(models.acano.CoSpaceAccessMethod.objects.count(), 1)
 
+    def _get_counts(self, result, step):
+        stats = dict(result)[step]
+        return stats.as_dict()['created'], stats.as_dict()['updated'], stats.as_dict()['unchanged']
+
     def test_sync_acano(self):
-        sync_all_acano(self.acano)
+        result = sync_all_acano(self.acano)
         self._check_acano_count()
-        sync_all_acano(self.acano)
+        self.assertEqual(self._get_counts(result, 'users'), (3, 0, 0))
+        self.assertEqual(self._get_counts(result, 'cospaces'), (1, 0, 0))
+
+        result = sync_all_acano(self.acano)
         self._check_acano_count()
+        self.assertEqual(self._get_counts(result, 'users'), (0, 0, 3))
+        self.assertEqual(self._get_counts(result, 'cospaces'), (0, 0, 1))
 
     def test_sync_acano_incremental(self):
         sync_all_acano(self.acano, incremental=True)
@@ -32,10 +46,55 @@ class DataStoreTestCase(ConferenceBaseTest):
         self.assertEqual(models.pexip.ConferenceAlias.objects.count(), 2)
 
     def test_sync_pexip(self):
-        sync_all_pexip(self.pexip)
+        result = sync_all_pexip(self.pexip)
         self._check_pexip_count()
-        sync_all_pexip(self.pexip)
+        self.assertEqual(self._get_counts(result, 'users'), (2, 0, 0))
+        self.assertEqual(self._get_counts(result, 'conferences')[0], 2 + 2)  # including aliases
+
+        result = sync_all_pexip(self.pexip)
         self._check_pexip_count()
+        self.assertEqual(self._get_counts(result, 'users'), (0, 0, 2))
+        self.assertEqual(self._get_counts(result, 'conferences'), (0, 0, 2))
+
+    def test_sync_pexip_unchanged(self):
+        sync_all_pexip(self.pexip)
+
+        models.pexip.Conference.objects.update(description='changed')
+        with patch('datastore.utils.pexip.sync_conference_aliases') as sync_aliases:
+            sync_all_pexip(self.pexip)
+        self.assertEqual(models.pexip.Conference.objects.filter(description='changed').count(), 2)
+        self.assertFalse(sync_aliases.called)
+
+        models.pexip.Conference.objects.update(sync_hash='')
+        sync_all_pexip(self.pexip)
+        self.assertFalse(models.pexip.Conference.objects.filter(description='changed').exists())
+
+    def test_sync_pexip_forced(self):
+        sync_all_pexip(self.pexip)
+
+        models.pexip.Conference.objects.update(description='changed')
+        sync_all_pexip(self.pexip, force=True)
+        self.assertFalse(models.pexip.Conference.objects.filter(description='changed').exists())
+
+        models.pexip.Conference.objects.update(description='changed')
+        models.base.ProviderSync.objects.update(last_forced_sync=now() - FORCED_SYNC_INTERVAL - timedelta(minutes=1))
+        sync_all_pexip(self.pexip, incremental=True)
+        self.assertEqual(models.pexip.Conference.objects.filter(description='changed').count(), 2)
+
+        sync_all_pexip(self.pexip)
+        self.assertFalse(models.pexip.Conference.objects.filter(description='changed').exists())
+        self.assertGreater(models.base.ProviderSync.objects.get().last_forced_sync, now() - timedelta(minutes=1))
+
+    def test_sync_pexip_reactivated(self):
+        sync_all_pexip(self.pexip)
+
+        conference = models.pexip.Conference.objects.first()
+        models.pexip.Conference.objects.filter(pk=conference.pk).update(is_active=False)
+        with patch('datastore.utils.pexip.invalidate_conference_map') as invalidate:
+            sync_all_pexip(self.pexip)
+
+        self.assertTrue(models.pexip.Conference.objects.get(pk=conference.pk).is_active)
+        invalidate.assert_any_call(self.pexip.cluster.pk, [conference.pk])
 
     def test_sync_pexip_incremental(self):
         sync_all_pexip(self.pexip, incremental=True)
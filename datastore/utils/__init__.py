@@ -2,7 +2,7 @@ from functools import wraps
 from typing import Iterator, Dict, Tuple, Any, Callable, TypeVar
 
 
-def bulk_iter(provider, model, id_field, server_objects, server_id_field='id', batch_size=50) \
+def bulk_iter(provider, model, id_field, server_objects, server_id_field='id', batch_size=200) \
               -> Iterator[Tuple[Dict, Any]]:
     """Iter server objects and try to find existing objects"""
     def _iter(batch):
@@ -41,3 +41,9 @@ def sync_method(fn: C) -> C:
             api.allow_cached_values = _allow_cached_values
             api.is_syncing = _is_syncing
     return inner
+
+
+def sync_number_ranges(api, incremental=False):
+    "Rebuild index of used numbers in the number ranges of the cluster from synced data"
+    from numberseries.allocation import reconcile_number_ranges
+    return reconcile_number_ranges(api.cluster)
@@ -2,7 +2,7 @@ import logging
 from collections import Counter
 from datetime import timedelta
 from time import sleep
-from typing import Iterator, Any, Tuple, Union, Sequence, Optional
+from typing import Iterator, Tuple, Union, Sequence, Optional
 from urllib.parse import parse_qs
 
 from cacheout import fifo_memoize
@@ -13,9 +13,9 @@ from django.utils.timezone import now
 from customer.models import Customer
 from datastore.models.acano import User, CoSpace, CoSpaceAccessMethod, CoSpaceMember
 from provider.ext_api.acano import AcanoAPI, AcanoDistributedRunner, AcanoDistributedGet
-from . import bulk_iter, sync_method
+from . import bulk_iter, sync_method, sync_number_ranges
 from ..models.base import ProviderSync
-from shared.utils import partial_update_or_create, partial_update, SyncBatcher
+from shared.utils import partial_update_or_create, partial_update, SyncBatcher, SyncStats, collect_sync_stats
 from ..models.customer import Tenant
 from .ldap import update_ldap_user
 from provider.exceptions import MultipleResponseError, NotFound, ResponseError, ResponseConnectionError
@@ -70,7 +70,7 @@ def sync_all_acano(provider, customer=None, incremental=False):
     return list(sync_all_acano_iter(provider, customer=customer, incremental=incremental))
 
 
-def sync_all_acano_iter(provider, customer=None, incremental=False) -> Iterator[Tuple[str, Any]]:
+def sync_all_acano_iter(provider, customer=None, incremental=False) -> Iterator[Tuple[str, SyncStats]]:
 
     if not provider.is_acano:
         return
@@ -90,10 +90,10 @@ def sync_all_acano_iter(provider, customer=None, incremental=False) -> Iterator[
     all_start = now()
 
     def _log_and_run(step, fn):
-        start = now()
-        result = fn(api)
-        logger.info('Full sync of {} for cluster %s in %s secs'.format(step), cluster, (now() - start).total_seconds())
-        return step, result
+        with collect_sync_stats(step) as stats:
+            stats.result = fn(api)
+        logger.info('Full sync of {} for cluster %s: %s'.format(step), cluster, stats, extra=dict(sync_stats=stats.as_dict()))
+        return step, stats
 
     if not incremental:
         yield _log_and_run('tenants', sync_tenants_from_acano)
@@ -116,6 +116,8 @@ def sync_all_acano_iter(provider, customer=None, incremental=False) -> Iterator[
         yield _log_and_run('users_incremental', sync_users_extended_from_acano_incremental)
         yield _log_and_run('cospaces_incremental', sync_cospaces_extended_from_acano_incremental)
 
+    yield _log_and_run('number_ranges', sync_number_ranges)
+
     api.is_syncing = False
 
     if incremental:
@@ -204,6 +206,10 @@ def sync_single_user_list(
             batcher.partial_update(obj, cur)
         else:
             partial_update(obj, cur)
+    elif batcher:
+        obj = batcher.create(User(uid=data.get('id'), provider=api.cluster, **cur), key=data.get('id'))
+        if cur['tenant']:
+            cur['tenant'].set_updated()
     else:
         obj, created = partial_update_or_create(
             User, uid=data.get('id'), provider=api.cluster, defaults=cur
@@ -545,6 +551,10 @@ def sync_single_cospace_list(
             batcher.partial_update(obj, cur)
         else:
             partial_update(obj, cur)
+    elif batcher:
+        obj = batcher.create(CoSpace(cid=data.get('id'), provider=api.cluster, **cur), key=data.get('id'))
+        if tenant:
+            tenant.set_updated()
     else:
         obj, created = partial_update_or_create(
             CoSpace, cid=data.get('id'), provider=api.cluster, defaults=cur
@@ -1,7 +1,7 @@
 import json
 from collections import Counter
 from datetime import timedelta
-from typing import Union
+from typing import Iterator, Tuple, Union
 
 import typing
 
@@ -13,9 +13,10 @@ from django.utils.timezone import now
 from customer.models import Customer, CustomerMatch
 from datastore.models.pexip import Email, Conference, ConferenceAlias, ConferenceAutoParticipant, EndUser, \
     Theme
+from policy.decision_cache import conference_map_batch, invalidate_conference_map
 from provider.models.pexip import PexipSpace
-from shared.utils import partial_update_or_create, partial_update, SyncBatcher
-from . import bulk_iter, sync_method
+from shared.utils import partial_update_or_create, partial_update, SyncBatcher, SyncStats, collect_sync_stats, get_sync_hash
+from . import bulk_iter, sync_method, sync_number_ranges
 from ..models.base import ProviderSync
 from ..models.customer import Tenant
 from .ldap import update_ldap_user
@@ -29,45 +30,17 @@ if typing.TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 DEFAULT_INCREMENTAL = 5
+SYNC_HASH_VERSION = 1  # change to force update of all synced objects
+FORCED_SYNC_INTERVAL = timedelta(days=1)  # full sync ignores sync hashes this often, to repair local changes
 
 
-def _get_conference_customer(conference, provider):
-    overridden_space = PexipSpace.objects.filter(cluster=provider, external_id=conference['id'])\
-        .select_related('customer').first()
-
-    if overridden_space and overridden_space.customer_id:
-        return overridden_space.customer
-
-
-def _get_conference_tenant(conference, provider):
-
-    customer = _get_conference_customer(conference, provider)
+def _get_customer_tenant(customer, obj, provider):
     if customer:
         tenant_id = customer.get_pexip_tenant_id()
         if not tenant_id:
             return None
         return _get_tenant_obj(tenant_id, provider)
-
-    return _get_tenant(conference, provider)
-
-
-def _get_user_customer(user, provider):
-    from provider.models.pexip import PexipEndUser
-    overridden_user = PexipEndUser.objects.filter(cluster=provider, external_id=user['id']) \
-        .select_related('customer').first()
-
-    if overridden_user and overridden_user.customer_id:
-        return overridden_user.customer
-
-
-def _get_user_tenant(user, provider):
-    customer = _get_user_customer(user, provider)
-    if customer:
-        tenant_id = customer.get_pexip_tenant_id()
-        if not tenant_id:
-            return None
-        return _get_tenant_obj(tenant_id, provider)
-    return _get_tenant(user, provider)
+    return _get_tenant(obj, provider)
 
 
 def _get_tenant(obj, provider):
@@ -157,11 +130,11 @@ def _get_conference(conference_id, provider, data=None) -> Union[Conference, Non
         return Conference.objects.get_or_create(cid=conference_id, provider=provider, defaults={'name': data['name']} if data else {})[0]
 
 
-def sync_all_pexip(provider, customer=None, incremental=False):
-    return list(sync_all_pexip_iter(provider, customer=customer, incremental=incremental))
+def sync_all_pexip(provider, customer=None, incremental=False, force=False):
+    return list(sync_all_pexip_iter(provider, customer=customer, incremental=incremental, force=force))
 
 
-def sync_all_pexip_iter(provider, customer=None, incremental=False):
+def sync_all_pexip_iter(provider, customer=None, incremental=False, force=False) -> Iterator[Tuple[str, SyncStats]]:
 
     cluster = provider.cluster if provider.cluster_id else provider
 
@@ -171,23 +144,28 @@ def sync_all_pexip_iter(provider, customer=None, incremental=False):
     if not cluster.is_pexip:
         return
 
-    partial_update_or_create(ProviderSync, provider=cluster, defaults={
+    provider_sync, _created = partial_update_or_create(ProviderSync, provider=cluster, defaults={
         ('last_incremental_sync' if incremental else 'last_full_sync'): now(),
     })
 
     all_start = now()
 
+    if not incremental and not force:
+        last_forced_sync = provider_sync.last_forced_sync
+        force = not last_forced_sync or last_forced_sync < all_start - FORCED_SYNC_INTERVAL
+
     api = cluster.get_api(customer)
     api.is_syncing = True
+    api.force_sync = force
 
     def _log_and_run(step, fn):
-        start = now()
-        result = fn(api, incremental=incremental)
+        with collect_sync_stats(step) as stats:
+            stats.result = fn(api, incremental=incremental)
         if incremental:
-            logger.info('Incremental sync of {} for cluster %s in %s secs'.format(step), cluster, (now() - start).total_seconds())
+            logger.info('Incremental sync of {} for cluster %s: %s'.format(step), cluster, stats, extra=dict(sync_stats=stats.as_dict()))
         else:
-            logger.info('Full sync of {} for cluster %s in %s secs'.format(step), cluster, (now() - start).total_seconds())
-        return step, result
+            logger.info('Full sync of {} for cluster %s: %s'.format(step), cluster, stats, extra=dict(sync_stats=stats.as_dict()))
+        return step, stats
 
     yield _log_and_run('version', sync_pexip_version)
     yield _log_and_run('tenants', sync_tenants_from_pexip)
@@ -201,7 +179,13 @@ def sync_all_pexip_iter(provider, customer=None, incremental=False):
     else:
         yield _log_and_run('themes', sync_themes_from_pexip)
 
+    yield _log_and_run('number_ranges', sync_number_ranges)
+
     api.is_syncing = False
+    api.force_sync = False
+
+    if force:
+        partial_update(provider_sync, {'last_forced_sync': all_start})
 
     if incremental:
         logger.info('Incremental sync of cluster %s in %s secs', cluster,
@@ -277,33 +261,54 @@ def sync_single_user_full(api: 'PexipAPI', user_id=None, obj=None, data=None, ld
         return
 
     from provider.models.pexip import PexipEndUser
-    end_user = PexipEndUser.objects.filter(cluster=api.cluster, external_id=data['id']).only('organization_unit__id').first()
+    end_user = PexipEndUser.objects.filter(cluster=api.cluster, external_id=data['id']).select_related('customer').first()
 
-    cur = {
-        'uuid': data.get('uuid', ''),
-        'email': _get_email(data.get('primary_email_address'), provider),
-        'sync_tag': data.get('sync_tag', ''),
-        'avatar_url': data.get('avatar_url', ''),
-        'tenant': _get_user_tenant(data, provider),
-        'customer': _get_user_customer(data, provider),
-        'match': _get_match(data, provider, only_existing=True),
-        'first_name': data.get('first_name', ''),
-        'last_name': data.get('last_name', ''),
-        'display_name': data.get('display_name', ''),
-        'description': data.get('description', ''),
-        'is_active': True,
-        'last_synced': now(),
-        'organization_unit': end_user.organization_unit if end_user else None,
-    }
+    customer = end_user.customer if end_user and end_user.customer_id else None
+    tenant = _get_customer_tenant(customer, data, provider)
+    match = _get_match(data, provider, only_existing=True)
 
-    if obj:
+    sync_hash = get_sync_hash(
+        SYNC_HASH_VERSION,
+        data,
+        end_user.organization_unit_id if end_user else None,
+        *(o.pk if o else None for o in (customer, tenant, match)),
+    )
+
+    if obj and obj.sync_hash == sync_hash and not api.force_sync:
         if batcher:
-            batcher.partial_update(obj, cur)
+            batcher.unchanged(obj)
         else:
-            partial_update(obj, cur)
+            partial_update(obj, {'is_active': True, 'last_synced': now()})
         created = False
     else:
-        obj, created = partial_update_or_create(EndUser, uid=data.get('id'), provider=api.cluster, defaults=cur)
+        cur = {
+            'uuid': data.get('uuid', ''),
+            'email': _get_email(data.get('primary_email_address'), provider),
+            'sync_tag': data.get('sync_tag', ''),
+            'avatar_url': data.get('avatar_url', ''),
+            'tenant': tenant,
+            'customer': customer,
+            'match': match,
+            'first_name': data.get('first_name', ''),
+            'last_name': data.get('last_name', ''),
+            'display_name': data.get('display_name', ''),
+            'description': data.get('description', ''),
+            'is_active': True,
+            'last_synced': now(),
+            'organization_unit': end_user.organization_unit if end_user else None,
+            'sync_hash': sync_hash,
+        }
+
+        if obj:
+            if batcher:
+                batcher.partial_update(obj, cur)
+            else:
+                partial_update(obj, cur)
+            created = False
+        elif batcher:
+            obj, created = batcher.partial_update_or_create(EndUser, uid=data.get('id'), provider=api.cluster, defaults=cur)
+        else:
+            obj, created = partial_update_or_create(EndUser, uid=data.get('id'), provider=api.cluster, defaults=cur)
 
     if created or obj.should_update_ldap:
         u, ldapconn = update_ldap_user(obj, ldapconn=ldapconn)
@@ -355,6 +360,19 @@ def sync_themes_from_pexip(api: 'PexipAPI', incremental=False):
     ProviderSync.objects.update_or_create(provider=api.cluster, defaults=dict(themes_last_sync=now()))
 
 
+def _get_conference_map_invalidator(cluster_id):
+    "Announce conferences and aliases reactivated by SyncBatcher, which doesn't send signals for them"
+
+    def _invalidate(model, pks):
+        if model is Conference:
+            invalidate_conference_map(cluster_id, pks)
+        elif model is ConferenceAlias:
+            conference_ids = ConferenceAlias.objects.filter(pk__in=pks).values_list('conference_id', flat=True)
+            invalidate_conference_map(cluster_id, [pk for pk in conference_ids if pk])
+
+    return _invalidate
+
+
 @sync_method
 def sync_conferences_from_pexip(api: 'PexipAPI', incremental=False):
 
@@ -362,7 +380,8 @@ def sync_conferences_from_pexip(api: 'PexipAPI', incremental=False):
 
     start = now()
 
-    batcher = SyncBatcher(time_update_fields=['last_synced'], defaults={'is_active': True})
+    batcher = SyncBatcher(time_update_fields=['last_synced'], defaults={'is_active': True},
+                          on_defaults_changed=_get_conference_map_invalidator(api.cluster.pk))
 
     filter_kwargs = {}
     if incremental:
@@ -373,18 +392,20 @@ def sync_conferences_from_pexip(api: 'PexipAPI', incremental=False):
 
     tenant_count = Counter()
 
-    for c, obj in bulk_iter(api.cluster, Conference, 'cid', api._iter_all_cospaces(**filter_kwargs), 'id'):
-        i += 1
-        if i % 50 == 0:
-            print(i)
+    with conference_map_batch():
+        for c, obj in bulk_iter(api.cluster, Conference, 'cid', api._iter_all_cospaces(**filter_kwargs), 'id'):
+            i += 1
+            if i % 50 == 0:
+                print(i)
 
-        obj = sync_single_conference_full(api, c.get('id'), data=c, obj=obj, batcher=batcher)
-        tenant_count[obj.tenant_id] += 1
+            obj = sync_single_conference_full(api, c.get('id'), data=c, obj=obj, batcher=batcher)
+            tenant_count[obj.tenant_id] += 1
 
-    batcher.commit()
+        batcher.commit()
 
     if not incremental:
-        Conference.objects.filter(provider=api.cluster, last_synced__lt=start - timedelta(minutes=5), is_active=True).update(is_active=False)
+        if Conference.objects.filter(provider=api.cluster, last_synced__lt=start - timedelta(minutes=5), is_active=True).update(is_active=False):
+            invalidate_conference_map(api.cluster.pk)
     ProviderSync.objects.update_or_create(provider=api.cluster, defaults=dict(cospaces_last_sync=now()))
 
     valid = set()
@@ -454,11 +475,29 @@ def sync_single_conference_full(api, conference_id=None, obj=None, data=None, ba
 
     logger.debug('Start sync for conference_id=%s, name %s', conference_id, conference.get('name', ''))
 
-    space = PexipSpace.objects.filter(cluster=api.cluster, external_id=conference['id']).only('organization_unit__id').first()
+    local_data = PexipSpace.objects.filter(cluster=api.cluster, external_id=conference['id']).select_related('customer').first()
+
+    customer = local_data.customer if local_data and local_data.customer_id else None
+    tenant = _get_customer_tenant(customer, conference, provider)
+    match = _get_match(conference, provider, only_existing=True)
+
+    sync_hash = get_sync_hash(
+        SYNC_HASH_VERSION,
+        conference,
+        [local_data.organization_unit_id, local_data.call_id, local_data.guid, local_data.is_virtual] if local_data else None,
+        *(o.pk if o else None for o in (customer, tenant, match)),
+    )
+
+    if obj and obj.sync_hash == sync_hash and not api.force_sync:  # aliases and automatic participants are included in hash
+        if batcher:
+            batcher.unchanged(obj)
+        else:
+            partial_update(obj, {'is_active': True, 'last_synced': now()})
+        return obj
 
     c = conference
     cur = {
-        'name': c.get('name', ''),
+        'name': c.get('name') or None,
         'description': c.get('description', ''),
         'allow_guests': c.get('allow_guests', True),
         'guest_pin': c.get('guest_pin', ''),
@@ -468,29 +507,27 @@ def sync_single_conference_full(api, conference_id=None, obj=None, data=None, ba
         'email': _get_email(c.get('primary_owner_email_address', ''), provider),
         'scheduled_id': c.get('scheduled_id'),
         'service_type': c.get('service_type', ''),
-        'tenant': _get_conference_tenant(conference, provider),
-        'customer': _get_conference_customer(conference, provider),
-        'match': _get_match(conference, provider, only_existing=True),
+        'tenant': tenant,
+        'customer': customer,
+        'match': match,
         'theme': _get_theme(c.get('theme'), provider),
         'full_data': json.dumps({k: v for k, v in conference.items() if k not in {'aliases', 'scheduled_conferences'}}),
         'last_synced': now(),
         'is_active': True,
-        'call_id': '',  # set below
-        'organization_unit': space.organization_unit if space else None,
+        'call_id': None,  # set below
+        'organization_unit': local_data.organization_unit if local_data else None,
+        'sync_hash': sync_hash,
     }
 
     cur['web_url'] = api.get_web_url(cospace={**conference, **cur})
     call_id = ''
 
-    local_data = PexipSpace.objects.filter(cluster=api.cluster, external_id=conference_id).first()
     if local_data:
         call_id = local_data.call_id or call_id
         cur['guid'] = local_data.guid
         cur['is_virtual'] = bool(local_data.is_virtual)
     else:
         cur['is_virtual'] = False
-        if obj:
-            call_id = call_id
 
     if not call_id or call_id not in [a['alias'] for a in conference['aliases']]:
         try:
@@ -501,12 +538,14 @@ def sync_single_conference_full(api, conference_id=None, obj=None, data=None, ba
         except IndexError:
             pass
 
-    cur['call_id'] = call_id
+    cur['call_id'] = call_id or None
 
     if obj and batcher:
         batcher.partial_update(obj, cur)
     elif obj:
         partial_update(obj, cur)
+    elif batcher:
+        obj, created = batcher.partial_update_or_create(Conference, cid=conference.get('id'), provider=api.cluster, defaults=cur)
     else:
         obj, created = partial_update_or_create(Conference, cid=conference.get('id'), provider=api.cluster, defaults=cur)
 
@@ -619,18 +658,19 @@ def sync_conference_aliases_from_pexip(api: 'PexipAPI', incremental=False):
 
     batcher = SyncBatcher()
 
-    for alias, obj in bulk_iter(api.cluster, ConferenceAlias, 'aid', api.get_conference_aliases(**filter_kwargs), 'id'):
-        data = {
-            'alias': alias.get('alias', '').lower(),
-            'description': alias.get('description', ''),
-            'conference': _get_conference(alias['conference'], provider=api.cluster),
-        }
-        if obj:
-            batcher.partial_update(obj, data)
-        else:
-            partial_update_or_create(ConferenceAlias, provider=api.cluster, aid=alias['id'], defaults=data)
+    with conference_map_batch():
+        for alias, obj in bulk_iter(api.cluster, ConferenceAlias, 'aid', api.get_conference_aliases(**filter_kwargs), 'id'):
+            data = {
+                'alias': alias.get('alias', '').lower(),
+                'description': alias.get('description', ''),
+                'conference': _get_conference(alias['conference'], provider=api.cluster),
+            }
+            if obj:
+                batcher.partial_update(obj, data)
+            else:
+                batcher.partial_update_or_create(ConferenceAlias, provider=api.cluster, aid=alias['id'], defaults=data)
 
-    batcher.commit()
+        batcher.commit()
 
     if not incremental:
         ConferenceAutoParticipant.objects.filter(provider=api.cluster, last_synced__lt=start - timedelta(minutes=5), is_active=True).update(is_active=False)
@@ -664,9 +704,12 @@ def sync_conference_aliases(api, conference_id, obj=None, data=None, batcher=Non
             batcher.partial_update(cur, data)
         elif cur:
             partial_update(cur, data)
+        elif batcher:
+            batcher.partial_update_or_create(ConferenceAlias, provider=api.cluster, aid=alias['id'], defaults=data)
         else:
             partial_update_or_create(ConferenceAlias, provider=api.cluster, aid=alias['id'], defaults=data)
 
     if conference_id:
-        ConferenceAlias.objects.filter(provider=api.cluster, conference=obj).exclude(aid__in=valid).update(is_active=False)
+        if ConferenceAlias.objects.filter(provider=api.cluster, conference=obj, is_active=True).exclude(aid__in=valid).update(is_active=False):
+            invalidate_conference_map(api.cluster.pk, [obj.pk])
 
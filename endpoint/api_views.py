@@ -241,9 +241,11 @@ class EndpointViewSet(CreateRevisionViewSetMixin, CustomerRelationMixin, viewset
 
         from .ext_api.cisco_ce import CiscoCEProviderAPI
 
+        paths = ['/'.join(value) for value in request.data['values']]
+
         def _get_data(api: 'CiscoCEProviderAPI'):
             try:
-                return api.endpoint, api.get_status_data()
+                return api.endpoint, api.get_status_data(paths=paths)
             except Exception as e:
                 return api.endpoint, e
 
@@ -40,6 +40,7 @@ from shared.utils import maybe_update
 
 from ..consts import PLACEHOLDER_PASSWORD, CallControlAction
 from .parser import cisco_ce as parser
+from .parser import schema_cache
 from .types.cisco_ce import (
     CaCertificate,
     CallHistoryDict,
@@ -117,11 +118,18 @@ class EndpointProviderAPI(ProviderAPI):
             return self._valuespace
 
         fd = fd or self.get_valuespace_data_file(force=force)
-        
-        result = self.endpoint.get_parser('valuespace', fd.content).parse()
+
+        result = self._parse_valuespace(fd)
         self._valuespace = result
         return result
 
+    def _parse_valuespace(self, fd: EndpointDataFileBase) -> ValueSpaceDict:
+        return schema_cache.get_parsed(
+            'valuespace.{}'.format(self.endpoint.manufacturer),
+            [fd.content],
+            lambda: self.endpoint.get_parser('valuespace', fd.content).parse(),
+        )
+
     def get_cached_valuespace_data_file(self, age=60 * 60):
 
         if not self.endpoint.has_direct_connection or not self.endpoint.is_online:
@@ -183,13 +191,19 @@ class EndpointProviderAPI(ProviderAPI):
             fd, valuespace = self.get_commands_data_file()
 
         if b'<Valuespace type' in fd.content:  # inline in file
-            valuespace_data = None
-        elif valuespace:
-            valuespace_data = self.endpoint.get_parser('valuespace', valuespace.content).parse()
-        else:
-            valuespace_data = self.get_valuespace_data()
-
-        return self.endpoint.get_parser('command', fd.content, valuespace_data).parse()
+            valuespace = None
+        elif not valuespace:
+            valuespace = self.get_valuespace_data_file(force=False)
+
+        def _parse():
+            valuespace_data = self._parse_valuespace(valuespace) if valuespace else {}  # empty to use inline
+            return self.endpoint.get_parser('command', fd.content, valuespace_data).parse()
+
+        return schema_cache.get_parsed(
+            'command.{}'.format(self.endpoint.manufacturer),
+            [fd.content, valuespace.content if valuespace else None],
+            _parse,
+        )
 
     def get_cached_commands_data_file(
         self,
@@ -272,16 +286,23 @@ class EndpointProviderAPI(ProviderAPI):
     def load_status_xml(content: bytes) -> ET.Element:
         return safe_xml_fromstring(content)
 
+    def get_status_section_hashes(self, status_data: parser.NestedStatusXMLResult) -> Optional[Dict[str, str]]:
+        """
+        Cleaned hash of each top level section of parsed status, to find which parts
+        have changed since the last check. None if not supported, i.e. everything has changed
+        """
+        return None
+
     def get_status_data(
-        self, force=False, fd: Optional[EndpointDataFileBase] = None
+        self, force=False, fd: Optional[EndpointDataFileBase] = None, paths: Iterable[str] = None
     ) -> parser.NestedStatusXMLResult:
-
+        "paths limits parsing to a subset of the status, if supported"
         fd = fd or self.get_status_data_file(force=force)
         try:
             self.load_status_xml(fd.content)
         except Exception:
             raise self.error('Could not parse response XML data')
-        return self.endpoint.get_parser('status', fd.content).parse()
+        return self.endpoint.get_parser('status', fd.content, paths=paths).parse()
 
     def get_cached_status_data(self, age=4 * 60 * 60):
 
@@ -58,6 +58,7 @@ if TYPE_CHECKING:
     from customer.models import Customer
     from endpoint_backup.models import EndpointBackup
     from endpoint_branding.models import EndpointBrandingProfile
+    from endpoint_data.models import EndpointDataFileBase
     from endpoint_provision.models import EndpointTask
     from roomcontrol.models import RoomControl, RoomControlTemplate
 
@@ -155,8 +156,9 @@ class CiscoCEProviderAPI(EndpointProviderAPI):
         headers = kwargs.pop('headers', {})
         headers.setdefault('Content-Type', 'application/xml')
         kwargs['headers'] = headers
+        kwargs.setdefault('timeout', (3.07, 20))
         try:
-            return super().request(*args, **kwargs, timeout=kwargs.pop('timeout', (3.07, 20)))
+            return super().request(*args, **kwargs)
         except Timeout as e:
             raise ResponseTimeoutError(e)
 
@@ -251,6 +253,16 @@ class CiscoCEProviderAPI(EndpointProviderAPI):
     def _fetch_configuration_data_file(self):
         return self.get('configuration.xml', timeout=45)
 
+    def get_status_data(
+        self, force=False, fd: Optional[EndpointDataFileBase] = None, paths: Iterable[str] = None
+    ) -> NestedStatusXMLResult:
+        "Parse directly from content, without loading the element tree separately for validation"
+        fd = fd or self.get_status_data_file(force=force)
+        try:
+            return self.endpoint.get_parser('status', fd.content, paths=paths).parse()
+        except (ParseError, ValueError):
+            raise self.error('Could not parse response XML data')
+
     def get_xml(self, path):
         "path example: /Status/Audio"
         response = self.get('getxml', params={'location': path})
@@ -267,6 +279,10 @@ class CiscoCEProviderAPI(EndpointProviderAPI):
                 raise
             return safe_xml_fromstring(new_content)
 
+    def get_status_section_hashes(self, status_data: NestedStatusXMLResult) -> Optional[Dict[str, str]]:
+        "Calculated while parsing, see StatusParser"
+        return status_data.section_hashes
+
     @staticmethod
     def fix_status_xml(content: bytes):
         """
@@ -1,10 +1,14 @@
 import dataclasses
+import re
+import sys
 from collections import OrderedDict, defaultdict
-from typing import Any, DefaultDict, Dict, Generic, Iterator, List, Optional
+from io import BytesIO
+from typing import Any, Callable, DefaultDict, Dict, Generic, Iterable, Iterator, List, Optional
 from typing import OrderedDict as TOrderedDict
 from typing import Sequence, Set, Tuple, TypeVar, Union
-from xml.etree.ElementTree import Element
+from xml.etree.ElementTree import Element, ParseError
 
+from defusedxml.ElementTree import iterparse as safe_xml_iterparse
 from django.utils.datastructures import MultiValueDict
 
 from endpoint.ext_api.parser.types import (
@@ -33,13 +37,52 @@ T = TypeVar('T', ParsedConfigurationTuple, ParsedStatusTuple, ParsedCommandTuple
 PathDefaultDict = DefaultDict[PathTuple, List[T]]
 
 
+class PathIndex(Generic[T]):
+    """
+    Flat path index of parsed nodes, built while parsing instead of walking the
+    result afterwards. Same content and order as NestedXMLResult._nested_keys
+    """
+
+    def __init__(self):
+        self.all_keys: PathDefaultDict[T] = defaultdict(list)
+        self.keys_with_items: PathDefaultDict[T] = defaultdict(list)
+        self._paths: Dict[Tuple[PathTuple, str], PathTuple] = {}
+
+    def get_path(self, parent: PathTuple, part: str) -> PathTuple:
+        "Reuse the same tuple for paths that occur multiple times"
+        try:
+            return self._paths[parent, part]
+        except KeyError:
+            result = self._paths[parent, part] = parent + (sys.intern(part),)
+            return result
+
+    def start(self, path: PathTuple):
+        self.all_keys[path]  # noqa keep key order of a depth first walk
+
+    def add(self, node: T, path: PathTuple, path_without_index: PathTuple):
+        self.all_keys[path].append(node)
+        if node.item:
+            self.keys_with_items[path].append(node)
+        if path != path_without_index:
+            self.all_keys[path_without_index].append(node)
+
+    def add_parent(self, node: T, path: PathTuple, path_without_index: PathTuple):
+        "Add parent node for items that have already been added"
+        self.all_keys[path].insert(0, node)
+        if path != path_without_index:
+            self.all_keys[path_without_index].append(node)
+
+
 class NestedXMLResult(Generic[T]):
 
-    def __init__(self, data: Sequence[T]):
+    def __init__(self, data: Sequence[T], index: PathIndex[T] = None):
         self.data = data
         self._cached_keys: Optional[PathDefaultDict[T]] = None
         self._cached_keys_with_items: Optional[PathDefaultDict[T]] = None
         self._duplicated_keys = set()
+        if index is not None:
+            self._cached_keys = index.all_keys
+            self._cached_keys_with_items = index.keys_with_items
 
     def _groupdict(self, lst):
         result = defaultdict(list)
@@ -159,6 +202,9 @@ class NestedConfigurationXMLResult(NestedXMLResult[ParsedConfigurationTuple]):
 
 
 class NestedStatusXMLResult(NestedXMLResult[ParsedStatusTuple]):
+
+    section_hashes: Optional[Dict[str, str]] = None  # set by StatusParser(section_hash=...)
+
     def _get_text_value(self, node: ParsedStatusTuple) -> str:
         return node.item
 
@@ -176,10 +222,11 @@ class ConfigurationParser(BaseParser):
         self.valuespace = valuespace
 
     def parse(self) -> NestedConfigurationXMLResult:
+        self.index = PathIndex()
         self.result = self._iter(self.root)
-        return NestedConfigurationXMLResult(self.result)
+        return NestedConfigurationXMLResult(self.result, self.index)
 
-    def _iter(self, node: Element, path=()) -> List[ParsedConfigurationTuple]:
+    def _iter(self, node: Element, path=(), path_without_index=()) -> List[ParsedConfigurationTuple]:
         '''
         [
             ('title', {'option':''}, child_tree, setting),
@@ -205,9 +252,11 @@ class ConfigurationParser(BaseParser):
             setting = None
 
             if section.get('maxOccurrence'):
-                cur_path = path + ('{}[{}]'.format(cur_tag, section.get('item')),)
+                cur_path = self.index.get_path(path, '{}[{}]'.format(cur_tag, section.get('item')))
             else:
-                cur_path = path + (cur_tag,)
+                cur_path = self.index.get_path(path, cur_tag)
+            cur_path_without_index = self.index.get_path(path_without_index, cur_tag)
+            self.index.start(cur_path)
 
             if section.get('valueSpaceRef'):
                 limitations = self.get_limitations(
@@ -216,16 +265,16 @@ class ConfigurationParser(BaseParser):
                 setting = Setting(cur_path, section.text, limitations)
             else:
 
-                items = self._iter(section, path=cur_path)
+                items = self._iter(section, path=cur_path, path_without_index=cur_path_without_index)
 
-            result.append(
-                ParsedConfigurationTuple(
-                    cur_tag,
-                    {'index': count, 'multiple': section.get('maxOccurrence'), 'path': cur_path},
-                    items,
-                    setting,
-                )
+            cur = ParsedConfigurationTuple(
+                cur_tag,
+                {'index': count, 'multiple': section.get('maxOccurrence'), 'path': cur_path},
+                items,
+                setting,
             )
+            self.index.add(cur, cur_path, cur_path_without_index)
+            result.append(cur)
 
         return result
 
@@ -241,8 +290,9 @@ class CommandParser(BaseParser):
         self.valuespace = valuespace
 
     def parse(self) -> NestedCommandsXMLResult:
+        self.index = PathIndex()
         self.result = self._iter(self.root)
-        return NestedCommandsXMLResult(self.result)
+        return NestedCommandsXMLResult(self.result, self.index)
 
     def _iter(self, node: Element, path=()) -> List[ParsedCommandTuple]:
         '''
@@ -256,19 +306,23 @@ class CommandParser(BaseParser):
         for section in node:
 
             cur_tag = get_tag(section)
+            cur_path = self.index.get_path(path, cur_tag)
+            self.index.start(cur_path)
 
             items = []
             command = None
 
             if section.get('command') == 'True':
-                command = Command(path + (cur_tag,),
+                command = Command(cur_path,
                                   self._iter_arguments(section),
                                   section.get('multiline') == 'True'
                                   )
             else:
-                items = self._iter(section, path=path + (cur_tag,))
+                items = self._iter(section, path=cur_path)
 
-            result.append(ParsedCommandTuple(cur_tag, {'path': path + (cur_tag,)}, items, command))
+            cur = ParsedCommandTuple(cur_tag, {'path': cur_path}, items, command)
+            self.index.add(cur, cur_path, cur_path)
+            result.append(cur)
 
         return result
 
@@ -335,11 +389,50 @@ class ValueSpaceParser(BaseParser):
         return result
 
 
-class StatusParser(BaseParser):
+class _StatusFrame:
 
-    def __init__(self, root):
+    __slots__ = ('tag', 'path', 'path_without_index', 'index', 'item', 'children', 'has_children', 'included',
+                 'count_tag', 'count')
+
+    def __init__(self, tag, path, path_without_index, index=0, item=None, included=False):
+        self.tag = tag
+        self.path = path
+        self.path_without_index = path_without_index
+        self.index = index
+        self.item = item
+        self.included = included
+        self.children: List[ParsedStatusTuple] = []
+        self.has_children = False
+        self.count_tag = ''
+        self.count = 0
+
+
+class StatusParser(BaseParser):
+    """
+    Parse status from an element tree (root) or, with less memory and in a single pass,
+    directly from xml content. Use paths to only include a subset of the document, e.g.
+    ``paths=['SystemUnit', 'RoomAnalytics/PeopleCount']``. fix_content is used to retry
+    parsing of invalid content. When parsing content, section_hash is called with the
+    values of each top level section to set NestedStatusXMLResult.section_hashes
+    """
+
+    def __init__(self, root: Element = None, content: bytes = None, paths: Iterable[str] = None,
+                 fix_content: Callable[[bytes], bytes] = None, section_hash: Callable[[bytes], str] = None):
         super().__init__()
         self.root = root
+        self.content = content
+        self.fix_content = fix_content
+        self.section_hash = section_hash
+        self.section_hashes: Optional[Dict[str, str]] = None
+
+        self.paths = None
+        self.path_prefixes = set()
+        if paths is not None:
+            self.paths = {
+                tuple(re.sub(r'\[[^\]]*\]', '', p).lstrip('./').rstrip('/').replace('.', '/').split('/'))
+                for p in paths
+            }
+            self.path_prefixes = {p[:i] for p in self.paths for i in range(1, len(p))}
 
     def _nest_duplicates(self, lst: List[ParsedStatusTuple]):
         result = []
@@ -351,18 +444,124 @@ class StatusParser(BaseParser):
                 result.append(r)
             elif r.meta['index'] == 0:
                 children = [i for i in lst if i.title == r.title]
-                result.append(ParsedStatusTuple(r.title, {'path': r.meta['path']}, children, ''))
+                parent = ParsedStatusTuple(r.title, {'path': r.meta['path']}, children, '')
+                self.index.add_parent(parent, r.meta['path'], self.index.get_path((), r.title))
+                result.append(parent)
             else:
                 continue
         return result
 
     def parse(self) -> NestedStatusXMLResult:
-        items = self._iter(self.root)
+        self.index = PathIndex()
+        if self.root is not None:
+            items = self._iter(self.root)
+        else:
+            items = self._iterparse_content()
 
         self.result = self._nest_duplicates(items)
-        return NestedStatusXMLResult(self.result)
+        result = NestedStatusXMLResult(self.result, self.index)
+        result.section_hashes = self.section_hashes
+        return result
+
+    def _iterparse_content(self) -> List[ParsedStatusTuple]:
+        try:
+            return self._iterparse(self.content)
+        except ParseError:
+            if not self.fix_content:
+                raise
+            new_content = self.fix_content(self.content)
+            if new_content == self.content:
+                raise
+            self.index = PathIndex()
+            self.section_hashes = None
+            return self._iterparse(new_content)
+
+    def _is_included(self, path_without_index: PathTuple):
+        if path_without_index in self.path_prefixes:
+            return True
+        return any(path_without_index[:i] in self.paths for i in range(1, len(path_without_index) + 1))
+
+    def _iterparse(self, content: bytes) -> List[ParsedStatusTuple]:
+
+        index = self.index
+        stack: List[_StatusFrame] = []
+        skip_depth = 0
+
+        section_hash = self.section_hash
+        section_values: List[str] = []  # leaf values of the current top level section
+        section_hashes: Dict[str, List[str]] = {}
+
+        for event, section in safe_xml_iterparse(BytesIO(content), events=('start', 'end')):
+
+            if event == 'start':
+                if skip_depth:
+                    skip_depth += 1
+                    continue
+                if not stack:  # root
+                    stack.append(_StatusFrame('', (), (), included=self.paths is None))
+                    continue
+
+                parent = stack[-1]
+                parent.has_children = True
+
+                cur_tag = get_tag(section)
+                if parent.count_tag == cur_tag:
+                    parent.count += 1
+                else:
+                    parent.count_tag, parent.count = cur_tag, 0
+
+                item = section.get('item')
+                if item:
+                    cur_path = index.get_path(parent.path, '{}[{}]'.format(cur_tag, item))
+                else:
+                    cur_path = index.get_path(parent.path, cur_tag)
+                cur_path_without_index = index.get_path(parent.path_without_index, cur_tag)
+
+                included = parent.included
+                if not included:
+                    if not self._is_included(cur_path_without_index):
+                        skip_depth = 1
+                        continue
+                    included = cur_path_without_index in self.paths
+
+                index.start(cur_path)
+                stack.append(_StatusFrame(cur_tag, cur_path, cur_path_without_index, parent.count, item, included))
+                continue
+
+            # end
+            if skip_depth:
+                skip_depth -= 1
+                if not skip_depth:
+                    section.clear()
+                continue
+
+            frame = stack.pop()
+            if not stack:  # root
+                if section_hash:
+                    self.section_hashes = {tag: ''.join(hashes) for tag, hashes in section_hashes.items()}
+                return frame.children
+
+            meta = {'index': frame.index, 'path': frame.path}
+            value = None if frame.has_children else (section.text or '')
+
+            if section_hash:
+                if value is not None:
+                    section_values.append('{}<{}>{}</{}>'.format('/'.join(frame.path), frame.tag, value, frame.tag))
+                if len(stack) == 1:
+                    section_hashes.setdefault(frame.tag, []).append(section_hash('\n'.join(section_values).encode()))
+                    section_values = []
+
+            cur = ParsedStatusTuple(frame.tag, meta, frame.children, value)
+            if frame.item:
+                cur.meta['item'] = frame.item
 
-    def _iter(self, node: Element, path=()) -> List[ParsedStatusTuple]:
+            index.add(cur, frame.path, frame.path_without_index)
+            stack[-1].children.append(cur)
+            section.clear()
+
+        raise ParseError('Missing root element')
+
+    def _iter(self, node: Element, path=(), path_without_index=()) -> List[ParsedStatusTuple]:
         '''
         [
             ('title', {'option':''}, child_tree, value),
@@ -387,12 +586,14 @@ class StatusParser(BaseParser):
             value = None
 
             if section.get('item'):
-                cur_path = path + ('{}[{}]'.format(cur_tag, section.get('item')),)
+                cur_path = self.index.get_path(path, '{}[{}]'.format(cur_tag, section.get('item')))
             else:
-                cur_path = path + (cur_tag,)
+                cur_path = self.index.get_path(path, cur_tag)
+            cur_path_without_index = self.index.get_path(path_without_index, cur_tag)
+            self.index.start(cur_path)
 
             if len(section):
-                items = self._iter(section, path=cur_path)
+                items = self._iter(section, path=cur_path, path_without_index=cur_path_without_index)
             else:
                 value = section.text or ''
 
@@ -400,7 +601,7 @@ class StatusParser(BaseParser):
             if section.get('item'):
                 cur.meta['item'] = section.get('item')
 
+            self.index.add(cur, cur_path, cur_path_without_index)
             result.append(cur)
 
         return result
-
@@ -0,0 +1,69 @@
+"""
+Cache of parsed valuespace and command schemas, shared between endpoints with the same
+product and software version.
+
+Entries are keyed by a hash of the source content, so identical files from different
+endpoints use the same entry. Parsed results are stored pickled and compressed in the
+shared cache, and kept unpickled in a small process local cache. Results are shared
+between callers and must be treated as read-only.
+"""
+import hashlib
+import logging
+import pickle
+import zlib
+from typing import Callable, Optional, Sequence, TypeVar
+
+from cacheout import LRUCache
+from django.core.cache import cache
+from django.utils.encoding import force_bytes
+
+logger = logging.getLogger(__name__)
+
+# Increase when parser output changes, to ignore old entries
+PARSER_VERSION = 1
+
+SHARED_TTL = 7 * 24 * 60 * 60
+
+local_cache = LRUCache(maxsize=20, ttl=60 * 60)
+
+R = TypeVar('R')
+
+
+def get_key(kind: str, contents: Sequence[Optional[bytes]]) -> str:
+    digest = hashlib.md5()
+    for content in contents:
+        digest.update(hashlib.md5(force_bytes(content or b'')).digest())
+    return 'endpoint.schema.{}.{}.{}'.format(kind, PARSER_VERSION, digest.hexdigest())
+
+
+def get_parsed(kind: str, contents: Sequence[Optional[bytes]], parse: Callable[[], R]) -> R:
+    """
+    Get parsed result for the source content, e.g. command file and the valuespace file
+    it refers to. parse() is only called if no other process has parsed the same content
+    """
+    key = get_key(kind, contents)
+
+    result = local_cache.get(key)
+    if result is not None:
+        return result
+
+    try:
+        stored = cache.get(key)
+        if stored is not None:
+            result = pickle.loads(zlib.decompress(stored))
+    except Exception:  # changed classes, broken cache backend
+        logger.info('Could not load parsed %s schema from cache', kind, exc_info=True)
+
+    if result is None:
+        result = parse()
+        try:
+            cache.set(key, zlib.compress(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)), SHARED_TTL)
+        except Exception:
+            logger.info('Could not store parsed %s schema in cache', kind, exc_info=True)
+
+    local_cache.set(key, result)
+    return result
+
+
+def clear_local():
+    local_cache.clear()
@@ -424,12 +424,12 @@ class PolyStudioXProviderAPI(PolyBaseProviderAPI):
         }
 
     def get_status_data(
-        self, force=False, fd: Optional[EndpointDataFileBase] = None
+        self, force=False, fd: Optional[EndpointDataFileBase] = None, paths: Iterable[str] = None
     ) -> parser.NestedXMLResult:
 
         fd = fd or self.get_status_data_file(force=force)
 
-        return self.endpoint.get_parser('status', fd.content).parse()
+        return self.endpoint.get_parser('status', fd.content, paths=paths).parse()
 
     @staticmethod
     def load_status_xml(content: bytes):
@@ -4,12 +4,13 @@ import re
 import uuid
 from datetime import datetime, timedelta
 from random import choice
-from typing import TYPE_CHECKING, Literal, Sequence, Tuple, Union
+from typing import TYPE_CHECKING, Iterable, Literal, Sequence, Tuple, Union
 
 import pytz
 from cacheout import fifo_memoize
 from django.conf import settings
 from django.db import models, transaction
+from django.utils.encoding import force_bytes
 from django.utils.text import slugify
 from django.utils.timezone import localtime, now
 from django.utils.translation import ugettext_lazy as _
@@ -320,6 +321,7 @@ class Endpoint(ProviderAPICompatible, models.Model):
         type: Literal['status', 'configuration', 'command', 'valuespace'],
         xml_data: bytes,
         valuespace=None,
+        paths: Iterable[str] = None,
     ):
         from defusedxml.cElementTree import fromstring as safe_xml_fromstring
 
@@ -331,7 +333,15 @@ class Endpoint(ProviderAPICompatible, models.Model):
         if self.manufacturer == MANUFACTURER.CISCO_CE:
             from .ext_api.parser import cisco_ce
             if type == 'status':
-                return cisco_ce.StatusParser(self.get_api().load_status_xml(xml_data))
+                from endpoint_data.models import EndpointDataFile
+
+                from .ext_api.cisco_ce import CiscoCEProviderAPI
+                return cisco_ce.StatusParser(  # paths is only supported for cisco status
+                    content=force_bytes(xml_data),
+                    paths=paths,
+                    fix_content=CiscoCEProviderAPI.fix_status_xml,
+                    section_hash=EndpointDataFile.get_cleaned_hash if paths is None else None,
+                )
             elif type == 'configuration':
                 return cisco_ce.ConfigurationParser(safe_xml_fromstring(xml_data), _valuespace())
             elif type == 'command':
@@ -20,7 +20,7 @@ from sentry_sdk import capture_exception
 from address.models import AddressBook
 from conferencecenter.celery import app
 from endpoint.consts import CONNECTION, STATUS, TASKSTATUS
-from endpoint.threading import endpoint_thread_pool
+from endpoint.threading import endpoint_status_pool, endpoint_thread_pool
 from provider.exceptions import ResponseConnectionError
 
 if TYPE_CHECKING:
@@ -119,7 +119,8 @@ def update_all_endpoint_status(self: Task, extra_filter=None):
 
 class UpdateEndpointStatusRunner:
     """
-    Fetch status and configuration data in separate thread and process the results
+    Fetch status and configuration data in separate threads and process each result as soon
+    as it is ready, see endpoint.threading.endpoint_status_pool
     """
 
     def __init__(self, extra_filter=None, timeout=15 * 60):
@@ -174,11 +175,10 @@ class UpdateEndpointStatusRunner:
 
     def run(self):
         for endpoint, fds in self.silence_timeout(
-            endpoint_thread_pool(
+            endpoint_status_pool(
                 self.get_endpoints().iterator(),
                 self._fetch_data,
                 timeout=self.timeout,
-                processes=10,
             )
         ):
 
@@ -194,24 +194,72 @@ class UpdateEndpointStatusRunner:
 
         self.set_other_systems_as_offline()
 
+    STATUS_STATE_CACHE_TTL = 60 * 60  # Force full processing of unchanged status at least this often
+
+    EVENTS_STATUS_SECTIONS = {'HttpFeedback'}
+
     def process_status_result(self, endpoint: 'Endpoint', status_fd):
+        """
+        Parse and update status. Content that is unchanged since the last check (apart from
+        timestamps and uptime) is skipped, and feedback slot checks only run if their
+        section has changed. Room analytics samples are stored for every check, using the
+        values from the last parsed status if unchanged
+        """
+        from endpoint_data.models import EndpointDataFile
+        from room_analytics import parse
+
+        cache_key = 'endpoint.{}.status_state'.format(endpoint.pk)
+        previous = cache.get(cache_key) or {}
+
+        cleaned_hash = EndpointDataFile.get_cleaned_hash(status_fd.content)
+        if previous.get('hash') == cleaned_hash and endpoint.status.status >= STATUS.ONLINE:
+            logger.debug('Status unchanged for endpoint %s', endpoint.pk)
+            endpoint.set_status(status=endpoint.status.status)
+            if previous.get('room_analytics'):
+                with self.ignore_exceptions(endpoint, 'room analytics update'):
+                    parse.store_values(previous['room_analytics'], endpoint)
+            return
+
         logger.debug('Start parsing status for endpoint %s', endpoint.pk)
 
         status_data = None  # noqa
+        section_hashes = None
 
         with self.ignore_exceptions(endpoint, 'status parsing') as status:
-            status_data = endpoint.get_api().get_status_data(fd=status_fd)
+            api = endpoint.get_api()
+            status_data = api.get_status_data(fd=status_fd)
+            section_hashes = api.get_status_section_hashes(status_data)
             if not status.success:
                 return
 
         if not status_data:
             return
 
-        with self.ignore_exceptions(endpoint, 'status update'):
+        changed = self.get_changed_sections(previous.get('sections'), section_hashes)
+
+        with self.ignore_exceptions(endpoint, 'status update') as status:
             endpoint.update_status(status_data, raise_exceptions=False)
+        if not status.success or endpoint.status.status < STATUS.ONLINE:
+            cache.delete(cache_key)
+            return
 
-        with self.ignore_exceptions(endpoint, 'feedback slot check'):
-            endpoint.get_api().check_events_status(status_data=status_data, delay_fix=True)
+        if changed is None or changed & self.EVENTS_STATUS_SECTIONS:
+            with self.ignore_exceptions(endpoint, 'feedback slot check'):
+                endpoint.get_api().check_events_status(status_data=status_data, delay_fix=True)
+
+        room_analytics = parse.parse_cisco_ce(status_data) if endpoint.is_cisco else None
+        cache.set(
+            cache_key,
+            {'hash': cleaned_hash, 'sections': section_hashes, 'room_analytics': room_analytics},
+            self.STATUS_STATE_CACHE_TTL,
+        )
+
+    @staticmethod
+    def get_changed_sections(previous: Optional[Mapping[str, str]], current: Optional[Mapping[str, str]]):
+        """Names of changed top level sections. None if unknown"""
+        if previous is None or current is None:
+            return None
+        return {k for k in set(previous) | set(current) if previous.get(k) != current.get(k)}
 
     def process_configuration_result(self, endpoint: 'Endpoint', configuration_fd):
         logger.debug('Start parsing configuration for endpoint %s', endpoint.pk)
@@ -382,9 +430,9 @@ def queue_pending_endpoint_tasks(self: Task, endpoint_ids=None, endpoint_id=None
 
         EndpointTask.objects.filter(pk__in=offline_tasks).update(ts_last_attempt=now())
 
-    # run each task grouped by endpoint. TODO: merge multiple configuration/commands
+    # run each task grouped by endpoint. configuration/commands are merged when possible
     for task_ids in run_tasks.values():
-        chain([run_task.si(task_id) for task_id in task_ids]).delay()
+        run_endpoint_tasks.delay(task_ids)
     for task_ids in run_slow_tasks.values():
         chain([run_slow_task.si(task_id) for task_id in task_ids]).delay()
 
@@ -434,6 +482,24 @@ def run_task(self: Task, task_id: int):
     _lock_and_run_task(self, task_id)
 
 
+@app.task(bind=True)
+def run_endpoint_tasks(self: Task, task_ids: List[int]):
+    """Run tasks for a single endpoint, with configuration and commands combined into as few requests as possible"""
+    from endpoint_provision.batch import EndpointTaskBatch
+    from endpoint_provision.models import EndpointTask
+
+    with transaction.atomic():
+        tasks = EndpointTask.objects\
+            .select_for_update(of=('self',))\
+            .filter(status__in=(EndpointTask.TASKSTATUS.PENDING, EndpointTask.TASKSTATUS.QUEUED))\
+            .filter(pk__in=task_ids)
+        tasks = sorted(tasks, key=lambda t: task_ids.index(t.pk))
+        single = EndpointTaskBatch(tasks).run()
+
+    for task in single:
+        _lock_and_run_task(self, task.pk)
+
+
 def _lock_and_run_task(self: Task, task_id: int):
     from endpoint_provision.models import EndpointTask
     start = now()
@@ -1,6 +1,10 @@
 
+import re
 from os import path
+from unittest.mock import patch
 
+from defusedxml.cElementTree import fromstring as safe_xml_fromstring
+from django.core.cache import cache
 from django.test.utils import override_settings
 
 from conferencecenter.tests.base import ThreadedTestCase
@@ -318,6 +322,117 @@ class TaskTestCase(ThreadedTestCase, EndpointBaseTest):
 
         update_all_endpoint_status()
 
+    def test_unchanged_status(self):
+        from endpoint.ext_api.cisco_ce import CiscoCEProviderAPI
+        from endpoint.tasks import UpdateEndpointStatusRunner
+        from endpoint_data.models import EndpointCurrentState
+        from room_analytics import parse
+
+        if not self.endpoint.is_cisco:
+            self.skipTest('Cisco status data')
+
+        with open(path.join(root, 'data', 'status.xml'), 'rb') as fd:
+            content = fd.read()
+
+        def _run(content):
+            status_fd = EndpointCurrentState.objects.store(self.endpoint, status=content).status
+            UpdateEndpointStatusRunner().process_status_result(self.endpoint, status_fd)
+            return Endpoint.objects.get(pk=self.endpoint.pk).status
+
+        with patch.object(CiscoCEProviderAPI, 'get_status_data', autospec=True,
+                          side_effect=CiscoCEProviderAPI.get_status_data) as get_status_data, \
+                patch.object(parse, 'store_values') as store_values, \
+                patch.object(CiscoCEProviderAPI, 'check_events_status') as check_events_status:
+            status = _run(content)
+            self.assertEqual(get_status_data.call_count, 1)
+            self.assertEqual(store_values.call_count, 1)
+            self.assertEqual(check_events_status.call_count, 1)
+            self.assertGreaterEqual(status.status, Endpoint.STATUS.ONLINE)
+
+            # only uptime changed. room analytics samples are still stored
+            EndpointStatus.objects.filter(endpoint=self.endpoint).update(ts_last_check=None)
+            status = _run(re.sub(rb'<Uptime>\d+</Uptime>', b'<Uptime>1234</Uptime>', content))
+            self.assertEqual(get_status_data.call_count, 1)
+            self.assertEqual(store_values.call_count, 2)
+            self.assertEqual(store_values.call_args_list[0], store_values.call_args_list[1])
+            self.assertIsNotNone(status.ts_last_check)
+            self.assertGreaterEqual(status.status, Endpoint.STATUS.ONLINE)
+
+            # other section changed
+            end = content.rindex(b'</Status>')
+            _run(content[:end] + b'<Test>1</Test>' + content[end:])
+            self.assertEqual(get_status_data.call_count, 2)
+            self.assertEqual(store_values.call_count, 3)
+            self.assertEqual(check_events_status.call_count, 1)
+
+            # expired state
+            cache.delete('endpoint.{}.status_state'.format(self.endpoint.pk))
+            _run(content)
+            self.assertEqual(get_status_data.call_count, 3)
+            self.assertEqual(store_values.call_count, 4)
+            self.assertEqual(check_events_status.call_count, 2)
+
+
+class SchemaCacheTestCase(EndpointBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        from endpoint.ext_api.parser import schema_cache
+        from endpoint_data.models import EndpointCurrentState
+
+        self.schema_cache = schema_cache
+        schema_cache.clear_local()
+        self.addCleanup(schema_cache.clear_local)
+
+        self.endpoints = [
+            Endpoint.objects.create(customer=self.customer, hostname='test{}'.format(i), manufacturer=self.manufacturer)
+            for i in range(2)
+        ]
+        for endpoint in self.endpoints:
+            for name in ('command', 'valuespace'):
+                with open(path.join(root, 'data', '{}.xml'.format(name)), 'rb') as fd:
+                    EndpointCurrentState.objects.store(endpoint, **{name: fd.read()})
+
+    def _get_api(self, endpoint):
+        return Endpoint.objects.get(pk=endpoint.pk).get_api()
+
+    def _get_content(self, endpoint, name):
+        return Endpoint.objects.get(pk=endpoint.pk).get_cached_file(name, None).content
+
+    def test_shared_schema(self):
+        from endpoint.ext_api.parser import cisco_ce
+        from endpoint_data.models import EndpointCurrentState
+
+        first, second = self.endpoints
+        expected_valuespace = cisco_ce.ValueSpaceParser(safe_xml_fromstring(self._get_content(second, 'valuespace'))).parse()
+
+        with patch.object(cisco_ce.CommandParser, 'parse', autospec=True,
+                          side_effect=cisco_ce.CommandParser.parse) as parse_commands, \
+                patch.object(cisco_ce.ValueSpaceParser, 'parse', autospec=True,
+                             side_effect=cisco_ce.ValueSpaceParser.parse) as parse_valuespace:
+            commands = self._get_api(first).get_commands_data()
+            self.assertEqual(parse_commands.call_count, 1)
+            self.assertEqual(parse_valuespace.call_count, 1)
+
+            self.assertIs(self._get_api(second).get_commands_data(), commands)
+
+            self.schema_cache.clear_local()  # other process
+            other_commands = self._get_api(second).get_commands_data()
+            self.assertIsNot(other_commands, commands)
+            self.assertEqual(repr(other_commands.tuple_items()), repr(commands.tuple_items()))
+            self.assertEqual(parse_commands.call_count, 1)
+
+            valuespace = self._get_api(second).get_valuespace_data()
+            self.assertEqual(parse_valuespace.call_count, 1)
+            self.assertEqual(repr(valuespace), repr(expected_valuespace))
+
+            # changed content
+            content = self._get_content(second, 'command')
+            EndpointCurrentState.objects.store(second, command=content.replace(b'</Command>', b'<Test/></Command>'))
+            self._get_api(second).get_commands_data()
+            self.assertEqual(parse_commands.call_count, 2)
+            self.assertEqual(parse_valuespace.call_count, 1)
+
 
 class CeleryTasksTestCase(EndpointBaseTest):
     # TODO in depth tests
@@ -1,5 +1,8 @@
+import re
 from os import path
 
+from xml.etree.ElementTree import ParseError
+
 from defusedxml.cElementTree import parse as safe_xml_parse
 from django.conf import settings
 from django.test import TestCase
@@ -38,5 +41,78 @@ class TestCiscoParser(TestCase):
             pprint(commands)
             pprint(configuration)
 
+    def _get_content(self, path):
+        with open(root + '/data/' + path, 'rb') as fd:
+            return fd.read()
+
+    def assertSameIndex(self, result):
+        walked = result.__class__(result.data)
+        self.assertEqual(
+            [(k, [id(n) for n in v]) for k, v in result._nested_keys.items()],
+            [(k, [id(n) for n in v]) for k, v in walked._nested_keys.items()],
+        )
+        self.assertEqual(
+            [(k, [id(n) for n in v]) for k, v in result.all_keys.items()],
+            [(k, [id(n) for n in v]) for k, v in walked.all_keys.items()],
+        )
+
+    def test_path_index(self):
+        valuespace = parser.ValueSpaceParser(self._get_file('valuespace.xml')).parse()
+
+        for filename in ('status.xml', 'status_dx80.xml', 'status_roomkit.xml'):
+            self.assertSameIndex(parser.StatusParser(self._get_file(filename)).parse())
+            self.assertSameIndex(parser.StatusParser(content=self._get_content(filename)).parse())
+
+        for filename in ('configuration.xml', 'configuration_dx80.xml', 'configuration_roomkit.xml'):
+            self.assertSameIndex(parser.ConfigurationParser(self._get_file(filename), valuespace).parse())
+
+        self.assertSameIndex(parser.CommandParser(self._get_file('command.xml'), valuespace).parse())
+
+    def test_streaming_status(self):
+        for filename in ('status.xml', 'status_dx80.xml', 'status_roomkit.xml'):
+            status = parser.StatusParser(self._get_file(filename)).parse()
+            streamed = parser.StatusParser(content=self._get_content(filename)).parse()
+            self.assertEqual(streamed.tuple_items(), status.tuple_items())
+            self.assertEqual(list(streamed), list(status))
+
+        partial = parser.StatusParser(
+            content=self._get_content('status.xml'), paths=['HttpFeedback/Status', './UserInterface/ContactInfo']
+        ).parse()
+        self.assertEqual('OK', partial.findtext('./HttpFeedback[2]/Status'))
+        self.assertEqual('', partial.findtext('./HttpFeedback[2]/URL'))
+        self.assertEqual(partial.findtext('./UserInterface/ContactInfo/ContactMethod/Number'), '1234@example.org')
+        self.assertEqual({k.split('.')[0].split('[')[0] for k, v in partial}, {'HttpFeedback', 'UserInterface'})
+
+        invalid = self._get_content('status.xml').replace(b'<Name>', b'<Name>\x01', 1)
+        with self.assertRaises(ParseError):
+            parser.StatusParser(content=invalid).parse()
+        fixed = parser.StatusParser(content=invalid, fix_content=lambda c: c.replace(b'\x01', b'')).parse()
+        self.assertEqual('OK', fixed.findtext('./HttpFeedback/Status'))
+
+
+        subset = parser.StatusParser(content=self._get_content('status.xml'), paths=['HttpFeedback[2]/Status']).parse()
+        self.assertEqual('OK', subset.findtext('./HttpFeedback[2]/Status'))
+
+    def test_section_hashes(self):
+        from endpoint_data.models import EndpointDataFile
+
+        def _hashes(content):
+            return parser.StatusParser(content=content, section_hash=EndpointDataFile.get_cleaned_hash).parse().section_hashes
+
+        content = self._get_content('status.xml')
+        hashes = _hashes(content)
+        self.assertIn('HttpFeedback', hashes)
+        self.assertIsNone(parser.StatusParser(content=content).parse().section_hashes)
+
+        uptime = re.sub(rb'<Uptime>\d+</Uptime>', b'<Uptime>1234</Uptime>', content)
+        self.assertNotEqual(uptime, content)
+        self.assertEqual(_hashes(uptime), hashes)
 
+        feedback = content.replace(b'<Status>OK</Status>', b'<Status>Failed</Status>', 1)
+        self.assertNotEqual(feedback, content)
+        changed = _hashes(feedback)
+        self.assertEqual({k for k in hashes if changed[k] != hashes[k]}, {'HttpFeedback'})
 
+        end = content.rindex(b'</Status>')
+        added = _hashes(content[:end] + b'<Test>1</Test>' + content[end:])
+        self.assertEqual(added, {**hashes, 'Test': added['Test']})
@@ -0,0 +1,162 @@
+import concurrent.futures
+import socket
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from unittest.mock import patch
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from conferencecenter.tests.base import ConferenceBaseTest
+from endpoint.threading import AdaptiveLimiter, bounded_thread_pool
+
+
+class FakeEndpointHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        # /<customer>/<delay>/status.xml
+        delay = float(self.path.strip('/').split('/')[1])
+        sleep(delay)
+        body = b'<Status><SystemUnit><ProductId>Cisco Codec</ProductId></SystemUnit></Status>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeEndpointServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 100  # don't reset connections when many workers connect at once
+
+
+class FakeEndpoint:
+    def __init__(self, customer_id, url):
+        self.customer_id = customer_id
+        self.url = url
+
+
+class BoundedThreadPoolTestCase(ConferenceBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeEndpointServer(('127.0.0.1', 0), FakeEndpointHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        # closed port for dead hosts
+        dead = socket.socket()
+        dead.bind(('127.0.0.1', 0))
+        self.dead_port = dead.getsockname()[1]
+        dead.close()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def get_endpoints(self, count=60):
+        port = self.server.server_address[1]
+        result = []
+        for i in range(count):
+            customer_id = i % 3
+            if customer_id == 2 and i % 2:  # customer with unreachable network
+                url = 'http://127.0.0.1:{}/2/0/status.xml'.format(self.dead_port)
+            else:
+                delay = 0.5 if i % 10 == 0 else 0.05
+                url = 'http://127.0.0.1:{}/{}/{}/status.xml'.format(port, customer_id, delay)
+            result.append(FakeEndpoint(customer_id, url))
+        return result
+
+    def fetch(self, endpoint):
+        if endpoint.url.startswith('http://127.0.0.1:{}/'.format(self.dead_port)):
+            sleep(0.2)  # simulate connect timeout
+        opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))  # requests is mocked in tests
+        with opener.open(endpoint.url, timeout=5) as response:
+            return response.read()
+
+    def test_results(self):
+        endpoints = self.get_endpoints()
+        limiter = AdaptiveLimiter(10, initial=4, slow_seconds=60)
+
+        results = dict(bounded_thread_pool(
+            endpoints, self.fetch, key=lambda e: e.customer_id, max_workers=20, limiter=limiter
+        ))
+
+        self.assertEqual(set(results), set(endpoints))
+        errors = [e for e, result in results.items() if isinstance(result, Exception)]
+        self.assertEqual(len(errors), 10)
+        self.assertTrue(all(e.customer_id == 2 for e in errors))
+
+        self.assertEqual(limiter.get_limit(0), 10)  # only successful results
+        self.assertEqual(sum(limiter.active.values()), 0)
+
+    def test_limiter(self):
+        limiter = AdaptiveLimiter(10, initial=4, slow_seconds=1)
+
+        for success, seconds, limit in [(True, 0, 5), (True, 0.5, 6), (False, 0, 3), (True, 2, 1), (False, 0, 1)]:
+            limiter.start(1)
+            limiter.done(1, success, seconds)
+            self.assertEqual(limiter.get_limit(1), limit)
+
+        limiter.start(1)
+        self.assertFalse(limiter.can_start(1))
+        self.assertTrue(limiter.can_start(2))
+
+        for _i in range(20):
+            limiter.start(2)
+            limiter.done(2, True, 0)
+        self.assertEqual(limiter.get_limit(2), 10)
+
+    def test_customer_limit(self):
+        active = {0: 0, 1: 0}
+        max_active = {0: 0, 1: 0}
+        lock = threading.Lock()
+
+        def _callback(endpoint):
+            with lock:
+                active[endpoint.customer_id] += 1
+                max_active[endpoint.customer_id] = max(max_active[endpoint.customer_id], active[endpoint.customer_id])
+            sleep(0.02)
+            with lock:
+                active[endpoint.customer_id] -= 1
+            if endpoint.customer_id == 1:
+                raise ValueError('error')
+            return True
+
+        endpoints = [FakeEndpoint(i % 2, '') for i in range(40)]
+        results = list(bounded_thread_pool(
+            endpoints, _callback, key=lambda e: e.customer_id, max_workers=10,
+            limiter=AdaptiveLimiter(6, initial=2),
+        ))
+        self.assertEqual(len(results), 40)
+        self.assertLessEqual(max_active[0], 6)
+        self.assertLessEqual(max_active[1], 2)
+
+    def test_timeout(self):
+        endpoints = [FakeEndpoint(0, '') for _i in range(20)]
+        results = []
+
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            for item in bounded_thread_pool(endpoints, lambda e: sleep(0.1), max_workers=2, timeout=0.25):
+                results.append(item)
+
+        self.assertTrue(2 <= len(results) < 20)
+
+    def test_close_connections(self):
+        used = set()
+
+        def _callback(endpoint):
+            used.add(connections[DEFAULT_DB_ALIAS])
+            sleep(0.01)
+
+        endpoints = [FakeEndpoint(0, '') for _i in range(20)]
+        with patch.object(type(connections[DEFAULT_DB_ALIAS]), 'close', autospec=True) as close:
+            self.assertEqual(len(list(bounded_thread_pool(endpoints, _callback, max_workers=3))), 20)
+
+        # once per worker thread, not per item
+        self.assertEqual(len(used), 3)
+        self.assertEqual(sorted(map(id, used)), sorted(id(call[0][0]) for call in close.call_args_list))
@@ -1,9 +1,13 @@
 import concurrent.futures
 import os
-from typing import Callable, Iterator, Tuple, TypeVar
+from collections import defaultdict, deque
+from time import monotonic
+from typing import Callable, Deque, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, TypeVar
 
 import celery.exceptions
 from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.base.base import BaseDatabaseWrapper
 from sentry_sdk import capture_exception
 
 from endpoint.ext_api.cisco_ce import CiscoCEProviderAPI
@@ -11,6 +15,7 @@ from endpoint.models import Endpoint
 from provider.exceptions import AuthenticationError, ResponseError
 
 TR = TypeVar('TR')
+TI = TypeVar('TI')
 
 
 def endpoint_thread_pool(
@@ -29,14 +34,7 @@ def endpoint_thread_pool(
 
     def _catch_callback(_api: CiscoCEProviderAPI) -> TR:
         try:
-            return _api.endpoint, callback(_api)
-        except (ResponseError, AuthenticationError) as e:
-            return _api.endpoint, e
-        except (concurrent.futures.TimeoutError, celery.exceptions.TimeoutError):
-            raise
-        except Exception as e:
-            capture_exception()
-            return _api.endpoint, e
+            return _api.endpoint, _run_callback(_api, callback)
         finally:
             _api.endpoint._api = None
             del _api
@@ -50,3 +48,163 @@ def endpoint_thread_pool(
             if raise_exceptions and isinstance(result, Exception):
                 raise result
             yield endpoint, result
+
+
+def _run_callback(arg, callback: Callable):
+    try:
+        return callback(arg)
+    except (ResponseError, AuthenticationError) as e:
+        return e
+    except (concurrent.futures.TimeoutError, celery.exceptions.TimeoutError):
+        raise
+    except Exception as e:
+        capture_exception()
+        return e
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit per key, e.g. customer. Raised by one for each fast successful
+    result and halved for each error or slow result, so that unreachable or overloaded
+    networks use fewer workers while other keys continue
+    """
+
+    def __init__(self, maximum: int, initial: int = None, slow_seconds: float = 10):
+        self.maximum = max(1, maximum)
+        self.initial = min(self.maximum, initial or max(1, self.maximum // 4))
+        self.slow_seconds = slow_seconds
+
+        self.limits: Dict[Hashable, float] = {}
+        self.active: Dict[Hashable, int] = defaultdict(int)
+
+    def get_limit(self, key: Hashable) -> int:
+        return max(1, int(self.limits.get(key, self.initial)))
+
+    def can_start(self, key: Hashable) -> bool:
+        return self.active[key] < self.get_limit(key)
+
+    def start(self, key: Hashable):
+        self.active[key] += 1
+
+    def done(self, key: Hashable, success: bool, seconds: float):
+        self.active[key] -= 1
+        limit = self.limits.get(key, self.initial)
+        if success and seconds < self.slow_seconds:
+            self.limits[key] = min(self.maximum, limit + 1)
+        else:
+            self.limits[key] = max(1, limit / 2)
+
+
+def bounded_thread_pool(
+    items: Iterable[TI],
+    callback: Callable[[TI], TR],
+    key: Callable[[TI], Hashable] = None,
+    max_workers: int = 10,
+    limiter: AdaptiveLimiter = None,
+    timeout: float = None,
+) -> Iterator[Tuple[TI, TR]]:
+    """
+    Run ``callback`` for each item in threads and yield ``(item, result)`` as soon as each
+    result is ready, in any order. Items are read lazily and at most ``max_workers`` are in
+    progress at the same time, and at most the limit of ``limiter`` for each ``key(item)``.
+    Exceptions are returned as results, like endpoint_thread_pool. The database connection
+    of each worker thread is closed once all items are done.
+
+    If ``timeout`` is reached no new items are started, and concurrent.futures.TimeoutError
+    is raised after the started items have been yielded
+    """
+    deadline = monotonic() + timeout if timeout else None
+    items = iter(items)
+    waiting: Deque[TI] = deque()  # items for keys at their limit
+    running: Dict[concurrent.futures.Future, Tuple[TI, Optional[Hashable], float]] = {}
+    worker_connections: List[BaseDatabaseWrapper] = []
+
+    def _init_worker():
+        worker_connection = connections[DEFAULT_DB_ALIAS]
+        worker_connection.inc_thread_sharing()  # closed by the calling thread when the pool is done
+        worker_connections.append(worker_connection)
+
+    def _next_item() -> Optional[Tuple[TI, Optional[Hashable]]]:
+        for _i in range(len(waiting)):
+            item = waiting.popleft()
+            item_key = key(item) if key else None
+            if not limiter or limiter.can_start(item_key):
+                return item, item_key
+            waiting.append(item)
+
+        for item in items:
+            item_key = key(item) if key else None
+            if not limiter or limiter.can_start(item_key):
+                return item, item_key
+            waiting.append(item)
+            if len(waiting) > max_workers * 10:  # only slow keys left in a while
+                break
+        return None
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, initializer=_init_worker) as executor:
+            while True:
+                while len(running) < max_workers and not (deadline and monotonic() > deadline):
+                    next_item = _next_item()
+                    if next_item is None:
+                        break
+                    item, item_key = next_item
+                    if limiter:
+                        limiter.start(item_key)
+                    running[executor.submit(_run_callback, item, callback)] = (item, item_key, monotonic())
+
+                if not running:
+                    break
+
+                wait_timeout = max(0.1, deadline - monotonic()) if deadline else None
+                done, _pending = concurrent.futures.wait(
+                    running, timeout=wait_timeout, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    item, item_key, ts_start = running.pop(future)
+                    result = future.result()
+                    if limiter:
+                        limiter.done(item_key, not isinstance(result, Exception), monotonic() - ts_start)
+                    yield item, result
+
+                if deadline and monotonic() > deadline and not done:
+                    for future in running:
+                        future.cancel()
+                    raise concurrent.futures.TimeoutError()
+    finally:
+        for worker_connection in worker_connections:
+            worker_connection.close()
+            worker_connection.dec_thread_sharing()
+
+    if deadline and monotonic() > deadline and (waiting or next(items, None) is not None):
+        raise concurrent.futures.TimeoutError()
+
+
+def endpoint_status_pool(
+    endpoints: Iterable[Endpoint],
+    callback: Callable[[CiscoCEProviderAPI], TR],
+    timeout: float = None,
+) -> Iterator[Tuple[Endpoint, TR]]:
+    """
+    Run ``callback`` for many endpoints with the concurrency limits of
+    settings.EPM_STATUS_CONCURRENCY and settings.EPM_STATUS_CUSTOMER_CONCURRENCY.
+    Results are yielded as soon as they are ready
+    """
+    max_workers = 1 if settings.TEST_MODE else settings.EPM_STATUS_CONCURRENCY
+    limiter = AdaptiveLimiter(settings.EPM_STATUS_CUSTOMER_CONCURRENCY)
+
+    def _callback(endpoint: Endpoint) -> TR:
+        api = endpoint.get_api()
+        try:
+            return callback(api)
+        finally:
+            endpoint._api = None
+
+    yield from bounded_thread_pool(
+        endpoints,
+        _callback,
+        key=lambda endpoint: endpoint.customer_id,
+        max_workers=max_workers,
+        limiter=limiter,
+        timeout=timeout,
+    )
@@ -0,0 +1,212 @@
+"""
+Run multiple provisioning tasks for the same endpoint using as few requests as possible.
+
+Configuration from all configuration/template tasks is set using a single request, and
+commands from all command/template tasks are run using a single request. Command results
+are split by position and attributed to the task that added them.
+
+If the combined configuration reports errors the affected tasks are run one by one as
+usual to get the correct result for each of them. Configuration is idempotent, and the
+commands of those tasks have not been sent yet. Commands may have side effects (dial,
+boot etc.), so they are only run again one by one if the combined request provably never
+reached the endpoint. If the result can't be split or the request fails in another way
+the command tasks are marked as failed, with the raw response if there is one.
+"""
+import logging
+from typing import List, Sequence, Tuple
+from xml.etree import ElementTree as ET
+
+import requests
+from defusedxml.cElementTree import fromstring as safe_xml_fromstring
+from django.conf import settings
+from django.utils.encoding import force_text
+from sentry_sdk import capture_exception
+from urllib3.exceptions import NewConnectionError
+
+from endpoint.types import CommandDict, ConfigurationDict
+from provider.exceptions import AuthenticationError, ResponseConnectionError
+from shared.exceptions import format_exception
+
+from .models import EndpointTask
+
+logger = logging.getLogger(__name__)
+
+BATCH_ACTIONS = {'configuration', 'commands', 'template'}
+
+
+def is_not_sent(error: Exception) -> bool:
+    "Check if a request provably never reached the endpoint, e.g. could not connect"
+    if not isinstance(error, ResponseConnectionError) or len(error.args) != 1:
+        return False
+
+    cause = error.args[0]
+    if isinstance(cause, str):  # raised before request, e.g. no direct connection available
+        return True
+    if isinstance(cause, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(cause, requests.exceptions.ConnectionError) and cause.args:
+        return isinstance(getattr(cause.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
+class CombinedTaskResult:
+    """Used in place of EndpointTask for combined requests, to collect the result"""
+
+    pk = None
+
+    def __init__(self):
+        self.result = None
+        self.errors: List[str] = []
+
+    def complete(self, result=None):
+        self.result = result
+
+    def fail(self, result=None):
+        self.errors.append(result or 'Failed')
+        return 'Failed: {}'.format(result) if result else 'Failed.'
+
+    def add_error(self, error, duration: float = None):
+        self.errors.append(str(error))
+        return 'Error: {}'.format(error)
+
+
+class EndpointTaskBatch:
+
+    def __init__(self, tasks: Sequence[EndpointTask]):
+        self.tasks = list(tasks)
+        self.requests = 0
+        self.commands_sent: List[EndpointTask] = []
+
+    @staticmethod
+    def can_batch(task: EndpointTask):
+        return task.action in BATCH_ACTIONS and task.endpoint and task.endpoint.is_cisco
+
+    @staticmethod
+    def get_configuration(task: EndpointTask) -> List[ConfigurationDict]:
+        if task.action == 'configuration':
+            return task.data.configuration or []
+        if task.action == 'template' and task.data.template_id:
+            return task.data.template.settings or []
+        return []
+
+    @staticmethod
+    def get_commands(task: EndpointTask) -> List[CommandDict]:
+        if task.action == 'commands':
+            commands = task.data.commands or ()
+        elif task.action == 'template' and task.data.template_id:
+            commands = task.data.template.commands or ()
+        else:
+            return []
+
+        return [
+            {
+                'command': command['command'],
+                'arguments': command.get('arguments') or {},
+                'body': command.get('body'),
+            }
+            for command in commands
+            if isinstance(command, dict) and command.get('command')
+        ]
+
+    def split(self) -> Tuple[List[EndpointTask], List[EndpointTask]]:
+        "Split tasks into (batched, single)"
+        batched = [t for t in self.tasks if self.can_batch(t)]
+        if len(batched) < 2:
+            return [], self.tasks
+        return batched, [t for t in self.tasks if t not in batched]
+
+    def run(self) -> List[EndpointTask]:
+        """
+        Run all tasks that can be combined. Returns the tasks that need to be run one by one
+        """
+        batched, single = self.split()
+        batched = [t for t in batched if t.check_runnable() is None]
+        if not batched:
+            return single
+
+        api = batched[0].endpoint.get_api()
+
+        try:
+            retry = self._run(api, batched)
+        except (AuthenticationError, ResponseConnectionError) as e:
+            for task in batched:
+                task.add_error(e)
+            return single
+        except Exception as e:
+            if settings.TEST_MODE:
+                raise
+            capture_exception()
+            retry = [t for t in batched if t.status in (t.TASKSTATUS.PENDING, t.TASKSTATUS.QUEUED)]
+            for task in [t for t in retry if t in self.commands_sent]:
+                task.fail('Combined command request failed: {}'.format(format_exception(e)))
+            retry = [t for t in retry if t not in self.commands_sent]
+
+        logger.info(
+            'Ran %s combined tasks for endpoint %s using %s requests. %s tasks needs to be rerun',
+            len(batched),
+            batched[0].endpoint_id,
+            self.requests,
+            len(retry),
+        )
+        return [t for t in self.tasks if t in retry or t in single]
+
+    def _run(self, api, tasks: List[EndpointTask]) -> List[EndpointTask]:
+
+        results = {task.pk: '' for task in tasks}
+        retry: List[EndpointTask] = []
+
+        configuration = [(task, self.get_configuration(task)) for task in tasks]
+        configuration = [(task, config) for task, config in configuration if config]
+        if configuration:
+            combined = CombinedTaskResult()
+            self.requests += 1
+            try:
+                api.set_configuration([c for _task, config in configuration for c in config], task=combined)
+            except (AuthenticationError, ResponseConnectionError):
+                raise
+            except Exception as e:
+                combined.add_error(e)
+
+            if combined.errors:
+                retry.extend(task for task, _config in configuration)
+            else:
+                for task, _config in configuration:
+                    results[task.pk] = combined.result or ''
+
+        commands = [(task, self.get_commands(task)) for task in tasks if task not in retry]
+        commands = [(task, cmds) for task, cmds in commands if cmds]
+        failed = {}
+        if commands:
+            self.requests += 1
+            content = None
+            command_results = None
+            self.commands_sent = [task for task, _cmds in commands]
+            try:
+                content = api.run_multiple_commands([c for _task, cmds in commands for c in cmds])
+                command_results = list(safe_xml_fromstring(content))
+            except AuthenticationError:
+                raise
+            except Exception as e:
+                if is_not_sent(e):
+                    retry.extend(task for task, _cmds in commands)
+                elif content is None:
+                    failed.update((task, 'Combined command request failed: {}'.format(format_exception(e)))
+                                  for task, _cmds in commands)
+
+            if command_results is not None and len(command_results) == sum(len(cmds) for _task, cmds in commands):
+                for task, cmds in commands:
+                    current, command_results = command_results[:len(cmds)], command_results[len(cmds):]
+                    results[task.pk] += '<Command>{}</Command>'.format(
+                        ''.join(ET.tostring(node, encoding='unicode') for node in current)
+                    )
+            elif content is not None:  # commands have been run, but result can't be attributed to each task
+                failed.update((task, 'Could not split combined command result: {}'.format(force_text(content)))
+                              for task, _cmds in commands)
+
+        for task in tasks:
+            if task in failed:
+                task.fail(failed[task])
+            elif task not in retry:
+                task.handle_result(results[task.pk])
+
+        return retry
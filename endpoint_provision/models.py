@@ -1,7 +1,7 @@
 import re
 from collections import defaultdict
 from datetime import timedelta
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from urllib.parse import urljoin
 
 from django.conf import settings
@@ -373,7 +373,8 @@ class EndpointTask(models.Model):
             ('status', 'ts_created'),
         )
 
-    def run(self):
+    def check_runnable(self) -> Optional[str]:
+        """Check if task can be run right now. Task is marked as failed or postponed if not"""
         if not self.endpoint:
             return self.fail('No endpoint')
 
@@ -394,18 +395,25 @@ class EndpointTask(models.Model):
                 'the next time the system is online'
             )
 
-        data = self.data
-        endpoint = self.endpoint
-        action = self.action
-
-        if not data:
-            return self.fail('No data for action {}'.format(action))
-        if not action:
+        if not self.data:
+            return self.fail('No data for action {}'.format(self.action))
+        if not self.action:
             return self.fail('No action')
 
-        if not endpoint.is_cisco and action in {'branding', 'room_control'}:
+        if not self.endpoint.is_cisco and self.action in {'branding', 'room_control'}:
             return self.fail('Not supported')
 
+        return None
+
+    def run(self):
+        error = self.check_runnable()
+        if error is not None:
+            return error
+
+        data = self.data
+        endpoint = self.endpoint
+        action = self.action
+
         start = now()
 
         extra_properties = self.data.extra_properties or {}
@@ -423,7 +431,7 @@ class EndpointTask(models.Model):
                     if data.template.settings:
                         result = api.set_configuration(data.template.settings, task=self)
                     if data.template.commands:
-                        result += api.run_multiple_commands(data.template.commands)
+                        result += force_text(api.run_multiple_commands(data.template.commands))
             elif action == 'commands':
                 cmd_result: List[str] = []
                 for command in (data.commands or ()):
@@ -547,22 +555,25 @@ class EndpointTask(models.Model):
             self.add_error(e, duration=(now() - start).total_seconds())
             raise e
         else:
-            result = force_text(result or '')
-            if 'Result status="Error"' in result:
-                if 'status="OK"' not in result:
-                    return self.fail(result)
-                errors = re.findall(r'<Reason>(.*?)</Reason>', result)
-                self.add_error(
-                    'Some errors did occur: {}'.format(
-                        '\n'.join(set(e for e in errors)) or 'check logs'
-                    )
-                )
-            if self.status != TASKSTATUS.ERROR:
-                self.complete(result)
-            return result
+            return self.handle_result(result)
         finally:
             api.active_task = None
 
+    def handle_result(self, result):
+        result = force_text(result or '')
+        if 'Result status="Error"' in result:
+            if 'status="OK"' not in result:
+                return self.fail(result)
+            errors = re.findall(r'<Reason>(.*?)</Reason>', result)
+            self.add_error(
+                'Some errors did occur: {}'.format(
+                    '\n'.join(set(e for e in errors)) or 'check logs'
+                )
+            )
+        if self.status != TASKSTATUS.ERROR:
+            self.complete(result)
+        return result
+
     def delay(self, replace_action=None, countdown=5):
         return EndpointTask.objects.create(
             endpoint=self.endpoint,
@@ -0,0 +1,118 @@
+from unittest.mock import patch
+
+import requests
+
+from endpoint.tasks import run_endpoint_tasks
+from endpoint.tests.base import EndpointBaseTest
+from endpoint.ext_api.cisco_ce import CiscoCEProviderAPI
+from endpoint.tests.mock_data.cisco_ce import cisco_ce_requests
+from endpoint_provision.models import EndpointProvision, EndpointTask, EndpointTemplate
+from provider.exceptions import ResponseTimeoutError
+
+
+COMBINED_RESULT = '''<?xml version="1.0"?>
+<Command>
+<FirstResult status="OK"/>
+<SecondResult status="Error"><Reason>Invalid argument</Reason></SecondResult>
+<TemplateResult status="OK"/>
+</Command>
+'''
+
+
+class EndpointTaskBatchTestCase(EndpointBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self._init()
+
+        template = EndpointTemplate.objects.create(
+            customer=self.customer,
+            settings=[{'key': ['Template'], 'value': 'test'}],
+            commands=[{'command': ['Template', 'Run'], 'arguments': {}}],
+        )
+        provision = EndpointProvision.objects.prepare(
+            self.customer,
+            self.endpoint,
+            'test',
+            configuration=[{'key': ['Test'], 'value': 'test'}],
+            commands=[
+                {'command': ['Test', 'First'], 'arguments': {'Value': '1'}},
+                {'command': ['Test', 'Second']},
+            ],
+            template=template,
+        )
+        self.tasks = {t.action: t for t in provision.prepare_tasks(self.endpoint)}
+        self.assertEqual(set(self.tasks), {'configuration', 'commands', 'template'})
+
+    def _get_requests(self):
+        return self._mock_requests.find_urls_all('POST /putxml')
+
+    def _run(self):
+        run_endpoint_tasks([t.pk for t in self.tasks.values()])
+        return {t.action: t for t in EndpointTask.objects.filter(pk__in=[t.pk for t in self.tasks.values()])}
+
+    def test_combined(self):
+        with patch.dict(cisco_ce_requests, {'CMD Test/First': COMBINED_RESULT}):
+            tasks = self._run()
+
+        requests = self._get_requests()
+        self.assertEqual(len(requests), 2)
+
+        configuration = [r.data for r in requests if b'<Configuration>' in r.data][0]
+        self.assertIn(b'<Test item="1">test</Test>', configuration)
+        self.assertIn(b'<Template item="1">test</Template>', configuration)
+
+        for task in tasks.values():
+            self.assertEqual(task.status, EndpointTask.TASKSTATUS.COMPLETED, task.action)
+
+        self.assertIn('<SecondResult status="Error">', tasks['commands'].result)
+        self.assertIn('Invalid argument', tasks['commands'].error)
+        self.assertNotIn('TemplateResult', tasks['commands'].result)
+
+        self.assertIn('<TemplateResult status="OK" />', tasks['template'].result)
+        self.assertIn('<Success />', tasks['template'].result)
+        self.assertFalse(tasks['template'].error)
+        self.assertNotIn('Result', tasks['configuration'].result)
+
+    def test_split_failed(self):
+        # result can not be attributed to each task. Commands may have been run, so don't run them again
+        single_result = '<?xml version="1.0"?><Command><FirstResult status="OK"/></Command>'
+        with patch.dict(cisco_ce_requests, {'CMD Test/First': single_result}):
+            tasks = self._run()
+
+        self.assertEqual(tasks['configuration'].status, EndpointTask.TASKSTATUS.COMPLETED)
+        for action in ('commands', 'template'):
+            self.assertEqual(tasks[action].status, EndpointTask.TASKSTATUS.ERROR, action)
+            self.assertIn('<FirstResult status="OK"/>', tasks[action].result)
+
+        self.assertEqual(len(self._get_requests()), 2)
+
+    def test_not_sent(self):
+        error = ResponseTimeoutError(requests.exceptions.ConnectTimeout())
+        with patch.object(CiscoCEProviderAPI, 'run_multiple_commands', side_effect=[error, b'']) as run_commands:
+            tasks = self._run()
+
+        # commands and template run one by one
+        self.assertEqual(run_commands.call_count, 2)
+        self.assertEqual(len(self._get_requests()), 1 + 2 + 1)
+        for task in tasks.values():
+            self.assertEqual(task.status, EndpointTask.TASKSTATUS.COMPLETED, task.action)
+
+    def test_maybe_sent(self):
+        error = ResponseTimeoutError(requests.exceptions.ReadTimeout())
+        with patch.object(CiscoCEProviderAPI, 'run_multiple_commands', side_effect=error) as run_commands:
+            tasks = self._run()
+
+        self.assertEqual(run_commands.call_count, 1)
+        self.assertEqual(tasks['configuration'].status, EndpointTask.TASKSTATUS.COMPLETED)
+        for action in ('commands', 'template'):
+            self.assertEqual(tasks[action].status, EndpointTask.TASKSTATUS.ERROR, action)
+
+    def test_single_request_per_action(self):
+        with patch.object(EndpointTask, 'check_runnable', return_value='Skip'):
+            self._run()
+        self.assertEqual(len(self._get_requests()), 0)
+
+        for task in self.tasks.values():
+            task.run()
+        self.assertEqual(len(self._get_requests()), 5)
@@ -0,0 +1,307 @@
+"""
+Hand out free numbers from a NumberRange for a cluster without probing the datastore for
+each candidate.
+
+The numbers in the range that are used by the cluster (call ids of coSpaces/access
+methods, or numeric aliases of Pexip conferences) are indexed per range and cluster. The
+index is rebuilt from the datastore after each sync, or when missing. Numbers handed out
+since the last sync are kept as reservations until they have been synced, or expire.
+All changes are made while holding a row lock on the NumberRange.
+
+If the default cache backend is redis, used numbers are stored in a sorted set and
+reservations in a hash (RedisNumberRangeIndex), so each allocation only adds a single
+number. Finding a free number uses O(log n) lookups in the sorted set, which are
+O(log n) each. Other cache backends store a sorted array of used numbers, which is
+loaded and saved as a whole for each allocation, i.e. O(n).
+"""
+import logging
+import random
+from array import array
+from bisect import bisect_left, insort
+from time import time
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Union
+
+from django.core.cache import cache
+from django.db import transaction
+
+from statistics.cdr_stream import get_connection
+
+from .models import NumberRange, NumberRangeDummy
+
+if TYPE_CHECKING:
+    from provider.models.provider import Cluster
+
+logger = logging.getLogger(__name__)
+
+CACHE_TIMEOUT = 24 * 60 * 60
+RESERVATION_TIMEOUT = 60 * 60
+
+
+def get_used_numbers(cluster: 'Cluster', start: int, stop: int) -> Iterable[int]:
+    "Numbers in range start-stop used by cluster according to the datastore"
+
+    def _to_int(value: str):
+        value = (value or '').split('@')[0]
+        if value.isdigit() and start <= int(value) <= stop:
+            return int(value)
+
+    if cluster.is_acano:
+        from datastore.models.acano import CoSpace, CoSpaceAccessMethod
+        values = [
+            *CoSpace.objects.filter(provider=cluster).values_list('call_id', flat=True),
+            *CoSpaceAccessMethod.objects.filter(provider=cluster).values_list('call_id', flat=True),
+        ]
+    elif cluster.is_pexip:
+        from datastore.models.pexip import Conference, ConferenceAlias
+        values = [
+            *Conference.objects.filter(provider=cluster, is_active=True).values_list('call_id', flat=True),
+            *ConferenceAlias.objects.filter(provider=cluster, conference__is_active=True, is_active=True)
+            .values_list('alias', flat=True),
+        ]
+    else:
+        values = []
+
+    return {number for number in map(_to_int, values) if number is not None}
+
+
+class NumberRangeIndex:
+    """
+    Sorted array of used numbers, stored in cache as a whole
+    """
+
+    def __init__(self, number_range: Union[NumberRange, NumberRangeDummy], cluster: 'Cluster'):
+        self.number_range = number_range
+        self.cluster = cluster
+
+        self.used = array('Q')
+        self.reserved: Dict[int, float] = {}
+
+    @property
+    def start(self):
+        return self.number_range.start
+
+    @property
+    def stop(self):
+        return self.number_range.stop
+
+    @property
+    def cache_key(self):
+        return 'numberseries.index.{}.{}.{}.{}'.format(self.number_range.pk, self.cluster.pk, self.start, self.stop)
+
+    def load(self) -> 'NumberRangeIndex':
+        cached = cache.get(self.cache_key) if not self.number_range.is_dummy else None
+        if cached is None:
+            return self.rebuild()
+
+        self.used, self.reserved = cached
+        return self
+
+    def save(self):
+        if not self.number_range.is_dummy:
+            cache.set(self.cache_key, (self.used, self.reserved), CACHE_TIMEOUT)
+
+    def rebuild(self) -> 'NumberRangeIndex':
+        "Reload used numbers from datastore, keeping reservations of numbers not synced yet"
+        used = set(get_used_numbers(self.cluster, self.start, self.stop))
+
+        min_ts = time() - RESERVATION_TIMEOUT
+        self.reserved = {number: ts for number, ts in self.reserved.items() if ts > min_ts and number not in used}
+
+        self.used = array('Q', sorted(used | set(self.reserved)))
+        self.save()
+        return self
+
+    def _rank(self, number: int) -> int:
+        "Number of used numbers lower than ``number``"
+        return bisect_left(self.used, number)
+
+    def _used_at(self, rank: int) -> int:
+        return self.used[rank]
+
+    def is_free(self, number: int):
+        i = self._rank(number)
+        return i == len(self) or self._used_at(i) != number
+
+    def get_free_count(self):
+        return self.stop - self.start + 1 - len(self)
+
+    def get_free(self, index: int) -> int:
+        "Get free number with index ``index`` counted from range start"
+        # free numbers before the used number with rank i is used[i] - self.start - i
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._used_at(mid) - self.start - mid <= index:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self.start + index + lo
+
+    def next_free(self, number: int) -> Optional[int]:
+        "Get first free number >= number, starting over from range start if there is none"
+        if not self.get_free_count():
+            return None
+
+        number = max(number, self.start)
+        if number <= self.stop:
+            free_before = number - self.start - self._rank(number)
+            result = self.get_free(free_before)
+            if result <= self.stop:
+                return result
+
+        return self.get_free(0)
+
+    def random_free(self) -> Optional[int]:
+        count = self.get_free_count()
+        if not count:
+            return None
+        return self.get_free(random.randrange(count))
+
+    def reserve(self, number: int):
+        if self.start <= number <= self.stop and self.is_free(number):
+            insort(self.used, number)
+        self.reserved[number] = time()
+        self.save()
+
+    def __len__(self):
+        return len(self.used)
+
+
+class RedisNumberRangeIndex(NumberRangeIndex):
+    """
+    Used numbers in a redis sorted set and reservations in a hash, which are updated
+    incrementally instead of being loaded and saved as a whole
+    """
+
+    def __init__(self, number_range: NumberRange, cluster: 'Cluster', connection=None):
+        self.number_range = number_range
+        self.cluster = cluster
+        self.connection = connection or get_connection()
+
+        self.used_key = self.cache_key + '.used'
+        self.reserved_key = self.cache_key + '.reserved'
+        self.built_key = self.cache_key + '.built'  # sorted set is removed by redis when empty
+
+    @property
+    def used(self) -> List[int]:
+        return [int(score) for _member, score in self.connection.zrange(self.used_key, 0, -1, withscores=True)]
+
+    @property
+    def reserved(self) -> Dict[int, float]:
+        return {int(number): float(ts) for number, ts in self.connection.hgetall(self.reserved_key).items()}
+
+    def _expire(self, pipe):
+        for key in (self.used_key, self.reserved_key, self.built_key):
+            pipe.expire(key, CACHE_TIMEOUT)
+
+    def load(self) -> 'RedisNumberRangeIndex':
+        if not self.connection.exists(self.built_key):
+            return self.rebuild()
+        return self
+
+    def save(self):
+        pass
+
+    def rebuild(self) -> 'RedisNumberRangeIndex':
+        "Reload used numbers from datastore, keeping reservations of numbers not synced yet"
+        used = set(get_used_numbers(self.cluster, self.start, self.stop))
+
+        min_ts = time() - RESERVATION_TIMEOUT
+        reserved = {number: ts for number, ts in self.reserved.items() if ts > min_ts and number not in used}
+
+        pipe = self.connection.pipeline()
+        pipe.delete(self.used_key, self.reserved_key)
+        numbers = sorted(used | {n for n in reserved if self.start <= n <= self.stop})
+        for i in range(0, len(numbers), 10000):
+            pipe.zadd(self.used_key, {n: n for n in numbers[i:i + 10000]})
+        for number, ts in reserved.items():
+            pipe.hset(self.reserved_key, number, ts)
+        pipe.set(self.built_key, 1)
+        self._expire(pipe)
+        pipe.execute()
+        return self
+
+    def _rank(self, number: int) -> int:
+        return self.connection.zcount(self.used_key, '-inf', '({}'.format(number))
+
+    def _used_at(self, rank: int) -> int:
+        return int(self.connection.zrange(self.used_key, rank, rank, withscores=True)[0][1])
+
+    def is_free(self, number: int):
+        return self.connection.zscore(self.used_key, number) is None
+
+    def reserve(self, number: int):
+        pipe = self.connection.pipeline()
+        if self.start <= number <= self.stop:
+            pipe.zadd(self.used_key, {number: number})
+        pipe.hset(self.reserved_key, number, time())
+        self._expire(pipe)
+        pipe.execute()
+
+    def __len__(self):
+        return self.connection.zcard(self.used_key)
+
+
+def get_index(number_range: Union[NumberRange, NumberRangeDummy], cluster: 'Cluster') -> NumberRangeIndex:
+    "Index of used numbers, stored in redis if available"
+    if not number_range.is_dummy:
+        connection = get_connection()
+        if connection is not None:
+            return RedisNumberRangeIndex(number_range, cluster, connection)
+    return NumberRangeIndex(number_range, cluster)
+
+
+def _lock_range(number_range: NumberRange) -> NumberRange:
+    return NumberRange.objects.select_for_update(of=('self',)).get(pk=number_range.pk)
+
+
+def allocate_number(number_range: Union[NumberRange, NumberRangeDummy], cluster: 'Cluster', random=False) -> Optional[int]:
+    """
+    Get a number from number range that is not used by the cluster, and reserve it. Numbers
+    are handed out in order using number_range.next_number, or randomly. Returns None if
+    all numbers in the range are used
+    """
+    if number_range.is_dummy:
+        index = get_index(number_range, cluster).load()
+        result = index.random_free() if random else index.next_free(number_range.use())
+    else:
+        with transaction.atomic():
+            locked = _lock_range(number_range)
+            index = get_index(locked, cluster).load()
+
+            if random:
+                result = index.random_free()
+            else:
+                result = index.next_free(locked.next_number or locked.start)
+                if result is not None:
+                    locked.next_number = number_range.next_number = result + 1
+                    locked.save(update_fields=['next_number'])
+
+            if result is not None:
+                index.reserve(result)
+
+    if result is None:
+        logger.warning('Number range %s is full for cluster %s (%s used)', number_range, cluster, len(index))
+    return result
+
+
+def get_cluster_number_ranges(cluster: 'Cluster'):
+    from provider.models.provider import ClusterSettings
+
+    range_ids = set()
+    for cluster_settings in ClusterSettings.objects.filter(cluster=cluster):
+        range_ids.update({cluster_settings.scheduled_room_number_range_id, cluster_settings.static_room_number_range_id})
+    range_ids.discard(None)
+
+    return NumberRange.objects.filter(pk__in=range_ids)
+
+
+def reconcile_number_ranges(cluster: 'Cluster'):
+    "Rebuild indexes of used numbers from datastore for all number ranges used by cluster"
+    count = 0
+    for number_range in get_cluster_number_ranges(cluster):
+        with transaction.atomic():
+            locked = _lock_range(number_range)
+            get_index(locked, cluster).load().rebuild()
+        count += 1
+    return count
@@ -1,5 +1,12 @@
+from unittest.mock import patch
+
 from django.test import TestCase
 from django.conf import settings
+from django.core.cache import cache
+
+from conferencecenter.tests.base import ConferenceBaseTest
+from conferencecenter.tests.fake_redis import FakeRedis
+from .models import NumberRange
 
 
 class NumberSerieTestCase(TestCase):
@@ -47,3 +54,84 @@ class NumberSerieTestCase(TestCase):
         prefix.last_number = 'AB-999-9'
         prefix.save()
         self.assertRaises(ValueError, NumberSeries.objects.use_next, 'account3')
+
+
+class NumberAllocationTestCase(ConferenceBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self._init()
+        self.cluster = self.pexip.cluster
+        self.number_range = NumberRange.objects.create(title='test', start=100, stop=109)
+        cache.clear()
+
+    def _add_alias(self, alias, aid):
+        from datastore.models.pexip import Conference, ConferenceAlias
+        conference = Conference.objects.create(provider=self.cluster, cid=aid, name=alias)
+        ConferenceAlias.objects.create(provider=self.cluster, conference=conference, aid=aid, alias=alias)
+
+    def test_allocate(self):
+        from .allocation import allocate_number
+
+        self._add_alias('100', 1)
+        self._add_alias('101@example.org', 2)
+        self._add_alias('103', 3)
+        self._add_alias('1000', 4)  # outside range
+
+        result = [allocate_number(self.number_range, self.cluster) for _i in range(3)]
+        self.assertEqual(result, [102, 104, 105])
+        self.assertEqual(NumberRange.objects.get(pk=self.number_range.pk).next_number, 106)
+
+        result += [allocate_number(self.number_range, self.cluster, random=True) for _i in range(4)]
+        self.assertEqual(sorted(result), [102, 104, 105, 106, 107, 108, 109])
+
+        self.assertIsNone(allocate_number(self.number_range, self.cluster))
+
+    def test_reconcile(self):
+        from .allocation import allocate_number, get_index, reconcile_number_ranges
+
+        cluster_settings = self.cluster.get_cluster_settings()
+        cluster_settings.static_room_number_range = self.number_range
+        cluster_settings.save()
+
+        self.assertEqual(allocate_number(self.number_range, self.cluster), 100)
+
+        self._add_alias('101', 1)
+        self.assertEqual(reconcile_number_ranges(self.cluster), 1)
+        index = get_index(self.number_range, self.cluster).load()
+        self.assertEqual(list(index.used), [100, 101])  # reserved and synced
+        self.assertEqual(index.reserved.keys(), {100})
+
+        self.assertEqual(allocate_number(self.number_range, self.cluster), 102)
+
+
+class RedisNumberAllocationTestCase(NumberAllocationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        from . import allocation
+
+        self.connection = FakeRedis()
+        patcher = patch.object(allocation, 'get_connection', return_value=self.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_incremental(self):
+        from .allocation import RedisNumberRangeIndex, allocate_number
+
+        self._add_alias('105', 1)
+        self.assertEqual(allocate_number(self.number_range, self.cluster), 100)
+
+        index = RedisNumberRangeIndex(self.number_range, self.cluster, self.connection)
+        self.assertEqual(index.used, [100, 105])
+
+        # only the new number is added, the stored numbers are not rewritten
+        with patch.object(self.connection, 'zadd', wraps=self.connection.zadd) as zadd, \
+                patch.object(self.connection, 'delete', wraps=self.connection.delete) as delete:
+            number = allocate_number(self.number_range, self.cluster, random=True)
+
+        self.assertIn(number, range(101, 110))
+        self.assertEqual(zadd.call_args_list, [((index.used_key, {number: number}),)])
+        self.assertFalse(delete.called)
+        self.assertEqual(index.used, sorted([100, 105, number]))
+        self.assertEqual(set(index.reserved), {100, number})
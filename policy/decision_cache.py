@@ -0,0 +1,318 @@
+"""
+Process local map of Pexip conference names and aliases per cluster, used to resolve
+conference, customer and match for policy requests without database queries.
+
+Changes are announced using a version counter in the shared cache. Each version bump
+may list changed conference ids, which other processes use to refresh only those
+conferences. If any change list is missing the whole map is rebuilt. Versions are bumped
+when the current transaction is committed, so no process can load uncommitted rows.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from time import time
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from cacheout import LRUCache
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import QuerySet
+
+from datastore.models.pexip import Conference, ConferenceAlias
+
+if TYPE_CHECKING:
+    from customer.models import Customer, CustomerMatch  # noqa
+
+logger = logging.getLogger(__name__)
+
+# Always rebuild everything after this many seconds, as a safety net for missed updates
+MAX_AGE = 15 * 60
+
+# Max age of local map if shared version counter is unavailable, e.g. redis is down
+FALLBACK_TTL = 10
+
+# Use full rebuild instead of change list if more conferences than this are changed
+MAX_CHANGE_IDS = 1000
+
+CHANGES_TTL = 60 * 60
+
+
+class ConferenceEntry(NamedTuple):
+    id: int
+    name: Optional[str]
+    tenant_tid: Optional[str]
+    match_id: Optional[int]
+    aliases: Tuple[str, ...]
+
+
+class PolicyDecision(NamedTuple):
+    conference: Optional[Conference]
+    customer: Optional['Customer']
+    match: Optional['CustomerMatch']
+
+
+class ConferenceAliasMap:
+
+    def __init__(self, cluster_id: int, version=None):
+        self.cluster_id = cluster_id
+        self.version = version
+        self.ts_created = self.ts_refreshed = time()
+
+        self.entries: Dict[int, ConferenceEntry] = {}
+        self.names: Dict[str, int] = {}
+        self.aliases: Dict[str, int] = {}
+
+        self.conferences = LRUCache(maxsize=2000)
+
+    @classmethod
+    def from_db(cls, cluster_id: int, version=None):
+        result = cls(cluster_id, version=version)
+        result._load(Conference.objects.filter(provider=cluster_id))
+        return result
+
+    def _load(self, conferences: 'QuerySet[Conference]'):
+        "Add active conferences. Most recently synced conference wins on name or alias collisions"
+        conference_data = list(
+            conferences.filter(is_active=True)
+            .order_by('last_synced', 'id')
+            .values_list('id', 'name', 'tenant_id', 'tenant__tid', 'match_id')
+        )
+
+        aliases: Dict[int, List[str]] = {}
+        alias_values = ConferenceAlias.objects.filter(
+            conference__in=conferences.filter(is_active=True).values('pk'),
+            is_active=True,
+        ).values_list('conference_id', 'alias')
+        for conference_id, alias in alias_values:
+            aliases.setdefault(conference_id, []).append(alias.lower())
+
+        for conference_id, name, tenant_id, tenant_tid, match_id in conference_data:
+            entry = ConferenceEntry(conference_id, name, tenant_tid if tenant_id else None, match_id,
+                                    tuple(aliases.get(conference_id, ())))
+            self.entries[conference_id] = entry
+            if name:
+                self.names[name] = conference_id
+            for alias in entry.aliases:
+                self.aliases[alias] = conference_id
+
+    def refresh(self, conference_ids: Iterable[int], version=None):
+        "Reload data for the given conferences only"
+        conference_ids = set(conference_ids)
+
+        names: Set[str] = set()
+        aliases: Set[str] = set()
+
+        for conference_id in conference_ids:
+            self.conferences.delete(conference_id)
+            entry = self.entries.pop(conference_id, None)
+            if not entry:
+                continue
+            if entry.name:
+                names.add(entry.name)
+                if self.names.get(entry.name) == conference_id:
+                    self.names.pop(entry.name)
+            for alias in entry.aliases:
+                aliases.add(alias)
+                if self.aliases.get(alias) == conference_id:
+                    self.aliases.pop(alias)
+
+        if conference_ids:
+            self._load(Conference.objects.filter(provider=self.cluster_id, pk__in=conference_ids))
+
+            for conference_id in conference_ids & set(self.entries):
+                entry = self.entries[conference_id]
+                if entry.name:
+                    names.add(entry.name)
+                aliases.update(entry.aliases)
+
+            self._rebuild_keys(names, aliases)
+
+        self.version = version
+        self.ts_refreshed = time()
+
+    def _rebuild_keys(self, names: Set[str], aliases: Set[str]):
+        """
+        Resolve collisions for the given names and aliases again after a refresh, e.g. to
+        fall back to another conference with the same alias when the one it was shadowed
+        by is removed. Same precedence as _load
+        """
+        conference_ids = [
+            entry.id for entry in self.entries.values()
+            if entry.name in names or not aliases.isdisjoint(entry.aliases)
+        ]
+        if not conference_ids:
+            return
+
+        ordered_ids = Conference.objects.filter(pk__in=conference_ids) \
+            .order_by('last_synced', 'id').values_list('id', flat=True)
+
+        for conference_id in ordered_ids:
+            entry = self.entries.get(conference_id)
+            if not entry:
+                continue
+            if entry.name in names:
+                self.names[entry.name] = conference_id
+            for alias in aliases.intersection(entry.aliases):
+                self.aliases[alias] = conference_id
+
+    def get_entry(self, obj) -> Optional[ConferenceEntry]:
+        "Same lookup order as ConferenceManager.match, i.e. conference name before local_alias"
+        from statistics.parser.utils import clean_target
+
+        if isinstance(obj, str):
+            obj = {'conference': obj}
+
+        name = obj.get('conference') or obj.get('conference_name') or obj.get('name')
+        conference_id = self.names.get(name) if name else None
+
+        if not conference_id and obj.get('local_alias'):
+            conference_id = self.aliases.get(str(clean_target(obj['local_alias'])).lower())
+
+        return self.entries.get(conference_id) if conference_id else None
+
+    def get_conference(self, entry: ConferenceEntry) -> Optional[Conference]:
+        conference = self.conferences.get(entry.id)
+        if conference is None:
+            conference = Conference.objects.filter(pk=entry.id).first()
+            if conference:
+                self.conferences.set(entry.id, conference)
+        return conference
+
+    def get_decision(self, obj) -> PolicyDecision:
+        """
+        Get conference and the customer and match it belongs to. Customer and match
+        are resolved the same way as Conference.get_customer, using MatchCache
+        """
+        from customer.models import MatchCache
+
+        entry = self.get_entry(obj)
+        if not entry:
+            return PolicyDecision(None, None, None)
+
+        match = MatchCache.get().get_matcher(entry.match_id) if entry.match_id else None
+
+        customer = None
+        if entry.tenant_tid is not None:
+            customer = MatchCache.match_cluster_tenant(self.cluster_id, entry.tenant_tid)
+        if not customer and match:
+            customer = match.customer
+
+        return PolicyDecision(self.get_conference(entry), customer, match)
+
+
+_maps: Dict[int, ConferenceAliasMap] = {}
+_batch = threading.local()
+
+
+def _version_key(cluster_id):
+    return 'policy.conference_map.version.{}'.format(cluster_id)
+
+
+def _changes_key(cluster_id, version):
+    return 'policy.conference_map.changes.{}.{}'.format(cluster_id, version)
+
+
+def get_conference_map_version(cluster_id) -> Optional[int]:
+    key = _version_key(cluster_id)
+    version = cache.get(key)
+    if version is None:
+        # start from current time so a flushed cache won't reuse old version numbers
+        cache.add(key, int(time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_conference_map(cluster_id, conference_ids: Optional[Iterable[int]] = None):
+    """
+    Announce changed conferences for cluster. If conference_ids is None all processes
+    will rebuild the full map
+    """
+    pending = getattr(_batch, 'pending', None)
+    if pending is not None:
+        cur = pending.get(cluster_id, set())
+        if conference_ids is None or cur is None:
+            pending[cluster_id] = None
+        else:
+            pending[cluster_id] = cur | set(conference_ids)
+        return
+
+    if conference_ids is not None:
+        conference_ids = list(set(conference_ids))
+        if len(conference_ids) > MAX_CHANGE_IDS:
+            conference_ids = None
+
+    transaction.on_commit(lambda: _bump_conference_map_version(cluster_id, conference_ids))
+
+
+def _bump_conference_map_version(cluster_id, conference_ids: Optional[List[int]]):
+    key = _version_key(cluster_id)
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time() * 1000), timeout=None)
+        version = None
+
+    if version is not None and conference_ids is not None:
+        cache.set(_changes_key(cluster_id, version), conference_ids, timeout=CHANGES_TTL)
+    else:
+        _maps.pop(cluster_id, None)
+
+
+@contextmanager
+def conference_map_batch():
+    """
+    Collect invalidations, e.g. during sync, and announce them once when done
+    """
+    if getattr(_batch, 'pending', None) is not None:
+        yield
+        return
+
+    _batch.pending = {}
+    try:
+        yield
+    finally:
+        pending, _batch.pending = _batch.pending, None
+        for cluster_id, conference_ids in pending.items():
+            invalidate_conference_map(cluster_id, conference_ids)
+
+
+def _get_changed_ids(cluster_id, old_version, new_version) -> Optional[Set[int]]:
+    if old_version is None or new_version is None or not (0 < new_version - old_version <= 100):
+        return None
+
+    keys = [_changes_key(cluster_id, v) for v in range(old_version + 1, new_version + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) != len(keys):
+        return None
+
+    result: Set[int] = set()
+    for ids in changes.values():
+        result.update(ids)
+    return result
+
+
+def get_conference_map(cluster) -> ConferenceAliasMap:
+    cluster_id = getattr(cluster, 'pk', cluster)
+
+    version = get_conference_map_version(cluster_id)
+    conference_map = _maps.get(cluster_id)
+
+    if conference_map and conference_map.ts_created > time() - MAX_AGE:
+        if version is None:
+            if conference_map.ts_refreshed > time() - FALLBACK_TTL:
+                return conference_map
+        elif conference_map.version == version:
+            return conference_map
+        else:
+            changed_ids = _get_changed_ids(cluster_id, conference_map.version, version)
+            if changed_ids is not None:
+                conference_map.refresh(changed_ids, version=version)
+                return conference_map
+
+    conference_map = ConferenceAliasMap.from_db(cluster_id, version=version)
+    _maps[cluster_id] = conference_map
+    return conference_map
+
+
+def get_policy_decision(cluster, obj) -> PolicyDecision:
+    return get_conference_map(cluster).get_decision(obj)
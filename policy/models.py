@@ -948,3 +948,12 @@ class ExternalPolicyLog(models.Model):
 
     objects = FastCountManager()
 
+
+
+def clear_conference_map(sender, instance, **kwargs):
+    from policy.decision_cache import invalidate_conference_map
+
+    invalidate_conference_map(instance.pk)
+
+
+models.signals.post_save.connect(clear_conference_map, sender='provider.Cluster')
@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 from django.contrib.auth.models import User
 from rest_framework.test import APITestCase
 
@@ -13,6 +15,12 @@ class PolicyTestMixin(ConferenceBaseTest, APITestCase):
 
     def setUp(self) -> None:
         super().setUp()
+
+        # policy rule set and conference map versions are bumped on commit, which test transactions never reach
+        on_commit = patch('django.db.transaction.on_commit', side_effect=lambda f: f())
+        on_commit.start()
+        self.addCleanup(on_commit.stop)
+
         super()._init()
         self.customer.lifesize_provider = self.pexip
         self.customer.save()
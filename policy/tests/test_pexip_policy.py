@@ -1,9 +1,14 @@
+import json
 from datetime import timedelta
+from unittest.mock import patch
 from urllib.parse import parse_qsl, urlparse
 
 from django.utils.timezone import now
 
 from customer.models import CustomerMatch
+from datastore.models.customer import Tenant
+from datastore.models.pexip import Conference, ConferenceAlias
+from policy.decision_cache import get_conference_map, get_policy_decision
 from policy.models import ClusterPolicy, CustomerPolicyState
 from policy.tests.base import PolicyTestMixin
 
@@ -203,7 +208,101 @@ class PexipPolicyTestCase(PolicyTestMixin):
         self.assertEqual(response.json().get('action'), 'reject')
 
 
+class PolicyDecisionCacheTestCase(PolicyTestMixin):
 
-
-
-
+    def setUp(self):
+        super().setUp()
+        self.cluster_policy = ClusterPolicy.objects.create(cluster=self.cluster, secret_key='asdfadsf')
+        self.tenant = Tenant.objects.create(tid=self.customer.get_pexip_tenant_id(), provider=self.cluster)
+        self.conference = self._create_conference('vmr', self.target_alias)
+
+    def _create_conference(self, name, *aliases):
+        conference = Conference.objects.create(
+            provider=self.cluster,
+            name=name,
+            tenant=self.tenant,
+            full_data=json.dumps({'name': name, 'service_type': 'conference'}),
+        )
+        for alias in aliases:
+            ConferenceAlias.objects.create(conference=conference, alias=alias, provider=self.cluster)
+        return conference
+
+    def test_decision(self):
+        conference, customer, match = get_policy_decision(self.cluster, {'local_alias': 'sip:65432'})
+        self.assertEqual(conference, self.conference)
+        self.assertEqual(customer, self.customer)
+
+        conference, customer, match = get_policy_decision(self.cluster, {'conference': 'vmr'})
+        self.assertEqual(conference, self.conference)
+
+        self.assertEqual(get_policy_decision(self.cluster, {'local_alias': '1111'}).conference, None)
+
+    def test_incremental_refresh(self):
+        conference_map = get_conference_map(self.cluster)
+
+        new_conference = self._create_conference('new', '1111')
+        self.assertEqual(get_policy_decision(self.cluster, {'local_alias': '1111'}).conference, new_conference)
+        self.assertIs(get_conference_map(self.cluster), conference_map)
+
+        new_conference.aliases.update(is_active=False)
+        new_conference.aliases.first().save()
+        self.assertEqual(get_policy_decision(self.cluster, {'local_alias': '1111'}).conference, None)
+
+        new_conference.delete()
+        self.assertEqual(get_policy_decision(self.cluster, {'conference': 'new'}).conference, None)
+        self.assertIs(get_conference_map(self.cluster), conference_map)
+
+    def test_invalidate_on_commit(self):
+        conference_map = get_conference_map(self.cluster)
+        callbacks = []
+
+        with patch('django.db.transaction.on_commit', side_effect=callbacks.append):
+            new_conference = self._create_conference('new', '1111')
+            self.assertEqual(get_conference_map(self.cluster).version, conference_map.version)
+
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(get_policy_decision(self.cluster, {'local_alias': '1111'}).conference, new_conference)
+
+    def test_incremental_refresh_shadowed(self):
+        older = self._create_conference('shared', '2222')
+        newer = self._create_conference('shared', '2222')
+        Conference.objects.filter(pk=older.pk).update(last_synced=now() - timedelta(hours=1))
+
+        conference_map = get_conference_map(self.cluster)
+        self.assertEqual(get_policy_decision(self.cluster, {'conference': 'shared'}).conference, newer)
+        self.assertEqual(get_policy_decision(self.cluster, {'local_alias': '2222'}).conference, newer)
+
+        newer.is_active = False
+        newer.save()
+
+        # falls back to the conference that was shadowed, same as Conference.objects.match
+        self.assertEqual(get_policy_decision(self.cluster, {'conference': 'shared'}).conference, older)
+        self.assertEqual(get_policy_decision(self.cluster, {'local_alias': '2222'}).conference, older)
+        self.assertEqual(Conference.objects.match({'name': 'shared'}), older)
+        self.assertIs(get_conference_map(self.cluster), conference_map)
+
+        # reactivated conference shadows the older one again
+        newer.is_active = True
+        newer.save()
+        self.assertEqual(get_policy_decision(self.cluster, {'conference': 'shared'}).conference, newer)
+        self.assertEqual(get_policy_decision(self.cluster, {'local_alias': '2222'}).conference, newer)
+
+    def test_no_queries(self):
+        get_policy_decision(self.cluster, {'local_alias': self.target_alias})
+
+        with self.assertNumQueries(0):
+            conference, customer, match = get_policy_decision(self.cluster, {'local_alias': self.target_alias})
+        self.assertEqual(conference, self.conference)
+        self.assertEqual(customer, self.customer)
+
+    def test_many_conferences(self):
+        for i in range(500):
+            self._create_conference('vmr{}'.format(i), str(100000 + i), 'vmr{}@example.org'.format(i))
+
+        for i in range(50):
+            alias = str(100000 + (i * 7) % 500) if i % 2 else 'sip:vmr{}@example.org'.format((i * 7) % 500)
+            response = self.client.get(URL_EXAMPLE.replace('local_alias=' + self.target_alias, 'local_alias=' + alias))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['result']['name'], 'vmr{}'.format((i * 7) % 500))
@@ -15,6 +15,7 @@ from django.utils.translation import gettext_lazy as _
 from customer.models import CustomerMatch, Customer
 from datastore.models.pexip import Conference
 from datastore.utils.pexip import sync_conference_from_alias
+from policy.decision_cache import get_policy_decision
 from policy.models import (
     CustomerPolicy,
     CustomerPolicyState,
@@ -126,20 +127,18 @@ def match_policy_service(cluster_policy, params):
     obj['local_alias'] = clean_target(params['local_alias'])
     obj['remote_alias'] = clean_target(params.get('remote_alias') or '')
 
-    conference = Conference.objects.match(obj, cluster=cluster)
+    conference, customer, match = get_policy_decision(cluster, obj)
     gateway_rule = get_active_rule(cluster, **params.dict())
-    customer = None
     needs_auth = False
-    match = None
 
-    if conference:
-        customer = conference.get_customer()
-        if conference.match_id:
-            needs_auth = needs_auth or conference.match.require_authorization
-            match = conference.match
+    if match:
+        needs_auth = needs_auth or match.require_authorization
 
-    if not customer:
-        customer = CustomerMatch.objects.get_customer_for_pexip(obj=obj, cluster=cluster)
+    if not customer and (obj.get('tag') or obj.get('service_tag')):
+        # Same as CustomerMatch.objects.get_customer_for_pexip, conference is already resolved
+        tag_match = CustomerMatch.objects.get_match_from_tag(obj.get('tag') or obj.get('service_tag'),
+                                                             cluster=cluster)
+        customer = tag_match.customer if tag_match and tag_match.customer_id else None
 
     if not match:
         match = CustomerMatch.objects.get_match(obj=obj, cluster=cluster)
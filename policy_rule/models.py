@@ -14,6 +14,7 @@ from customer.models import Customer
 from provider.exceptions import NotFound
 from policy_rule.consts import PEXIP_HELP_TEXTS, PEXIP_VERBOSE_NAMES
 from policy_rule.fields import NullableRemoteObjectRelationField
+from policy_rule.rule_set import get_rule_set, invalidate_rule_set
 from provider.models.provider import Cluster
 from shared.utils import partial_update_or_create
 from statistics.parser.utils import clean_target
@@ -61,6 +62,7 @@ class PolicyRuleManager(models.Manager):
             .filter(cluster=cluster, external_id__isnull=False)\
             .exclude(external_id__in=valid_ids)\
             .update(sync_back=False, external_id=None)
+        invalidate_rule_set(cluster.pk)
 
         return new_objects
 
@@ -382,20 +384,15 @@ def get_matching_rules(cluster, local_alias='', remote_alias='', call_direction=
             scope.set_context('params', locals())
             capture_message('Invalid call_direction')
 
-    cluster_rules = PolicyRule.objects.filter(cluster=cluster)  # TODO cache
-
-    result = []
-    for rule in cluster_rules.order_by('priority', 'id'):
-
-        is_match, reason = match_rule(rule, local_alias=local_alias, remote_alias=remote_alias,
-                                      call_direction=call_direction, protocol=protocol,
-                                      is_registered=is_registered, location=location)
-        if is_match:
-            result.append(rule)
-            if only_one:
-                return result
-
-    return result
+    return get_rule_set(cluster).get_matching_rules(
+        local_alias=local_alias,
+        remote_alias=remote_alias,
+        call_direction=call_direction,
+        protocol=protocol,
+        is_registered=is_registered,
+        location=location,
+        only_one=only_one,
+    )
 
 
 def match_rule(self: PolicyRule, local_alias='', remote_alias='', call_direction='dial_in', protocol='sip',
@@ -592,3 +589,15 @@ class PolicyRuleHitCount(models.Model):
     rule = models.ForeignKey(PolicyRule, on_delete=models.CASCADE)
     date = models.DateField(default=date.today)
     count = models.IntegerField(default=1)
+
+
+def clear_rule_set_cache(sender, instance, **kwargs):
+    if sender is PolicyRule:
+        invalidate_rule_set(instance.cluster_id)
+    else:
+        invalidate_rule_set(instance.pk)
+
+
+models.signals.post_save.connect(clear_rule_set_cache, sender=PolicyRule)
+models.signals.post_delete.connect(clear_rule_set_cache, sender=PolicyRule)
+models.signals.post_save.connect(clear_rule_set_cache, sender=Cluster)
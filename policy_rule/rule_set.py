@@ -0,0 +1,205 @@
+import logging
+import re
+from time import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from django.core.cache import cache
+from django.db import transaction
+
+from statistics.parser.utils import clean_target
+
+if TYPE_CHECKING:
+    from policy_rule.models import PolicyRule  # noqa
+
+logger = logging.getLogger(__name__)
+
+# Max age of local rule set if shared version counter is unavailable, e.g. redis is down
+FALLBACK_TTL = 10
+
+PROTOCOL_FIELDS = {
+    'api': 'match_incoming_webrtc',
+    'webrtc': 'match_incoming_webrtc',
+    'rtmp': 'match_incoming_webrtc',
+    'sip': 'match_incoming_sip',
+    'mssip': 'match_incoming_mssip',
+    'h323': 'match_incoming_h323',
+}
+
+DIRECTION_FIELDS = {
+    'dial_in': 'match_incoming_calls',
+    'dial_out': 'match_outgoing_calls',
+}
+
+
+def _bool(s):
+    if s in (True, 'true', 1, '1'):
+        return True
+    return False
+
+
+def _compile(pattern: str):
+    try:
+        return re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        logger.warning('Invalid policy rule regexp %s: %s', pattern, e)
+        error = e
+
+        class _Invalid:
+            def match(self, s):
+                raise error
+
+        return _Invalid()
+
+
+class CompiledPolicyRule:
+    "Pre-compiled matching data for a single PolicyRule. See policy_rule.models.match_rule"
+
+    def __init__(self, rule: 'PolicyRule'):
+        self.pk = rule.pk
+        self.name = rule.name
+
+        self.field_names = tuple(f.attname for f in rule._meta.concrete_fields)
+        self.values = tuple(getattr(rule, f) for f in self.field_names)
+
+        self.only_if_registered = rule.match_incoming_only_if_registered
+        self.match_string_full = rule.match_string_full
+        self.source_location_name = rule.match_source_location_name if rule.match_source_location else None
+        self.source_mode_and = rule.match_source_mode == 'AND'
+        self.source_alias = _compile(rule.match_source_alias) if rule.match_source_alias else None
+        self.match_string = _compile(rule.match_string)
+
+    def get_rule(self) -> 'PolicyRule':
+        "New model instance each time, to not share related object caches between requests"
+        from policy_rule.models import PolicyRule
+
+        return PolicyRule.from_db('default', self.field_names, self.values)
+
+    def match(self, local_alias: str, remote_alias: str, call_direction: str, is_registered,
+              location: str) -> Tuple[bool, str]:
+        "Match call parameters. Enabled state, direction and protocol is already handled by bucket"
+
+        if self.only_if_registered and _bool(is_registered) is not True:
+            return False, 'registered'
+
+        destination = local_alias if call_direction == 'dial_in' else remote_alias
+        source = local_alias if call_direction != 'dial_in' else remote_alias
+
+        if not self.match_string_full:
+            destination = clean_target(destination)
+        source = clean_target(source)
+
+        pass_source = True
+        if self.source_location_name is not None and location != self.source_location_name:
+            pass_source = False
+        if self.source_alias and not self.source_alias.match(source):
+            pass_source = False
+
+        if not pass_source and self.source_mode_and:
+            return False, 'source'
+
+        if not self.match_string.match(destination):
+            return False, 'destination'
+
+        return True, ''
+
+
+class PolicyRuleSet:
+    """
+    Enabled rules for a cluster, in priority order and bucketed by call direction
+    and protocol so that only rules which can match are evaluated
+    """
+
+    def __init__(self, rules: List['PolicyRule'], version=None):
+        self.version = version
+        self.ts_created = time()
+
+        self._rules = [(rule, CompiledPolicyRule(rule)) for rule in rules if rule.enable]
+        self._buckets: Dict[Tuple[str, str], List[CompiledPolicyRule]] = {}
+
+    @classmethod
+    def from_db(cls, cluster_id: int, version=None):
+        from policy_rule.models import PolicyRule
+
+        rules = PolicyRule.objects.filter(cluster=cluster_id).order_by('priority', 'id')
+        return cls(list(rules), version=version)
+
+    def _get_bucket(self, call_direction: str, protocol: str) -> List[CompiledPolicyRule]:
+        key = (
+            call_direction if call_direction in DIRECTION_FIELDS else '',
+            PROTOCOL_FIELDS.get(protocol, ''),
+        )
+        if key not in self._buckets:
+            direction_field, protocol_field = DIRECTION_FIELDS.get(key[0]), key[1]
+            self._buckets[key] = [
+                compiled
+                for rule, compiled in self._rules
+                if (not direction_field or getattr(rule, direction_field))
+                and (not protocol_field or getattr(rule, protocol_field))
+            ]
+        return self._buckets[key]
+
+    def get_matching_rules(self, local_alias='', remote_alias='', call_direction='dial_in', protocol='sip',
+                           is_registered='false', location='', only_one=False) -> List['PolicyRule']:
+        result = []
+        for compiled in self._get_bucket(call_direction, protocol):
+            is_match, reason = compiled.match(local_alias, remote_alias, call_direction, is_registered, location)
+            if not is_match:
+                logger.debug(
+                    'Policy rule %s (%s) did not match call, reason: %s', compiled.pk, compiled.name, reason
+                )
+                continue
+
+            logger.info('Policy rule %s (%s) matched call', compiled.pk, compiled.name)
+            result.append(compiled.get_rule())
+            if only_one:
+                break
+        return result
+
+
+_rule_sets: Dict[int, PolicyRuleSet] = {}
+
+
+def _version_key(cluster_id):
+    return 'policy_rule.version.{}'.format(cluster_id)
+
+
+def get_rule_set_version(cluster_id) -> Optional[int]:
+    key = _version_key(cluster_id)
+    version = cache.get(key)
+    if version is None:
+        # start from current time so a flushed cache won't reuse old version numbers
+        cache.add(key, int(time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_rule_set_version(cluster_id):
+    key = _version_key(cluster_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time() * 1000), timeout=None)
+    _rule_sets.pop(cluster_id, None)
+
+
+def invalidate_rule_set(cluster_id):
+    "Bump version when the current transaction is committed, so no process can rebuild from uncommitted rules"
+    transaction.on_commit(lambda: _bump_rule_set_version(cluster_id))
+
+
+def get_rule_set(cluster) -> PolicyRuleSet:
+    "Get cached rule set for cluster. Rebuilt when the shared version counter changes"
+    cluster_id = getattr(cluster, 'pk', cluster)
+
+    version = get_rule_set_version(cluster_id)
+    rule_set = _rule_sets.get(cluster_id)
+
+    if rule_set:
+        if version is not None and rule_set.version == version:
+            return rule_set
+        if version is None and rule_set.ts_created > time() - FALLBACK_TTL:
+            return rule_set
+
+    rule_set = PolicyRuleSet.from_db(cluster_id, version=version)
+    _rule_sets[cluster_id] = rule_set
+    return rule_set
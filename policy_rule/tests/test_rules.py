@@ -1,7 +1,10 @@
+from unittest.mock import patch
+
 from datastore.models.customer import Tenant
 from datastore.models.pexip import Conference, ConferenceAlias
 from policy.tests.base import PolicyTestMixin
-from policy_rule.models import PolicyRule, PolicyRuleResponse
+from policy_rule.models import PolicyRule, PolicyRuleResponse, get_matching_rules, match_rule
+from policy_rule.rule_set import get_rule_set_version
 from . import consts
 
 
@@ -186,3 +189,55 @@ class EmptyPolicyRuleResponseTestCase(PolicyRuleTestMixin):
         rule = self._create_rule(**rule_kwargs)
         container = PolicyRuleResponse(rule)
         return container.response()
+
+
+class PolicyRuleSetTestCase(PolicyRuleTestMixin):
+
+    def test_same_result_as_match_rule(self):
+        self._create_rule(match_string='555.*', match_incoming_sip=False, name='no sip')
+        self._create_rule(match_string='555.*', match_outgoing_calls=False, name='no outgoing')
+        self._create_rule(match_string='555.*', match_source_alias='.*remote.com', name='source')
+        self._create_rule(match_string='555.*', match_incoming_only_if_registered=True, name='registered')
+        self._create_rule(match_string='555.*', enable=False, name='disabled')
+
+        rules = list(PolicyRule.objects.filter(cluster=self.cluster).order_by('priority', 'id'))
+        for call_direction in ('dial_in', 'dial_out'):
+            for protocol in ('sip', 'h323', 'webrtc', 'other'):
+                for is_registered in ('true', 'false'):
+                    params = {
+                        'local_alias': 'sip:5551@local.com',
+                        'remote_alias': 'sip:5551@remote.com',
+                        'call_direction': call_direction,
+                        'protocol': protocol,
+                        'is_registered': is_registered,
+                    }
+                    expected = [r.pk for r in rules if match_rule(r, **params)[0]]
+                    result = [r.pk for r in get_matching_rules(self.cluster, **params)]
+                    self.assertEqual(result, expected, params)
+
+    def test_invalidate(self):
+        params = {'local_alias': 'sip:777@local.com', 'call_direction': 'dial_in', 'protocol': 'sip'}
+        self.assertEqual(get_matching_rules(self.cluster, **params), [])
+
+        rule = self._create_rule(match_string='777.*')
+        self.assertEqual([r.pk for r in get_matching_rules(self.cluster, **params)], [rule.pk])
+
+        rule.enable = False
+        rule.save()
+        self.assertEqual(get_matching_rules(self.cluster, **params), [])
+
+        rule.delete()
+        self.assertEqual(get_matching_rules(self.cluster, **params), [])
+
+    def test_invalidate_on_commit(self):
+        version = get_rule_set_version(self.cluster.pk)
+        callbacks = []
+
+        with patch('django.db.transaction.on_commit', side_effect=callbacks.append):
+            self._create_rule(match_string='777.*')
+            self.assertEqual(get_rule_set_version(self.cluster.pk), version)
+
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+        self.assertGreater(get_rule_set_version(self.cluster.pk), version)
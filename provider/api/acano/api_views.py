@@ -11,6 +11,7 @@ from sentry_sdk import capture_exception
 from endpoint.view_mixins import CustomerRelationMixin
 from license import get_license
 from license.api_helpers import license_validate_add
+from numberseries.allocation import allocate_number
 from numberseries.models import NumberRangeDummy
 from provider.api.acano.serializers import CoSpaceSerializer, CoSpaceBulkCreateSerializer, \
     CoSpaceCreateSerializer
@@ -108,9 +109,9 @@ class CoSpaceViewSet(DynamicAPIMixin, CustomerAPIMixin, CustomerRelationMixin, v
         number_range = api.get_static_room_number_range()
 
         if serializer.validated_data.get('call_id_generation_method') == 'random':
-            data['call_id'] = number_range.random()
+            data['call_id'] = allocate_number(number_range, api.cluster, random=True)
         elif serializer.validated_data.get('call_id_generation_method') == 'increase':
-            data['call_id'] = number_range.use()
+            data['call_id'] = allocate_number(number_range, api.cluster)
 
         data['tenant'] = self._get_customer().acano_tenant_id
 
@@ -177,6 +177,20 @@ class ProviderStatusAPIView(CustomerMixin, APIView):
 
         return self.get_status(self._single_vcs_status, customer_providers)
 
+    @staticmethod
+    def _get_live_call_state(provider: 'Provider'):
+        "Stored call state for counts, if the cluster uses it. See statistics.live_state"
+        from statistics import live_state
+
+        cluster = provider.cluster
+        if not cluster or not cluster.use_local_call_state or not cluster.has_cdr_events:
+            return None
+
+        if provider.is_acano and len(cluster.get_clustered(include_self=True)) > 1:
+            return None  # counts are per call bridge
+
+        return live_state.get_for_cluster(cluster)
+
     def _single_acano_status(self, provider, customer, has_all_customers=False):
 
         result = {
@@ -229,6 +243,14 @@ class ProviderStatusAPIView(CustomerMixin, APIView):
 
             tenant_kwargs = {'tenant': customer.acano_tenant_id} if not self._has_all_customers() else {}
 
+            live_state = self._get_live_call_state(provider)
+            if live_state:
+                yield {
+                    'call_count': live_state.get_call_count(**tenant_kwargs),
+                    'call_leg_count': live_state.get_leg_count(**tenant_kwargs),
+                }
+                return
+
             yield {
                 'call_count': api.get_calls(limit=1, **tenant_kwargs)[1],
             }
@@ -268,6 +290,14 @@ class ProviderStatusAPIView(CustomerMixin, APIView):
 
             tenant_kwargs = {'tenant': customer.pexip_tenant_id} if not self._has_all_customers() else {}
 
+            live_state = self._get_live_call_state(provider)
+            if live_state:
+                yield {
+                    'call_count': live_state.get_call_count(**tenant_kwargs),
+                    'call_leg_count': live_state.get_leg_count(**tenant_kwargs),
+                }
+                return
+
             yield {
                 'call_count': api.get_calls(limit=1, **tenant_kwargs)[1],
             }
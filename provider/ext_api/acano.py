@@ -1,6 +1,5 @@
 import secrets
 from builtins import StopIteration
-from multiprocessing.pool import ThreadPool, AsyncResult, ApplyResult
 from random import shuffle
 from time import sleep, monotonic
 from typing import (
@@ -33,6 +32,7 @@ from ..exceptions import AuthenticationError, NotFound, ResponseError, ResponseC
 from datetime import timedelta
 from urllib.parse import urlencode, parse_qsl
 from .base import ProviderAPI, BookMeetingProviderAPI, MCUProvider
+from .paging import Page, PrefetchPageIterator
 from sentry_sdk import capture_exception
 from collections import OrderedDict, defaultdict
 import re
@@ -400,7 +400,7 @@ class AcanoAPI(BookMeetingProviderAPI, MCUProvider, ProviderAPI):
 
     def populate_call_id(self, api_data: Dict, number_range=None, random=False):
         "Get callId from static value or from number range"
-        from datastore.models.acano import CoSpace
+        from numberseries.allocation import allocate_number
 
         call_id = api_data.get('callId', None)
         if hasattr(call_id, 'use'):  # number range instance passed using callId
@@ -409,14 +409,8 @@ class AcanoAPI(BookMeetingProviderAPI, MCUProvider, ProviderAPI):
 
         if call_id:
             pass
-        elif number_range and random:
-            call_id = number_range.random()
-            while CoSpace.objects.get_by_call_id(self.cluster, call_id):
-                call_id = number_range.random()
         elif number_range:
-            call_id = number_range.use()
-            while CoSpace.objects.get_by_call_id(self.cluster, call_id):
-                call_id = number_range.use()
+            call_id = allocate_number(number_range, self.cluster, random=random)
 
         if not call_id:
             call_id = self.get_scheduled_room_number_range().random()
@@ -644,6 +638,12 @@ class AcanoAPI(BookMeetingProviderAPI, MCUProvider, ProviderAPI):
         offset = kwargs.get('offset') or 0
         limit = kwargs.get('limit')
 
+        if not args and not any(kwargs.get(k) for k in ('filter', 'cospace', 'include_legs', 'include_participants')):
+            live_state = self.get_live_call_state()
+            if live_state:
+                calls, count = live_state.get_calls(tenant=kwargs.get('tenant'), offset=offset, limit=limit)
+                return [self._convert_live_call(c) for c in calls], count
+
         clustered = len(self.cluster.get_clustered(include_self=True)) or 1
         if clustered <= 1:
             return self.get_calls(*args, **kwargs)
@@ -678,6 +678,16 @@ class AcanoAPI(BookMeetingProviderAPI, MCUProvider, ProviderAPI):
             return result, total_count  # This probably wont be correct for clustered calls
         return result, len(result)
 
+    @staticmethod
+    def _convert_live_call(call):
+        return {
+            'id': call['guid'],
+            'name': call['cospace'],
+            'cospace': call['cospace_id'] if call['cospace_id'] != 'AdHoc' else '',
+            'correlator': call['correlator'],
+            'tenant': call['tenant'] or None,
+        }
+
     def get_clustered_participant_count(self, *args, **kwargs):
         return self.get_clustered_participants(*args, only_count=True, **kwargs)[1]
 
@@ -686,6 +696,16 @@ class AcanoAPI(BookMeetingProviderAPI, MCUProvider, ProviderAPI):
         if only_count:
             limit = 1
 
+        live_state = self.get_live_call_state() if not (call_id or cospace or filter) else None
+        if live_state and only_count:
+            return [], live_state.get_leg_count(tenant=tenant)
+        elif live_state:
+            legs, count = live_state.get_legs(tenant=tenant, limit=limit)
+            return [
+                {'id': leg['guid'], 'name': leg['name'] or 'Unspecified', 'call': leg['call_guid'], 'callbridge': ''}
+                for leg in legs
+            ], count
+
         total_count = 0
 
         result = []
@@ -1405,7 +1425,7 @@ class AcanoAPI(BookMeetingProviderAPI, MCUProvider, ProviderAPI):
 
         number_range = self.get_scheduled_room_number_range()
 
-        call_id = cur_call_id or number_range.random()
+        call_id = cur_call_id or self.populate_call_id({}, number_range=number_range, random=True)
 
         data = {
             'callId': call_id,
@@ -2876,42 +2896,9 @@ class AcanoPageIterator:
 
         return items
 
-    def get_first_page(self) -> Element:
-        items = self.get_xml(self.api, self.offset)
-        self.total_count = int(items.get('total'))
-
-        self.per_page = len(items)  # acano has different max limits for different api calls
-
-        self.offset += len(items)
-        return items
-
-    def buffer_pages(self, it) -> Iterator[List[Element]]:
-        """
-        Buffer one page to try to start fetching next batch in background
-        """
-        last = None
-
-        def _reset_last(replace=None):
-            nonlocal last
-            was_last, last = last, replace
-            if isinstance(was_last, AsyncResult):
-                was_last = was_last.get()
-            if was_last is not None:
-                yield was_last
-
-        while True:
-            try:
-                if isinstance(last, AsyncResult):
-                    # wait for last page before starting next batch
-                    last = last.get()
-                pages = next(it)
-                yield from _reset_last(replace=pages)
-            except StopIteration:
-                yield from _reset_last()
-                break
-            except Exception:
-                yield from _reset_last()
-                raise
+    def get_page(self, api: AcanoAPI, offset: int) -> Page:
+        items = self.get_xml(api, offset)
+        return Page(items, int(items.get('total') or 0), root=items)
 
     def get_apis(self):
         if self.only_call_bridges:
@@ -2926,43 +2913,32 @@ class AcanoPageIterator:
 
         return apis
 
-    def iter_pages_single(self) -> Iterator[List[Element]]:
-        while self.offset < self.total_count:
-            yield [self.get_xml(self.api, self.offset)]
-            self.offset += self.per_page
-
-    def iter_pages_threaded(self, apis) -> Iterator[Union[ApplyResult, List[Element]]]:
-
-        while self.offset < self.total_count:
-            with ThreadPool(min(len(apis), MAX_THREADS)) as pool:
-                args = []
-                for api in apis[:MAX_THREADS]:
-                    if self.offset > self.total_count:
-                        break
-                    args.append((api, self.offset))
-                    self.offset += self.per_page
-                pages = pool.starmap_async(self.get_xml, args)
-                yield pages
-
     def iter_pages(self) -> Iterator[Element]:
-        yield self.get_first_page()
 
-        if self.offset > self.total_count:
-            return
+        threaded = False
 
-        if self.allow_threads and self.offset + self.per_page < self.total_count:
+        def _get_apis():
+            nonlocal threaded
             apis = self.get_apis()
             if len(apis) > 1:
+                threaded = True
                 clusters_in_threads[self.api.cluster.pk] = True
-                try:
-                    for pages in self.buffer_pages(self.iter_pages_threaded(apis)):
-                        yield from pages
-                finally:
-                    clusters_in_threads.pop(self.api.cluster.pk, None)
-                return
-
-        for pages in self.iter_pages_single():
-            yield from pages
+            return apis
+
+        pages = PrefetchPageIterator(
+            self.get_page,
+            self.api,
+            get_apis=_get_apis if self.allow_threads else None,
+            offset=self.offset,
+            max_workers=MAX_THREADS,
+        )
+        try:
+            for page in pages:
+                self.total_count = pages.total
+                yield page.items
+        finally:
+            if threaded:
+                clusters_in_threads.pop(self.api.cluster.pk, None)
 
     def iter(self) -> Iterator[Element]:
 
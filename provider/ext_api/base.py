@@ -17,6 +17,7 @@ from provider.types import ProviderAPICompatible
 from shared.exceptions import format_exception
 from shared.utils import maybe_update
 
+from . import connection_pool
 from ..exceptions import (
     AuthenticationError,
     DuplicateError,
@@ -83,7 +84,7 @@ class RestProviderAPI:
         return self.host
 
     def get_session(self, **kwargs):
-        session = requests.Session()
+        session = connection_pool.mount(requests.Session())
         for k, v in kwargs.items():
             setattr(session, k, v)
         session.verify = self.verify_certificate
@@ -783,6 +784,9 @@ class ProviderAPI(RestProviderAPI):
     # Is this provider currently syncing data to local database
     is_syncing = False
 
+    # Update all synced objects, even if sync hash is unchanged
+    force_sync = False
+
     # Use false if single user/cospace (using id) always should be updated:
     _use_cache_for_single_objects = False  # Note: overrided by some providers
 
@@ -835,6 +839,14 @@ class ProviderAPI(RestProviderAPI):
     def use_call_cache(self):
         return self.allow_cached_values and self.has_cdr_events
 
+    def get_live_call_state(self):
+        "Active calls and participants stored by the cdr parsers, see statistics.live_state"
+        if not self.use_call_cache:
+            return None
+
+        from statistics import live_state
+        return live_state.get_for_cluster(self.cluster)
+
     @property
     def use_cache_for_single_objects(self):
         if self.is_syncing:
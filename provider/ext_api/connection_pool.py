@@ -0,0 +1,204 @@
+"""
+Process wide connection pool for external API requests.
+
+Sessions are still created per API instance (cookies, auth headers and proxies
+are instance specific), but they all use the same transport adapters, so
+keep-alive connections to a host are reused between API instances and tasks.
+
+There is one adapter for each combination of TLS settings (verify and client
+certificate). requests sets the certificate requirements on the urllib3 pool
+of the host for each request, so a connection opened without certificate
+verification must never be reused by a session that verifies certificates.
+"""
+import os
+import queue
+import threading
+from collections import defaultdict
+from time import monotonic
+from typing import Dict, Hashable, Tuple
+
+from django.conf import settings
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+
+
+_lock = threading.Lock()
+_adapters: Dict[Tuple[Hashable, Hashable], 'SharedHTTPAdapter'] = {}
+_adapters_pid = None
+
+_stats: Dict[str, Dict[str, float]] = defaultdict(lambda: {'requests': 0, 'reused': 0, 'new_connections': 0, 'wait_seconds': 0.0})
+
+
+def _record(host: str, reused: bool, wait_seconds: float):
+    with _lock:
+        stats = _stats[host]
+        stats['requests'] += 1
+        stats['reused' if reused else 'new_connections'] += 1
+        stats['wait_seconds'] += wait_seconds
+
+
+class TrackedPoolMixin:
+
+    last_used = 0.0
+
+    def _get_conn(self, timeout=None):
+        start = monotonic()
+        conn = super()._get_conn(timeout=timeout)
+        self.last_used = monotonic()
+        _record(self.host, reused=conn.sock is not None, wait_seconds=self.last_used - start)
+        return conn
+
+    def close_idle(self):
+        "Close kept-alive connections, but keep the pool usable"
+        idle = self.pool
+        if idle is None:
+            return
+        for _i in range(idle.qsize()):
+            try:
+                conn = idle.get(block=False)
+            except queue.Empty:
+                break
+            if conn:
+                conn.close()
+            idle.put(None, block=False)
+
+
+class TrackedHTTPConnectionPool(TrackedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class TrackedHTTPSConnectionPool(TrackedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+POOL_CLASSES = {
+    'http': TrackedHTTPConnectionPool,
+    'https': TrackedHTTPSConnectionPool,
+}
+
+
+class SharedHTTPAdapter(HTTPAdapter):
+    "Adapter shared between all sessions in the process. Closing a session does not close its connections"
+
+    def __init__(self, idle_seconds=60, **kwargs):
+        self.idle_seconds = idle_seconds
+        self._last_eviction = monotonic()
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = POOL_CLASSES
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        new = proxy not in self.proxy_manager
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        if new:
+            manager.pool_classes_by_scheme = POOL_CLASSES
+        return manager
+
+    def send(self, request, *args, **kwargs):
+        self.close_idle()
+        return super().send(request, *args, **kwargs)
+
+    def iter_pools(self):
+        managers = [self.poolmanager, *self.proxy_manager.values()]
+        for manager in managers:
+            with manager.pools.lock:
+                pools = list(manager.pools._container.values())
+            yield from pools
+
+    def close_idle(self, force=False):
+        ts = monotonic()
+        if not force and ts - self._last_eviction < min(self.idle_seconds, 10):
+            return
+        self._last_eviction = ts
+
+        for pool in self.iter_pools():
+            if force or ts - pool.last_used > self.idle_seconds:
+                pool.close_idle()
+
+    def close(self):
+        pass  # shared between sessions. Idle connections are closed by close_idle()
+
+    def close_all(self):
+        super().close()
+
+
+def _get_key(verify, cert) -> Tuple[Hashable, Hashable]:
+    return verify, tuple(cert) if isinstance(cert, (list, tuple)) else cert
+
+
+def get_adapter(verify=True, cert=None) -> SharedHTTPAdapter:
+    """
+    Get adapter for the current process and TLS settings. Forked processes (e.g. celery
+    prefork workers) get their own
+    """
+    global _adapters_pid
+
+    key = _get_key(verify, cert)
+    pid = os.getpid()
+    if _adapters_pid == pid and key in _adapters:
+        return _adapters[key]
+
+    with _lock:
+        if _adapters_pid != pid:
+            _adapters.clear()
+            _adapters_pid = pid
+            _stats.clear()
+
+        if key not in _adapters:
+            _adapters[key] = SharedHTTPAdapter(
+                idle_seconds=settings.HTTP_POOL_IDLE_SECONDS,
+                pool_connections=settings.HTTP_POOL_HOSTS,
+                pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+                pool_block=settings.HTTP_POOL_BLOCK,
+            )
+        return _adapters[key]
+
+
+def get_adapters():
+    with _lock:
+        return list(_adapters.values()) if _adapters_pid == os.getpid() else []
+
+
+def close_all():
+    for adapter in get_adapters():
+        adapter.close_all()
+
+
+def reset():
+    "Drop adapters without closing sockets, which may be in use by parent process after fork"
+    global _adapters, _adapters_pid, _lock
+    _lock = threading.Lock()  # may have been held by another thread at fork
+    _adapters = {}
+    _adapters_pid = None
+    _stats.clear()
+
+
+def get_stats():
+    "Pool hits, new connections and time spent waiting for a free connection, per host"
+    with _lock:
+        return {host: dict(stats) for host, stats in _stats.items()}
+
+
+class SessionAdapter(BaseAdapter):
+    "Mounted in each session. Sends requests using the shared adapter for the TLS settings of the request"
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        return get_adapter(verify, cert).send(
+            request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies
+        )
+
+    def close(self):
+        pass  # shared between sessions. Idle connections are closed by SharedHTTPAdapter.close_idle()
+
+
+def mount(session):
+    adapter = SessionAdapter()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset)
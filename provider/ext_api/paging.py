@@ -0,0 +1,138 @@
+"""
+Fetch all pages of offset based collection APIs (Pexip configuration API, CMS) using
+multiple connections.
+
+The first page is fetched as usual to get the page size and total count. The remaining
+offsets are then fetched concurrently, at most one request at a time for each api object,
+and pages are yielded in order as soon as they are available. If a page reports another
+total count or page size than the first one (e.g. items are added or removed during the
+sync) the rest of the pages are fetched one by one from that offset.
+"""
+import logging
+from collections import deque
+from multiprocessing.pool import AsyncResult, ThreadPool
+from typing import Any, Callable, Deque, Generic, Iterator, List, NamedTuple, Sequence, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = 4
+
+A = TypeVar('A')
+
+
+class Page(NamedTuple):
+    items: Sequence[Any]
+    total: int
+    has_next: bool = True
+    root: Any = None
+
+
+class PrefetchPageIterator(Generic[A]):
+
+    def __init__(
+        self,
+        fetch: Callable[[A, int], Page],
+        api: A,
+        get_apis: Callable[[], Sequence[A]] = None,
+        offset: int = 0,
+        max_workers=MAX_WORKERS,
+    ):
+        """
+        ``get_apis`` is called when there is more than one page left to fetch, and should
+        return api objects that can be used at the same time, including ``api``
+        """
+        self.fetch = fetch
+        self.api = api
+        self.get_apis = get_apis
+        self.offset = offset
+        self.max_workers = max_workers
+
+        self.apis: List[A] = [api]
+        self.total = 0
+        self.per_page = 0
+        self.requests = 0
+        self.is_sequential = True
+
+    def _fetch(self, api: A, offset: int) -> Page:
+        self.requests += 1
+        return self.fetch(api, offset)
+
+    @staticmethod
+    def is_last(page: Page, next_offset: int) -> bool:
+        return not page.items or not page.has_next or next_offset >= page.total
+
+    def is_consistent(self, page: Page, offset: int) -> bool:
+        if page.total != self.total:
+            return False
+        return len(page.items) == min(self.per_page, self.total - offset)
+
+    def iter(self) -> Iterator[Page]:
+        page = self._fetch(self.api, self.offset)
+        self.total, self.per_page = page.total, len(page.items)
+        yield page
+
+        offset = self.offset + len(page.items)
+        if self.is_last(page, offset):
+            return
+
+        if self.get_apis and offset + self.per_page < self.total:
+            self.apis = list(self.get_apis())[:self.max_workers] or [self.api]
+            self.is_sequential = len(self.apis) <= 1
+
+        if not self.is_sequential:
+            offset = yield from self.iter_concurrent(offset)
+            if offset is None:
+                return
+
+        yield from self.iter_sequential(offset)
+
+    def iter_concurrent(self, offset: int) -> Iterator[Page]:
+        """
+        Yield the rest of the pages. Returns offset to continue from one by one if results
+        are inconsistent
+        """
+        pending: Deque[Tuple[int, AsyncResult]] = deque()
+        next_offset = offset
+
+        with ThreadPool(len(self.apis)) as pool:
+
+            def _fill():
+                nonlocal next_offset
+                while len(pending) < len(self.apis) and next_offset < self.total:
+                    # page n and n + len(apis) use the same api object, never at the same time
+                    api = self.apis[(next_offset - offset) // self.per_page % len(self.apis)]
+                    pending.append((next_offset, pool.apply_async(self._fetch, (api, next_offset))))
+                    next_offset += self.per_page
+
+            _fill()
+            while pending:
+                page_offset, result = pending.popleft()
+                page = result.get()
+                if not self.is_consistent(page, page_offset):
+                    logger.info(
+                        'Inconsistent page at offset %s (%s items of %s, expected %s of %s). Continuing one by one',
+                        page_offset,
+                        len(page.items),
+                        page.total,
+                        self.per_page,
+                        self.total,
+                    )
+                    self.is_sequential = True
+                    return page_offset
+
+                yield page
+                _fill()
+
+        return None
+
+    def iter_sequential(self, offset: int) -> Iterator[Page]:
+        while True:
+            page = self._fetch(self.api, offset)
+            yield page
+            offset += len(page.items)
+            if self.is_last(page, offset):
+                break
+
+    def __iter__(self):
+        return self.iter()
+
@@ -24,6 +24,7 @@ from ..exceptions import AuthenticationError, DuplicateError, MessageResponseErr
 from datetime import timedelta, datetime
 from urllib.parse import urlencode, quote
 from .base import ProviderAPI, BookMeetingProviderAPI, MCUProvider, DistributedReadOnlyCallControlProvider
+from .paging import Page, PrefetchPageIterator
 from sentry_sdk import capture_exception, capture_message
 from collections import defaultdict
 import re
@@ -44,6 +45,9 @@ logger = logging.getLogger(__name__)
 
 LOOKUP_CALL_CONFERENCE_PREFIX = 'lookup.'
 
+# Fetch pages of collections concurrently using this many connections
+PAGING_CONNECTIONS = 4
+
 """
 Nomenclature in class:
 * cospace = video meeting room / auditorium / test call. Have aliases and settings
@@ -237,7 +241,7 @@ class PexipAPI(BookMeetingProviderAPI, DistributedReadOnlyCallControlProvider, M
 
         if not call_id:
             number_range = self.get_scheduled_room_number_range()
-            call_id = str(number_range.random())
+            call_id = self.get_next_call_id(None, number_range=number_range, random=True)
 
         name = meeting.title or '{} möte'.format(self.customer.title)
         name = '{} : {}'.format(name, call_id)  # TODO uuid for uniqueness? Check for duplicate first?
@@ -421,7 +425,7 @@ class PexipAPI(BookMeetingProviderAPI, DistributedReadOnlyCallControlProvider, M
 
     def get_next_call_id(self, call_id: Union[None, int, str, 'NumberRange'], number_range=None, random=False):
         """Get callId from static value or from number range"""
-        from datastore.models.pexip import Conference
+        from numberseries.allocation import allocate_number
 
         if hasattr(call_id, 'use'):  # number range instance passed call_id
             number_range = number_range or call_id
@@ -429,14 +433,8 @@ class PexipAPI(BookMeetingProviderAPI, DistributedReadOnlyCallControlProvider, M
 
         if call_id:
             pass
-        elif number_range and random:
-            call_id = number_range.random()
-            while Conference.objects.match_by_alias(str(call_id), self.cluster):
-                call_id = number_range.random()
         elif number_range:
-            call_id = number_range.use()
-            while Conference.objects.match_by_alias(str(call_id), self.cluster):
-                call_id = number_range.use()
+            call_id = allocate_number(number_range, self.cluster, random=random)
 
         return str(call_id) if call_id else None
 
@@ -590,25 +588,36 @@ class PexipAPI(BookMeetingProviderAPI, DistributedReadOnlyCallControlProvider, M
 
     def get_calls_cached(self, include_legs=False, include_participants=False, filter=None, cospace=None, call_id=None, limit=None, tenant=None, offset=0):
         from statistics.models import Call
-        calls = Call.objects.distinct().filter(server__cluster=self.cluster,
-                                               ts_start__gt=now() - timedelta(days=30),  # use index
-                                               ts_stop__isnull=True)\
-            .filter(legs__ts_stop__isnull=True, legs__should_count_stats=True)
 
-        if tenant is not None:
-            calls = calls.filter(tenant=tenant)
+        cols = ['id', 'name', 'cospace', 'call_id', 'start_time', 'tenant']
 
-        if filter:
-            calls = calls.filter(cospace__icontains=filter)
+        live_state = self.get_live_call_state() if not filter and cospace is None and call_id is None else None
+        if live_state:
+            calls, count = live_state.get_calls(tenant=tenant, offset=offset, limit=limit)
+            result = [dict(zip(cols, (c['guid'], c['cospace'], c['cospace'], c['id'], c['ts_start'], c['tenant']))) for c in calls]
+        else:
+            calls = Call.objects.distinct().filter(server__cluster=self.cluster,
+                                                   ts_start__gt=now() - timedelta(days=30),  # use index
+                                                   ts_stop__isnull=True)\
+                .filter(legs__ts_stop__isnull=True, legs__should_count_stats=True)
 
-        if cospace is not None:
-            calls = calls.filter(cospace=cospace)
+            if tenant is not None:
+                calls = calls.filter(tenant=tenant)
 
-        if call_id is not None:
-            calls = calls.filter(guid=call_id)
+            if filter:
+                calls = calls.filter(cospace__icontains=filter)
+
+            if cospace is not None:
+                calls = calls.filter(cospace=cospace)
+
+            if call_id is not None:
+                calls = calls.filter(guid=call_id)
+
+            result = [dict(zip(cols, v)) for v in calls.values_list('guid', 'cospace', 'cospace', 'id', 'ts_start', 'tenant')[offset:offset + limit if limit else None]]
+            count = None
+
+        cdr_states = Call.get_many_cdr_state_info(self.cluster.pk, [c['id'] for c in result])
 
-        cols = ['id', 'name', 'cospace', 'call_id', 'start_time', 'tenant']
-        result = [dict(zip(cols, v)) for v in calls.values_list('guid', 'cospace', 'cospace', 'id', 'ts_start', 'tenant')[offset:offset + limit if limit else None]]
         for c in result:
             call_id = c.pop('call_id')
             c['ts_start'] = c['start_time']
@@ -616,12 +625,12 @@ class PexipAPI(BookMeetingProviderAPI, DistributedReadOnlyCallControlProvider, M
             if not c.get('id'):
                 c['id'] = '{}{}'.format(LOOKUP_CALL_CONFERENCE_PREFIX, call_id)
             else:
-                cdr_state = Call.get_cdr_state_info(self.cluster.pk, c['id'])
+                cdr_state = cdr_states[c['id']]
                 c.update({**cdr_state, **c})
 
             self.populate_call_participants(c, include_legs=include_legs, include_participants=include_participants)
 
-        return result, calls.count()
+        return result, calls.count() if count is None else count
 
     def get_calls(self, include_legs=False, include_participants=False, filter=None, cospace=None, limit=None, tenant=None, offset=0):
 
@@ -939,30 +948,6 @@ class PexipAPI(BookMeetingProviderAPI, DistributedReadOnlyCallControlProvider, M
 
     def get_participants_cached(self, call_id=None, guid=None, cospace=None, filter=None, tenant=None, only_internal=True, limit=None):
         from statistics.models import Leg
-        legs = Leg.objects.filter(server__cluster=self.cluster,
-                                  ts_start__gte=now() - timedelta(days=30),  # use db index
-                                  ts_stop__isnull=True)
-
-        if only_internal:
-            legs = legs.filter(should_count_stats=True)
-
-        if guid is not None:
-            if not guid:
-                raise ValueError('Cant filter on empty id')
-            legs = legs.filter(
-                Q(guid=guid) | Q(guid2=guid)
-            )  # TODO swap guid/guid2 in pexip stats/policy
-
-        if tenant is not None:
-            legs = legs.filter(tenant=tenant)
-
-        lookup_cospace = self.get_lookup_cospace(call_id)
-        if lookup_cospace:
-            legs = legs.filter(call__cospace=lookup_cospace)
-        elif call_id:
-            legs = legs.filter(call__guid=call_id)
-        elif cospace:
-            legs = legs.filter(call__cospace=cospace)
 
         cols = [
             'id',
@@ -975,20 +960,68 @@ class PexipAPI(BookMeetingProviderAPI, DistributedReadOnlyCallControlProvider, M
             'connect_time',
             'conference',
         ]
-        result = [
-            dict(zip(cols, v))
-            for v in legs.values_list(
-                'guid',
-                'guid2',
-                'name',
-                'call__guid',
-                'local',
-                'remote',
-                'tenant',
-                'ts_start',
-                'call__cospace',
-            )[:limit]
-        ]
+
+        live_state = None
+        if only_internal and guid is None and not call_id and not cospace:
+            live_state = self.get_live_call_state()
+
+        if live_state:
+            legs, count = live_state.get_legs(tenant=tenant, limit=limit)
+            result = [
+                dict(zip(cols, (
+                    leg['guid'],
+                    leg['guid2'],
+                    leg['name'],
+                    leg['call_guid'],
+                    leg['local'],
+                    leg['remote'],
+                    leg['tenant'],
+                    leg['ts_start'],
+                    leg['cospace'],
+                )))
+                for leg in legs
+            ]
+        else:
+            legs = Leg.objects.filter(server__cluster=self.cluster,
+                                      ts_start__gte=now() - timedelta(days=30),  # use db index
+                                      ts_stop__isnull=True)
+
+            if only_internal:
+                legs = legs.filter(should_count_stats=True)
+
+            if guid is not None:
+                if not guid:
+                    raise ValueError('Cant filter on empty id')
+                legs = legs.filter(
+                    Q(guid=guid) | Q(guid2=guid)
+                )  # TODO swap guid/guid2 in pexip stats/policy
+
+            if tenant is not None:
+                legs = legs.filter(tenant=tenant)
+
+            lookup_cospace = self.get_lookup_cospace(call_id)
+            if lookup_cospace:
+                legs = legs.filter(call__cospace=lookup_cospace)
+            elif call_id:
+                legs = legs.filter(call__guid=call_id)
+            elif cospace:
+                legs = legs.filter(call__cospace=cospace)
+
+            result = [
+                dict(zip(cols, v))
+                for v in legs.values_list(
+                    'guid',
+                    'guid2',
+                    'name',
+                    'call__guid',
+                    'local',
+                    'remote',
+                    'tenant',
+                    'ts_start',
+                    'call__cospace',
+                )[:limit]
+            ]
+            count = None
 
         for leg in result:
             id2 = leg.pop('id2')
@@ -996,10 +1029,11 @@ class PexipAPI(BookMeetingProviderAPI, DistributedReadOnlyCallControlProvider, M
                 leg['id'] = id2
             leg['ts_start'] = leg['connect_time']
 
-            cdr_state = Leg.get_cdr_state_info(self.cluster.pk, leg['id'])
-            leg.update({**cdr_state, **leg})
+        cdr_states = Leg.get_many_cdr_state_info(self.cluster.pk, [leg['id'] for leg in result])
+        for leg in result:
+            leg.update({**cdr_states.get(leg['id'], {}), **leg})
 
-        return result, legs.count()
+        return result, legs.count() if count is None else count
 
     def get_participants(self, call_id=None, cospace=None, filter=None, tenant=None, only_internal=True, limit=None):
 
@@ -1622,36 +1656,48 @@ class PexipAPI(BookMeetingProviderAPI, DistributedReadOnlyCallControlProvider, M
         result.sort(key=lambda x: x['start'], reverse=True)
         return result
 
+    def get_page(self, url, params, offset, timeout=None) -> Page:
+
+        response = self.get(url, params={**params, 'offset': offset}, **({'timeout': timeout} if timeout else {}))
+
+        if response.status_code != 200:
+            raise self.error('Invalid status {}'.format(response.status_code), response)
+
+        data = response.json()
+        meta = data['meta']
+        return Page(data['objects'], meta['total_count'], has_next=bool(meta.get('next', True)), root=meta)
+
+    def get_paging_apis(self) -> List['PexipAPI']:
+        """Use more than one connection to the management node"""
+        return [self] + [self.clone_api(self.provider) for _i in range(PAGING_CONNECTIONS - 1)]
+
     def _iter_all_pages(self, url, params=None, yield_root=False, match_tenant=True, timeout=None):
 
         params = (params or {}).copy()
 
         params.setdefault('limit', 300)
-        count = params.get('offset') or 0
+        offset = params.pop('offset', None) or 0
         tenant = params.pop('tenantFilter', None)
 
-        timeout_end = time.monotonic() + timeout if timeout else None
-        timeout_kwargs = {}
-
-        while 1:
-            params.update({'offset': count})
-
-            if timeout:
-                timeout_kwargs = {'timeout': max(0.1, timeout_end - time.monotonic())}
-            response = self.get(url, params=params, **timeout_kwargs)
-
-            if response.status_code != 200:
-                raise self.error('Invalid status {}'.format(response.status_code), response)
+        if timeout:
+            timeout_end = time.monotonic() + timeout
+            pages = PrefetchPageIterator(
+                lambda api, cur: api.get_page(url, params, cur, timeout=max(0.1, timeout_end - time.monotonic())),
+                self,
+                offset=offset,
+            )
+        else:
+            pages = PrefetchPageIterator(
+                lambda api, cur: api.get_page(url, params, cur), self, get_apis=self.get_paging_apis, offset=offset
+            )
 
-            data = response.json()
+        for page in pages:
 
             if yield_root:
                 yield_root = False
-                yield data['meta']
-
-            total_count = data['meta']['total_count']
+                yield page.root
 
-            for item in data['objects']:
+            for item in page.items:
 
                 if match_tenant or tenant:
                     if url == 'configuration/v1/conference/':
@@ -1665,11 +1711,6 @@ class PexipAPI(BookMeetingProviderAPI, DistributedReadOnlyCallControlProvider, M
                 if tenant is None or cur_tenant == tenant:
                     yield item
 
-                count += 1
-
-            if count >= total_count or not data['objects'] or not data['meta']['next']:
-                break
-
     def _iter_pages_with_count(self, url, params, limit=None, match_tenant=True, timeout=None):
 
         i = 0
@@ -928,8 +928,8 @@ def cache_single_cluster_data(self: Task, cluster_id: int, customer_id: int = No
             it = pexip.sync_all_pexip_iter(cluster, customer=customer, incremental=incremental)
         else:
             return
-        for step, _r in it:
-            logger.info('Synced %s for cluster %s (%s)', step, cluster.pk, cluster)
+        for step, stats in it:
+            logger.info('Synced %s for cluster %s (%s): %s', step, cluster.pk, cluster, stats)
             cache.set(lock_cache_key, 1, 30 * 60)  # refresh lock after each task
     except (ResponseConnectionError, AuthenticationError) as e:
         logger.warning('Could not sync cluster %s (id %s) %s: %s',
@@ -0,0 +1,189 @@
+import os
+import ssl
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+from unittest.mock import patch
+
+import requests
+from django.test import SimpleTestCase, override_settings
+
+from conferencecenter.tests.base import ConferenceBaseTest
+from provider.ext_api import connection_pool
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        connection_pool.reset()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+        from conferencecenter.tests import mocker
+        mocker.register_uri('GET', self.url, real_http=True)
+
+    def tearDown(self):
+        connection_pool.close_all()
+        connection_pool.reset()
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def _get(self):
+        session = connection_pool.mount(requests.Session())
+        session.trust_env = False
+        response = session.get(self.url, timeout=5)
+        session.close()
+        return response
+
+    def test_reuse_between_sessions(self):
+        for _i in range(5):
+            self.assertEqual(self._get().content, b'ok')
+
+        stats = connection_pool.get_stats()['127.0.0.1']
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['new_connections'], 1)
+        self.assertEqual(stats['reused'], 4)
+
+    def test_idle_eviction(self):
+        self._get()
+        adapter = connection_pool.get_adapter()
+        adapter.close_idle()  # recently used
+        self._get()
+
+        with patch.object(connection_pool, 'monotonic', return_value=monotonic() + adapter.idle_seconds + 1):
+            adapter.close_idle()
+        self._get()
+
+        stats = connection_pool.get_stats()['127.0.0.1']
+        self.assertEqual(stats['new_connections'], 2)
+        self.assertEqual(stats['reused'], 1)
+
+    def test_fork(self):
+        adapter = connection_pool.get_adapter()
+        self._get()
+        with patch.object(connection_pool.os, 'getpid', return_value=-1):
+            self.assertIsNot(connection_pool.get_adapter(), adapter)
+            self.assertEqual(connection_pool.get_stats(), {})
+
+    @override_settings(HTTP_POOL_MAXSIZE=2, HTTP_POOL_BLOCK=True)
+    def test_bounded(self):
+        connection_pool.reset()
+        threads = [threading.Thread(target=self._get) for _i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = connection_pool.get_stats()['127.0.0.1']
+        self.assertEqual(stats['requests'], 6)
+        self.assertLessEqual(stats['new_connections'], 2)
+
+
+def _write_self_signed_cert(directory):
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, '127.0.0.1')])
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(datetime.utcnow() - timedelta(days=1))
+        .not_valid_after(datetime.utcnow() + timedelta(days=1))
+        .sign(key, hashes.SHA256(), default_backend())
+    )
+
+    cert_file = os.path.join(directory, 'cert.pem')
+    key_file = os.path.join(directory, 'key.pem')
+    with open(cert_file, 'wb') as fd:
+        fd.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_file, 'wb') as fd:
+        fd.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()
+        ))
+    return cert_file, key_file
+
+
+class TLSConnectionPoolTestCase(SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        connection_pool.reset()
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*_write_self_signed_cert(self.tmp_dir.name))
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.server.daemon_threads = True
+        self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'https://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+        from conferencecenter.tests import mocker
+        mocker.register_uri('GET', self.url, real_http=True)
+
+    def tearDown(self):
+        connection_pool.close_all()
+        connection_pool.reset()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+        super().tearDown()
+
+    def _get(self, verify=False):
+        session = connection_pool.mount(requests.Session())
+        session.trust_env = False
+        session.verify = verify
+        try:
+            return session.get(self.url, timeout=5)
+        finally:
+            session.close()
+
+    def test_verify_not_shared(self):
+        self.assertEqual(self._get(verify=False).content, b'ok')
+        self.assertEqual(self._get(verify=False).content, b'ok')
+
+        with self.assertRaises(requests.exceptions.SSLError):  # kept-alive connection is not reused
+            self._get(verify=True)
+
+        self.assertEqual(self._get(verify=False).content, b'ok')
+        self.assertIsNot(connection_pool.get_adapter(False), connection_pool.get_adapter(True))
+
+
+class ProviderSessionTestCase(ConferenceBaseTest):
+
+    def test_shared_adapter(self):
+        self._init()
+        first = self.customer.get_api().get_session()
+        second = self.customer.get_api().get_session()
+        self.assertIsNot(first, second)
+        self.assertIsInstance(first.adapters['https://'], connection_pool.SessionAdapter)
+        self.assertIsInstance(second.adapters['https://'], connection_pool.SessionAdapter)
@@ -0,0 +1,82 @@
+import threading
+from time import sleep
+
+from django.test import SimpleTestCase
+
+from provider.ext_api.paging import Page, PrefetchPageIterator
+
+
+class FakeCollection:
+
+    def __init__(self, total=1000, per_page=30):
+        self.items = list(range(total))
+        self.per_page = per_page
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def fetch(self, api, offset):
+        with self.lock:
+            self.requests.append((api, offset))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            sleep(0.002 if offset % 4 else 0.005)  # finish out of order
+            items = self.items[offset:offset + self.per_page]
+            return Page(items, len(self.items), has_next=offset + self.per_page < len(self.items))
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class PrefetchPageIteratorTestCase(SimpleTestCase):
+
+    def _iter_items(self, pages):
+        return [item for page in pages for item in page.items]
+
+    def test_concurrent(self):
+        collection = FakeCollection()
+        pages = PrefetchPageIterator(collection.fetch, 'api0', get_apis=lambda: ['api0', 'api1', 'api2'])
+
+        self.assertEqual(self._iter_items(pages), collection.items)
+        self.assertFalse(pages.is_sequential)
+        self.assertEqual(pages.requests, 34)
+        self.assertEqual(len({offset for _api, offset in collection.requests}), 34)
+        self.assertEqual({api for api, _offset in collection.requests}, {'api0', 'api1', 'api2'})
+        self.assertLessEqual(collection.max_active, 3)
+
+    def test_offset(self):
+        collection = FakeCollection(total=100)
+        pages = PrefetchPageIterator(collection.fetch, 'api0', get_apis=lambda: ['api0', 'api1'], offset=50)
+        self.assertEqual(self._iter_items(pages), collection.items[50:])
+
+    def test_single_page(self):
+        collection = FakeCollection(total=10)
+        get_apis_called = []
+        pages = PrefetchPageIterator(collection.fetch, 'api0', get_apis=lambda: get_apis_called.append(1) or ['api1'])
+        self.assertEqual(self._iter_items(pages), collection.items)
+        self.assertEqual(get_apis_called, [])
+        self.assertEqual(collection.requests, [('api0', 0)])
+
+    def test_sequential(self):
+        collection = FakeCollection(total=100)
+        pages = PrefetchPageIterator(collection.fetch, 'api0')
+        self.assertEqual(self._iter_items(pages), collection.items)
+        self.assertEqual([offset for _api, offset in collection.requests], [0, 30, 60, 90])
+        self.assertEqual(collection.max_active, 1)
+
+    def test_inconsistent_total(self):
+        collection = FakeCollection(total=200)
+        fetch = collection.fetch
+
+        def _fetch(api, offset):
+            result = fetch(api, offset)
+            if offset == 0:
+                collection.items.append(200)  # added during sync
+            return result
+
+        pages = PrefetchPageIterator(_fetch, 'api0', get_apis=lambda: ['api0', 'api1'])
+        self.assertEqual(self._iter_items(pages), collection.items)
+        self.assertTrue(pages.is_sequential)
+        self.assertEqual(collection.requests[-1], ('api0', 180))
@@ -0,0 +1,310 @@
+"""
+5 minute and hourly aggregates of sensor values, stored in EndpointSensorAggregate to avoid
+loading every single value for reports over longer time spans.
+
+Aggregates are updated when each value is stored. Values stored before aggregation was
+enabled are read from EndpointSensorValue until the endpoint has been backfilled, see
+SensorAggregateBackfill. Backfill only covers values before its ts_stop, buckets containing
+ts_stop are merged with the values added after it instead of being replaced. Raw values older than settings.SENSOR_VALUE_RETENTION_DAYS are
+deleted by the clean_sensor_values task, aggregates are kept.
+"""
+import logging
+from datetime import datetime, timedelta
+from time import monotonic
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest, Least
+from django.utils.timezone import localtime, now, utc
+
+from room_analytics.consts import SensorType
+from room_analytics.models import EndpointSensorAggregate, EndpointSensorValue, SensorAggregateBackfill
+
+logger = logging.getLogger(__name__)
+
+FIVE_MINUTES = 5 * 60
+HOUR = 60 * 60
+RESOLUTIONS = (HOUR, FIVE_MINUTES)  # coarsest first
+
+# Graphs use raw values for shorter time spans, and the finest resolution with fewer points
+RAW_MAX_SPAN = timedelta(days=1)
+MAX_POINTS = 2500
+
+# Head count when the endpoint couldn't count people
+UNKNOWN_HEAD_COUNT = -1
+
+# Hours to backfill per step, for each endpoint
+BACKFILL_HOURS = 24 * 7
+DELETE_CHUNK_SIZE = 5000
+
+SensorPoint = Tuple[int, datetime, int]  # endpoint_id, ts, value
+
+
+def floor_bucket(ts: datetime, resolution: int) -> datetime:
+    seconds = int(ts.timestamp())
+    return datetime.fromtimestamp(seconds - seconds % resolution, utc)
+
+
+def ceil_bucket(ts: datetime, resolution: int) -> datetime:
+    bucket = floor_bucket(ts, resolution)
+    return bucket if bucket == ts else bucket + timedelta(seconds=resolution)
+
+
+def get_retention_limit() -> Optional[datetime]:
+    days = getattr(settings, 'SENSOR_VALUE_RETENTION_DAYS', 0)
+    if not days:
+        return None
+    return floor_bucket(now() - timedelta(days=days), HOUR)
+
+
+def _is_included(value_type: int, value: int) -> bool:
+    return not (value_type == SensorType.HEAD_COUNT and value == UNKNOWN_HEAD_COUNT)
+
+
+def add_value(value: EndpointSensorValue):
+    """Add a newly stored value to the aggregate of each resolution"""
+    if not _is_included(value.value_type, value.value):
+        return
+
+    for resolution in RESOLUTIONS:
+        ts_bucket = floor_bucket(value.ts, resolution)
+        _add_to_bucket(value.endpoint_id, value.value_type, resolution, ts_bucket, [value.value, value.value, value.value, 1])
+
+
+def _add_to_bucket(endpoint_id: int, value_type: int, resolution: int, ts_bucket: datetime, values: List[int]):
+    """Merge ``values`` (min, max, sum, count) into the bucket"""
+    min_value, max_value, value_sum, count = values
+
+    bucket = EndpointSensorAggregate.objects.filter(
+        endpoint=endpoint_id, value_type=value_type, resolution=resolution, ts_bucket=ts_bucket
+    )
+
+    def _update():
+        return bucket.update(
+            min_value=Least('min_value', Value(min_value), output_field=models.SmallIntegerField()),
+            max_value=Greatest('max_value', Value(max_value), output_field=models.SmallIntegerField()),
+            value_sum=F('value_sum') + value_sum,
+            count=F('count') + count,
+        )
+
+    if _update():
+        return
+
+    try:
+        with transaction.atomic():
+            EndpointSensorAggregate.objects.create(
+                endpoint_id=endpoint_id,
+                value_type=value_type,
+                resolution=resolution,
+                ts_bucket=ts_bucket,
+                min_value=min_value,
+                max_value=max_value,
+                value_sum=value_sum,
+                count=count,
+            )
+    except IntegrityError:  # created by other process
+        _update()
+
+
+def rebuild_aggregates(endpoint_ids: Sequence[int], ts_start: datetime, ts_stop: datetime) -> int:
+    """
+    Recalculate aggregates for values from the hour of ``ts_start`` until ``ts_stop`` using the
+    raw values. Raw values must not have been deleted for the time span. Buckets containing
+    ``ts_stop`` are merged instead of replaced, since values after it are added by add_value.
+    Returns number of rows
+    """
+    ts_start = floor_bucket(ts_start, HOUR)
+
+    buckets: Dict[Tuple[int, int, int, datetime], List[int]] = {}
+
+    values = EndpointSensorValue._base_manager.filter(
+        endpoint__in=endpoint_ids, ts__gte=ts_start, ts__lt=ts_stop
+    ).values_list('endpoint', 'value_type', 'ts', 'value')
+
+    for endpoint_id, value_type, ts, value in values.iterator():
+        if not _is_included(value_type, value):
+            continue
+        for resolution in RESOLUTIONS:
+            key = (endpoint_id, value_type, resolution, floor_bucket(ts, resolution))
+            cur = buckets.get(key)
+            if cur is None:
+                buckets[key] = [value, value, value, 1]
+            else:
+                cur[0], cur[1] = min(cur[0], value), max(cur[1], value)
+                cur[2] += value
+                cur[3] += 1
+
+    rows = []
+    partial = []
+    for (endpoint_id, value_type, resolution, ts_bucket), values in buckets.items():
+        if ts_bucket >= floor_bucket(ts_stop, resolution):
+            partial.append((endpoint_id, value_type, resolution, ts_bucket, values))
+            continue
+        min_value, max_value, value_sum, count = values
+        rows.append(
+            EndpointSensorAggregate(
+                endpoint_id=endpoint_id,
+                value_type=value_type,
+                resolution=resolution,
+                ts_bucket=ts_bucket,
+                min_value=min_value,
+                max_value=max_value,
+                value_sum=value_sum,
+                count=count,
+            )
+        )
+
+    with transaction.atomic():
+        for resolution in RESOLUTIONS:
+            EndpointSensorAggregate.objects.filter(
+                endpoint__in=endpoint_ids,
+                resolution=resolution,
+                ts_bucket__gte=ts_start,
+                ts_bucket__lt=floor_bucket(ts_stop, resolution),
+            ).delete()
+        EndpointSensorAggregate.objects.bulk_create(rows)
+        for args in partial:
+            _add_to_bucket(*args)
+
+    return len(rows) + len(partial)
+
+
+def backfill_aggregates(max_seconds: float = None) -> int:
+    """
+    Calculate aggregates for values stored before aggregation was enabled, going back
+    ``BACKFILL_HOURS`` at a time for each endpoint. Returns number of remaining endpoints
+    """
+    time_start = monotonic()
+
+    for backfill in SensorAggregateBackfill.objects.order_by('-ts_stop'):
+        while True:
+            first_ts = (
+                EndpointSensorValue._base_manager.filter(endpoint=backfill.endpoint_id, ts__lt=backfill.ts_stop)
+                .order_by('ts')
+                .values_list('ts', flat=True)
+                .first()
+            )
+            if not first_ts:
+                backfill.delete()
+                break
+
+            ts_start = floor_bucket(max(first_ts, backfill.ts_stop - timedelta(hours=BACKFILL_HOURS)), HOUR)
+            with transaction.atomic():  # merged buckets must not be added twice
+                rebuild_aggregates([backfill.endpoint_id], ts_start, backfill.ts_stop)
+                backfill.ts_stop = ts_start
+                backfill.save(update_fields=['ts_stop'])
+
+            if max_seconds and monotonic() - time_start > max_seconds:
+                return SensorAggregateBackfill.objects.count()
+
+    return 0
+
+
+def delete_old_values(max_seconds: float = None) -> int:
+    """
+    Delete raw values older than settings.SENSOR_VALUE_RETENTION_DAYS, for endpoints with
+    complete aggregates. Returns number of deleted values
+    """
+    time_start = monotonic()
+
+    limit = get_retention_limit()
+    if not limit:
+        return 0
+
+    values = EndpointSensorValue._base_manager.filter(ts__lt=limit).exclude(
+        endpoint__in=SensorAggregateBackfill.objects.values_list('endpoint', flat=True)
+    )
+
+    deleted = 0
+    while True:
+        ids = list(values.order_by().values_list('id', flat=True)[:DELETE_CHUNK_SIZE])
+        if not ids:
+            break
+        deleted += EndpointSensorValue._base_manager.filter(id__in=ids).delete()[0]
+        if max_seconds and monotonic() - time_start > max_seconds:
+            break
+
+    if deleted:
+        logger.info('Deleted %s sensor values before %s', deleted, limit)
+    return deleted
+
+
+def select_resolution(ts_start: datetime, ts_stop: datetime, max_resolution: int) -> Optional[int]:
+    """
+    Coarsest resolution up to ``max_resolution`` seconds, with buckets aligned to local time
+    and at least one whole bucket between ``ts_start`` and ``ts_stop``
+    """
+    for resolution in RESOLUTIONS:
+        if resolution > max_resolution:
+            continue
+        if any(localtime(ts).utcoffset().total_seconds() % resolution for ts in (ts_start, ts_stop)):
+            continue
+        if ceil_bucket(ts_start, resolution) < floor_bucket(ts_stop, resolution):
+            return resolution
+    return None
+
+
+def get_graph_resolution(ts_start: datetime, ts_stop: datetime) -> int:
+    """
+    Max resolution to show values between ``ts_start`` and ``ts_stop`` in a line graph
+    """
+    limit = get_retention_limit()
+    if ts_stop - ts_start <= RAW_MAX_SPAN and not (limit and ts_start < limit):
+        return 0
+
+    span = (ts_stop - ts_start).total_seconds()
+    for resolution in reversed(RESOLUTIONS):
+        if span / resolution <= MAX_POINTS:
+            return resolution
+    return RESOLUTIONS[0]
+
+
+def get_values(
+    endpoint_ids: Sequence[int],
+    value_type: SensorType,
+    ts_start: datetime,
+    ts_stop: datetime,
+    max_resolution: int = 0,
+    aggregate='max_value',
+) -> List[SensorPoint]:
+    """
+    Values between ``ts_start`` and ``ts_stop`` (inclusive) ordered by time. Whole buckets of
+    the coarsest available resolution up to ``max_resolution`` seconds are loaded from the
+    aggregates, with the start of the bucket as time and ``aggregate`` as value
+    """
+    raw = EndpointSensorValue._base_manager.filter(endpoint__in=endpoint_ids, value_type=value_type)
+    if value_type == SensorType.HEAD_COUNT:
+        raw = raw.exclude(value=UNKNOWN_HEAD_COUNT)
+
+    resolution = select_resolution(ts_start, ts_stop, max_resolution)
+    if not resolution:
+        return list(raw.filter(ts__gte=ts_start, ts__lte=ts_stop).order_by('ts').values_list('endpoint', 'ts', 'value'))
+
+    agg_start, agg_stop = ceil_bucket(ts_start, resolution), floor_bucket(ts_stop, resolution)
+
+    raw_cond = Q(ts__gte=ts_start, ts__lt=agg_start) | Q(ts__gte=agg_stop, ts__lte=ts_stop)
+    exclude_cond = Q()
+
+    pending = SensorAggregateBackfill.objects.filter(endpoint__in=endpoint_ids, ts_stop__gt=agg_start)
+    for endpoint_id, backfill_stop in pending.values_list('endpoint', 'ts_stop'):
+        backfill_stop = min(ceil_bucket(backfill_stop, resolution), agg_stop)
+        raw_cond |= Q(endpoint=endpoint_id, ts__gte=agg_start, ts__lt=backfill_stop)
+        exclude_cond |= Q(endpoint=endpoint_id, ts_bucket__lt=backfill_stop)
+
+    aggregates = EndpointSensorAggregate.objects.filter(
+        endpoint__in=endpoint_ids,
+        value_type=value_type,
+        resolution=resolution,
+        ts_bucket__gte=agg_start,
+        ts_bucket__lt=agg_stop,
+    )
+    if exclude_cond:
+        aggregates = aggregates.exclude(exclude_cond)
+
+    result: List[SensorPoint] = list(raw.filter(raw_cond).values_list('endpoint', 'ts', 'value'))
+    result.extend(aggregates.values_list('endpoint', 'ts_bucket', aggregate))
+    result.sort(key=lambda point: point[1])
+    return result
+
@@ -0,0 +1,56 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils.timezone import now
+
+
+def add_backfill(apps, schema_editor):
+    """Values already stored are not aggregated, see room_analytics.downsample"""
+    EndpointSensorValue = apps.get_model('room_analytics', 'EndpointSensorValue')
+    SensorAggregateBackfill = apps.get_model('room_analytics', 'SensorAggregateBackfill')
+
+    # values after this are aggregated when stored, backfill must not overlap with them
+    ts_stop = now()
+
+    endpoint_ids = EndpointSensorValue._base_manager.order_by().values_list('endpoint', flat=True).distinct()
+    SensorAggregateBackfill.objects.bulk_create(
+        [SensorAggregateBackfill(endpoint_id=endpoint_id, ts_stop=ts_stop) for endpoint_id in endpoint_ids]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('endpoint', '0081_add_session_expires'),
+        ('room_analytics', '0003_migrate_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EndpointSensorAggregate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('value_type', models.SmallIntegerField(choices=[(0, 'HEAD_COUNT'), (1, 'PRESENCE'), (5, 'TEMPERATURE'), (10, 'HUMIDITY'), (20, 'AIR_QUALITY')])),
+                ('resolution', models.IntegerField()),
+                ('ts_bucket', models.DateTimeField()),
+                ('min_value', models.SmallIntegerField(default=0)),
+                ('max_value', models.SmallIntegerField(default=0)),
+                ('value_sum', models.IntegerField(default=0)),
+                ('count', models.IntegerField(default=0)),
+                ('endpoint', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, to='endpoint.Endpoint')),
+            ],
+            options={
+                'unique_together': {('endpoint', 'value_type', 'resolution', 'ts_bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SensorAggregateBackfill',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('ts_stop', models.DateTimeField()),
+                ('endpoint', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='endpoint.Endpoint')),
+            ],
+        ),
+        migrations.RunPython(add_backfill, migrations.RunPython.noop),
+    ]
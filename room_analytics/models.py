@@ -89,7 +89,12 @@ class EndpointSensorValue(models.Model):
 
         if not self.customer and self.endpoint.customer:
             self.customer = self.endpoint.customer
+
+        is_new = self.pk is None
         super().save(*args, **kwargs)
+        if is_new:
+            from room_analytics.downsample import add_value
+            add_value(self)
         self.update_endpoint_status()
 
     def update_endpoint_status(self):
@@ -186,6 +191,38 @@ class EndpointRoomPresence(EndpointSensorValue):
         proxy = True
 
 
+class EndpointSensorAggregate(models.Model):
+    """
+    Min/max/sum of sensor values per 5 minute or hourly UTC bucket. See room_analytics.downsample
+    """
+
+    endpoint = models.ForeignKey(Endpoint, db_constraint=False, on_delete=models.DO_NOTHING, db_index=False)
+    value_type = models.SmallIntegerField(choices=[(t.value, t.name) for t in SensorType])
+    resolution = models.IntegerField()  # seconds
+    ts_bucket = models.DateTimeField()
+
+    min_value = models.SmallIntegerField(default=0)
+    max_value = models.SmallIntegerField(default=0)
+    value_sum = models.IntegerField(default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('endpoint', 'value_type', 'resolution', 'ts_bucket')
+
+    @property
+    def avg_value(self) -> float:
+        return self.value_sum / self.count if self.count else 0
+
+
+class SensorAggregateBackfill(models.Model):
+    """
+    Values stored before ``ts_stop`` are not included in EndpointSensorAggregate yet
+    """
+
+    endpoint = models.OneToOneField(Endpoint, db_constraint=False, on_delete=models.DO_NOTHING)
+    ts_stop = models.DateTimeField()
+
+
 class EndpointOldHeadCount(models.Model):
 
     ts = models.DateTimeField(default=localtime, db_index=True)
@@ -1,4 +1,4 @@
-from typing import Optional, Union
+from typing import Dict, Optional, Union
 from xml.etree.ElementTree import Element
 
 from endpoint.ext_api.parser.cisco_ce import NestedXMLResult
@@ -52,32 +52,31 @@ def parse_cisco_ce(status_root: Union[Element, NestedXMLResult]):
 
 
 def store_cisco_ce(status_root: Union[Element, NestedXMLResult], endpoint: Endpoint):
+    store_values(parse_cisco_ce(status_root), endpoint)
+
+
+def store_values(values: Dict[str, Optional[Union[bool, int]]], endpoint: Endpoint):
+    """Store samples from values parsed using e.g. parse_cisco_ce"""
 
     from . import models
 
-    presence = _try_bool(status_root.findtext('./RoomAnalytics/PeoplePresence', None))
+    presence = values.get('presence')
     if presence is not None:
         models.EndpointRoomPresence.objects.create(endpoint=endpoint, value=1 if presence else 0)
 
-    head_count = _try_int(status_root.findtext('./RoomAnalytics/PeopleCount/Current', None))
+    head_count = values.get('head_count')
     if head_count is not None:
         if head_count >= 0:  # TODO: What does -1 mean?
             models.EndpointHeadCount.objects.create(endpoint=endpoint, value=head_count)
 
-    temperature = _try_int(
-        status_root.findtext('./Peripherals/ConnectedDevice/RoomAnalytics/AmbientTemperature', None)
-    )
+    temperature = values.get('temperature')
     if temperature is not None:
         models.EndpointTemperature.objects.create(endpoint=endpoint, value=temperature)
 
-    humidity = _try_int(
-        status_root.findtext('./Peripherals/ConnectedDevice/RoomAnalytics/RelativeHumidity', None)
-    )
+    humidity = values.get('humidity')
     if humidity is not None:
         models.EndpointHumidity.objects.create(endpoint=endpoint, value=humidity)
 
-    air_quality = _try_int(
-        status_root.findtext('./Peripherals/ConnectedDevice/RoomAnalytics/AirQuality/Index', None)
-    )
+    air_quality = values.get('air_quality')
     if air_quality is not None:
         models.EndpointAirQuality.objects.create(endpoint=endpoint, value=air_quality)
@@ -0,0 +1,11 @@
+from celery import Task
+
+from conferencecenter.celery import app
+
+
+@app.task(bind=True)
+def clean_sensor_values(self: Task):
+    from room_analytics.downsample import backfill_aggregates, delete_old_values
+
+    backfill_aggregates(max_seconds=20)
+    delete_old_values(max_seconds=20)
@@ -0,0 +1,136 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+from room_analytics import downsample
+from room_analytics.consts import SensorType
+from room_analytics.models import EndpointHeadCount, EndpointSensorAggregate, EndpointSensorValue, SensorAggregateBackfill
+from room_analytics.utils.report import GroupedHeadCountStats, get_head_count_values
+
+from .test_stats import PeopleCountTestBase
+
+
+class DownsampleTestCase(PeopleCountTestBase):
+
+    def _get_hourly(self):
+        return {
+            (row.value_type, row.ts_bucket): (row.min_value, row.max_value, row.value_sum, row.count)
+            for row in EndpointSensorAggregate.objects.filter(endpoint=self.endpoint, resolution=downsample.HOUR)
+        }
+
+    def _get_grouped(self, by='date'):
+        return GroupedHeadCountStats([self.endpoint], self.ts_start, self.ts_stop).bucket_endpoint_head_counts(by)
+
+    def test_aggregates(self):
+        hourly = self._get_hourly()
+        self.assertEqual(len(hourly), len(self.all_hours) * 2)
+
+        for i, ts in enumerate(self.all_hours):
+            self.assertEqual(hourly[(SensorType.HEAD_COUNT, ts)], (i % 8, i % 8 + 2, 2 * (i % 8) + 2, 2))
+            self.assertEqual(hourly[(SensorType.PRESENCE, ts)], (1, 1, 1, 1))
+
+        self.assertEqual(
+            EndpointSensorAggregate.objects.filter(resolution=downsample.FIVE_MINUTES, value_type=SensorType.HEAD_COUNT).count(),
+            len(self.all_hours) * 2,
+        )
+
+        EndpointHeadCount.objects.create(endpoint=self.endpoint, value=-1, ts=self.all_hours[0])
+        EndpointHeadCount.objects.create(endpoint=self.endpoint, value=20, ts=self.all_hours[0] + timedelta(minutes=59))
+        self.assertEqual(self._get_hourly()[(SensorType.HEAD_COUNT, self.all_hours[0])], (0, 20, 22, 3))
+
+        # hourly head count and presence, 5 minute head count at :00, :30, :55 and presence
+        self.assertEqual(
+            downsample.rebuild_aggregates([self.endpoint.pk], self.ts_start, self.all_hours[-1] + timedelta(hours=1)),
+            len(self.all_hours) * 5 + 1,
+        )
+        self.assertEqual(self._get_hourly()[(SensorType.HEAD_COUNT, self.all_hours[0])], (0, 20, 22, 3))
+
+    def test_report_same_as_raw(self):
+        with CaptureQueriesContext(connection) as queries:
+            values = get_head_count_values([self.endpoint], self.ts_start, self.ts_stop, max_resolution=downsample.HOUR)
+        self.assertEqual(len(queries), 3)  # backfill, raw values at edges, aggregates
+        self.assertEqual(len(values[0].x), len(self.all_hours))
+
+        for by in ('date', 'day', 'hour'):
+            expected = self._get_grouped(by)
+            with patch.object(downsample, 'select_resolution', return_value=None):
+                self.assertEqual(self._get_grouped(by), expected)
+
+    def test_select_resolution(self):
+        ts = self.all_hours[0]
+        self.assertEqual(downsample.select_resolution(ts, ts + timedelta(hours=2), downsample.HOUR), downsample.HOUR)
+        self.assertEqual(downsample.select_resolution(ts, ts + timedelta(hours=2), downsample.FIVE_MINUTES), downsample.FIVE_MINUTES)
+        self.assertEqual(downsample.select_resolution(ts, ts + timedelta(minutes=30), downsample.HOUR), downsample.FIVE_MINUTES)
+        self.assertIsNone(downsample.select_resolution(ts, ts + timedelta(minutes=30), 0))
+
+        self.assertEqual(downsample.get_graph_resolution(ts, ts + timedelta(hours=3)), 0)
+        self.assertEqual(downsample.get_graph_resolution(ts, ts + timedelta(days=3)), downsample.FIVE_MINUTES)
+        self.assertEqual(downsample.get_graph_resolution(ts, ts + timedelta(days=30)), downsample.HOUR)
+
+        # partial hours at start and end are loaded from raw values
+        ts_start = self.all_hours[1] + timedelta(minutes=20)
+        ts_stop = self.all_hours[4] + timedelta(minutes=40)
+        values = downsample.get_values([self.endpoint.pk], SensorType.HEAD_COUNT, ts_start, ts_stop, downsample.HOUR)
+        self.assertEqual(
+            [(ts, value) for _endpoint_id, ts, value in values],
+            [(self.all_hours[1] + timedelta(minutes=30), 3)]
+            + [(self.all_hours[i], i % 8 + 2) for i in (2, 3)]
+            + [(self.all_hours[4], 4), (self.all_hours[4] + timedelta(minutes=30), 6)],
+        )
+
+    def test_backfill(self):
+        expected = self._get_grouped()
+        hourly = self._get_hourly()
+
+        EndpointSensorAggregate.objects.all().delete()
+        SensorAggregateBackfill.objects.create(endpoint=self.endpoint, ts_stop=self.all_hours[-1] + timedelta(hours=1))
+
+        # not backfilled yet, read from raw values
+        self.assertEqual(self._get_grouped(), expected)
+
+        with patch.object(downsample, 'BACKFILL_HOURS', 48):
+            self.assertEqual(downsample.backfill_aggregates(max_seconds=0.0001), 1)
+            self.assertEqual(self._get_grouped(), expected)
+            self.assertEqual(downsample.backfill_aggregates(), 0)
+
+        self.assertFalse(SensorAggregateBackfill.objects.exists())
+        self.assertEqual(self._get_hourly(), hourly)
+        self.assertEqual(self._get_grouped(), expected)
+
+    def test_backfill_partial_hour(self):
+        hourly = self._get_hourly()
+        ts_stop = self.all_hours[-1] + timedelta(minutes=20)
+
+        # values after ts_stop are added when stored, hour of ts_stop is merged with them
+        EndpointSensorAggregate.objects.all().delete()
+        for value in EndpointSensorValue._base_manager.filter(ts__gte=ts_stop):
+            downsample.add_value(value)
+        SensorAggregateBackfill.objects.create(endpoint=self.endpoint, ts_stop=ts_stop)
+
+        self.assertEqual(downsample.backfill_aggregates(), 0)
+        self.assertEqual(self._get_hourly(), hourly)
+
+    def test_retention(self):
+        expected = self._get_grouped()
+        raw_count = EndpointSensorValue._base_manager.count()
+
+        self.assertEqual(downsample.delete_old_values(), 0)
+
+        with override_settings(SENSOR_VALUE_RETENTION_DAYS=3):
+            limit = downsample.get_retention_limit()
+            old_count = EndpointSensorValue._base_manager.filter(ts__lt=limit).count()
+            self.assertGreater(old_count, 0)
+
+            backfill = SensorAggregateBackfill.objects.create(endpoint=self.endpoint, ts_stop=now())
+            self.assertEqual(downsample.delete_old_values(), 0)
+            backfill.delete()
+
+            self.assertEqual(downsample.delete_old_values(), old_count)
+            self.assertEqual(EndpointSensorValue._base_manager.count(), raw_count - old_count)
+
+            self.assertEqual(self._get_grouped(), expected)
+            self.assertEqual(downsample.get_graph_resolution(limit - timedelta(hours=2), limit), downsample.FIVE_MINUTES)
@@ -3,6 +3,8 @@ from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from os import path
 
 from django.utils.dateparse import parse_datetime
@@ -15,7 +17,9 @@ from room_analytics.utils.report import GroupedHeadCountStats
 from room_analytics.utils.time import get_hours_between
 from endpoint import consts
 from endpoint.models import Endpoint, EndpointMeetingParticipant
-from room_analytics.models import EndpointHeadCount, EndpointRoomPresence
+from room_analytics.consts import SensorType
+from room_analytics.models import EndpointAirQuality, EndpointHeadCount, EndpointRoomPresence
+from room_analytics.utils.sensor_index import SensorValueIndex
 
 root = path.dirname(path.abspath(__file__))
 
@@ -182,3 +186,94 @@ class TestEndpointStats(APITestCase, PeopleCountTestBase):
         self.assertNotEquals(no_fill_missing['data'][0]['x'], no_fill_full['data'][0]['x'])
         self.assertNotEquals(no_fill_missing['data'][0]['y'], no_fill_full['data'][0]['y'])
 
+
+
+class SensorValueIndexTestCase(PeopleCountTestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.endpoint2 = Endpoint.objects.create(customer=self.customer, manufacturer=consts.MANUFACTURER.CISCO_CE,
+                                                 mac_address='11:22:33:44:55:77')
+        for i, ts in enumerate(self.all_hours[:48]):
+            EndpointAirQuality.objects.create(endpoint=self.endpoint, value=i % 5, ts=ts + timedelta(minutes=i % 50))
+            if i % 3:
+                EndpointHeadCount.objects.create(endpoint=self.endpoint2, value=i % 4, ts=ts + timedelta(minutes=20))
+
+    def _get_ranges(self):
+        result = []
+        for i, ts in enumerate(self.all_hours[:60]):
+            for start_offset, duration in ((0, 10), (-61, 30), (15, 90), (30, 1), (45, 240)):
+                ts_start = ts + timedelta(minutes=start_offset + i % 7)
+                result.append((self.endpoint if i % 2 else self.endpoint2, ts_start, ts_start + timedelta(minutes=duration)))
+        return result
+
+    def test_same_as_queryset(self):
+        ranges = self._get_ranges()
+        with CaptureQueriesContext(connection) as queries:
+            index = SensorValueIndex((endpoint.pk, ts_start, ts_stop) for endpoint, ts_start, ts_stop in ranges)
+        self.assertEqual(len(queries), 1)
+
+        found = 0
+        for model in (EndpointHeadCount, EndpointAirQuality, EndpointRoomPresence):
+            for endpoint, ts_start, ts_stop in ranges:
+                expected = model.objects.get_for_time(endpoint, ts_start, ts_stop)
+                self.assertEqual(index.get_for_time(model._value_type, endpoint.pk, ts_start, ts_stop), expected,
+                                 (model, endpoint, ts_start, ts_stop))
+                found += expected is not None
+        self.assertGreater(found, len(ranges))
+
+        self.assertFalse(index.covers(self.endpoint.pk, self.ts_start - timedelta(days=1), self.ts_start))
+        with self.assertRaises(KeyError):
+            index.get_for_time(SensorType.HEAD_COUNT, self.endpoint.pk + 100, self.ts_start, self.ts_stop)
+
+    def _get_legs(self):
+        from statistics.models import Leg
+
+        server = self.customer.get_api().cluster.get_statistics_server()
+        return [
+            Leg(server=server, endpoint=endpoint, ts_start=ts_start, ts_stop=ts_stop)
+            for endpoint, ts_start, ts_stop in self._get_ranges()[:40]
+        ]
+
+    def test_leg_save(self):
+        from statistics.models import Leg
+
+        def _save(legs, prefetch):
+            with CaptureQueriesContext(connection) as queries:
+                if prefetch:
+                    Leg.prefetch_sensor_values(legs)
+                for leg in legs:
+                    leg.save()
+            return [q for q in queries if 'endpointsensorvalue' in q['sql']]
+
+        legs = self._get_legs()
+        queries = _save(legs, prefetch=False)
+        self.assertEqual(len(queries), 40 * 3 * 2)
+
+        prefetched_legs = self._get_legs()
+        queries = _save(prefetched_legs, prefetch=True)
+        self.assertEqual(len(queries), 1)
+
+        fields = ('head_count', 'air_quality', 'presence')
+        self.assertEqual(
+            [[getattr(leg, f) for f in fields] for leg in legs],
+            [[getattr(leg, f) for f in fields] for leg in prefetched_legs],
+        )
+
+        # changed time, outside prefetched range
+        leg = prefetched_legs[0]
+        leg.ts_stop = leg.ts_stop + timedelta(days=30)
+        self.assertEqual(len(_save([leg], prefetch=False)), 6)
+
+    def test_rewrite(self):
+        from statistics.cleanup import rewrite_room_analytics
+        from statistics.models import Leg
+
+        legs = self._get_legs()
+        for leg in legs:
+            leg.save()
+        expected = sorted(Leg.objects.values_list('id', 'head_count', 'air_quality', 'presence'))
+
+        Leg.objects.update(head_count=None, air_quality=None, presence=None)
+        self.assertEqual(rewrite_room_analytics(chunk_size=15), sum(1 for row in expected if row[1:] != (None, None, None)))
+        self.assertEqual(sorted(Leg.objects.values_list('id', 'head_count', 'air_quality', 'presence')), expected)
@@ -2,13 +2,14 @@ import dataclasses
 from collections import defaultdict
 from dataclasses import dataclass
 from datetime import timedelta, datetime
-from typing import Iterable, Tuple, List, Sequence, Dict, Union, Iterator, TYPE_CHECKING, Any
+from typing import Iterable, Tuple, List, Sequence, Dict, Union, Iterator, TYPE_CHECKING, Any, Optional
 
 from django.db.models import QuerySet
 from django.utils.timezone import localtime
 from typing_extensions import DefaultDict
 
-from room_analytics.models import EndpointHeadCount
+from room_analytics import downsample
+from room_analytics.consts import SensorType
 from room_analytics.graph import get_layout, get_graph
 from endpoint.consts import DEFAULT_CAPACITY
 from room_analytics.utils.timebucket import BucketType, Bucket, BUCKET_TYPES
@@ -38,9 +39,12 @@ def get_head_count_values(
     ts_start: datetime,
     ts_stop: datetime,
     as_percent=False,
+    max_resolution: Optional[int] = None,
 ) -> List[EndpointHeadCountData]:
     """
-    Get all values between `ts_start` and `ts_stop` grouped by endpoint
+    Get all values between `ts_start` and `ts_stop` grouped by endpoint. Values may be
+    downsampled to max value per bucket of up to `max_resolution` seconds, default depending
+    on the length of the time span
     """
 
     if not isinstance(endpoints, QuerySet):
@@ -50,12 +54,13 @@ def get_head_count_values(
 
     endpoints_data = {e.pk: e for e in endpoint_values}
 
-    head_count = EndpointHeadCount.objects.filter(ts__gte=ts_start, ts__lte=ts_stop, endpoint__in=endpoints)
+    if max_resolution is None:
+        max_resolution = downsample.get_graph_resolution(ts_start, ts_stop)
 
     points: DefaultDict[int, Points] = defaultdict(lambda: Points([], []))
 
-    head_counts: Sequence[Tuple[int, datetime, int]] = list(
-        head_count.order_by('ts').exclude(value=-1).values_list('endpoint', 'ts', 'value')
+    head_counts: Sequence[Tuple[int, datetime, int]] = downsample.get_values(
+        list(endpoints_data), SensorType.HEAD_COUNT, ts_start, ts_stop, max_resolution=max_resolution
     )
 
     for endpoint_id, ts, count in head_counts:
@@ -103,7 +108,10 @@ class GroupedHeadCountStats:
         self.cached = {}
 
     def get_values(self) -> List[EndpointHeadCountData]:
-        return get_head_count_values(self.endpoints, self.ts_start, self.ts_stop, as_percent=False)
+        # all buckets use max value per hour or longer
+        return get_head_count_values(
+            self.endpoints, self.ts_start, self.ts_stop, as_percent=False, max_resolution=downsample.HOUR
+        )
 
     @staticmethod
     def _split_int_ranges_str(value_str: Union[Sequence[int], str]) -> List[int]:
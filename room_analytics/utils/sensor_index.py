@@ -0,0 +1,80 @@
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.db.models import Q
+
+from room_analytics.consts import SensorType
+from room_analytics.models import EndpointSensorValue
+
+# Aggregate used by the proxy model managers, e.g. EndpointAirQuality.objects
+VALUE_TYPES = {
+    SensorType.HEAD_COUNT: max,
+    SensorType.AIR_QUALITY: min,
+    SensorType.PRESENCE: max,
+}
+
+# get_qs_for_time() includes values up to this long before start
+LOOKBEHIND = timedelta(hours=1)
+
+
+class SensorValueIndex:
+    """
+    Sensor values for multiple endpoints and time ranges, loaded using a single query.
+    get_for_time() gives the same result as EndpointSensorValueManager.get_for_time()
+    for ranges inside the loaded ranges
+    """
+
+    def __init__(self, ranges: Iterable[Tuple[int, datetime, datetime]], value_types: Sequence[SensorType] = None):
+
+        self.value_types = list(value_types or VALUE_TYPES)
+        self.ranges: Dict[int, Tuple[datetime, datetime]] = {}
+
+        for endpoint_id, ts_start, ts_stop in ranges:
+            if endpoint_id in self.ranges:
+                cur_start, cur_stop = self.ranges[endpoint_id]
+                ts_start, ts_stop = min(ts_start, cur_start), max(ts_stop, cur_stop)
+            self.ranges[endpoint_id] = (ts_start, ts_stop)
+
+        self.ts: Dict[Tuple[int, int], List[datetime]] = defaultdict(list)
+        self.values: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+
+        if self.ranges:
+            self._load()
+
+    def _load(self):
+        cond = Q()
+        for endpoint_id, (ts_start, ts_stop) in self.ranges.items():
+            cond |= Q(endpoint=endpoint_id, ts__gt=ts_start - LOOKBEHIND, ts__lt=ts_stop)
+
+        rows = (
+            EndpointSensorValue._base_manager.filter(cond, value_type__in=self.value_types)
+            .order_by('ts')
+            .values_list('endpoint_id', 'value_type', 'ts', 'value')
+        )
+        for endpoint_id, value_type, ts, value in rows.iterator():
+            self.ts[(endpoint_id, value_type)].append(ts)
+            self.values[(endpoint_id, value_type)].append(value)
+
+    def covers(self, endpoint_id: int, ts_start: datetime, ts_stop: datetime) -> bool:
+        loaded = self.ranges.get(endpoint_id)
+        return bool(loaded) and loaded[0] <= ts_start and ts_stop <= loaded[1]
+
+    def get_for_time(self, value_type: SensorType, endpoint_id: int, ts_start: datetime, ts_stop: datetime) -> Optional[int]:
+        if not self.covers(endpoint_id, ts_start, ts_stop):
+            raise KeyError('Range not loaded for endpoint {}'.format(endpoint_id))
+
+        ts = self.ts.get((endpoint_id, value_type))
+        if not ts:
+            return None
+
+        first = bisect_left(ts, ts_start)
+        if first and ts[first - 1] > ts_start - LOOKBEHIND:
+            # last value before start is still active. include all values with the same timestamp
+            first = bisect_left(ts, ts[first - 1])
+
+        values = self.values[(endpoint_id, value_type)][first:bisect_left(ts, ts_stop)]
+        if not values:
+            return None
+        return VALUE_TYPES[value_type](values)
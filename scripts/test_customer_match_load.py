@@ -0,0 +1,80 @@
+import os
+import sys
+from time import perf_counter
+
+import django
+
+'''
+Compare CustomerMatchIndex lookups with looping over all CustomerMatch rules
+
+    python test_customer_match_load.py [rule count]
+'''
+
+
+def get_synthetic_matchers(count):
+    "Unsaved matchers of all kinds, ordered by priority"
+    from customer.models import CustomerMatch
+
+    matchers = []
+    for i in range(count):
+        kind = i % 5
+        if kind == 0:
+            m = CustomerMatch(prefix_match='p{}.'.format(i))
+        elif kind == 1:
+            m = CustomerMatch(suffix_match='@s{}.example.org'.format(i))
+        elif kind == 2:
+            m = CustomerMatch(prefix_match='b{}'.format(i), suffix_match='.org')
+        elif kind == 3:
+            m = CustomerMatch(prefix_match='e{}'.format(i), suffix_match='.e{}'.format(i), match_mode=CustomerMatch.EITHER)
+        else:
+            m = CustomerMatch(regexp_match=r'r{}[0-9]+@.*'.format(i))
+        m.pk = i + 1
+        m.priority = 10 - (i % 3)
+        matchers.append(m)
+    matchers.sort(key=lambda m: (m.priority, m.pk))
+    return matchers
+
+
+def get_synthetic_needles(count, samples=100):
+    "Texts matching some of the matchers from get_synthetic_matchers(count)"
+    result = ['nomatch@example.org', 'b2.example.org', 'x.e3', '(invalid']
+    for i in range(0, count, max(1, count // samples)):
+        result.extend([
+            'p{}.room@example.org'.format(i),
+            'room@s{}.example.org'.format(i),
+            'b{}room@example.org'.format(i),
+            'e{}@example.com'.format(i),
+            'room.e{}'.format(i),
+            'R{}123@example.org'.format(i),
+        ])
+    return result
+
+
+def run(count=10000):
+    from customer.match_index import CustomerMatchIndex
+
+    matchers = get_synthetic_matchers(count)
+    needles = [n.lower() for n in get_synthetic_needles(count, samples=5)]
+
+    start = perf_counter()
+    index = CustomerMatchIndex(matchers)
+    build_time = perf_counter() - start
+
+    start = perf_counter()
+    index_result = [index.get_match(n) for n in needles]
+    index_time = perf_counter() - start
+
+    start = perf_counter()
+    loop_result = [next((m for m in matchers if m.match(n)), None) for n in needles]
+    loop_time = perf_counter() - start
+
+    assert index_result == loop_result
+    print('CustomerMatch {} rules, {} lookups: index {:.3f}s (build {:.3f}s), loop {:.3f}s'.format(
+        count, len(needles), index_time, build_time, loop_time))
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'conferencecenter.settings')
+    django.setup()
+    run(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,118 @@
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter
+from unittest.mock import patch
+
+import django
+
+'''
+Compare report calculations using numpy columns (statistics.utils.leg_columns) with the
+plain python implementation, for synthetic legs
+
+    python test_leg_columns_load.py [leg count]
+'''
+
+
+def get_synthetic_legs(count, seed=1):
+    "Legs ordered by ts_start, with aligned and unaligned times, microseconds and a DST change"
+    from django.utils.timezone import get_current_timezone, make_aware
+
+    from statistics.types import LegData, LegRelatedTitles
+
+    rand = random.Random(seed)
+    timezone = get_current_timezone()
+
+    ts = make_aware(datetime(2021, 3, 28, 0, 0))
+    targets = ['user{}@example.org'.format(i) for i in range(50)] + ['']
+    ous = ['ou{}'.format(i) for i in range(5)] + ['']
+    tenants = ['tenant{}'.format(i) for i in range(3)] + ['']
+
+    legs = []
+    for i in range(count):
+        ts += timedelta(seconds=rand.choice([0, 1, 30, 60, 60 * 10]) * rand.random())
+        ts_start = ts
+        if i % 7 == 0:
+            ts_start = ts_start.replace(minute=0, second=0, microsecond=0 if i % 14 else 500000)
+
+        duration = rand.choice([1, 59, 60 * 60, 2 * 60 * 60, 26 * 60 * 60]) * rand.random() + (i % 3)
+        ts_stop = ts_start + timedelta(seconds=duration)
+        if i % 11 == 0:
+            ts_stop = ts_stop.replace(minute=0, second=0, microsecond=0)
+            if ts_stop <= ts_start:
+                ts_stop += timedelta(hours=1)
+
+        target, ou, tenant = rand.choice(targets), rand.choice(ous), rand.choice(tenants)
+        org_unit = rand.choice([None, 1, 2])
+
+        leg = LegData(
+            i,
+            ts_start.astimezone(timezone),
+            ts_stop.astimezone(timezone),
+            int((ts_stop - ts_start).total_seconds()),
+            target,
+            tenant,
+            ou,
+            rand.choice(['', 'cospace1', 'cospace2']),
+            'guid{}'.format(i),
+            '',
+            rand.randint(0, count // 3),
+            bool(i % 5 == 0),
+            org_unit,
+            '',
+            '',
+            None,
+            None,
+        )
+        leg.titles = LegRelatedTitles(
+            target,
+            leg.call__cospace_id or 'cospace',
+            tenant or 'Default',
+            ou or 'unknown',
+            'unit{}'.format(org_unit) if org_unit else 'unknown',
+        )
+        legs.append(leg)
+
+    legs.sort(key=lambda leg: leg.ts_start)
+    return legs
+
+
+def run(count=10000):
+    from statistics.utils import leg_columns
+    from statistics.utils.leg_collection import LegCollection, LegCollectionRelatedData
+
+    assert leg_columns.is_available(), 'numpy is not installed'
+
+    legs = get_synthetic_legs(count, seed=2)
+    related_data = LegCollectionRelatedData(units={}, users={})
+
+    collection = LegCollection(legs, related_data=related_data)
+    collection.columns = None
+    columnar = LegCollection(legs, related_data=related_data)
+
+    benchmarks = [
+        ('get_grouped_call_stats_per__hour', {}),
+        ('grouped_legs_count_for_chunks', {}),
+        ('grouped_legs_count_for_chunks', {'resolution_seconds': 60}),
+    ]
+    for name, kwargs in benchmarks:
+        start = perf_counter()
+        with patch.object(leg_columns, 'is_available', return_value=False):
+            result = getattr(collection, name)(**kwargs)
+        python_time = perf_counter() - start
+
+        start = perf_counter()
+        columnar.columns = leg_columns.LegColumns(columnar.legs)
+        columnar_result = getattr(columnar, name)(**kwargs)
+        columnar_time = perf_counter() - start
+
+        assert result == columnar_result, name
+        print('{}{}: {} legs, {:.2f}s -> {:.2f}s'.format(name, kwargs or '', len(legs), python_time, columnar_time))
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'conferencecenter.settings')
+    django.setup()
+    run(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,56 @@
+import os
+import sys
+from time import perf_counter
+
+import django
+
+'''
+Time policy service requests for existing conference aliases, without network
+
+    python test_policy_load.py [cluster id] [request count]
+'''
+
+
+def run(cluster_id=None, request_count=200):
+    from django.test import RequestFactory
+
+    from datastore.models.pexip import ConferenceAlias
+    from policy import views
+    from policy.models import ClusterPolicy
+
+    policies = ClusterPolicy.objects.all()
+    if cluster_id:
+        policies = policies.filter(cluster=cluster_id)
+    policy = policies.first()
+
+    aliases = list(
+        ConferenceAlias.objects.filter(provider=policy.cluster, is_active=True, conference__is_active=True)
+        .values_list('alias', flat=True)[:1000]
+    )
+    assert aliases, 'No conference aliases for cluster {}'.format(policy.cluster_id)
+
+    rf = RequestFactory()
+    params = {
+        'protocol': 'sip',
+        'call_direction': 'dial_in',
+        'remote_alias': 'sip:alice@example.com',
+        'remote_display_name': 'Alice',
+        'trigger': 'invite',
+    }
+
+    start = perf_counter()
+    for i in range(request_count):
+        request = rf.get('/', {**params, 'local_alias': aliases[(i * 7) % len(aliases)]})
+        response = views.policy_service_response(request, secret_key=policy.secret_key)
+        assert response.status_code == 200, response.content
+    duration = perf_counter() - start
+
+    print('Policy service: {} requests in {:.2f}s, {:.1f} ms/request'.format(
+        request_count, duration, duration / request_count * 1000))
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'conferencecenter.settings')
+    django.setup()
+    run(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,59 @@
+import os
+import sys
+import tracemalloc
+from tempfile import TemporaryFile
+
+import django
+
+'''
+Compare peak memory for streamed and fully loaded debug statistics exports of existing legs
+
+    python test_stats_export_load.py [server id] [leg count]
+'''
+
+
+def get_peak_memory(export):
+    tracemalloc.start()
+    try:
+        export()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(server_id=None, count=50000):
+    from statistics.models import Leg
+    from statistics.utils.leg_collection import LegCollection, iter_populated_legs
+    from statistics.utils.report import debug_excel_export, iter_debug_csv_export
+
+    legs = Leg.objects.order_by('ts_start')
+    if server_id:
+        legs = legs.filter(server=server_id)
+
+    ids = list(legs.values_list('id', flat=True)[:count])
+    assert ids, 'No legs'
+    legs = Leg.objects.filter(id__in=ids).order_by('ts_start')
+
+    def stream_csv():
+        for _line in iter_debug_csv_export(iter_populated_legs(legs, chunk_size=500)):
+            pass
+
+    def stream_excel():
+        with TemporaryFile() as fd:
+            debug_excel_export(iter_populated_legs(legs, chunk_size=500), write_only=True).save(fd)
+
+    def load_excel():
+        with TemporaryFile() as fd:
+            debug_excel_export(LegCollection.from_legs(legs)).save(fd)
+
+    stream_csv()  # imports and caches
+
+    for name, export in [('stream csv', stream_csv), ('stream excel', stream_excel), ('loaded excel', load_excel)]:
+        print('{}: {} legs, peak memory {:.1f} MB'.format(name, len(ids), get_peak_memory(export) / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'conferencecenter.settings')
+    django.setup()
+    run(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,46 @@
+import os
+import sys
+from time import time
+
+import django
+
+'''
+Time Cisco status parsing from an element tree, streamed from content and for a subset of paths
+
+    python test_status_parse_load.py [status xml file] [repeat count]
+'''
+
+
+def run(filename=None, count=50):
+    from defusedxml.cElementTree import fromstring as safe_xml_fromstring
+
+    from endpoint.ext_api.parser import cisco_ce as parser
+    from endpoint_data.models import EndpointDataFile
+
+    filename = filename or os.path.join(os.path.dirname(__file__), '..', 'endpoint', 'tests', 'data', 'status_roomkit.xml')
+    with open(filename, 'rb') as fd:
+        content = fd.read()
+
+    def _dom():
+        result = parser.StatusParser(safe_xml_fromstring(content)).parse()
+        return parser.NestedStatusXMLResult(result.data)._nested_keys  # walk as before
+
+    benchmarks = [
+        ('dom', _dom),
+        ('stream', lambda: parser.StatusParser(content=content).parse()._nested_keys),
+        ('stream with section hashes', lambda: parser.StatusParser(
+            content=content, section_hash=EndpointDataFile.get_cleaned_hash).parse()._nested_keys),
+        ('subset', lambda: parser.StatusParser(content=content, paths=['SystemUnit', 'Call']).parse()._nested_keys),
+    ]
+    for name, fn in benchmarks:
+        start = time()
+        for _i in range(count):
+            fn()
+        print('Status parse x{} {}: {:.2f}s'.format(count, name, time() - start))
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'conferencecenter.settings')
+    django.setup()
+    run(*sys.argv[1:2], *[int(arg) for arg in sys.argv[2:3]])
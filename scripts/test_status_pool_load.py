@@ -0,0 +1,103 @@
+import os
+import socket
+import sys
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+
+import django
+
+'''
+Compare endpoint_thread_pool with bounded_thread_pool for status polls of fake local
+endpoints, some slow and some unreachable
+
+    python test_status_pool_load.py [endpoint count]
+'''
+
+
+class FakeEndpointHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        # /<customer>/<delay>/status.xml
+        delay = float(self.path.strip('/').split('/')[1])
+        sleep(delay)
+        body = b'<Status><SystemUnit><ProductId>Cisco Codec</ProductId></SystemUnit></Status>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeEndpointServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 100  # don't reset connections when many workers connect at once
+
+
+class FakeEndpoint:
+    def __init__(self, customer_id, url):
+        self.customer_id = customer_id
+        self.url = url
+
+
+def run(count=120):
+    from endpoint.threading import AdaptiveLimiter, bounded_thread_pool, endpoint_thread_pool
+
+    server = FakeEndpointServer(('127.0.0.1', 0), FakeEndpointHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    dead = socket.socket()
+    dead.bind(('127.0.0.1', 0))
+    dead_port = dead.getsockname()[1]
+    dead.close()
+
+    class FakeAPI:
+        def __init__(self, endpoint):
+            self.endpoint = endpoint
+
+    endpoints = []
+    for i in range(count):
+        customer_id = i % 3
+        if customer_id == 2 and i % 2:  # customer with unreachable network
+            url = 'http://127.0.0.1:{}/2/0/status.xml'.format(dead_port)
+        else:
+            url = 'http://127.0.0.1:{}/{}/{}/status.xml'.format(port, customer_id, 0.5 if i % 10 == 0 else 0.05)
+        endpoint = FakeEndpoint(customer_id, url)
+        endpoint.get_api = lambda endpoint=endpoint: FakeAPI(endpoint)
+        endpoints.append(endpoint)
+
+    def fetch(endpoint):
+        if endpoint.url.startswith('http://127.0.0.1:{}/'.format(dead_port)):
+            sleep(0.2)  # simulate connect timeout
+        opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+        with opener.open(endpoint.url, timeout=5) as response:
+            return response.read()
+
+    try:
+        start = monotonic()
+        old = list(endpoint_thread_pool(endpoints, lambda api: fetch(api.endpoint), processes=10))
+        old_time = monotonic() - start
+
+        start = monotonic()
+        new = list(bounded_thread_pool(
+            endpoints, fetch, key=lambda e: e.customer_id, max_workers=50, limiter=AdaptiveLimiter(20)
+        ))
+        new_time = monotonic() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert len(old) == len(new)
+    print('Status poll of {} fake endpoints: {:.2f}s -> {:.2f}s'.format(len(endpoints), old_time, new_time))
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'conferencecenter.settings')
+    django.setup()
+    run(*[int(arg) for arg in sys.argv[1:2]])
@@ -1,9 +1,14 @@
+import hashlib
+import json
 import re
-from collections import defaultdict
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
 from datetime import timedelta, datetime
-from typing import Sequence, Dict, TypeVar, Callable, List, Optional, Type, Tuple, Any
+from time import monotonic
+from typing import Sequence, Dict, TypeVar, Callable, List, Optional, Type, Tuple, Any, Iterable, Iterator, Hashable
 
-from django.db import models, transaction
+from django.db import IntegrityError, connections, models, transaction
 from django.utils.timezone import now
 
 
@@ -98,30 +103,123 @@ def prettify_xml(xml):
     return text_content_re.sub(r'>\g<1></', xml)
 
 
+def get_sync_hash(*values) -> str:
+    """
+    Hash of normalized remote data. Stored on synced objects to detect if anything has changed
+    since the last sync
+    """
+    data = json.dumps(values, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.md5(data.encode()).hexdigest()
+
+
+class SyncStats:
+    """
+    Row change counters and duration of a sync step. Counters are added by all SyncBatcher
+    instances created inside ``collect_sync_stats()``
+    """
+
+    def __init__(self, step=''):
+        self.step = step
+        self.created = Counter()
+        self.updated = Counter()
+        self.unchanged = Counter()
+        self.duration = 0.0
+        self.result = None
+        self.lock = threading.Lock()
+
+    def add(self, model: Type[models.Model], created=0, updated=0, unchanged=0):
+        name = model._meta.label
+        with self.lock:
+            self.created[name] += created
+            self.updated[name] += updated
+            self.unchanged[name] += unchanged
+
+    def as_dict(self):
+        return {
+            'created': sum(self.created.values()),
+            'updated': sum(self.updated.values()),
+            'unchanged': sum(self.unchanged.values()),
+            'duration': round(self.duration, 3),
+        }
+
+    def __str__(self):
+        return '{created} created, {updated} updated, {unchanged} unchanged in {duration} secs'.format(
+            **self.as_dict()
+        )
+
+
+_active_sync_stats = threading.local()
+
+
+@contextmanager
+def collect_sync_stats(step=''):
+    """
+    Collect row change counters from SyncBatcher instances created inside the block
+    """
+    stats = SyncStats(step)
+    stack = _active_sync_stats.__dict__.setdefault('stack', [])
+    stack.append(stats)
+
+    start = monotonic()
+    try:
+        yield stats
+    finally:
+        stats.duration = monotonic() - start
+        stack.remove(stats)
+
+
+def can_bulk_save(model: Type[models.Model]) -> bool:
+    "bulk_create/bulk_update skips custom save() methods and signals. Only use them for plain models"
+    if model.save is not models.Model.save:
+        return False
+    return not any(signal.has_listeners(model) for signal in (models.signals.pre_save, models.signals.post_save))
+
+
 class SyncBatcher:
     """
-    Batch multiple updates. Group updates that only change time field into single operation
+    Batch multiple updates. Group updates that only change time field into single operation,
+    and other changes and new objects into bulk_update/bulk_create per model.
+    The time only update doesn't send any signals, so ``on_defaults_changed(model, pks)`` is
+    called for rows where it changes any of the ``defaults`` fields, e.g. reactivated rows
     """
 
     min_now_change: Optional[datetime] = None
-    update_queue: Dict[Type[models.Model], List[Tuple[models.Model, Dict[str, Any]]]]
+    create_queue: Dict[Type[models.Model], Dict[Hashable, models.Model]]
+    update_queue: Dict[Type[models.Model], List[Tuple[models.Model, Sequence[str]]]]
     only_time_update_queue: Dict[Type[models.Model], List[models.Model]]
 
-    def __init__(self, size=50, time_update_fields: Sequence = None, max_time_drift=10, defaults=None):
+    def __init__(self, size=200, time_update_fields: Sequence = None, max_time_drift=10, defaults=None,
+                 on_defaults_changed: Callable[[Type[models.Model], List[Any]], None] = None):
         self.max_size = size
         self.cur_size = 0
 
+        self.create_queue = defaultdict(dict)
         self.update_queue = defaultdict(list)
         self.only_time_update_queue = defaultdict(list)
+        self.created_keys = set()
 
         self.time_update_fields = time_update_fields if time_update_fields else ()
         self.defaults = defaults or {}
+        self.on_defaults_changed = on_defaults_changed
 
         self.only_time_update_set = set(time_update_fields) | set(defaults.keys()) if time_update_fields else set()
         self.max_time_drift = timedelta(seconds=max_time_drift)
 
-        from threading import Lock
-        self.lock = Lock()
+        self.stats = list(getattr(_active_sync_stats, 'stack', ()))
+
+        self.lock = threading.Lock()
+
+    def _add_stats(self, model, **counts):
+        for stats in self.stats:
+            stats.add(model, **counts)
+
+    def _queued(self):
+        self.cur_size += 1
+
+        if self.cur_size >= self.max_size:
+            self.commit()
+        elif self.min_now_change and self.min_now_change < now() - self.max_time_drift:
+            self.commit()
 
     def partial_update(self, obj, changes: Dict):
 
@@ -129,64 +227,129 @@ class SyncBatcher:
 
         changed = update_changed_fields(obj, all_changes)
         if not changed:
+            self._add_stats(obj.__class__, unchanged=1)
             return changed
 
         if not len(set(changed) - self.only_time_update_set):  # only time + default fields changed
+            self._add_stats(obj.__class__, unchanged=1)
             self.only_time_update_queue[obj.__class__].append(obj)
             if not self.min_now_change:
                 self.min_now_change = now()
         else:
-            self.update_queue[obj.__class__].append((obj, changes))
-
-        self.cur_size += 1
-
-        if self.cur_size >= self.max_size:
-            self.commit()
-        elif self.min_now_change and self.min_now_change < now() - self.max_time_drift:
-            self.commit()
+            self._add_stats(obj.__class__, updated=1)
+            self.update_queue[obj.__class__].append((obj, tuple(all_changes)))
+
+        self._queued()
+        return changed
+
+    def unchanged(self, obj):
+        "Data is known to be the same as last sync (e.g. same sync hash). Only update time fields"
+        self._add_stats(obj.__class__, unchanged=1)
+        if not self.time_update_fields:
+            return
+
+        self.only_time_update_queue[obj.__class__].append(obj)
+        if not self.min_now_change:
+            self.min_now_change = now()
+
+        self._queued()
+
+    def create(self, obj, key: Hashable = None):
+        """
+        Queue new object to be inserted using bulk_create. ``key`` is the remote id, to skip
+        duplicates if the remote list changes during the sync. Models with custom save()
+        or signals are saved directly
+        """
+        model = obj.__class__
+        if not can_bulk_save(model):
+            obj.save()
+            self._add_stats(model, created=1)
+            return obj
+
+        key = key if key is not None else id(obj)
+        if (model, key) in self.created_keys:
+            return obj
+
+        if key not in self.create_queue[model]:
+            self._add_stats(model, created=1)
+        self.create_queue[model][key] = obj
+
+        self._queued()
+        return obj
 
     def partial_update_or_create(self, qs_or_model, *, defaults: Dict, **filters):
         with transaction.atomic():
             obj, created = _get_or_create(qs_or_model, defaults=defaults, **filters)
 
-        if not created:
+        if created:
+            self._add_stats(obj.__class__, created=1)
+        else:
             self.partial_update(obj, defaults)
 
         return obj, created
 
     def replace_queues(self):
-        self.lock.acquire(blocking=True)
-
-        only_time_update_queue, update_queue = self.update_queue, self.only_time_update_queue
+        with self.lock:
+            queues = self.create_queue, self.update_queue, self.only_time_update_queue
 
-        self.update_queue = defaultdict(list)
-        self.only_time_update_queue = defaultdict(list)
+            self.create_queue = defaultdict(dict)
+            self.update_queue = defaultdict(list)
+            self.only_time_update_queue = defaultdict(list)
 
-        self.min_now_change = None
-        self.cur_size = 0
+            self.min_now_change = None
+            self.cur_size = 0
 
-        self.lock.release()
-        return only_time_update_queue, update_queue
+        return queues
 
     def commit(self):
 
-        update_queue, only_time_update_queue = self.replace_queues()
+        create_queue, update_queue, only_time_update_queue = self.replace_queues()
 
+        if create_queue:
+            self.create_objects(create_queue)
         if only_time_update_queue:
             self.update_only_time_objects(only_time_update_queue)
         if update_queue:
             self.update_objects(update_queue)
 
+    def create_objects(self, queue):
+        for model, objects in queue.items():
+            self.created_keys.update((model, key) for key in objects)
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create(objects.values(), batch_size=self.max_size)
+            except IntegrityError:  # already created by other process. Insert one by one
+                for obj in objects.values():
+                    try:
+                        with transaction.atomic():
+                            obj.save(force_insert=True)
+                    except IntegrityError:
+                        pass
+
     def update_only_time_objects(self, queue):
         time_update = {f: now() for f in self.time_update_fields}
         for model, objects in queue.items():
-            model.objects.filter(pk__in=[obj.pk for obj in objects]).update(**time_update,
-                                                                            **self.defaults)
+            qs = model.objects.filter(pk__in=[obj.pk for obj in objects])
+
+            changed_ids = []
+            if self.defaults and self.on_defaults_changed:
+                changed_ids = list(qs.exclude(**self.defaults).values_list('pk', flat=True))
+
+            qs.update(**time_update, **self.defaults)
+
+            if changed_ids:
+                self.on_defaults_changed(model, changed_ids)
+
     def update_objects(self, queue):
         with transaction.atomic():
-            for _model, objects in queue.items():
-                for obj, changes in objects:
-                    obj.save(update_fields=changes)
+            for model, objects in queue.items():
+                if not can_bulk_save(model):
+                    for obj, fields in objects:
+                        obj.save(update_fields=fields)
+                    continue
+
+                for fields, group in get_multidict(objects, lambda o: o[1]).items():
+                    model.objects.bulk_update([obj for obj, _fields in group], fields, batch_size=self.max_size)
 
     def __del__(self):
         if self.cur_size:
@@ -215,3 +378,29 @@ def get_multidict(it: Sequence[TD], key: Callable[[TD], TR]) -> Dict[TR, List[TD
     for item in it:
         result[key(item)].append(item)
     return dict(result)
+
+
+def iter_values_in(
+    qs: models.QuerySet, field: str, values: Iterable[Any], *fields: str, chunk_size=500
+) -> Iterator[Tuple]:
+    """
+    Stream ``qs.values_list(*fields)`` for rows where ``field`` is one of ``values``.
+    PostgreSQL gets all values as a single array parameter instead of one parameter per
+    value, other databases are queried in chunks of ``chunk_size`` values
+    """
+    values = list(values)
+    if not values:
+        return
+
+    connection = connections[qs.db]
+    if connection.vendor == 'postgresql':
+        meta = qs.model._meta
+        where = '{}.{} = ANY(%s)'.format(
+            connection.ops.quote_name(meta.db_table),
+            connection.ops.quote_name(meta.get_field(field).column),
+        )
+        yield from qs.extra(where=[where], params=[values]).values_list(*fields).iterator()
+        return
+
+    for i in range(0, len(values), chunk_size):
+        yield from qs.filter(**{'{}__in'.format(field): values[i:i + chunk_size]}).values_list(*fields).iterator()
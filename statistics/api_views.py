@@ -11,7 +11,8 @@ from rest_framework.response import Response
 from provider.docs import StatusResponseSerializer
 from shared.exceptions import format_exception
 from statistics.forms import StatsForm
-from statistics.graph import get_graph
+from statistics import rollup
+from statistics.graph import CallSecondsLineGraph, get_graph
 from statistics.models import Server
 from statistics.serializers import (
     CallStatisticsSerializer,
@@ -23,6 +24,7 @@ from statistics.serializers import (
     ReparseStatisticsSerializer,
     RematchStatisticsSerializer,
 )
+from statistics.types import LegSummaryResult, LegSummaryResultRow
 from statistics.utils.leg_collection import LegCollection
 from statistics.view_mixins import CallStatisticsReportMixin
 
@@ -113,12 +115,55 @@ class DashboardCallsStatistics(CallStatisticsReportMixin, views.APIView):
     def get_stats_data(self):
         return super().get_stats_data(as_json=True)
 
+    def _get_rollup_filters(self, form=None):
+        "Cleaned form data if totals and graphs can be read from statistics.rollup, else None"
+        form = form or self.form
+        cleaned = form.cleaned_data if form is not None and form.is_valid() else {}
+        if not rollup.is_representable(cleaned):
+            return None
+
+        server = cleaned['server']
+        servers = list(server.combine_servers.all()) if server.is_combined else [server]
+        return servers, cleaned['ts_start'], cleaned['ts_stop']
+
+    def get_call_data(self, form):
+        if self._get_rollup_filters(form):
+            return [], LegCollection.from_legs([])
+        return super().get_call_data(form)
+
+    def get_summary(self, legs: LegCollection, cleaned: dict):
+        rollup_filters = self._get_rollup_filters()
+        if not rollup_filters:
+            return super().get_summary(legs, cleaned)
+
+        totals = rollup.get_totals(*rollup_filters)
+        total = LegSummaryResultRow(
+            duration=round(totals.call_seconds / 3600, 2),
+            guest_duration=round(totals.guest_seconds / 3600, 2),
+            participant_count=totals.started_legs,
+            call_count=totals.started_calls,
+        )
+        return LegSummaryResult(
+            cospace={}, ou={}, user={}, org_unit={}, target_group={},
+            cospace_total=total, ou_total=total, user_total=total, org_unit_total=total, target_group_total=total,
+        )
+
     def get_graphs(self, legs: LegCollection, as_json=False, **kwargs):
+        rollup_filters = self._get_rollup_filters()
+        if rollup_filters:
+            return {
+                'seconds_per_hour': self.get_rollup_graph(*rollup_filters, as_json=as_json),
+            }
+
         return {
             'seconds_per_hour': get_graph(legs, as_json=as_json, **kwargs, by='hour', total=True),
             # 'sametime_graph': get_sametime_graph(legs, related_data=related_data, as_json=as_json, **kwargs),
         }
 
+    def get_rollup_graph(self, servers, ts_start, ts_stop, as_json=False):
+        seconds = rollup.get_call_seconds_per_hour(servers, ts_start, ts_stop)
+        return CallSecondsLineGraph(LegCollection.from_legs([])).get_graph({'': seconds} if seconds else {}, as_json=as_json)
+
 
 class ServerViewSet(viewsets.ModelViewSet):
 
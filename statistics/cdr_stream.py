@@ -0,0 +1,325 @@
+"""
+Buffer for incoming CDR payloads, using redis streams. Each stream is drained in
+batches by a single consumer at a time (see statistics.tasks.drain_cdr_streams), so
+events are handled in the same order as they were received. Payloads that fail are kept
+first in the stream and retried by a later consumer, and moved to a dead-letter stream
+(<key>.failed) after MAX_ATTEMPTS.
+
+CMS payloads use a single stream per installation and are parsed using
+statistics.parser.acano_batch.BatchParser. Pexip eventsink events are partitioned
+by conference name, so that events for a conference are handled in order while
+different conferences can be handled in parallel by multiple workers. Participants
+that move between conferences get events in more than one partition, which is handled
+by locking their legs in statistics.parser.pexip_batch.PexipEventBatchParser.
+
+Enabled by settings.CDR_BATCH_HANDLING if the default cache backend is redis.
+"""
+import json
+import logging
+import zlib
+from time import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.utils.encoding import force_text
+from redis.exceptions import LockError
+from sentry_sdk import capture_exception
+
+logger = logging.getLogger(__name__)
+
+ACANO_STREAM_KEY = 'statistics.cdr_stream.acano'
+PEXIP_STREAM_KEY = 'statistics.cdr_stream.pexip'
+
+# Approximate max number of buffered payloads. Oldest are dropped if consumer can't keep up
+MAX_LENGTH = 1000000
+
+# Consumer is rescheduled if it has not started within this many seconds
+SCHEDULED_TTL = 5
+
+# Failed payloads are retried after this many seconds, at most MAX_ATTEMPTS times
+RETRY_DELAY = 30
+MAX_ATTEMPTS = 3
+MAX_FAILED_LENGTH = 10000
+
+
+class StreamEntry(NamedTuple):
+    id: bytes
+    server_id: int
+    payload: bytes
+    remote_ip: str
+
+
+def get_connection():
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection()
+    except (ImportError, NotImplementedError):  # other cache backend
+        return None
+
+
+def is_enabled():
+    return bool(getattr(settings, 'CDR_BATCH_HANDLING', False)) and get_connection() is not None
+
+
+class CDRStream:
+
+    def __init__(self, key: str, connection=None):
+        self.key = key
+        self.connection = connection or get_connection()
+
+    def add(self, server_id: int, payload: bytes, remote_ip: str = None) -> bool:
+        """Add payload to stream. Returns True if a consumer should be scheduled"""
+        self.connection.xadd(
+            self.key,
+            {'server': server_id, 'payload': payload, 'ip': remote_ip or ''},
+            maxlen=MAX_LENGTH,
+            approximate=True,
+        )
+        return bool(self.connection.set(self.key + '.scheduled', 1, nx=True, ex=SCHEDULED_TTL))
+
+    def read(self, count: int) -> List[StreamEntry]:
+        result = []
+        for entry_id, fields in self.connection.xrange(self.key, count=count):
+            try:
+                server_id = int(fields[b'server'])
+            except (KeyError, ValueError):
+                logger.warning('Invalid cdr stream entry %s', entry_id)
+                server_id = None
+            result.append(StreamEntry(
+                entry_id,
+                server_id,
+                fields.get(b'payload', b''),
+                fields.get(b'ip', b'').decode('utf-8'),
+            ))
+        return result
+
+    def ack(self, entry_ids: List[bytes]):
+        if entry_ids:
+            pipe = self.connection.pipeline()
+            pipe.xdel(self.key, *entry_ids)
+            pipe.hdel(self.key + '.attempts', *entry_ids)
+            pipe.execute()
+
+    def fail(self, entries: List[StreamEntry]) -> bool:
+        """
+        Count failed attempt for entries. Entries that have failed MAX_ATTEMPTS times are
+        moved to the dead-letter stream. Returns True if any entry is left to be retried
+        """
+        if not entries:
+            return False
+
+        pipe = self.connection.pipeline()
+        for entry in entries:
+            pipe.hincrby(self.key + '.attempts', entry.id, 1)
+        attempts = pipe.execute()
+
+        failed = [entry for entry, count in zip(entries, attempts) if count >= MAX_ATTEMPTS]
+        if failed:
+            logger.warning('Moving %s failed cdr payloads from stream %s to %s.failed', len(failed), self.key, self.key)
+            pipe = self.connection.pipeline()
+            for entry in failed:
+                pipe.xadd(
+                    self.key + '.failed',
+                    {'server': entry.server_id or '', 'payload': entry.payload, 'ip': entry.remote_ip},
+                    maxlen=MAX_FAILED_LENGTH,
+                    approximate=True,
+                )
+            pipe.execute()
+            self.ack([entry.id for entry in failed])
+
+        if len(failed) == len(entries):
+            return False
+
+        self.connection.set(self.key + '.retry', 1, ex=RETRY_DELAY)
+        return True
+
+    def is_retry_delayed(self) -> bool:
+        return bool(self.connection.exists(self.key + '.retry'))
+
+    def clear_scheduled(self):
+        self.connection.delete(self.key + '.scheduled')
+
+    def lock(self, timeout: float):
+        return self.connection.lock(self.key + '.lock', timeout=timeout)
+
+    def __len__(self):
+        return self.connection.xlen(self.key)
+
+
+class AcanoCDRStream(CDRStream):
+
+    def __init__(self, connection=None):
+        super().__init__(ACANO_STREAM_KEY, connection=connection)
+
+
+class PexipEventStream(CDRStream):
+
+    def __init__(self, partition: int, connection=None):
+        self.partition = partition
+        super().__init__('{}.{}'.format(PEXIP_STREAM_KEY, partition), connection=connection)
+
+    @staticmethod
+    def get_partition_count():
+        return max(1, getattr(settings, 'CDR_BATCH_PARTITIONS', 8))
+
+    @classmethod
+    def get_partition(cls, event: Dict) -> int:
+        """Stable partition for event. Conference and participant events use the conference name"""
+        data = event.get('data') or {}
+        if not isinstance(data, dict):
+            data = {}
+        if (event.get('event') or '').startswith('conference_'):
+            key = data.get('name')
+        else:
+            key = data.get('conference')
+        key = key or data.get('call_id') or data.get('uuid') or ''
+        return zlib.crc32(str(key).encode('utf-8')) % cls.get_partition_count()
+
+    @classmethod
+    def get_all(cls, connection=None) -> List['PexipEventStream']:
+        connection = connection or get_connection()
+        return [cls(i, connection=connection) for i in range(cls.get_partition_count())]
+
+
+def _group_by_server(entries: List[StreamEntry]):
+    from statistics.models import Server
+
+    by_server: Dict[int, List[StreamEntry]] = {}
+    for entry in entries:
+        if entry.server_id is not None:
+            by_server.setdefault(entry.server_id, []).append(entry)
+
+    servers = Server.objects.in_bulk(list(by_server))
+
+    for server_id, server_entries in by_server.items():
+        if servers.get(server_id):
+            yield servers[server_id], server_entries
+
+
+def handle_acano_entries(entries: List[StreamEntry]) -> List[StreamEntry]:
+    """
+    Log and parse CMS payloads, grouped by server. Order is kept for each server.
+    Returns entries for servers where parsing failed
+    """
+    from debuglog.models import AcanoCDRLog
+    from statistics.parser.acano_batch import BatchParser
+
+    failed = []
+    for server, server_entries in _group_by_server(entries):
+        payloads = []
+        for entry in server_entries:
+            cdr_log = None
+            try:
+                cdr_log = AcanoCDRLog.objects.store(content=entry.payload, ip=entry.remote_ip)
+            except Exception:
+                capture_exception()
+            payloads.append((entry.payload, cdr_log))
+
+        try:
+            BatchParser(server).parse_payloads(payloads)
+        except Exception:
+            if settings.DEBUG or settings.TEST_MODE:
+                raise
+            capture_exception()
+            failed.extend(server_entries)
+
+    return failed
+
+
+def handle_pexip_entries(entries: List[StreamEntry]) -> List[StreamEntry]:
+    """
+    Log and parse Pexip eventsink events, grouped by server. Order is kept for each server.
+    Returns entries for servers where parsing failed
+    """
+    from debuglog.models import PexipEventLog
+    from statistics.parser.pexip_batch import PexipEventBatchParser
+    from statistics.tasks import get_pexip_log_kwargs
+
+    failed = []
+    for server, server_entries in _group_by_server(entries):
+        events = []
+        log_items = []
+        for entry in server_entries:
+            if len(entry.payload) < 4:
+                logger.warning('Invalid pexip event sink data from %s, %s bytes', entry.remote_ip, len(entry.payload))
+                continue
+            log_items.append(get_pexip_log_kwargs(server, entry.payload, entry.remote_ip))
+            try:
+                events.append(json.loads(force_text(entry.payload)))
+            except ValueError:
+                if settings.DEBUG or settings.TEST_MODE:
+                    raise
+                capture_exception()
+                events.append(None)
+
+        try:
+            cdr_logs = PexipEventLog.objects.store_many(log_items)
+        except Exception:
+            capture_exception()
+            cdr_logs = [None] * len(events)
+
+        try:
+            PexipEventBatchParser(server).parse_eventsink_events(
+                [(event, cdr_log) for event, cdr_log in zip(events, cdr_logs) if event]
+            )
+        except Exception:
+            if settings.DEBUG or settings.TEST_MODE:
+                raise
+            capture_exception()
+            failed.extend(server_entries)
+
+    return failed
+
+
+def drain(
+    stream: CDRStream,
+    handler: Callable[[List[StreamEntry]], Optional[List[StreamEntry]]],
+    batch_size: int = None,
+    max_time: float = 30,
+) -> Optional[int]:
+    """
+    Handle buffered payloads in batches until the stream is empty or max_time has passed.
+    The handler returns entries that failed, which are kept in the stream to be retried
+    by a later consumer, so no newer payloads are handled before them.
+    Returns number of handled payloads, or None if another consumer is already running
+    """
+    batch_size = batch_size or getattr(settings, 'CDR_BATCH_SIZE', 500)
+
+    # new payloads will schedule a new run, which will continue if this one has stopped
+    stream.clear_scheduled()
+
+    if stream.is_retry_delayed():
+        return 0
+
+    lock = stream.lock(timeout=max_time + 60)
+    if not lock.acquire(blocking=False):
+        return None
+
+    count = 0
+    try:
+        expires = time() + max_time
+        while time() < expires:
+            # restart lock timeout for each batch, so that slow batches won't let another consumer start
+            lock.reacquire()
+
+            entries = stream.read(batch_size)
+            if not entries:
+                break
+
+            failed = handler(entries) or []
+            failed_ids = {entry.id for entry in failed}
+            stream.ack([entry.id for entry in entries if entry.id not in failed_ids])
+            count += len(entries) - len(failed_ids)
+
+            if stream.fail(failed):
+                break
+    except LockError:
+        logger.warning('Lock for cdr stream %s has expired, stopping', stream.key)
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            pass
+
+    logger.debug('Handled %s cdr payloads from stream %s', count, stream.key)
+    return count
@@ -9,6 +9,7 @@ from django.utils.timezone import now
 
 from customer.models import CustomerMatch
 from provider.models.provider import Cluster
+from statistics import rollup
 from statistics.models import Call, Leg, Tenant, Server, Domain
 from endpoint.models import Endpoint
 from statistics.parser.utils import is_phone, get_ou, get_domain, rewrite_internal_domains, get_org_unit, \
@@ -106,6 +107,9 @@ def rewrite_history(recluster=False, verbose=False, ts_start=None, ts_stop=None,
 
     rewrite_basic_data(ts_kwargs=ts_kwargs, force_rematch=force_rematch, verbose=verbose)
     rewrite_pexip(ts_kwargs=ts_kwargs, force_rematch=force_rematch, verbose=verbose)
+    rewrite_room_analytics(ts_kwargs=ts_kwargs, verbose=verbose)
+
+    rollup.history_rewritten(ts_start, ts_stop, server=(extra_filters or {}).get('server'))
 
     if recluster:
         connection.cursor().execute('CLUSTER statistics_leg USING statistics_leg_pkey')
@@ -224,6 +228,43 @@ def rewrite_basic_data(verbose=False, ts_kwargs=None, force_rematch=False):
        )
 
 
+def rewrite_room_analytics(verbose=False, ts_kwargs=None, chunk_size=1000):
+    "Update head count, air quality and presence for legs from stored room analytics values"
+
+    ts_kwargs = ts_kwargs or {}
+    fields = ('head_count', 'air_quality', 'presence')
+
+    legs = LegDirect().filter(endpoint__isnull=False, ts_start__isnull=False, **ts_kwargs)\
+        .only('id', 'endpoint_id', 'ts_start', 'ts_stop', *fields).order_by('ts_start')
+
+    def _rewrite(chunk):
+        Leg.prefetch_sensor_values(chunk)
+        changed = []
+        for leg in chunk:
+            before = [getattr(leg, f) for f in fields]
+            leg.populate_head_count()
+            leg.populate_air_quality()
+            leg.populate_presence()
+            if [getattr(leg, f) for f in fields] != before:
+                changed.append(leg)
+        Leg.objects.bulk_update(changed, fields)
+        return len(changed)
+
+    count = 0
+    chunk = []
+    for leg in legs.iterator():
+        chunk.append(leg)
+        if len(chunk) >= chunk_size:
+            count += _rewrite(chunk)
+            chunk = []
+    if chunk:
+        count += _rewrite(chunk)
+
+    if verbose:
+        print('Updated room analytics for {} legs'.format(count))
+    return count
+
+
 def merge_duplicate_calls(server, ts_start=None, ts_stop=None, use_cospace_id=False):
     try:
         if 'direct' in settings.DATABASES:
@@ -284,6 +325,9 @@ def merge_duplicate_calls(server, ts_start=None, ts_stop=None, use_cospace_id=Fa
 
     cursor.close()
 
+    if result:
+        rollup.history_rewritten(ts_start, ts_stop, server=server)
+
     return dict(result)
 
 
@@ -131,8 +131,19 @@ def get_graph(legs, related_data=None, by='day', as_image=False, ts_start=None,
         raise KeyError('{} not valid timespan'.format(by))
 
 
-def get_sametime_graph(legs: LegCollection, resolution=None, bars=600, as_image=False, as_json=False):
-
+def get_sametime_graph(
+    legs: LegCollection,
+    resolution=None,
+    bars=600,
+    as_image=False,
+    as_json=False,
+    max_concurrent=True,
+):
+    """
+    Bar graph of number of legs at the same time. Uses the max number of concurrent legs during
+    each bar if ``max_concurrent``, so that short legs between the start of two bars are included.
+    Otherwise the number of legs active at the start of each bar
+    """
     if not legs:
         return ''
 
@@ -142,7 +153,10 @@ def get_sametime_graph(legs: LegCollection, resolution=None, bars=600, as_image=
         if len(ts):
             resolution = min(20, (((ts[-1] - ts[0]).days + 1) * 24 * 60) // bars)
 
-    data, unit_data, tenant_data, total_data = legs.grouped_legs_count_for_chunks(resolution_seconds=resolution * 60)
+    data, unit_data, tenant_data, total_data = legs.grouped_legs_count_for_chunks(
+        resolution_seconds=resolution * 60,
+        max_concurrent=max_concurrent,
+    )
 
     if len(unit_data) > len(data) or not settings.ENABLE_GROUPS:
         data = unit_data
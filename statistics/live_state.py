@@ -0,0 +1,384 @@
+"""
+Active calls and participants for each cluster, stored in redis to list and count them in
+call control views without querying the statistics tables or the call bridges.
+
+Updated when calls and legs are saved by the CDR/eventsink parsers (see the signals at the
+end of statistics.models), and rebuilt from the database by the reconcile_live_call_state
+task to include changes made using queryset updates, deletes and lost events. The same as
+PexipAPI.get_calls_cached, only legs with should_count_stats are included and calls are
+listed while they have at least one of them. CMS calls are grouped by call correlator, so
+a call distributed over multiple call bridges is listed once.
+
+Writes for a single call are not atomic, but events for a call are handled in order by a
+single consumer at a time (see statistics.cdr_stream) and any drift is corrected by the
+next rebuild.
+
+Enabled by settings.LIVE_CALL_STATE if the default cache backend is redis. The state of a
+cluster is only used while its last rebuild is more recent than SYNCED_TTL seconds.
+"""
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from django.conf import settings
+from django.utils.timezone import now, utc
+from sentry_sdk import capture_exception
+
+from statistics.cdr_stream import get_connection
+
+if TYPE_CHECKING:
+    from provider.models.provider import Cluster
+    from statistics.models import Call, Leg
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'statistics.live_state'
+
+# Rebuilt by reconcile_live_call_state each minute. Fall back to the database if it stops
+SYNCED_TTL = 5 * 60
+
+# Same limit as PexipAPI.get_calls_cached, to use the ts_start index
+ACTIVE_LIMIT = timedelta(days=30)
+
+
+def is_enabled():
+    return bool(getattr(settings, 'LIVE_CALL_STATE', False)) and get_connection() is not None
+
+
+def get_for_cluster(cluster: 'Cluster') -> Optional['LiveCallState']:
+    """State for ``cluster`` if it can be used instead of the database"""
+    if not cluster or not is_enabled():
+        return None
+
+    state = LiveCallState(cluster.pk)
+    return state if state.is_synced() else None
+
+
+def get_call_key(call: 'Call') -> str:
+    return call.correlator_guid or str(call.pk)
+
+
+def _timestamp(ts: Optional[datetime]) -> float:
+    return ts.timestamp() if ts else 0
+
+
+def _dump_call(call: 'Call') -> dict:
+    return {
+        'id': call.pk,
+        'guid': call.guid or '',
+        'cospace': call.cospace,
+        'cospace_id': call.cospace_id,
+        'correlator': call.correlator_guid or '',
+        'tenant': call.tenant or '',
+        'ts_start': _timestamp(call.ts_start),
+    }
+
+
+def _dump_leg(leg: 'Leg', call: 'Call') -> dict:
+    return {
+        'id': leg.pk,
+        'guid': leg.guid or '',
+        'guid2': leg.guid2 or '',
+        'name': leg.name,
+        'local': leg.local,
+        'remote': leg.remote,
+        'tenant': leg.tenant or '',
+        'ts_start': _timestamp(leg.ts_start),
+        'call': call.pk,
+        'call_key': get_call_key(call),
+        'call_guid': call.guid or '',
+        'cospace': call.cospace,
+    }
+
+
+def _load(value: Optional[bytes]) -> Optional[dict]:
+    if not value:
+        return None
+    result = json.loads(value)
+    result['ts_start'] = datetime.fromtimestamp(result['ts_start'], utc) if result['ts_start'] else None
+    return result
+
+
+class LiveCallState:
+
+    def __init__(self, cluster_id: int, connection=None):
+        self.cluster_id = cluster_id
+        self.connection = connection or get_connection()
+
+        prefix = '{}.{}'.format(KEY_PREFIX, cluster_id)
+        self.synced_key = prefix + '.synced'
+        self.keys_key = prefix + '.keys'  # tenant and call indexes, for rebuild
+        self.call_data_key = prefix + '.call_data'
+        self.leg_data_key = prefix + '.leg_data'
+        self.prefix = prefix
+
+    # keys
+
+    def calls_key(self, tenant: str = None):
+        if tenant is None:
+            return self.prefix + '.calls'
+        return '{}.tenant.{}.calls'.format(self.prefix, tenant)
+
+    def legs_key(self, tenant: str = None):
+        if tenant is None:
+            return self.prefix + '.legs'
+        return '{}.tenant.{}.legs'.format(self.prefix, tenant)
+
+    def call_legs_key(self, call_key: str):
+        return '{}.call.{}.legs'.format(self.prefix, call_key)
+
+    # read
+
+    def is_synced(self) -> bool:
+        return bool(self.connection.exists(self.synced_key))
+
+    def _get_page(self, index_key: str, data_key: str, offset=0, limit=None) -> Tuple[List[dict], int]:
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.zrange(index_key, offset, offset + limit - 1 if limit else -1)
+        pipe.zcard(index_key)
+        members, count = pipe.execute()
+
+        if not members:
+            return [], count
+        values = [_load(v) for v in self.connection.hmget(data_key, members)]
+        return [v for v in values if v], count
+
+    def get_calls(self, tenant: str = None, offset=0, limit=None) -> Tuple[List[dict], int]:
+        """Calls ordered by start time, and total count"""
+        return self._get_page(self.calls_key(tenant), self.call_data_key, offset=offset, limit=limit)
+
+    def get_legs(self, tenant: str = None, offset=0, limit=None) -> Tuple[List[dict], int]:
+        """Legs ordered by start time, and total count"""
+        return self._get_page(self.legs_key(tenant), self.leg_data_key, offset=offset, limit=limit)
+
+    def get_call_count(self, tenant: str = None) -> int:
+        return self.connection.zcard(self.calls_key(tenant))
+
+    def get_leg_count(self, tenant: str = None) -> int:
+        return self.connection.zcard(self.legs_key(tenant))
+
+    # write
+
+    def update_call(self, call: 'Call'):
+        if call.ts_stop:
+            return self.remove_call(call)
+
+        call_key = get_call_key(call)
+        data = _dump_call(call)
+
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.hget(self.call_data_key, call_key)
+        pipe.zscore(self.calls_key(), call_key)
+        old, score = pipe.execute()
+
+        if score is None:  # not listed until it has legs, see update_leg
+            return
+
+        pipe = self.connection.pipeline()
+        pipe.hset(self.call_data_key, call_key, json.dumps(data))
+
+        old = _load(old)
+        if old and old['tenant'] != data['tenant']:
+            pipe.zrem(self.calls_key(old['tenant']), call_key)
+            pipe.zadd(self.calls_key(data['tenant']), {call_key: score})
+            pipe.sadd(self.keys_key, self.calls_key(data['tenant']))
+        pipe.execute()
+
+    def remove_call(self, call: 'Call'):
+        """Remove legs of an ended call, and the call if no other call bridge has legs left"""
+        call_key = get_call_key(call)
+        call_legs_key = self.call_legs_key(call_key)
+
+        leg_ids = self.connection.zrange(call_legs_key, 0, -1)
+        legs = [_load(v) for v in self.connection.hmget(self.leg_data_key, leg_ids)] if leg_ids else []
+
+        removed = [leg for leg in legs if leg and leg['call'] == call.pk]
+        self._remove_legs(removed, call_keys=[call_key])
+
+    def update_leg(self, leg: 'Leg', call: 'Call' = None):
+        call = call or leg.call
+        if leg.ts_stop or not leg.should_count_stats or not call or call.ts_stop:
+            return self.remove_leg(leg)
+
+        data = _dump_leg(leg, call)
+        call_key = data['call_key']
+
+        old = _load(self.connection.hget(self.leg_data_key, leg.pk))
+        if old and (old['call_key'], old['tenant']) != (call_key, data['tenant']):
+            self._remove_legs([old])
+
+        self._add(
+            [(leg.pk, data)],
+            {call_key: _dump_call(call)},
+        )
+
+    def remove_leg(self, leg: 'Leg'):
+        old = _load(self.connection.hget(self.leg_data_key, leg.pk))
+        if old:
+            self._remove_legs([old])
+
+    def _add(self, legs: Sequence[Tuple[int, dict]], calls: Dict[str, dict], pipe=None, replace=False):
+
+        execute = pipe is None
+        if pipe is None:
+            pipe = self.connection.pipeline()
+
+        keys = set()
+
+        def _zadd(key, mapping):
+            pipe.zadd(key, mapping)
+            keys.add(key)
+
+        for call_key, call in calls.items():
+            if replace:
+                pipe.hset(self.call_data_key, call_key, json.dumps(call))
+            else:  # keep changes from update_call
+                pipe.hsetnx(self.call_data_key, call_key, json.dumps(call))
+            pipe.zadd(self.calls_key(), {call_key: call['ts_start']})
+            _zadd(self.calls_key(call['tenant']), {call_key: call['ts_start']})
+
+        for leg_id, leg in legs:
+            pipe.hset(self.leg_data_key, leg_id, json.dumps(leg))
+            pipe.zadd(self.legs_key(), {leg_id: leg['ts_start']})
+            _zadd(self.legs_key(leg['tenant']), {leg_id: leg['ts_start']})
+            _zadd(self.call_legs_key(leg['call_key']), {leg_id: leg['ts_start']})
+
+        if keys:
+            pipe.sadd(self.keys_key, *keys)
+
+        if execute:
+            pipe.execute()
+
+    def _remove_legs(self, legs: Sequence[dict], call_keys: Sequence[str] = ()):
+        """Remove legs, and calls in ``call_keys`` or of the legs without any legs left"""
+        pipe = self.connection.pipeline()
+        call_keys = list(call_keys)
+        for leg in legs:
+            pipe.zrem(self.legs_key(), leg['id'])
+            pipe.zrem(self.legs_key(leg['tenant']), leg['id'])
+            pipe.zrem(self.call_legs_key(leg['call_key']), leg['id'])
+            pipe.hdel(self.leg_data_key, leg['id'])
+            call_keys.append(leg['call_key'])
+
+        call_keys = list(dict.fromkeys(call_keys))
+        for call_key in call_keys:
+            pipe.zcard(self.call_legs_key(call_key))
+            pipe.hget(self.call_data_key, call_key)
+
+        result = pipe.execute()[-2 * len(call_keys):] if call_keys else []
+
+        pipe = self.connection.pipeline()
+        empty = False
+        for call_key, leg_count, call in zip(call_keys, result[::2], result[1::2]):
+            if leg_count:
+                continue
+            empty = True
+            pipe.zrem(self.calls_key(), call_key)
+            call = _load(call)
+            if call:
+                pipe.zrem(self.calls_key(call['tenant']), call_key)
+            pipe.hdel(self.call_data_key, call_key)
+            pipe.delete(self.call_legs_key(call_key))
+            pipe.srem(self.keys_key, self.call_legs_key(call_key))
+
+        if empty:
+            pipe.execute()
+
+    def rebuild(self) -> Tuple[int, int]:
+        """Replace stored state with active calls and legs from the database"""
+        from statistics.models import Leg
+
+        limit = now() - ACTIVE_LIMIT
+        legs = Leg.objects.filter(
+            server__cluster=self.cluster_id,
+            ts_start__gte=limit,
+            ts_stop__isnull=True,
+            should_count_stats=True,
+            call__ts_start__gt=limit,
+            call__ts_stop__isnull=True,
+        ).select_related('call').order_by()
+
+        leg_data = []
+        call_data = {}
+        for leg in legs.iterator():
+            leg_data.append((leg.pk, _dump_leg(leg, leg.call)))
+            call_data.setdefault(get_call_key(leg.call), _dump_call(leg.call))
+
+        old_keys = self.connection.smembers(self.keys_key)
+
+        pipe = self.connection.pipeline()
+        pipe.delete(self.calls_key(), self.legs_key(), self.call_data_key, self.leg_data_key, *old_keys)
+        if old_keys:
+            pipe.srem(self.keys_key, *old_keys)
+        self._add(leg_data, call_data, pipe=pipe, replace=True)
+        pipe.set(self.synced_key, now().isoformat(), ex=SYNCED_TTL)
+        pipe.execute()
+
+        return len(call_data), len(leg_data)
+
+    def clear(self):
+        old_keys = self.connection.smembers(self.keys_key)
+        self.connection.delete(
+            self.synced_key, self.keys_key, self.calls_key(), self.legs_key(), self.call_data_key, self.leg_data_key, *old_keys
+        )
+
+
+def reconcile(clusters: Iterable['Cluster'] = None):
+    from provider.models.provider import Cluster
+
+    if not is_enabled():
+        return
+
+    for cluster in Cluster.objects.all() if clusters is None else clusters:
+        state = LiveCallState(cluster.pk)
+        if cluster.use_local_call_state is False:
+            state.clear()
+            continue
+        try:
+            state.rebuild()
+        except Exception:
+            if settings.DEBUG or settings.TEST_MODE:
+                raise
+            capture_exception()
+
+
+def _get_state(instance) -> Optional[LiveCallState]:
+    if not getattr(settings, 'LIVE_CALL_STATE', False) or not instance.server_id:
+        return None
+    cluster_id = instance.server.cluster_id
+    if not cluster_id or not is_enabled():
+        return None
+    return LiveCallState(cluster_id)
+
+
+def call_saved(sender, instance: 'Call', **kwargs):
+    state = _get_state(instance)
+    if not state:
+        return
+    try:
+        state.update_call(instance)
+    except Exception:
+        if settings.TEST_MODE:
+            raise
+        logger.warning('Could not update live state for call %s', instance.pk)
+        capture_exception()
+
+
+def leg_saved(sender, instance: 'Leg', **kwargs):
+    state = _get_state(instance)
+    if not state:
+        return
+    try:
+        state.update_leg(instance)
+    except Exception:
+        if settings.TEST_MODE:
+            raise
+        logger.warning('Could not update live state for leg %s', instance.pk)
+        capture_exception()
+
+
+def legs_updated(legs: Iterable['Leg']):
+    """Update state for legs changed using bulk_update"""
+    for leg in legs:
+        leg_saved(leg.__class__, leg)
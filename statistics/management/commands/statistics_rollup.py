@@ -0,0 +1,49 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+from django.utils.timezone import localtime, make_aware, now
+
+
+class Command(BaseCommand):
+    help = "Backfill or check stored hourly call statistics"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Number of days back in time')
+        parser.add_argument('--start', type=str, help='First date (YYYY-MM-DD), instead of --days')
+        parser.add_argument('--stop', type=str, help='Last date (YYYY-MM-DD)')
+        parser.add_argument('--server', type=int, action='append', help='Server id. Default all servers')
+        parser.add_argument('--check', action='store_true', help='Compare stored values with legs, without changes')
+
+    def handle(self, *args, **options):
+        from statistics.models import Server
+        from statistics.rollup import check_hourly_stats, update_hourly_stats
+
+        servers = Server.objects.exclude(type__in=(Server.COMBINE, Server.ENDPOINTS)).order_by('pk')
+        if options['server']:
+            servers = servers.filter(pk__in=options['server'])
+
+        ts_stop = now()
+        if options['stop']:
+            ts_stop = make_aware(datetime.combine(parse_date(options['stop']) + timedelta(days=1), time()))
+        if options['start']:
+            ts_start = make_aware(datetime.combine(parse_date(options['start']), time()))
+        else:
+            ts_start = localtime(ts_stop - timedelta(days=options['days'])).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        errors = 0
+        for server in servers:
+            day = ts_start
+            while day < ts_stop:
+                day_stop = day + timedelta(days=1)
+                if options['check']:
+                    for difference in check_hourly_stats(server, day, day_stop):
+                        errors += 1
+                        self.stdout.write('{}: {}'.format(server, difference))
+                else:
+                    count = update_hourly_stats(server, day, day_stop)
+                    self.stdout.write('{}: {} {} rows'.format(server, day.date(), count))
+                day = day_stop
+
+        if options['check']:
+            self.stdout.write('{} differences'.format(errors))
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organization', '0003_organizationunit_customer'),
+        ('statistics', '0069_add_call_should_count_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlyCallStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('ts_hour', models.DateTimeField()),
+                ('is_total', models.BooleanField(default=False)),
+                ('tenant', models.CharField(blank=True, max_length=64)),
+                ('ou', models.CharField(blank=True, max_length=200)),
+                ('target', models.CharField(blank=True, max_length=300)),
+                ('call_seconds', models.FloatField(default=0)),
+                ('guest_seconds', models.FloatField(default=0)),
+                ('started_calls', models.IntegerField(default=0)),
+                ('max_concurrency', models.IntegerField(default=0)),
+                ('org_unit', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='organization.OrganizationUnit')),
+                ('server', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='statistics.Server')),
+            ],
+            options={
+                'index_together': {('server', 'ts_hour')},
+            },
+        ),
+    ]
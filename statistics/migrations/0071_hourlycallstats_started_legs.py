@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('statistics', '0070_hourlycallstats'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='hourlycallstats',
+            name='max_concurrency',
+        ),
+        migrations.AddField(
+            model_name='hourlycallstats',
+            name='started_legs',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -1,7 +1,9 @@
 import hashlib
+import threading
 import typing
+from contextlib import contextmanager
 from datetime import timedelta
-from typing import Sequence, Union, Literal
+from typing import Dict, Iterable, Optional, Sequence, Union, Literal
 
 from cacheout import fifo_memoize
 from django.contrib.postgres.indexes import BrinIndex
@@ -25,6 +27,7 @@ from shared.utils import partial_update_or_create, partial_update
 
 if typing.TYPE_CHECKING:
     from customer.models import Customer
+    from room_analytics.utils.sensor_index import SensorValueIndex
 
 '''
 Warning
@@ -94,6 +97,54 @@ def tenant_server(tenant_guid: str, server_id: int) -> 'ServerTenant':
     return ServerTenant.objects.get_or_create(tenant=tenant, server=Server(pk=server_id))[0]
 
 
+CDR_STATE_TIMEOUT = 2 * 60 * 60
+
+_cdr_state_buffer = threading.local()
+
+
+@contextmanager
+def buffer_cdr_state():
+    """
+    Collect changes to Call/Leg.cdr_state_info and write them using a single set_many and
+    delete_many when leaving the outermost block
+    """
+    if getattr(_cdr_state_buffer, 'changes', None) is not None:
+        yield
+        return
+
+    _cdr_state_buffer.changes = changes = {}
+    try:
+        yield
+    finally:
+        _cdr_state_buffer.changes = None
+
+        removed = [k for k, v in changes.items() if v is None]
+        if removed:
+            cache.delete_many(removed)
+        values = {k: v for k, v in changes.items() if v is not None}
+        if values:
+            cache.set_many(values, CDR_STATE_TIMEOUT)
+
+
+def _set_cdr_state(cache_key: str, value: Optional[dict]):
+    if value is not None and not isinstance(value, dict):
+        value = None
+
+    changes = getattr(_cdr_state_buffer, 'changes', None)
+    if changes is not None:
+        changes[cache_key] = value
+    elif value is None:
+        cache.delete(cache_key)
+    else:
+        cache.set(cache_key, value, CDR_STATE_TIMEOUT)
+
+
+def _get_many_cdr_state(cache_keys: Dict[str, str]) -> Dict[str, dict]:
+    """Load cdr state for each id in ``cache_keys`` (id -> cache key) using a single cache call"""
+    values = cache.get_many(list(set(cache_keys.values()))) if cache_keys else {}
+    return {name: values.get(cache_key) or {} for name, cache_key in cache_keys.items()}
+
+
 class ServerManager(models.Manager):
 
     def filter_for_customer(self, customer, **kwargs):
@@ -459,6 +510,12 @@ class Call(models.Model):
                          condition=Q(meeting__isnull=False)),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_ts_finalized = instance.__dict__.get('ts_finalized')  # see statistics.rollup.call_updated
+        return instance
+
     def save(self, *args, **kwargs):
 
         self.load_dates()
@@ -575,6 +632,10 @@ class Call(models.Model):
             return {}
         return cache.get(cls.cdr_state_cache_key(cluster_id, name)) or {}
 
+    @classmethod
+    def get_many_cdr_state_info(cls, cluster_id: int, names: Iterable[str]) -> Dict[str, dict]:
+        return _get_many_cdr_state({name: cls.cdr_state_cache_key(cluster_id, name) for name in names if name})
+
     @property
     def cdr_state_info(self):
         return self.get_cdr_state_info(self.server.cluster_id, self.cospace)
@@ -583,12 +644,7 @@ class Call(models.Model):
     def cdr_state_info(self, value: dict):
         if not self.cospace:
             return
-        cache_key = self.cdr_state_cache_key(self.server.cluster_id, self.cospace)
-        if value is None or not isinstance(value, dict):
-            cache.delete(cache_key)
-            return
-
-        cache.set(cache_key, value, 2 * 60 * 60)
+        _set_cdr_state(self.cdr_state_cache_key(self.server.cluster_id, self.cospace), value)
 
 
 class ActiveCall(models.Model):
@@ -763,6 +819,23 @@ class Leg(models.Model):
 
     acano_cdr_event_logs = models.ManyToManyField('debuglog.AcanoCDRLog', db_constraint=False, related_name='statistics_legs')
 
+    sensor_values: Optional['SensorValueIndex'] = None  # set by prefetch_sensor_values()
+
+    @staticmethod
+    def prefetch_sensor_values(legs: Iterable['Leg']) -> Optional['SensorValueIndex']:
+        "Load room analytics values for multiple legs using a single query, to be used when they are saved"
+        from room_analytics.utils.sensor_index import SensorValueIndex
+
+        legs = [leg for leg in legs if leg.endpoint_id and leg.ts_start]
+        if not legs:
+            return None
+
+        ts_now = now()
+        index = SensorValueIndex((leg.endpoint_id, leg.ts_start, leg.ts_stop or ts_now) for leg in legs)
+        for leg in legs:
+            leg.sensor_values = index
+        return index
+
     def save(self, *args, **kwargs):
 
         if not self.domain_id and self.target and '@' in self.target:
@@ -791,13 +864,19 @@ class Leg(models.Model):
 
         super().save(*args, **kwargs)
 
+    def _get_sensor_value(self, model):
+        ts_stop = self.ts_stop or now()
+        if self.sensor_values is not None and self.sensor_values.covers(self.endpoint_id, self.ts_start, ts_stop):
+            return self.sensor_values.get_for_time(model._value_type, self.endpoint_id, self.ts_start, ts_stop)
+        return model.objects.get_for_time(self.endpoint_id, self.ts_start, ts_stop)
+
     def populate_head_count(self):
         if not self.endpoint_id or not self.ts_start:
             return
 
         from room_analytics.models import EndpointHeadCount
 
-        new_head_count = EndpointHeadCount.objects.get_for_time(self.endpoint, self.ts_start, self.ts_stop or now())
+        new_head_count = self._get_sensor_value(EndpointHeadCount)
         if new_head_count is not None:
             self.head_count = new_head_count
             return new_head_count
@@ -808,9 +887,7 @@ class Leg(models.Model):
 
         from room_analytics.models import EndpointAirQuality
 
-        new_air_quality = EndpointAirQuality.objects.get_for_time(
-            self.endpoint, self.ts_start, self.ts_stop or now()
-        )
+        new_air_quality = self._get_sensor_value(EndpointAirQuality)
         if new_air_quality is not None:
             self.air_quality = new_air_quality
             return new_air_quality
@@ -821,7 +898,7 @@ class Leg(models.Model):
 
         from room_analytics.models import EndpointRoomPresence
 
-        presence = EndpointRoomPresence.objects.get_for_time(self.endpoint, self.ts_start, self.ts_stop or now())
+        presence = self._get_sensor_value(EndpointRoomPresence)
         if presence is not None:
             self.presence = presence
             return presence
@@ -853,6 +930,10 @@ class Leg(models.Model):
             return {}
         return cache.get(cls.cdr_state_cache_key(cluster_id, guid)) or {}
 
+    @classmethod
+    def get_many_cdr_state_info(cls, cluster_id: int, guids: Iterable[str]) -> Dict[str, dict]:
+        return _get_many_cdr_state({guid: cls.cdr_state_cache_key(cluster_id, guid) for guid in guids if guid})
+
     @property
     def cdr_state_info(self):
         guid = self.guid2 or self.guid  # TODO Temp Pexip ID-fix
@@ -863,12 +944,7 @@ class Leg(models.Model):
         if not self.guid:
             return
         guid = self.guid2 or self.guid  # TODO Temp Pexip ID-fix
-        cache_key = self.cdr_state_cache_key(self.server.cluster_id, guid)
-        if value is None or not isinstance(value, dict):
-            cache.delete(cache_key)
-            return
-
-        cache.set(cache_key, value, 2 * 60 * 60)
+        _set_cdr_state(self.cdr_state_cache_key(self.server.cluster_id, guid), value)
 
     @property
     def protocol_str(self):
@@ -963,6 +1039,31 @@ class DayStat(models.Model):
     minutes = models.IntegerField()
 
 
+class HourlyCallStats(models.Model):
+    """
+    Call statistics per hour for each tenant, ou, organization unit and target combination
+    of a server, and a total row for each hour. See statistics.rollup
+    """
+
+    server = models.ForeignKey(Server, on_delete=models.CASCADE, db_index=False)
+    ts_hour = models.DateTimeField()
+    is_total = models.BooleanField(default=False)
+
+    tenant = models.CharField(max_length=64, blank=True)
+    ou = models.CharField(max_length=200, blank=True)
+    org_unit = models.ForeignKey('organization.OrganizationUnit', null=True, db_index=False, db_constraint=False,
+                                 on_delete=models.DO_NOTHING)
+    target = models.CharField(max_length=300, blank=True)
+
+    call_seconds = models.FloatField(default=0)
+    guest_seconds = models.FloatField(default=0)
+    started_calls = models.IntegerField(default=0)
+    started_legs = models.IntegerField(default=0)
+
+    class Meta:
+        index_together = ('server', 'ts_hour')
+
+
 class DomainTransform(models.Model):
     """
     Rewrite domains of call legs (e.g. VCS default domain/ip for internal calls) and connect to ou/org unit
@@ -996,3 +1097,23 @@ def clear_cache(sender=None, *args, **kwargs):
 
     _get_domain_object.cache.clear()
     tenant_obj.cache.clear()
+
+
+def update_stats_rollup(sender, instance: Call, **kwargs):
+    if settings.STATS_ROLLUP:
+        from statistics.rollup import call_updated
+        call_updated(sender, instance, **kwargs)
+
+
+def update_live_call_state(sender, instance: Union[Call, Leg], **kwargs):
+    if settings.LIVE_CALL_STATE:
+        from statistics import live_state
+        if isinstance(instance, Leg):
+            live_state.leg_saved(sender, instance, **kwargs)
+        else:
+            live_state.call_saved(sender, instance, **kwargs)
+
+
+models.signals.post_save.connect(update_stats_rollup, sender=Call)
+models.signals.post_save.connect(update_live_call_state, sender=Call)
+models.signals.post_save.connect(update_live_call_state, sender=Leg)
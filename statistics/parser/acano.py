@@ -116,8 +116,7 @@ class Parser:
             if self.debug:
                 print('call', guid, update_data.get('cospace', '') if update_data else '')
 
-        if self.cdr_log:
-            obj.acano_cdr_event_logs.add(self.cdr_log)
+        self.add_cdr_log(obj)
 
         return obj
 
@@ -157,11 +156,14 @@ class Parser:
             if not created and update_data:
                 maybe_update(obj, update_data)
 
-        if self.cdr_log:
-            obj.acano_cdr_event_logs.add(self.cdr_log)
+        self.add_cdr_log(obj)
 
         return obj
 
+    def add_cdr_log(self, obj: Union[Call, Leg]):
+        if self.cdr_log:
+            obj.acano_cdr_event_logs.add(self.cdr_log)
+
     def parse_call(self, call, record):
 
         cur_call = {}
@@ -536,6 +538,8 @@ class Parser:
         if ts_stop:
             cur_call['ts_stop'] = ts_stop
 
+        cur_call['ts_finalized'] = now()  # callEnd is the last record of a call
+
         call_ou = call.ou
         call_tenant = call.tenant
         call_unit = call.org_unit if call.org_unit_id else None
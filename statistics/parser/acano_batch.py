@@ -0,0 +1,379 @@
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+from django.db import transaction
+from sentry_sdk import capture_exception
+
+from defusedxml import cElementTree as ET
+
+from shared.utils import maybe_update, update_changed_fields
+from .. import live_state
+from ..models import Call, Leg, Server
+from .acano import Parser, RERAISE_ERRORS
+
+if TYPE_CHECKING:
+    from debuglog.models import AcanoCDRLog
+
+# Leg fields which can be written using bulk_update, without the side effects of Leg.save()
+DEFERRED_LEG_FIELDS = {'name'}
+
+PREFETCH_CHUNK_SIZE = 500
+
+# Number of records parsed and committed in each transaction
+TRANSACTION_CHUNK_SIZE = 50
+
+
+class BatchRecord:
+    __slots__ = ('record', 'cdr_logs')
+
+    def __init__(self, record, cdr_log: Optional['AcanoCDRLog'] = None):
+        self.record = record
+        self.cdr_logs = [cdr_log] if cdr_log else []
+
+    @property
+    def type(self):
+        return self.record.get('type')
+
+    def get_guids(self) -> List[str]:
+        "Guids of calls and legs referenced in record"
+        result = []
+        for child in self.record:
+            if child.tag == 'call':
+                result.append(child.get('id'))
+            elif child.tag == 'callLeg':
+                result.append(child.get('id'))
+                if child.findtext('./call'):
+                    result.append(child.findtext('./call'))
+        return result
+
+    def get_update_leg(self):
+        "callLeg element if this is a plain callLegUpdate record, which can be coalesced"
+        if self.type != 'callLegUpdate' or len(self.record) != 1:
+            return None
+        leg = self.record[0]
+        if leg.tag != 'callLeg' or not leg.get('id'):
+            return None
+        return leg
+
+    def merge_update(self, other: 'BatchRecord'):
+        """
+        Merge a later callLegUpdate for the same leg into this one. Gives the same result
+        as parsing both: display name and call from the last record, data only used when
+        the leg is created (remote address, protocol, time) from the first
+        """
+        leg = self.get_update_leg()
+        for child in other.get_update_leg():
+            if child.tag not in ('displayName', 'call'):
+                continue
+            if child.tag == 'call' and not child.text:
+                continue
+            existing = leg.find(child.tag)
+            if existing is not None:
+                existing.text = child.text
+            else:
+                leg.append(child)
+        self.cdr_logs.extend(log for log in other.cdr_logs if log not in self.cdr_logs)
+
+
+def coalesce_records(records: Iterable[BatchRecord]) -> List[BatchRecord]:
+    """
+    Merge consecutive callLegUpdate records for the same leg, i.e. updates without any
+    other record for that leg in between. Order of the remaining records is kept
+    """
+    result: List[BatchRecord] = []
+    pending: Dict[str, BatchRecord] = {}
+
+    for record in records:
+        leg = record.get_update_leg()
+        if leg is not None:
+            first = pending.get(leg.get('id'))
+            if first is not None:
+                first.merge_update(record)
+                continue
+            pending[leg.get('id')] = record
+        elif record.type in ('callStart', 'callEnd'):
+            pending.clear()
+        else:
+            for guid in record.get_guids():
+                pending.pop(guid, None)
+
+        result.append(record)
+
+    return result
+
+
+class BatchParser(Parser):
+    """
+    Parse many CMS CDR payloads at once, e.g. drained from statistics.cdr_stream.
+
+    Records are handled in the same order as they were received, but intermediate
+    callLegUpdate records are coalesced, existing calls and legs are loaded using a few
+    queries instead of one locked query per record, rows for new calls and legs are
+    created using bulk_create, and leg updates and log relations are written in bulk.
+    Records are committed in transactions of TRANSACTION_CHUNK_SIZE records
+    """
+
+    def __init__(self, server: Server, debug=False):
+        super().__init__(server, debug=debug)
+
+        self.calls: Dict[str, Call] = {}
+        self.legs: Dict[str, Leg] = {}
+
+        # empty rows created in bulk for guids that don't exist yet, populated when first used
+        self.new_calls: Dict[str, Call] = {}
+        self.new_legs: Dict[str, Leg] = {}
+        self.record_created: List[Tuple[Dict[str, Union[Call, Leg]], str, Union[Call, Leg]]] = []
+
+        self.cdr_logs: List['AcanoCDRLog'] = []
+        self.dirty_legs: Dict[int, Tuple[Leg, Set[str]]] = {}
+        self.log_relations: Dict[type, Set[Tuple[int, int]]] = defaultdict(set)
+        self.record_log_relations: List[Tuple[type, int, int]] = []
+        self.defer_leg_updates = False
+
+    def parse_payloads(self, payloads: Sequence[Tuple[Union[str, bytes], Optional['AcanoCDRLog']]]):
+
+        records = []
+        for payload, cdr_log in payloads:
+            if isinstance(payload, str):
+                payload = payload.encode('utf-8')
+            try:
+                root = ET.fromstring(payload)
+            except ET.ParseError:
+                if RERAISE_ERRORS:
+                    raise
+                capture_exception()
+                continue
+            records.extend(BatchRecord(record, cdr_log) for record in root)
+
+        return self.parse_records(records)
+
+    def parse_records(self, records: Sequence[BatchRecord]):
+
+        records = coalesce_records(records)
+
+        for chunk in _chunks(records, TRANSACTION_CHUNK_SIZE):
+            with transaction.atomic():
+                self.prefetch(chunk)
+                self.create_new(chunk)
+
+                for record in chunk:
+                    self.parse_batch_record(record)
+
+                self.defer_leg_updates = False
+                self.flush()
+                self.delete_unused()
+
+        return len(records)
+
+    def parse_batch_record(self, record: BatchRecord):
+        self.cdr_logs = record.cdr_logs
+        self.cdr_log = record.cdr_logs[0] if record.cdr_logs else None
+        self.defer_leg_updates = record.type == 'callLegUpdate'
+        self.record_log_relations = []
+        self.record_created = []
+        try:
+            with transaction.atomic():
+                self.parse_record(record.record)
+        except Exception:
+            if RERAISE_ERRORS:
+                raise
+            capture_exception()
+            # changes are rolled back, new rows are empty again
+            self.evict(record.get_guids())
+            for target, guid, obj in self.record_created:
+                target[guid] = obj.__class__(pk=obj.pk, server=self.server, guid=guid)
+            return
+
+        for model, obj_id, log_id in self.record_log_relations:
+            self.log_relations[model].add((obj_id, log_id))
+
+    def prefetch(self, records: Sequence[BatchRecord]):
+        "Load existing calls and legs for all guids in the batch"
+        call_guids = set()
+        leg_guids = set()
+        for record in records:
+            for child in record.record:
+                if child.tag == 'call':
+                    call_guids.add(child.get('id'))
+                elif child.tag == 'callLeg':
+                    leg_guids.add(child.get('id'))
+                    if child.findtext('./call'):
+                        call_guids.add(child.findtext('./call'))
+
+        legs = []
+        for chunk in _chunks(sorted(leg_guids - set(self.legs))):
+            legs.extend(Leg.objects.filter(server=self.server, guid__in=chunk).order_by('-pk'))
+        Leg.prefetch_sensor_values(legs)
+
+        calls = []
+        for chunk in _chunks(sorted(call_guids - set(self.calls))):
+            calls.extend(Call.objects.filter(server=self.server, guid__in=chunk).order_by('-pk'))
+
+        call_ids = {leg.call_id for leg in legs if leg.call_id} - {call.pk for call in calls}
+        for chunk in _chunks(sorted(call_ids)):
+            calls.extend(Call.objects.filter(pk__in=chunk))
+
+        # reversed order, lowest pk wins for duplicates
+        self.calls.update((call.guid, call) for call in calls)
+        calls_by_id = {call.pk: call for call in self.calls.values()}
+
+        for leg in legs:
+            if leg.call_id in calls_by_id:
+                leg.call = calls_by_id[leg.call_id]
+            self.legs[leg.guid] = leg
+
+    def create_new(self, records: Sequence[BatchRecord]):
+        "Create empty rows for calls and legs in records which don't exist yet, using bulk_create"
+        call_guids = set()
+        leg_guids = set()
+        for record in records:
+            for child in record.record:
+                if child.tag == 'call':
+                    call_guids.add(child.get('id'))
+                elif child.tag == 'callLeg':
+                    call_guid = child.findtext('./call')
+                    if call_guid:
+                        call_guids.add(call_guid)
+                    elif record.type == 'callLegStart':  # stored as possible spam leg
+                        continue
+                    leg_guids.add(child.get('id'))
+
+        call_guids -= set(self.calls) | set(self.new_calls) | {None}
+        leg_guids -= set(self.legs) | set(self.new_legs) | {None}
+        if not call_guids and not leg_guids:
+            return
+
+        self.server.acquire_lock('leg')  # until unique constraint on Leg.server|guid
+        for model, guids, target in ((Call, call_guids, self.new_calls), (Leg, leg_guids, self.new_legs)):
+            for chunk in _chunks(sorted(guids)):
+                existing = set(model.objects.filter(server=self.server, guid__in=chunk).values_list('guid', flat=True))
+                model.objects.bulk_create([model(server=self.server, guid=guid) for guid in chunk if guid not in existing])
+                target.update(
+                    (obj.guid, obj)
+                    for obj in model.objects.filter(server=self.server, guid__in=set(chunk) - existing).only('pk', 'guid')
+                )
+
+    def delete_unused(self):
+        "Remove rows created by create_new which were not used by any record, e.g. spam legs"
+        if self.new_legs:
+            Leg.objects.filter(pk__in=[leg.pk for leg in self.new_legs.values()]).delete()
+            self.new_legs.clear()
+        if self.new_calls:
+            Call.objects.filter(pk__in=[call.pk for call in self.new_calls.values()]).delete()
+            self.new_calls.clear()
+
+    def populate_new(self, target: Dict[str, Union[Call, Leg]], guid: str, data: dict):
+        "Save data for a row created by create_new, the same way as get_or_create would"
+        empty = target.pop(guid)
+        self.record_created.append((target, guid, empty))
+
+        obj = empty.__class__(pk=empty.pk, server=self.server, guid=guid, **data)
+        obj.save()
+        self.add_cdr_log(obj)
+        return obj
+
+    def evict(self, guids: Iterable[str]):
+        for guid in guids:
+            self.calls.pop(guid, None)
+            leg = self.legs.pop(guid, None)
+            if leg:
+                self.dirty_legs.pop(leg.pk, None)
+
+    def flush(self):
+        "Write pending leg updates and log relations"
+        by_fields: Dict[Tuple[str, ...], List[Leg]] = defaultdict(list)
+        for leg, fields in self.dirty_legs.values():
+            by_fields[tuple(sorted(fields))].append(leg)
+        self.dirty_legs.clear()
+
+        for fields, legs in by_fields.items():
+            Leg.objects.bulk_update(legs, fields)
+            live_state.legs_updated(legs)
+
+        for model, relations in self.log_relations.items():
+            field = model.acano_cdr_event_logs
+            through = field.through
+            from_field = field.field.m2m_field_name() + '_id'
+            to_field = field.field.m2m_reverse_field_name() + '_id'
+            through.objects.bulk_create(
+                [through(**{from_field: obj_id, to_field: log_id}) for obj_id, log_id in relations],
+                ignore_conflicts=True,
+            )
+        self.log_relations.clear()
+
+    def add_cdr_log(self, obj: Union[Call, Leg]):
+        for cdr_log in self.cdr_logs:
+            self.record_log_relations.append((obj.__class__, obj.pk, cdr_log.pk))
+
+    def get_call(self, guid, update_data=None):
+
+        obj = self.calls.get(guid)
+        if obj is None and guid in self.new_calls:
+            tenant_fallback = update_data.pop('tenant_fallback', None)
+            create_data = update_data.copy()
+            if tenant_fallback and not update_data.get('tenant'):
+                create_data['tenant'] = tenant_fallback
+            obj = self.calls[guid] = self.populate_new(self.new_calls, guid, create_data)
+            return obj
+        if obj is None:
+            obj = self.calls[guid] = super().get_call(guid, update_data=update_data)
+            return obj
+
+        update_data.pop('tenant_fallback', None)
+        if update_data:
+            maybe_update(obj, update_data)
+
+        self.add_cdr_log(obj)
+        return obj
+
+    def get_call_leg(self, guid, call, update_data=None, fallback_data=None):
+
+        obj = self.legs.get(guid)
+        if obj is None and guid in self.new_legs:
+            if call:
+                call = self.get_call(call, update_data={'tenant_fallback': update_data.get('tenant')})
+                if call.tenant:
+                    update_data['tenant'] = call.tenant
+                update_data['call'] = call
+            obj = self.legs[guid] = self.populate_new(self.new_legs, guid, {**update_data, **(fallback_data or {})})
+            return obj
+        if obj is None:
+            obj = self.legs[guid] = super().get_call_leg(
+                guid, call, update_data=update_data, fallback_data=fallback_data
+            )
+            return obj
+
+        if call:
+            call = self.get_call(call, update_data={'tenant_fallback': update_data.get('tenant')})
+            if call.tenant:
+                update_data['tenant'] = call.tenant
+        else:
+            call = None
+
+        update_data = update_data or {}
+        if call:
+            update_data['call'] = call
+
+        if self.defer_leg_updates:
+            changed = update_changed_fields(obj, update_data)
+            if changed and not (set(changed) - DEFERRED_LEG_FIELDS):
+                self.dirty_legs.setdefault(obj.pk, (obj, set()))[1].update(changed)
+            elif changed:
+                obj.save()
+        elif update_data:
+            maybe_update(obj, update_data)
+
+        self.add_cdr_log(obj)
+        return obj
+
+    def finalize_call(self, call, commit=None):
+        # legs are changed in database when call ends. write pending changes and reload if needed
+        self.flush()
+        result = super().finalize_call(call, commit=commit)
+        self.evict([guid for guid, leg in self.legs.items() if leg.call_id == call.pk])
+        return result
+
+
+def _chunks(items: Sequence, size=PREFETCH_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -535,6 +535,15 @@ class PexipParser(PexipParserBase):
 
 
 class PexipEventParser(PexipParserBase):
+    def add_cdr_log(self, obj, *cdr_logs: PexipEventLog):
+        try:
+            obj.pexip_cdr_event_logs.add(*cdr_logs)
+        except IntegrityError:  # should always work but has race condition. django bug?
+            pass
+
+    def update_leg(self, leg: Leg, leg_data: Dict):
+        return maybe_update(leg, leg_data)
+
     def parse_eventsink_event(self, event, cdr_log=None):
 
         if not event or not event.get('data'):
@@ -595,7 +604,7 @@ class PexipEventParser(PexipParserBase):
             call.cdr_state_info = data if not call.ts_stop else None
 
         if cdr_log:
-            call.pexip_cdr_event_logs.add(cdr_log)
+            self.add_cdr_log(call, cdr_log)
 
         return call
 
@@ -751,17 +760,14 @@ class PexipEventParser(PexipParserBase):
                     should_increase_state = False
                     should_decrease_state = False
                 else:
-                    changed = maybe_update(leg, leg_data)
+                    changed = self.update_leg(leg, leg_data)
 
         leg.cdr_state_info = event['data'] if not leg.ts_stop else None
 
         if created:  # add existing events
             existing_events = PexipEventLog.objects.filter(ts_created__gt=participant['ts_start'] - timedelta(minutes=5),
                                                            uuid_start__startswith=guid[:36]).only('id')
-            try:
-                leg.pexip_cdr_event_logs.add(*existing_events)
-            except IntegrityError:
-                pass
+            self.add_cdr_log(leg, *existing_events)
 
         if not created and changed:
             # participant may change call and customer, e.g. ivr -> conference
@@ -769,10 +775,7 @@ class PexipEventParser(PexipParserBase):
                                                            guid=conversation_id, name=participant['name'][:300])
 
         if cdr_log:
-            try:
-                leg.pexip_cdr_event_logs.add(cdr_log)
-            except IntegrityError:  # should always work but has race condition. django bug?
-                pass
+            self.add_cdr_log(leg, cdr_log)
 
         if should_decrease_state:  # sometimes a participant can be ivr, and become conference just for disconnect
             logger.info('Decrease participant for conversation %s (leg %s) with tenant %s. gateway=%s', conversation_id, guid, participant.get('tenant'), is_gateway)
@@ -0,0 +1,208 @@
+from collections import defaultdict
+from copy import copy
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from sentry_sdk import capture_exception
+
+from debuglog.models import PexipEventLog
+from shared.utils import update_changed_fields
+from ..models import Leg, buffer_cdr_state
+from .pexip import PexipEventParser
+
+RERAISE_ERRORS = settings.DEBUG or getattr(settings, 'TEST_MODE', False)
+
+
+class BatchEvent:
+    __slots__ = ('event', 'cdr_logs')
+
+    def __init__(self, event: Dict, cdr_log: Optional[PexipEventLog] = None):
+        self.event = event
+        self.cdr_logs = [cdr_log] if cdr_log else []
+
+    @property
+    def data(self) -> Dict:
+        data = self.event.get('data')
+        return data if isinstance(data, dict) else {}
+
+    def get_participant_key(self) -> Optional[Tuple[str, str]]:
+        "Key for participant_updated events, which can be coalesced"
+        if self.event.get('event') != 'participant_updated':
+            return None
+        key = (self.data.get('call_id') or '', self.data.get('uuid') or '')
+        if key == ('', ''):
+            return None
+        return key
+
+
+def coalesce_events(events: Sequence[BatchEvent]) -> List[BatchEvent]:
+    """
+    Replace consecutive participant_updated events for the same participant with the
+    last one, since each update contains the full participant state. Any other event
+    type, or an update for another participant in the same conversation, ends the run
+    """
+    result: List[BatchEvent] = []
+    pending: Dict[Tuple[str, str], int] = {}
+    conversations: Dict[str, Tuple[str, str]] = {}
+
+    for event in events:
+        key = event.get_participant_key()
+        if key is None:
+            pending.clear()
+            conversations.clear()
+            result.append(event)
+            continue
+
+        conversation_id = event.data.get('conversation_id') or ''
+        if conversation_id and conversations.get(conversation_id, key) != key:
+            pending.pop(conversations[conversation_id], None)
+        if conversation_id:
+            conversations[conversation_id] = key
+
+        index = pending.get(key)
+        if index is not None:
+            previous = result[index]
+            result[index] = event
+            event.cdr_logs = previous.cdr_logs + [log for log in event.cdr_logs if log not in previous.cdr_logs]
+            continue
+
+        pending[key] = len(result)
+        result.append(event)
+
+    return result
+
+
+class PexipEventBatchParser(PexipEventParser):
+    """
+    Parse many eventsink events at once, e.g. drained from statistics.cdr_stream.
+    All events for a conference must be in the same batch stream to keep the order.
+
+    Intermediate participant_updated events are coalesced, legs are reused between
+    events instead of being locked and loaded again, and leg changes and log relations
+    are written once per batch. Everything is committed in a single transaction, and
+    cdr state for active calls and legs is written to the cache after it.
+
+    A participant can move between conferences (e.g. from ivr), so its events may be
+    handled by batches for other conferences at the same time. Existing legs for all
+    participants in the batch are locked in a fixed order before the first event, so
+    concurrent batches wait for each other instead of overwriting changes or deadlocking
+    """
+
+    def __init__(self, server, debug=False):
+        super().__init__(server, debug=debug)
+
+        self.legs: Dict[str, Leg] = {}
+        self.dirty_legs: Dict[int, Leg] = {}
+        self.cdr_logs: List[PexipEventLog] = []
+        self.log_relations: Dict[type, Set[Tuple[int, int]]] = defaultdict(set)
+        self.event_log_relations: List[Tuple[type, int, int]] = []
+        self.event_legs: Dict[str, Optional[Tuple[Leg, bool]]] = {}
+
+    def parse_eventsink_events(self, events: Sequence[Tuple[Dict, Optional[PexipEventLog]]]):
+
+        batch = coalesce_events([BatchEvent(event, cdr_log) for event, cdr_log in events if event])
+
+        with buffer_cdr_state(), transaction.atomic():
+            self.lock_legs(batch)
+
+            for item in batch:
+                self.cdr_logs = item.cdr_logs
+                self.event_log_relations = []
+                self.event_legs = {}
+
+                if (item.event.get('event') or '').startswith('conference_'):
+                    self.flush_legs()  # call end checks for active legs in database
+
+                try:
+                    with transaction.atomic():
+                        self.parse_eventsink_event(item.event, cdr_log=item.cdr_logs[0] if item.cdr_logs else None)
+                except Exception:
+                    if RERAISE_ERRORS:
+                        raise
+                    capture_exception()
+                    self.restore_legs()
+                    continue
+
+                for model, obj_id, log_id in self.event_log_relations:
+                    self.log_relations[model].add((obj_id, log_id))
+
+            self.flush()
+
+        return len(batch)
+
+    def lock_legs(self, batch: Sequence[BatchEvent]) -> List[int]:
+        "Lock existing legs of all participants in batch. Returns ids of locked legs"
+        guids: Set[str] = set()
+        for item in batch:
+            if (item.event.get('event') or '').startswith('participant_'):
+                guids.update(filter(None, (item.data.get('call_id'), item.data.get('uuid'))))
+
+        if not guids:
+            return []
+
+        return list(
+            Leg.objects.filter(server=self.server, guid__in=sorted(guids))
+            .order_by('pk')
+            .select_for_update(of=('self',))
+            .values_list('pk', flat=True)
+        )
+
+    def get_or_create_leg(self, call, guid, participant_data):
+
+        leg = self.legs.get(guid)
+        if leg is not None:
+            self.event_legs.setdefault(guid, (copy(leg), leg.pk in self.dirty_legs))
+            return leg, False
+
+        leg, created = super().get_or_create_leg(call, guid, participant_data)
+        self.event_legs.setdefault(guid, None)
+        self.legs[guid] = leg
+        return leg, created
+
+    def restore_legs(self):
+        "Restore legs to state before current event, which has been rolled back"
+        for guid, previous in self.event_legs.items():
+            leg = self.legs.pop(guid, None)
+            if leg is None:
+                continue
+            self.dirty_legs.pop(leg.pk, None)
+            if previous is not None:
+                previous_leg, was_dirty = previous
+                self.legs[guid] = previous_leg
+                if was_dirty:
+                    self.dirty_legs[previous_leg.pk] = previous_leg
+        self.event_legs = {}
+
+    def update_leg(self, leg: Leg, leg_data: Dict):
+        changed = update_changed_fields(leg, leg_data)
+        if changed:
+            self.dirty_legs[leg.pk] = leg
+        return changed
+
+    def add_cdr_log(self, obj, *cdr_logs: PexipEventLog):
+        # all logs for coalesced events
+        for cdr_log in {*cdr_logs, *self.cdr_logs}:
+            if cdr_log.pk:
+                self.event_log_relations.append((obj.__class__, obj.pk, cdr_log.pk))
+
+    def flush_legs(self):
+        "Save changed legs once, with the result of all handled events"
+        dirty_legs, self.dirty_legs = self.dirty_legs, {}
+        Leg.prefetch_sensor_values(dirty_legs.values())
+        for leg in dirty_legs.values():
+            leg.save()
+
+    def flush(self):
+        self.flush_legs()
+
+        for model, relations in self.log_relations.items():
+            field = model.pexip_cdr_event_logs
+            through = field.through
+            from_field = field.field.m2m_field_name() + '_id'
+            to_field = field.field.m2m_reverse_field_name() + '_id'
+            through.objects.bulk_create(
+                [through(**{from_field: obj_id, to_field: log_id}) for obj_id, log_id in relations],
+                ignore_conflicts=True,
+            )
+        self.log_relations.clear()
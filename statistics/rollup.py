@@ -0,0 +1,380 @@
+"""
+Hourly call statistics, stored in HourlyCallStats to avoid loading and splitting all legs
+for each report.
+
+Rows are stored per UTC hour for each tenant, ou, organization unit and target combination,
+and a total row (is_total=True) for each hour, including hours without calls. A total row
+marks the hour as calculated, hours without one are read from the legs instead.
+
+Calls and legs are counted in the hour they started. The call statistics dashboard reads
+totals and hourly call seconds from the stored rows when its filters are supported, see
+is_representable.
+
+Hours are recalculated when a call has been finalized (ts_finalized is set) and after
+rewrites by statistics.cleanup, if settings.STATS_ROLLUP is enabled. Hours from the start
+of a leg that is still active are not stored, since its time is not known yet. Use the
+statistics_rollup management command to backfill or to check stored values.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils.timezone import localtime, now, utc
+
+from statistics.models import Call, HourlyCallStats, Leg, Server
+from statistics.types import LegData
+
+HOUR = timedelta(hours=1)
+
+# Wait for more ended calls before recalculating
+UPDATE_DELAY = 60
+
+# Legs without ts_stop that started earlier than this are never ended, e.g. missing events
+ACTIVE_LEG_MAX_AGE = timedelta(hours=48)
+
+StatsKey = Optional[Tuple[str, str, Optional[int], str]]  # tenant, ou, org_unit, target
+TOTAL: StatsKey = None
+
+
+class HourStats:
+    __slots__ = ('call_seconds', 'guest_seconds', 'started_calls', 'started_legs')
+
+    def __init__(self):
+        self.call_seconds = 0.0
+        self.guest_seconds = 0.0
+        self.started_calls = 0
+        self.started_legs = 0
+
+    def add(self, other: 'HourStats'):
+        for field in self.__slots__:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+
+class StatsDifference(NamedTuple):
+    ts_hour: datetime
+    key: StatsKey
+    field: str
+    stored: float
+    expected: float
+
+
+def floor_hour(ts: datetime) -> datetime:
+    ts = ts.astimezone(utc)
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def ceil_hour(ts: datetime) -> datetime:
+    hour = floor_hour(ts)
+    return hour if hour == ts else hour + HOUR
+
+
+def iter_hours(ts_start: datetime, ts_stop: datetime) -> Iterable[datetime]:
+    hour = floor_hour(ts_start)
+    while hour < ts_stop:
+        yield hour
+        hour += HOUR
+
+
+def get_legs(server: Server, ts_start: datetime, ts_stop: datetime) -> List[LegData]:
+    """
+    Legs active between ``ts_start`` and ``ts_stop``, including all legs of their calls
+    so that the first leg of each call is known
+    """
+    from statistics.utils.leg_collection import populate_legs
+
+    calls = Call.objects.filter(server=server, ts_start__lt=ts_stop, ts_stop__gt=ts_start)
+    legs = Leg.objects.filter(server=server, should_count_stats=True) \
+        .filter(Q(ts_start__lt=ts_stop, ts_stop__gt=ts_start) | Q(call__in=calls.values_list('id'))) \
+        .order_by('ts_start')
+
+    return populate_legs(legs)[0]
+
+
+def get_first_active_start(server: Server, ts_stop: datetime) -> Optional[datetime]:
+    "Start of the first leg that is still active and started before ``ts_stop``"
+    return Leg.objects.filter(
+        server=server,
+        ts_stop__isnull=True,
+        ts_start__gte=now() - ACTIVE_LEG_MAX_AGE,
+        ts_start__lt=ts_stop,
+    ).order_by('ts_start').values_list('ts_start', flat=True).first()
+
+
+def calculate_hourly_stats(
+    legs: Sequence[LegData], ts_start: datetime, ts_stop: datetime
+) -> Dict[datetime, Dict[StatsKey, HourStats]]:
+    """
+    Sum statistics per hour and key for ``ts_start`` - ``ts_stop``. ``legs`` must be
+    ordered by ts_start. Every hour in the range has a TOTAL item. Partial hours at the
+    ends of the range only include time and starts within the range
+    """
+    result: Dict[datetime, Dict[StatsKey, HourStats]] = {
+        hour: {TOTAL: HourStats()} for hour in iter_hours(ts_start, ts_stop)
+    }
+
+    def _get(hour: datetime, key: StatsKey) -> HourStats:
+        stats = result[hour]
+        if key not in stats:
+            stats[key] = HourStats()
+        return stats[key]
+
+    started_calls = set()
+
+    for leg in legs:
+        keys = (TOTAL, (leg.tenant, leg.ou, leg.org_unit, leg.target))
+        leg_start, leg_stop = leg.ts_start.astimezone(utc), leg.ts_stop.astimezone(utc)
+        is_started = ts_start <= leg_start < ts_stop
+
+        for key in keys:
+            if (leg.call_id, key) not in started_calls:
+                started_calls.add((leg.call_id, key))
+                if is_started:
+                    _get(floor_hour(leg_start), key).started_calls += 1
+            if is_started:
+                _get(floor_hour(leg_start), key).started_legs += 1
+
+        if leg_stop <= ts_start or leg_start >= ts_stop:
+            continue
+
+        for hour in iter_hours(max(leg_start, ts_start), min(leg_stop, ts_stop)):
+            seconds = (min(leg_stop, hour + HOUR, ts_stop) - max(leg_start, hour, ts_start)).total_seconds()
+            for key in keys:
+                stats = _get(hour, key)
+                stats.call_seconds += seconds
+                if leg.is_guest:
+                    stats.guest_seconds += seconds
+
+    return result
+
+
+def update_hourly_stats(server: Server, ts_start: datetime, ts_stop: datetime) -> int:
+    """
+    Recalculate stored statistics for all hours touching ``ts_start`` - ``ts_stop``, except
+    the current hour and hours with legs that are still active. Returns number of stored rows
+    """
+    ts_start = floor_hour(ts_start)
+    ts_stop = min(ceil_hour(ts_stop), floor_hour(now()))
+
+    active_start = get_first_active_start(server, ts_stop)
+    if active_start:
+        ts_stop = min(ts_stop, floor_hour(active_start))
+
+    if ts_stop <= ts_start:
+        return 0
+
+    hours = calculate_hourly_stats(get_legs(server, ts_start, ts_stop), ts_start, ts_stop)
+
+    rows = []
+    for hour, hour_stats in hours.items():
+        for key, stats in hour_stats.items():
+            tenant, ou, org_unit, target = key or ('', '', None, '')
+            rows.append(HourlyCallStats(
+                server=server,
+                ts_hour=hour,
+                is_total=key is TOTAL,
+                tenant=tenant[:64],
+                ou=ou[:200],
+                org_unit_id=org_unit,
+                target=target[:300],
+                call_seconds=stats.call_seconds,
+                guest_seconds=stats.guest_seconds,
+                started_calls=stats.started_calls,
+                started_legs=stats.started_legs,
+            ))
+
+    with transaction.atomic():
+        HourlyCallStats.objects.filter(server=server, ts_hour__gte=ts_start, ts_hour__lt=ts_stop).delete()
+        HourlyCallStats.objects.bulk_create(rows)
+
+    return len(rows)
+
+
+def check_hourly_stats(server: Server, ts_start: datetime, ts_stop: datetime) -> List[StatsDifference]:
+    """
+    Compare stored statistics with values calculated from legs. Missing hours are not
+    included, use update_hourly_stats to backfill
+    """
+    ts_start = floor_hour(ts_start)
+    ts_stop = min(ceil_hour(ts_stop), floor_hour(now()))
+
+    stored: Dict[datetime, Dict[StatsKey, HourlyCallStats]] = defaultdict(dict)
+    for row in HourlyCallStats.objects.filter(server=server, ts_hour__gte=ts_start, ts_hour__lt=ts_stop):
+        key = TOTAL if row.is_total else (row.tenant, row.ou, row.org_unit_id, row.target)
+        stored[row.ts_hour.astimezone(utc)][key] = row
+
+    if not stored:
+        return []
+
+    expected = calculate_hourly_stats(get_legs(server, ts_start, ts_stop), ts_start, ts_stop)
+
+    result = []
+    for hour, rows in sorted(stored.items()):
+        expected_rows = expected.get(hour, {})
+        for key in set(rows) | set(expected_rows):
+            row, stats = rows.get(key), expected_rows.get(key)
+            for field in HourStats.__slots__:
+                stored_value = getattr(row, field) if row else 0
+                expected_value = getattr(stats, field) if stats else 0
+                if abs(stored_value - expected_value) > 0.01:
+                    result.append(StatsDifference(hour, key, field, stored_value, expected_value))
+
+    return result
+
+
+def schedule_update(server_id: int, ts_start: datetime, ts_stop: datetime = None):
+    """
+    Recalculate each affected day in the background, after a short delay to include calls
+    ending at the same time
+    """
+    from statistics import tasks
+
+    ts_stop = ts_stop or now()
+    if settings.TEST_MODE:
+        update_hourly_stats(Server.objects.get(pk=server_id), ts_start, ts_stop)
+        return
+
+    day = floor_hour(ts_start).replace(hour=0)
+    while day < ts_stop:
+        cache_key = 'statistics.rollup.scheduled.{}.{}'.format(server_id, day.date())
+        if cache.add(cache_key, 1, UPDATE_DELAY):
+            tasks.update_stats_rollup.apply_async(
+                [server_id, day.isoformat(), (day + timedelta(days=1)).isoformat()], countdown=UPDATE_DELAY
+            )
+        day += timedelta(days=1)
+
+
+def call_updated(sender, instance: Call, **kwargs):
+    "Recalculate hours of call when it has been finalized, i.e. ts_finalized is changed"
+    if not getattr(settings, 'STATS_ROLLUP', False):
+        return
+    if not instance.ts_finalized or instance.ts_finalized == getattr(instance, '_loaded_ts_finalized', None):
+        return
+
+    instance._loaded_ts_finalized = instance.ts_finalized
+    if instance.ts_start and instance.ts_stop and instance.server_id:
+        schedule_update(instance.server_id, instance.ts_start, instance.ts_stop)
+
+
+def history_rewritten(ts_start: datetime = None, ts_stop: datetime = None, server: Server = None):
+    """Recalculate stored hours after legs have been changed by statistics.cleanup"""
+    if not getattr(settings, 'STATS_ROLLUP', False):
+        return
+
+    servers = [server] if server else Server.objects.filter(hourlycallstats__isnull=False).distinct()
+    for cur in servers:
+        cur_start = ts_start
+        if not cur_start:
+            first = HourlyCallStats.objects.filter(server=cur).order_by('ts_hour').first()
+            if not first:
+                continue
+            cur_start = first.ts_hour
+        schedule_update(cur.pk if isinstance(cur, Server) else cur, cur_start, ts_stop)
+
+
+def is_representable(cleaned_data: dict) -> bool:
+    """
+    Check if the total call seconds for the report filters can be read from stored stats
+    """
+    if not getattr(settings, 'STATS_ROLLUP', False) or not cleaned_data:
+        return False
+
+    server = cleaned_data.get('server')
+    if not server or server.is_endpoint or not cleaned_data.get('multitenant'):
+        return False
+
+    if not cleaned_data.get('ts_start') or not cleaned_data.get('ts_stop'):
+        return False
+
+    for key in ('tenant', 'ou', 'cospace', 'member', 'protocol', 'only_gateway', 'organization'):
+        if cleaned_data.get(key):
+            return False
+    if cleaned_data.get('endpoints') is not None:
+        return False
+
+    # labels are local hours
+    for ts in (cleaned_data['ts_start'], cleaned_data['ts_stop']):
+        if localtime(ts).utcoffset().total_seconds() % 3600:
+            return False
+
+    return True
+
+
+def _get_stored_totals(
+    servers: Sequence[Server], ts_start: datetime, ts_stop: datetime
+) -> Tuple[List[HourlyCallStats], List[Tuple[datetime, datetime]]]:
+    """
+    Stored total rows for complete hours that are stored for all servers, and the spans
+    of ``ts_start`` - ``ts_stop`` that must be calculated from legs instead
+    """
+    rows = list(HourlyCallStats.objects.filter(
+        server__in=servers,
+        is_total=True,
+        ts_hour__gte=ceil_hour(ts_start),
+        ts_hour__lt=floor_hour(ts_stop),
+    ))
+
+    stored = defaultdict(set)
+    for row in rows:
+        stored[row.ts_hour.astimezone(utc)].add(row.server_id)
+
+    raw_spans: List[Tuple[datetime, datetime]] = []
+    cur = ts_start
+    for hour in iter_hours(ceil_hour(ts_start), floor_hour(ts_stop)):
+        if len(stored.get(hour, ())) == len(servers):
+            if cur < hour:
+                raw_spans.append((cur, hour))
+            cur = hour + HOUR
+    if cur < ts_stop:
+        raw_spans.append((cur, ts_stop))
+
+    complete = [row for row in rows if len(stored[row.ts_hour.astimezone(utc)]) == len(servers)]
+    return complete, raw_spans
+
+
+def get_call_seconds_per_hour(servers: Sequence[Server], ts_start: datetime, ts_stop: datetime) -> Dict[str, float]:
+    """
+    Total call seconds per local hour, using the same labels as
+    LegCollection.get_grouped_call_seconds_per__hour. Stored hours are used for complete
+    hours, legs are loaded for the rest of the time span
+    """
+    from statistics.utils.leg_collection import LegCollection
+
+    result: Counter = Counter()
+
+    rows, raw_spans = _get_stored_totals(servers, ts_start, ts_stop)
+    for row in rows:
+        if row.call_seconds:
+            result[localtime(row.ts_hour).strftime('%Y-%m-%d %H:00')] += row.call_seconds
+
+    for span_start, span_stop in raw_spans:
+        legs = Leg.objects.filter(
+            server__in=servers, should_count_stats=True, ts_stop__gte=span_start, ts_start__lte=span_stop
+        ).order_by('ts_start')
+        total = LegCollection.from_queryset(legs, span_start, span_stop).get_grouped_call_seconds_per__hour()[3]
+        result.update(total.get('', {}))
+
+    return dict(result)
+
+
+def get_totals(servers: Sequence[Server], ts_start: datetime, ts_stop: datetime) -> HourStats:
+    """
+    Total statistics for ``ts_start`` - ``ts_stop``. Stored hours are used for complete
+    hours, legs are loaded for the rest of the time span
+    """
+    result = HourStats()
+
+    rows, raw_spans = _get_stored_totals(servers, ts_start, ts_stop)
+    for row in rows:
+        result.add(row)
+
+    for span_start, span_stop in raw_spans:
+        for server in servers:
+            hours = calculate_hourly_stats(get_legs(server, span_start, span_stop), span_start, span_stop)
+            for hour_stats in hours.values():
+                result.add(hour_stats[TOTAL])
+
+    return result
@@ -60,6 +60,73 @@ def handle_acano_cdr(server_id: int, payload: Union[str, bytes], cdr_log_id=None
         capture_exception()
 
 
+@app.task
+def drain_acano_cdr_stream():
+    from statistics import cdr_stream
+
+    if not cdr_stream.is_enabled():
+        return
+
+    stream = cdr_stream.AcanoCDRStream()
+    count = cdr_stream.drain(stream, cdr_stream.handle_acano_entries)
+    if count and len(stream):
+        drain_acano_cdr_stream.delay()  # time limit reached or new entries during last batch
+
+
+@app.task
+def drain_pexip_event_stream(partition: int):
+    from statistics import cdr_stream
+
+    if not cdr_stream.is_enabled():
+        return
+
+    stream = cdr_stream.PexipEventStream(partition)
+    count = cdr_stream.drain(stream, cdr_stream.handle_pexip_entries)
+    if count and len(stream):
+        drain_pexip_event_stream.delay(partition)  # time limit reached or new entries during last batch
+
+
+@app.task
+def drain_cdr_streams():
+    "Schedule consumers for non empty streams, in case a scheduled run has been lost"
+    from statistics import cdr_stream
+
+    if not cdr_stream.is_enabled():
+        return
+
+    if len(cdr_stream.AcanoCDRStream()):
+        drain_acano_cdr_stream.delay()
+
+    for stream in cdr_stream.PexipEventStream.get_all():
+        if len(stream):
+            drain_pexip_event_stream.delay(stream.partition)
+
+
+@app.task
+def reconcile_live_call_state():
+    "Rebuild active calls and legs in statistics.live_state from the database"
+    from statistics import live_state
+
+    live_state.reconcile()
+
+
+@app.task
+def update_stats_rollup(server_id: int, ts_start: Union[datetime, str], ts_stop: Union[datetime, str]):
+    from statistics.models import Server
+    from statistics.rollup import update_hourly_stats
+
+    server = Server.objects.filter(pk=server_id).first()
+    if not server:
+        return
+
+    if isinstance(ts_start, str):
+        ts_start = parse_datetime(ts_start)
+    if isinstance(ts_stop, str):
+        ts_stop = parse_datetime(ts_stop)
+
+    update_hourly_stats(server, ts_start, ts_stop)
+
+
 @app.task
 def handle_pexip_cdr(server_id: int, payload: Union[str, bytes], cdr_log_id=None, remote_ip: str = None):
 
@@ -87,15 +154,10 @@ def handle_pexip_cdr(server_id: int, payload: Union[str, bytes], cdr_log_id=None
         capture_exception()
 
 
-def log_pexip_event(server: 'Server', payload: str, remote_ip: str):
-
-    from debuglog.models import PexipEventLog
-
-    cdr_log = None
+def get_pexip_log_kwargs(server: 'Server', payload: Union[str, bytes], remote_ip: str):
 
     data = {}
     uuid_start = None
-    server = None
 
     # extract data for log
     try:
@@ -109,15 +171,27 @@ def log_pexip_event(server: 'Server', payload: str, remote_ip: str):
         if RERAISE_ERRORS:
             raise
         capture_exception()
-    finally:
-        try:
-            cdr_log = PexipEventLog.objects.store(content=payload,
-                                        ip=remote_ip,
-                                        type=data.get('event', ''),
-                                        cluster_id=server.cluster_id if server else None,
-                                        uuid_start=uuid_start or '')
-        except Exception:
-            capture_exception()
+
+    return dict(
+        content=force_text(payload),
+        ip=remote_ip,
+        type=data.get('event', '') if isinstance(data, dict) else '',
+        cluster_id=server.cluster_id if server else None,
+        uuid_start=uuid_start or '',
+    )
+
+
+def log_pexip_event(server: 'Server', payload: str, remote_ip: str):
+
+    from debuglog.models import PexipEventLog
+
+    cdr_log = None
+
+    log_kwargs = get_pexip_log_kwargs(server, payload, remote_ip)
+    try:
+        cdr_log = PexipEventLog.objects.store(**log_kwargs)
+    except Exception:
+        capture_exception()
 
     return cdr_log
 
@@ -0,0 +1,195 @@
+import random
+from copy import copy
+from datetime import datetime, timedelta
+from unittest import skipIf
+from unittest.mock import patch
+
+from django.utils import timezone as tz
+from django.utils.timezone import get_current_timezone, make_aware
+
+from conferencecenter.tests.base import ConferenceBaseTest
+from statistics.graph import get_sametime_graph
+from statistics.types import LegData, LegRelatedTitles
+from statistics.utils import leg_columns
+from statistics.utils.leg_collection import LegCollection, LegCollectionRelatedData
+from statistics.utils.report import summarize
+
+
+def get_synthetic_legs(count, seed=1):
+    "Legs ordered by ts_start, with aligned and unaligned times, microseconds and a DST change"
+    rand = random.Random(seed)
+    timezone = get_current_timezone()
+
+    ts = make_aware(datetime(2021, 3, 28, 0, 0))
+    targets = ['user{}@example.org'.format(i) for i in range(50)] + ['']
+    ous = ['ou{}'.format(i) for i in range(5)] + ['']
+    tenants = ['tenant{}'.format(i) for i in range(3)] + ['']
+
+    legs = []
+    for i in range(count):
+        ts += timedelta(seconds=rand.choice([0, 1, 30, 60, 60 * 10]) * rand.random())
+        ts_start = ts
+        if i % 7 == 0:
+            ts_start = ts_start.replace(minute=0, second=0, microsecond=0 if i % 14 else 500000)
+
+        duration = rand.choice([1, 59, 60 * 60, 2 * 60 * 60, 26 * 60 * 60]) * rand.random() + (i % 3)
+        ts_stop = ts_start + timedelta(seconds=duration)
+        if i % 11 == 0:
+            ts_stop = ts_stop.replace(minute=0, second=0, microsecond=0)
+            if ts_stop <= ts_start:
+                ts_stop += timedelta(hours=1)
+
+        target, ou, tenant = rand.choice(targets), rand.choice(ous), rand.choice(tenants)
+        org_unit = rand.choice([None, 1, 2])
+
+        leg = LegData(
+            i,
+            ts_start.astimezone(timezone),
+            ts_stop.astimezone(timezone),
+            int((ts_stop - ts_start).total_seconds()),
+            target,
+            tenant,
+            ou,
+            rand.choice(['', 'cospace1', 'cospace2']),
+            'guid{}'.format(i),
+            '',
+            rand.randint(0, count // 3),
+            bool(i % 5 == 0),
+            org_unit,
+            '',
+            '',
+            None,
+            None,
+        )
+        leg.titles = LegRelatedTitles(
+            target,
+            leg.call__cospace_id or 'cospace',
+            tenant or 'Default',
+            ou or 'unknown',
+            'unit{}'.format(org_unit) if org_unit else 'unknown',
+        )
+        legs.append(leg)
+
+    legs.sort(key=lambda leg: leg.ts_start)
+    return legs
+
+
+@skipIf(not leg_columns.is_available(), 'numpy is not installed')
+class LegColumnsTestCase(ConferenceBaseTest):
+
+    def _get_collections(self, count, seed=1):
+        legs = get_synthetic_legs(count, seed=seed)
+        related_data = LegCollectionRelatedData(units={}, users={'user1@example.org': 'user1', 'user2@example.org': 'user2'})
+
+        collection = LegCollection(legs, related_data=related_data)
+        collection.columns = None
+
+        columnar = LegCollection(legs, related_data=related_data)
+        columnar.columns = leg_columns.LegColumns(legs)
+        return collection, columnar
+
+    def assertSameResult(self, first, second):
+        self.assertEqual(first, second)
+        # same order and types, e.g. for json and excel output
+        self.assertEqual(repr(first), repr(second))
+
+    def test_grouped_call_stats(self):
+        collection, columnar = self._get_collections(1000)
+
+        self.assertSameResult(collection.get_grouped_call_stats_per_day(), columnar.get_grouped_call_stats_per_day())
+        self.assertSameResult(collection.get_grouped_call_stats_per__hour(), columnar.get_grouped_call_stats_per__hour())
+        self.assertSameResult(
+            collection.get_grouped_call_stats_per_time_of_day(), columnar.get_grouped_call_stats_per_time_of_day()
+        )
+
+    def test_grouped_call_stats_dst_change(self):
+        with tz.override('Europe/Stockholm'):
+            collection, columnar = self._get_collections(1000, seed=2)
+            with patch.object(leg_columns, 'is_available', return_value=False):
+                expected = collection.get_grouped_call_stats_per__hour()
+            self.assertSameResult(expected, columnar.get_grouped_call_stats_per__hour())
+
+    def _get_chunk_counts(self, collection, **kwargs):
+        result = collection.grouped_legs_count_for_chunks(**kwargs)
+        # timestamps are normalized to current utc offset, compare order instead of repr
+        return result, [{title: list(counts) for title, counts in group.items()} for group in result]
+
+    def test_grouped_legs_count_for_chunks(self):
+        collection, columnar = self._get_collections(1000)
+
+        for resolution in (60, 600, 3600):
+            with patch.object(leg_columns, 'is_available', return_value=False):
+                expected = self._get_chunk_counts(collection, resolution_seconds=resolution)
+            self.assertEqual(expected, self._get_chunk_counts(columnar, resolution_seconds=resolution))
+
+    def test_max_concurrent(self):
+        collection, columnar = self._get_collections(300)
+        legs = collection.legs
+        resolution = 600
+
+        with patch.object(leg_columns, 'is_available', return_value=False):
+            sampled = collection.grouped_legs_count_for_chunks(resolution_seconds=resolution)
+        result = columnar.grouped_legs_count_for_chunks(resolution_seconds=resolution, max_concurrent=True)
+
+        for group, sampled_group in zip(result[:3], sampled[:3]):
+            self.assertEqual(set(group), set(sampled_group))
+
+        with patch.object(leg_columns, 'is_available', return_value=False):
+            python_result = collection.grouped_legs_count_for_chunks(resolution_seconds=resolution, max_concurrent=True)
+        self.assertEqual(python_result[3], result[3])
+        self.assertEqual(list(python_result[3]['']), sorted(python_result[3]['']))
+
+        step = timedelta(seconds=resolution)
+        total = result[3]['']
+        for ts, count in total.items():
+            self.assertGreaterEqual(count, sampled[3][''].get(ts, 0))
+
+            # brute force max of active legs at step start and at each leg start during step
+            times = [ts] + [leg.ts_start for leg in legs if ts < leg.ts_start < ts + step]
+            expected = max(sum(1 for leg in legs if leg.ts_start <= t <= leg.ts_stop) for t in times)
+            self.assertEqual(count, expected, ts)
+
+        # short legs during a step are included
+        short_leg = copy(legs[0])
+        short_leg.ts_start = make_aware(datetime(2021, 1, 1, 10, 1))
+        short_leg.ts_stop = make_aware(datetime(2021, 1, 1, 10, 2))
+        short_legs = LegCollection([short_leg, copy(short_leg)], related_data=collection.related_data)
+
+        self.assertEqual(short_legs.grouped_legs_count_for_chunks(resolution_seconds=resolution)[3], {})
+        self.assertEqual(
+            short_legs.grouped_legs_count_for_chunks(resolution_seconds=resolution, max_concurrent=True)[3],
+            {'': {make_aware(datetime(2021, 1, 1, 10, 0)): 2}},
+        )
+
+        # used by default for the same time graph, with or without numpy
+        self.assertEqual(get_sametime_graph(short_legs, resolution=10, as_json=True, max_concurrent=False), '')
+        graph = get_sametime_graph(short_legs, resolution=10, as_json=True)
+        self.assertEqual([line['y'] for line in graph['data']], [[2]])
+        with patch.object(leg_columns, 'is_available', return_value=False):
+            graph = get_sametime_graph(short_legs, resolution=10, as_json=True)
+        self.assertEqual([line['y'] for line in graph['data']], [[2]])
+
+    def test_summarize(self):
+        collection, columnar = self._get_collections(1000)
+
+        self.assertEqual(summarize(collection).dict(), summarize(columnar).dict())
+
+        legs = collection.legs
+        ts_start = legs[100].ts_start + timedelta(seconds=30)
+        ts_stop = legs[800].ts_start
+        self.assertEqual(
+            summarize(collection, ts_start=ts_start, ts_stop=ts_stop).dict(),
+            summarize(columnar, ts_start=ts_start, ts_stop=ts_stop).dict(),
+        )
+
+    def test_many_legs(self):
+        collection, columnar = self._get_collections(10000, seed=2)
+
+        for name, kwargs in [
+            ('get_grouped_call_stats_per__hour', {}),
+            ('grouped_legs_count_for_chunks', {}),
+            ('grouped_legs_count_for_chunks', {'resolution_seconds': 60}),
+        ]:
+            with patch.object(leg_columns, 'is_available', return_value=False):
+                result = getattr(collection, name)(**kwargs)
+            self.assertEqual(result, getattr(columnar, name)(**kwargs), name)
@@ -0,0 +1,133 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.test import override_settings
+from django.utils.timezone import now
+
+from conferencecenter.tests.base import ConferenceBaseTest
+from conferencecenter.tests.fake_redis import FakeRedis, as_bytes
+from statistics import live_state
+from statistics.models import Call, Leg
+
+
+@override_settings(LIVE_CALL_STATE=True)
+class LiveCallStateTestCase(ConferenceBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self._init()
+
+        self.connection = FakeRedis()
+        patcher = patch.object(live_state, 'get_connection', return_value=self.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.server = self.pexip.cluster.get_statistics_server()
+        self.state = live_state.LiveCallState(self.pexip.cluster.pk)
+        self.ts = now().replace(microsecond=0) - timedelta(minutes=10)
+
+    def _call(self, name, tenant='', minutes=0, **kwargs):
+        return Call.objects.create(server=self.server, guid='guid-' + name, cospace=name, tenant=tenant,
+                                   ts_start=self.ts + timedelta(minutes=minutes), **kwargs)
+
+    def _leg(self, call, name, minutes=0, **kwargs):
+        kwargs.setdefault('tenant', call.tenant)
+        return Leg.objects.create(server=self.server, call=call, guid='guid-' + name, name=name,
+                                  ts_start=self.ts + timedelta(minutes=minutes), **kwargs)
+
+    def _get_state(self):
+        calls, call_count = self.state.get_calls()
+        legs, leg_count = self.state.get_legs()
+        return [c['cospace'] for c in calls], call_count, [leg['name'] for leg in legs], leg_count
+
+    def _populate(self):
+        call1 = self._call('call1', tenant='t1')
+        call2 = self._call('call2', tenant='t2', minutes=1)
+        self._call('call3', minutes=2)  # no legs
+
+        self._leg(call1, 'leg1')
+        self._leg(call2, 'leg2', minutes=1)
+        self._leg(call1, 'leg3', minutes=2)
+        self._leg(call2, 'gateway', minutes=3, should_count_stats=False)
+        return call1, call2
+
+    def test_update(self):
+        call1, call2 = self._populate()
+        self.state.rebuild()  # mark as synced
+
+        self.assertEqual(self._get_state(), (['call1', 'call2'], 2, ['leg1', 'leg2', 'leg3'], 3))
+        self.assertEqual(self.state.get_calls(tenant='t1')[1], 1)
+        self.assertEqual(self.state.get_leg_count(tenant='t1'), 2)
+        self.assertEqual(self.state.get_legs(offset=1, limit=1)[0][0]['name'], 'leg2')
+
+        leg2 = Leg.objects.get(name='leg2')
+        leg2.ts_stop = now()
+        leg2.save()
+        self.assertEqual(self._get_state(), (['call1'], 1, ['leg1', 'leg3'], 2))
+        self.assertEqual(self.state.get_call_count(tenant='t2'), 0)
+
+        call1.tenant = 't2'
+        call1.save()
+        self.assertEqual(self.state.get_call_count(tenant='t1'), 0)
+        self.assertEqual(self.state.get_call_count(tenant='t2'), 1)
+
+        call1.ts_stop = now()
+        call1.save()
+        self.assertEqual(self._get_state(), ([], 0, [], 0))
+        self.assertLessEqual(set(self.connection.data), {as_bytes(self.state.synced_key), as_bytes(self.state.keys_key)})
+
+    def test_rebuild(self):
+        self._populate()
+        expected = self._get_state()
+        data = dict(self.connection.data)
+
+        self.connection.data.clear()
+        Leg.objects.filter(name='leg1').update(name='renamed')
+        self.assertEqual(self.state.rebuild(), (2, 3))
+
+        self.assertTrue(live_state.get_for_cluster(self.pexip.cluster))
+        self.assertEqual(self._get_state(), (expected[0], 2, ['renamed', 'leg2', 'leg3'], 3))
+        self.assertEqual(set(self.connection.data) - {as_bytes(self.state.synced_key)}, set(data))
+
+        Call.objects.filter(cospace='call2').update(ts_stop=now())
+        live_state.reconcile([self.pexip.cluster])
+        self.assertEqual(self._get_state(), (['call1'], 1, ['renamed', 'leg3'], 2))
+
+    def test_clustered_correlator(self):
+        call1 = self._call('call', correlator_guid='correlator')
+        call2 = Call.objects.create(server=self.server, guid='guid-call-node2', cospace='call',
+                                    correlator_guid='correlator', ts_start=self.ts)
+        self._leg(call1, 'leg1')
+        self._leg(call2, 'leg2')
+        self.assertEqual(self._get_state(), (['call'], 1, ['leg1', 'leg2'], 2))
+
+        call1.ts_stop = now()
+        call1.save()
+        self.assertEqual(self._get_state(), (['call'], 1, ['leg2'], 1))
+
+        call2.ts_stop = now()
+        call2.save()
+        self.assertEqual(self._get_state(), ([], 0, [], 0))
+
+    def test_pexip_api(self):
+        self._populate()
+        self.pexip.cluster.use_local_call_state = True
+        self.pexip.cluster.save()
+
+        api = self.pexip.get_api(self.customer, allow_cached_values=True)
+        self.assertTrue(api.use_call_cache)
+
+        with override_settings(LIVE_CALL_STATE=False):
+            expected_calls = api.get_calls()
+            expected_legs = api.get_participants()
+
+        self.assertIsNone(api.get_live_call_state())  # not synced
+        self.state.rebuild()
+
+        with patch.object(Call.objects, 'distinct', side_effect=AssertionError), \
+                patch.object(Leg.objects, 'filter', side_effect=AssertionError):
+            self.assertEqual(api.get_calls(), expected_calls)
+            self.assertEqual(api.get_participants(), expected_legs)
+            self.assertEqual(api.get_calls(tenant='t2', limit=1)[1], 1)
+
+        self.assertEqual(api.get_calls(filter='call2')[1], 1)  # database
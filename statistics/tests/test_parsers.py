@@ -2,7 +2,11 @@ import csv
 from copy import deepcopy
 from io import StringIO
 from os.path import dirname
+from unittest.mock import patch
 import json
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
 from organization.models import OrganizationUnit, UserUnitRelation, CoSpaceUnitRelation
 from conferencecenter.tests.mock_data.pexip import eventsink_events
@@ -10,6 +14,7 @@ from policy.models import ActiveParticipant
 from provider.models.provider import Provider
 from statistics.models import Call, Server, Leg
 from conferencecenter.tests.base import ConferenceBaseTest
+from conferencecenter.tests.fake_redis import FakeRedis
 
 from statistics.parser.cisco_ce import CiscoCEStatisticsParser
 from statistics.parser.pexip import PexipEventParser
@@ -167,6 +172,243 @@ class AcanoTestMissingEvents(ConferenceBaseTest):
         self.assertTrue(leg.should_count_stats)
 
 
+class AcanoBatchParseTestCase(ConferenceBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self._init()
+
+    leg_update = '''
+    <?xml version="1.0" ?>
+    <records session="8bf2f897-e4d6-4217-81d2-1ad41c245389">
+        <record type="callLegUpdate" time="2022-05-17T10:08:{seconds:02d}Z">
+            <callLeg id="1611cb0c-e6a1-4e54-bd3a-53926d321da3">
+                <state>connected</state>
+                <call>d4d90b1d-7590-4a1b-8586-3dfdd35936ba</call>
+                <displayName>Name {seconds}</displayName>
+                <remoteAddress>070123456{seconds}@node01.example.org</remoteAddress>
+            </callLeg>
+        </record>
+    </records>
+    '''.strip()
+
+    def _get_payloads(self):
+        with open(dirname(__file__) + '/acano_cdr.json') as fd:
+            return [json.loads(l)['rawpost'] for l in fd.read().strip().split('\n')]
+
+    def _get_result(self, server):
+        fields = ('guid', 'ts_start', 'ts_stop', 'duration', 'target', 'name', 'protocol',
+                  'should_count_stats', 'org_unit', 'call__guid')
+        legs = Leg.objects.filter(server=server).order_by('guid').values_list(*fields)
+        calls = Call.objects.filter(server=server).order_by('guid').values_list(
+            'guid', 'ts_start', 'ts_stop', 'duration', 'cospace', 'leg_count', 'org_unit',
+        )
+        return list(legs), list(calls)
+
+    def test_same_result_as_parser(self):
+        from statistics.parser.acano import Parser
+        from statistics.parser.acano_batch import BatchParser
+
+        org_unit = OrganizationUnit.objects.create(customer=self.customer, name='test')
+        CoSpaceUnitRelation.objects.create(
+            unit=org_unit, provider_ref='9edd2132-11ab-481e-8bc8-6ceac75e45b0'
+        )
+
+        server = Server.objects.create(name='sequential', type=Server.ACANO)
+        batch_server = Server.objects.create(name='batch', type=Server.ACANO)
+
+        payloads = self._get_payloads()
+        for payload in payloads:
+            Parser(server).parse_xml(payload)
+
+        legs, calls = self._get_result(server)
+        self.assertTrue(legs)
+
+        # calls with the same correlator are merged, regardless of server
+        Leg.objects.filter(server=server).delete()
+        Call.objects.filter(server=server).delete()
+
+        BatchParser(batch_server).parse_payloads([(payload, None) for payload in payloads])
+
+        self.assertEqual((legs, calls), self._get_result(batch_server))
+
+    def test_transaction_chunks(self):
+        from statistics.parser import acano_batch
+        from statistics.parser.acano_batch import BatchParser
+
+        server = Server.objects.create(name='batch', type=Server.ACANO)
+        chunk_server = Server.objects.create(name='chunks', type=Server.ACANO)
+
+        payloads = [(payload, None) for payload in self._get_payloads()]
+        BatchParser(server).parse_payloads(payloads)
+
+        expected = self._get_result(server)
+        Leg.objects.filter(server=server).delete()  # calls with the same correlator are merged
+        Call.objects.filter(server=server).delete()
+
+        with patch.object(acano_batch, 'TRANSACTION_CHUNK_SIZE', 3), \
+                patch.object(BatchParser, 'flush', autospec=True, side_effect=BatchParser.flush) as flush, \
+                CaptureQueriesContext(connection) as queries:
+            records = BatchParser(chunk_server).parse_payloads(payloads)
+
+        self.assertEqual(expected, self._get_result(chunk_server))
+        self.assertGreaterEqual(flush.call_count, -(-records // 3))  # at least once per transaction
+
+        # new rows are created in bulk, unused rows for spam legs are removed
+        leg_count = Leg.objects.filter(server=chunk_server).count()
+        self.assertTrue(leg_count)
+        leg_inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "statistics_leg"')]
+        self.assertLess(len(leg_inserts), leg_count)
+        self.assertFalse(Leg.objects.filter(server=chunk_server, ts_start__isnull=True).exists())
+        self.assertFalse(Call.objects.filter(server=chunk_server, ts_start__isnull=True).exists())
+
+    def test_coalesce_updates(self):
+        from debuglog.models import AcanoCDRLog
+        from statistics.parser.acano_batch import BatchParser
+
+        from statistics.parser.acano import Parser
+
+        server = Server.objects.create(name='batch', type=Server.ACANO)
+        sequential_server = Server.objects.create(name='sequential', type=Server.ACANO)
+
+        payloads = []
+        for i in range(10):
+            payload = self.leg_update.format(seconds=i)
+            payloads.append((payload, AcanoCDRLog.objects.store(content=payload, ip='127.0.0.1')))
+
+        with CaptureQueriesContext(connection) as sequential_queries:
+            Parser(sequential_server).parse_xml(payloads[0][0])
+            Parser(sequential_server).parse_xml(payloads[1][0])
+
+        self.assertEqual(BatchParser(server).parse_payloads(payloads[:5]), 1)
+
+        leg = Leg.objects.get(server=server, guid='1611cb0c-e6a1-4e54-bd3a-53926d321da3')
+        self.assertEqual(leg.name, 'Name 4')
+        self.assertEqual(leg.target, '0701234560@node01.example.org')  # first record creates leg
+        self.assertEqual(leg.call.guid, 'd4d90b1d-7590-4a1b-8586-3dfdd35936ba')
+        self.assertEqual(leg.acano_cdr_event_logs.count(), 5)
+
+        # five updates using fewer queries than two updates in sequence
+        with CaptureQueriesContext(connection) as batch_queries:
+            self.assertEqual(BatchParser(server).parse_payloads(payloads[5:]), 1)
+        self.assertLess(len(batch_queries), len(sequential_queries))
+
+        leg.refresh_from_db()
+        self.assertEqual(leg.name, 'Name 9')
+        self.assertEqual(leg.acano_cdr_event_logs.count(), 10)
+        self.assertEqual(Leg.objects.filter(server=server).count(), 1)
+
+    def test_order_kept_per_leg(self):
+        from statistics.parser.acano_batch import BatchParser
+
+        server = Server.objects.create(name='batch', type=Server.ACANO)
+        leg_end = AcanoTestMissingEvents.call_leg_update.replace(
+            'callLegUpdate', 'callLegEnd'
+        ).replace('<state>connected</state>', '<reason>remoteTeardown</reason><durationSeconds>98</durationSeconds>')
+
+        payloads = [
+            AcanoTestMissingEvents.call_start,
+            self.leg_update.format(seconds=1),
+            leg_end,
+            self.leg_update.format(seconds=2),
+        ]
+        self.assertEqual(BatchParser(server).parse_payloads([(p, None) for p in payloads]), 4)
+
+        leg = Leg.objects.get(server=server, guid='1611cb0c-e6a1-4e54-bd3a-53926d321da3')
+        self.assertEqual(leg.name, 'Name 2')
+        self.assertTrue(leg.ts_stop)
+        self.assertEqual(leg.duration, 98)
+
+    def test_handle_stream_entries(self):
+        from statistics.cdr_stream import StreamEntry, handle_acano_entries
+
+        server = self.acano.cluster.acano.get_statistics_server()
+        entries = [
+            StreamEntry(str(i).encode(), server.pk, payload.encode('utf-8'), '127.0.0.1')
+            for i, payload in enumerate(self._get_payloads())
+        ]
+        entries.append(StreamEntry(b'invalid', server.pk + 1000, b'', ''))
+
+        handle_acano_entries(entries)
+
+        call = Call.objects.get(server=server, cospace_id='9edd2132-11ab-481e-8bc8-6ceac75e45b0')
+        self.assertGreater(call.duration, 60)
+        self.assertTrue(call.acano_cdr_event_logs.exists())
+
+    @override_settings(TEST_MODE=False)
+    def test_handle_stream_entries_failed(self):
+        from statistics.cdr_stream import StreamEntry, handle_acano_entries
+
+        server = self.acano.cluster.acano.get_statistics_server()
+        entries = [
+            StreamEntry(str(i).encode(), server.pk, payload.encode('utf-8'), '127.0.0.1')
+            for i, payload in enumerate(self._get_payloads())
+        ]
+
+        with patch('statistics.parser.acano_batch.BatchParser.parse_payloads', side_effect=ValueError):
+            self.assertEqual(handle_acano_entries(entries), entries)
+        self.assertEqual(handle_acano_entries(entries), [])
+
+
+class CDRStreamDrainTestCase(ConferenceBaseTest):
+
+    def setUp(self):
+        from statistics.cdr_stream import CDRStream
+
+        super().setUp()
+        self.connection = FakeRedis()
+        self.stream = CDRStream('test', connection=self.connection)
+        self.handled = []
+
+    def _add(self, *server_ids):
+        for server_id in server_ids:
+            self.stream.add(server_id, 'payload{}'.format(len(self.stream)).encode())
+
+    def _handler(self, failing_server_ids=()):
+        def _handle(entries):
+            self.handled.extend(entry.payload for entry in entries if entry.server_id not in failing_server_ids)
+            return [entry for entry in entries if entry.server_id in failing_server_ids]
+        return _handle
+
+    def test_failed_kept_first(self):
+        from statistics.cdr_stream import drain
+
+        self._add(1, 2, 1, 2, 1, 2)
+        self.assertEqual(drain(self.stream, self._handler({2}), batch_size=4), 2)
+        self.assertEqual(len(self.stream), 4)
+
+        self.assertEqual(drain(self.stream, self._handler()), 0)  # retry delay
+        self.connection.delete('test.retry')
+
+        self.assertEqual(drain(self.stream, self._handler(), batch_size=4), 4)
+        self.assertEqual(len(self.stream), 0)
+        self.assertEqual(self.handled, [b'payload0', b'payload2', b'payload1', b'payload3', b'payload4', b'payload5'])
+        self.assertEqual(self.connection.hgetall('test.attempts'), {})
+
+    def test_dead_letter(self):
+        from statistics.cdr_stream import MAX_ATTEMPTS, drain
+
+        self._add(1, 2, 1)
+        for _i in range(MAX_ATTEMPTS):
+            self.connection.delete('test.retry')
+            drain(self.stream, self._handler({2}))
+
+        self.assertEqual(len(self.stream), 0)
+        self.assertEqual(self.handled, [b'payload0', b'payload2'])
+        self.assertEqual([fields[b'payload'] for _id, fields in self.connection.xrange('test.failed')], [b'payload1'])
+
+    def test_lock_expired(self):
+        from statistics.cdr_stream import drain
+
+        def _handle(entries):
+            self.connection.delete('test.lock')  # lock timeout during slow batch
+            return self._handler()(entries)
+
+        self._add(1, 1, 1)
+        self.assertEqual(drain(self.stream, _handle, batch_size=2), 2)
+        self.assertEqual(len(self.stream), 1)
+
+
 class CiscoCEParseTestCase(ConferenceBaseTest):
 
     def test_parse_cisco_ce_roomkit(self):
@@ -288,6 +530,144 @@ class PexipParseTestCase(ConferenceBaseTest):
         self.assertEqual(Call.objects.filter(server=server).first().tenant, self.customer.pexip_tenant_id)
         self.assertEqual(Leg.objects.filter(server=server).first().tenant, self.customer.pexip_tenant_id)
 
+    def _get_batch_events(self):
+        events = [eventsink_events['conference_started'], eventsink_events['participant_connected']]
+        for i in range(3):
+            update = deepcopy(eventsink_events['participant_connected'])
+            update['event'] = 'participant_updated'
+            update['data']['display_name'] = 'Name {}'.format(i)
+            events.append(update)
+
+        other = deepcopy(eventsink_events['participant_connected'])
+        other['data']['conversation_id'] = other['data']['call_id'] = other['data']['uuid'] = \
+            'd90e5a2a-1b8b-4a44-9a51-5a6c1f5e0f11'
+        events.append(other)
+
+        disconnected = deepcopy(eventsink_events['participant_disconnected'])
+        disconnected['data']['display_name'] = 'Name 2'
+        events.append(disconnected)
+        events.append(eventsink_events['conference_ended'])
+        return deepcopy(events)
+
+    def _get_batch_result(self, server):
+        legs = Leg.objects.filter(server=server).order_by('guid').values_list(
+            'guid', 'name', 'ts_start', 'ts_stop', 'duration', 'should_count_stats', 'tenant', 'target',
+        )
+        calls = Call.objects.filter(server=server).values_list('cospace', 'ts_start', 'ts_stop', 'tenant')
+        return list(legs), list(calls)
+
+    def test_batch_same_result_as_parser(self):
+        from statistics.parser.pexip_batch import PexipEventBatchParser
+
+        pexip = self.pexip.cluster
+        server = Server.objects.create(type=Server.PEXIP, cluster=pexip)
+        batch_server = Server.objects.create(type=Server.PEXIP, cluster=pexip)
+
+        for event in self._get_batch_events():
+            PexipEventParser(server).parse_eventsink_event(event)
+
+        events = [(event, None) for event in self._get_batch_events()]
+        self.assertEqual(PexipEventBatchParser(batch_server).parse_eventsink_events(events), 6)
+
+        legs, calls = self._get_batch_result(server)
+        self.assertEqual(len(legs), 2)
+        self.assertEqual((legs, calls), self._get_batch_result(batch_server))
+
+    def test_batch_lock_legs(self):
+        from django.db import transaction
+
+        from statistics.parser.pexip_batch import BatchEvent, PexipEventBatchParser
+
+        server = self.pexip.cluster.get_statistics_server()
+        events = self._get_batch_events()
+        PexipEventBatchParser(server).parse_eventsink_events([(event, None) for event in events])
+
+        # e.g. participant moved to another conference, handled by another partition
+        moved = deepcopy(events[-2])
+        moved['data']['conference'] = 'meet.other'
+        with transaction.atomic():
+            locked = PexipEventBatchParser(server).lock_legs([BatchEvent(moved), BatchEvent(events[-1])])
+        self.assertEqual(locked, [Leg.objects.get(server=server, guid=moved['data']['call_id']).pk])
+
+    def test_batch_cdr_state(self):
+        from unittest.mock import patch
+
+        from django.core.cache import cache
+
+        from statistics.parser.pexip_batch import PexipEventBatchParser
+
+        server = self.pexip.cluster.get_statistics_server()
+        events = [(event, None) for event in self._get_batch_events()[:6]]  # active
+
+        with patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            PexipEventBatchParser(server).parse_eventsink_events(events)
+        self.assertEqual(set_many.call_count, 1)
+        self.assertEqual(len(set_many.call_args[0][0]), 2)  # legs. call state is not set for old events
+
+        guids = list(Leg.objects.filter(server=server).values_list('guid', flat=True))
+        with patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            states = Leg.get_many_cdr_state_info(self.pexip.cluster.pk, guids + ['', 'missing'])
+            call_states = Call.get_many_cdr_state_info(self.pexip.cluster.pk, ['meet.webapp'])
+        self.assertEqual(get_many.call_count, 2)
+
+        self.assertEqual(len(states), 3)
+        self.assertEqual(states['missing'], {})
+        self.assertEqual(
+            {state.get('display_name') for guid, state in states.items() if guid in guids},
+            {'Name 2', eventsink_events['participant_connected']['data']['display_name']},
+        )
+        self.assertEqual(call_states, {'meet.webapp': {}})
+
+    def test_batch_coalesce(self):
+        from statistics.parser.pexip_batch import BatchEvent, coalesce_events
+
+        events = [BatchEvent(event) for event in self._get_batch_events()]
+        result = coalesce_events(events)
+        self.assertEqual([e.event['event'] for e in result], [
+            'conference_started', 'participant_connected', 'participant_updated',
+            'participant_connected', 'participant_disconnected', 'conference_ended',
+        ])
+        self.assertEqual(result[2].event['data']['display_name'], 'Name 2')
+
+        # other participant in same conversation ends run
+        other = deepcopy(events[3].event)
+        other['data']['call_id'] += '2'
+        result = coalesce_events([events[2], BatchEvent(other), events[3], events[4]])
+        self.assertEqual(len(result), 3)
+        self.assertEqual(result[2].event['data']['display_name'], 'Name 2')
+
+    def test_batch_partition(self):
+        from statistics.cdr_stream import PexipEventStream
+
+        partitions = {PexipEventStream.get_partition(event) for event in self._get_batch_events()}
+        self.assertEqual(len(partitions), 1)
+
+        other = deepcopy(eventsink_events['conference_started'])
+        other_partitions = set()
+        for i in range(10):
+            other['data']['name'] = 'meet.other{}'.format(i)
+            other_partitions.add(PexipEventStream.get_partition(other))
+        self.assertGreater(len(other_partitions), 1)
+
+    def test_handle_stream_entries(self):
+        from debuglog.models import PexipEventLog
+        from statistics.cdr_stream import StreamEntry, handle_pexip_entries
+
+        server = self.pexip.cluster.get_statistics_server()
+        entries = [
+            StreamEntry(str(i).encode(), server.pk, json.dumps(event).encode('utf-8'), '127.0.0.1')
+            for i, event in enumerate(self._get_batch_events())
+        ]
+        entries.append(StreamEntry(b'invalid', server.pk, b'', ''))
+
+        handle_pexip_entries(entries)
+
+        self.assertEqual(PexipEventLog.objects.count(), 8)
+        leg = Leg.objects.get(server=server, guid=eventsink_events['participant_connected']['data']['call_id'])
+        self.assertEqual(leg.name, 'Name 2')
+        self.assertTrue(leg.ts_stop)
+        self.assertEqual(leg.pexip_cdr_event_logs.count(), 5)  # including coalesced updates
+
     def test_pexip_csv(self):
 
         self._init()
@@ -0,0 +1,226 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils.timezone import make_aware, utc
+
+from conferencecenter.tests.base import ConferenceBaseTest
+from statistics import rollup
+from statistics.models import Call, HourlyCallStats, Leg, Server, ServerTenant, Tenant
+from statistics.tests.test_leg_columns import get_synthetic_legs
+from statistics.utils.leg_collection import LegCollection
+
+
+class HourlyCallStatsTestCase(ConferenceBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self._init()
+
+        self.server = self.acano.cluster.get_statistics_server()
+        ServerTenant.objects.create(server=self.server, tenant=Tenant.objects.get_or_create(guid=self.customer.acano_tenant_id)[0])
+
+        legs = get_synthetic_legs(200)
+        calls = Call.objects.bulk_create([
+            Call(server=self.server, guid='call{}'.format(call_id))
+            for call_id in sorted({leg.call_id for leg in legs})
+        ])
+        call_ids = {int(call.guid[4:]): call.pk for call in Call.objects.filter(server=self.server)}
+        self.assertEqual(len(calls), len(call_ids))
+
+        Leg.objects.bulk_create([
+            Leg(
+                server=self.server,
+                call_id=call_ids[leg.call_id],
+                guid=leg.guid,
+                ts_start=leg.ts_start,
+                ts_stop=leg.ts_stop,
+                duration=leg.duration,
+                target=leg.target,
+                tenant=leg.tenant,
+                ou=leg.ou,
+                is_guest=leg.is_guest,
+            )
+            for leg in legs
+        ])
+        for call in Call.objects.filter(server=self.server):
+            call_legs = call.legs.all()
+            Call.objects.filter(pk=call.pk).update(
+                ts_start=min(leg.ts_start for leg in call_legs),
+                ts_stop=max(leg.ts_stop for leg in call_legs),
+            )
+
+        self.ts_start = make_aware(datetime(2021, 3, 27))
+        self.ts_stop = make_aware(datetime(2021, 3, 31))
+
+    def _get_raw_hours(self, ts_start, ts_stop):
+        legs = Leg.objects.filter(server=self.server, ts_stop__gte=ts_start, ts_start__lte=ts_stop).order_by('ts_start')
+        return LegCollection.from_queryset(legs, ts_start, ts_stop).get_grouped_call_seconds_per__hour()[3]['']
+
+    def assertSameSeconds(self, first, second):
+        self.assertEqual(set(first), set(second))
+        for key in first:
+            self.assertAlmostEqual(first[key], second[key], places=3, msg=key)
+
+    def test_update(self):
+        count = rollup.update_hourly_stats(self.server, self.ts_start, self.ts_stop)
+        self.assertEqual(count, HourlyCallStats.objects.filter(server=self.server).count())
+        self.assertEqual(HourlyCallStats.objects.filter(server=self.server, is_total=True).count(), 4 * 24)
+
+        legs = list(Leg.objects.filter(server=self.server))
+        totals = HourlyCallStats.objects.filter(server=self.server, is_total=True)
+
+        self.assertAlmostEqual(
+            sum(row.call_seconds for row in totals),
+            sum((leg.ts_stop - leg.ts_start).total_seconds() for leg in legs),
+            places=3,
+        )
+        self.assertAlmostEqual(
+            sum(row.guest_seconds for row in totals),
+            sum((leg.ts_stop - leg.ts_start).total_seconds() for leg in legs if leg.is_guest),
+            places=3,
+        )
+        self.assertEqual(sum(row.started_calls for row in totals), len({leg.call_id for leg in legs}))
+        self.assertEqual(sum(row.started_legs for row in totals), len(legs))
+
+        target_seconds = {}
+        for row in HourlyCallStats.objects.filter(server=self.server, is_total=False):
+            target_seconds[row.target] = target_seconds.get(row.target, 0) + row.call_seconds
+
+        for target, seconds in target_seconds.items():
+            expected = sum((leg.ts_stop - leg.ts_start).total_seconds() for leg in legs if leg.target == target)
+            self.assertAlmostEqual(seconds, expected, places=3)
+
+    def test_check(self):
+        rollup.update_hourly_stats(self.server, self.ts_start, self.ts_stop)
+        self.assertEqual(rollup.check_hourly_stats(self.server, self.ts_start, self.ts_stop), [])
+
+        leg = Leg.objects.filter(server=self.server).order_by('ts_start')[10]
+        Leg.objects.filter(pk=leg.pk).update(ts_stop=leg.ts_stop + timedelta(hours=1))
+
+        differences = rollup.check_hourly_stats(self.server, self.ts_start, self.ts_stop)
+        self.assertTrue(differences)
+        self.assertIn('call_seconds', {difference.field for difference in differences})
+        self.assertIn(None, {difference.key for difference in differences})
+
+        call_command('statistics_rollup', server=[self.server.pk], start='2021-03-27', stop='2021-03-30', check=True, stdout=open('/dev/null', 'w'))
+
+        rollup.history_rewritten(server=self.server)  # not enabled
+        self.assertTrue(rollup.check_hourly_stats(self.server, self.ts_start, self.ts_stop))
+
+        with override_settings(STATS_ROLLUP=True):
+            rollup.history_rewritten(server=self.server)
+        self.assertEqual(rollup.check_hourly_stats(self.server, self.ts_start, self.ts_stop), [])
+
+    def test_call_seconds_per_hour(self):
+        rollup.update_hourly_stats(self.server, self.ts_start, self.ts_stop)
+
+        # unaligned range, with missing hours
+        ts_start = make_aware(datetime(2021, 3, 28, 1, 30))
+        ts_stop = make_aware(datetime(2021, 3, 29, 10, 15, 30))
+        HourlyCallStats.objects.filter(server=self.server, ts_hour__gte=datetime(2021, 3, 28, 12, tzinfo=utc),
+                                       ts_hour__lt=datetime(2021, 3, 28, 15, tzinfo=utc)).delete()
+
+        self.assertSameSeconds(
+            rollup.get_call_seconds_per_hour([self.server], ts_start, ts_stop),
+            self._get_raw_hours(ts_start, ts_stop),
+        )
+
+    def test_totals(self):
+        rollup.update_hourly_stats(self.server, self.ts_start, self.ts_stop)
+
+        # unaligned range, with missing hours
+        ts_start = make_aware(datetime(2021, 3, 28, 1, 30))
+        ts_stop = make_aware(datetime(2021, 3, 29, 10, 15, 30))
+        HourlyCallStats.objects.filter(server=self.server, ts_hour__gte=datetime(2021, 3, 28, 12, tzinfo=utc),
+                                       ts_hour__lt=datetime(2021, 3, 28, 15, tzinfo=utc)).delete()
+
+        totals = rollup.get_totals([self.server], ts_start, ts_stop)
+
+        legs = list(Leg.objects.filter(server=self.server).order_by('ts_start'))
+        started = [leg for leg in legs if ts_start <= leg.ts_start < ts_stop]
+        first_legs = {}
+        for leg in legs:
+            first_legs.setdefault(leg.call_id, leg)
+
+        self.assertAlmostEqual(totals.call_seconds, sum(self._get_raw_hours(ts_start, ts_stop).values()), places=3)
+        self.assertEqual(totals.started_legs, len(started))
+        self.assertEqual(totals.started_calls, len([leg for leg in first_legs.values() if leg in started]))
+
+    def test_call_updated(self):
+        call = Call.objects.filter(server=self.server).order_by('ts_start').first()
+        call.ts_finalized = call.ts_stop
+        call.save()
+        self.assertFalse(HourlyCallStats.objects.exists())
+
+        call = Call.objects.get(pk=call.pk)
+        with override_settings(STATS_ROLLUP=True), \
+                patch.object(rollup, 'schedule_update', wraps=rollup.schedule_update) as schedule_update:
+            call.save()  # already finalized
+            self.assertEqual(schedule_update.call_count, 0)
+
+            call.ts_finalized = call.ts_stop + timedelta(minutes=1)
+            call.save()
+            self.assertEqual(schedule_update.call_count, 1)
+
+            call.save()
+            self.assertEqual(schedule_update.call_count, 1)
+
+            other = Call.objects.filter(server=self.server, ts_finalized__isnull=True).first()
+            other.save()
+            self.assertEqual(schedule_update.call_count, 1)
+
+        self.assertTrue(HourlyCallStats.objects.filter(server=self.server, ts_hour__lte=call.ts_start).exists())
+        self.assertEqual(rollup.check_hourly_stats(self.server, call.ts_start, call.ts_stop), [])
+
+    def test_active_legs(self):
+        leg = Leg.objects.filter(server=self.server).order_by('ts_start')[100]
+        Leg.objects.filter(pk=leg.pk).update(ts_stop=None)
+
+        with patch.object(rollup, 'now', return_value=leg.ts_start + timedelta(hours=24)):
+            rollup.update_hourly_stats(self.server, self.ts_start, self.ts_stop)
+
+        # hours from start of active leg are not stored
+        hours = HourlyCallStats.objects.filter(server=self.server, is_total=True).values_list('ts_hour', flat=True)
+        self.assertEqual(max(hours), rollup.floor_hour(leg.ts_start) - timedelta(hours=1))
+
+        # too old to still be active
+        rollup.update_hourly_stats(self.server, self.ts_start, self.ts_stop)
+        self.assertEqual(HourlyCallStats.objects.filter(server=self.server, is_total=True).count(), 4 * 24)
+
+    def test_management_command(self):
+        call_command('statistics_rollup', server=[self.server.pk], start='2021-03-27', stop='2021-03-30', stdout=open('/dev/null', 'w'))
+        self.assertTrue(HourlyCallStats.objects.filter(server=self.server, ts_hour__lt=self.ts_stop).exists())
+        self.assertEqual(rollup.check_hourly_stats(self.server, self.ts_start, self.ts_stop), [])
+
+    def test_dashboard(self):
+        User.objects.create_user(username='test', password='test', is_superuser=True, is_staff=True)
+        self.client.login(username='test', password='test')
+
+        Server.objects.exclude(pk=self.server.pk).delete()  # dashboard uses first available server
+
+        rollup.update_hourly_stats(self.server, self.ts_start, self.ts_stop)
+        params = { 'ts_start': '2021-03-28 01:30', 'ts_stop': '2021-03-29 10:00'}
+
+        response = self.client.get('/json-api/v1/call_statistics/dashboard/', params)
+        self.assertEqual(response.status_code, 200)
+        expected = response.json()['graphs']['seconds_per_hour']['data']
+        expected_total = response.json()['summary']['cospace_total']
+        self.assertTrue(expected)
+
+        with override_settings(STATS_ROLLUP=True), \
+                patch.object(rollup, 'get_call_seconds_per_hour', wraps=rollup.get_call_seconds_per_hour) as get_seconds, \
+                patch('statistics.forms.StatsForm.get_calls_and_legs') as get_calls_and_legs:
+            response = self.client.get('/json-api/v1/call_statistics/dashboard/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(get_seconds.called)
+        self.assertFalse(get_calls_and_legs.called)
+        self.assertEqual(response.json()['graphs']['seconds_per_hour']['data'], expected)
+
+        total = response.json()['summary']['cospace_total']
+        self.assertAlmostEqual(total['duration'], expected_total['duration'], delta=0.1)
+        self.assertGreater(total['guest_duration'], 0)
+        self.assertGreater(total['call_count'], 0)
+        self.assertGreater(total['participant_count'], 0)
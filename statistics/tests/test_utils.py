@@ -1,6 +1,7 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 
-from django.utils.timezone import now
+from django.test import SimpleTestCase
+from django.utils.timezone import now, utc
 
 from conferencecenter.tests.base import ConferenceBaseTest
 from provider.models.provider import Cluster
@@ -68,3 +69,80 @@ class UtilsTestCase(ConferenceBaseTest):
 
         reset_missing_leg_stop_time(cluster.pk)
         self.assertEqual(Leg.objects.filter(ts_stop__isnull=True).count(), 0)
+
+    def test_leg_org_unit_relations(self):
+        from organization.models import CoSpaceUnitRelation, OrganizationUnit, UserUnitRelation
+        from statistics.tests.test_leg_columns import get_synthetic_legs
+        from statistics.utils.leg_collection import LegsOrgUnitRelations
+
+        unit = OrganizationUnit.objects.create(name='Unit', customer=self.customer)
+        unit2 = OrganizationUnit.objects.create(name='Unit2', customer=self.customer)
+
+        legs = get_synthetic_legs(1200)
+        for i, leg in enumerate(legs):  # more values than the sqlite chunk size
+            leg.target = 'user{}@example.org'.format(i)
+            leg.call__cospace_id = 'cospace{}'.format(i)
+            leg.org_unit = None
+        legs[-1].org_unit = unit.pk
+
+        UserUnitRelation.objects.create(user_jid=legs[0].target, unit=unit)
+        UserUnitRelation.objects.create(user_jid=legs[-2].target, unit=unit2)
+        UserUnitRelation.objects.create(user_jid='other@example.org', unit=unit2)
+        CoSpaceUnitRelation.objects.create(provider_ref=legs[1].call__cospace_id, unit=unit2)
+        CoSpaceUnitRelation.objects.create(provider_ref=legs[-3].call__cospace_id, unit=unit)
+
+        relations = LegsOrgUnitRelations(legs)
+        self.assertEqual(relations.user_relations, {legs[0].target: unit.pk, legs[-2].target: unit2.pk})
+        self.assertEqual(
+            relations.cospace_relations, {legs[1].call__cospace_id: unit2.pk, legs[-3].call__cospace_id: unit.pk}
+        )
+
+        self.assertEqual(relations.get_for_leg(legs[0]), unit.pk)
+        self.assertEqual(relations.get_for_leg(legs[1]), unit2.pk)
+        self.assertEqual(relations.get_for_leg(legs[-1]), unit.pk)
+        self.assertEqual(relations.get_for_leg(legs[-4]), None)
+
+
+class TimeRangeChunkerTestCase(SimpleTestCase):
+
+    def test_first_step_microseconds(self):
+        from statistics.utils.time import TimeRangeChunker
+
+        ts_start = datetime(2021, 3, 1, 10, 0, 0, 500000, tzinfo=utc)
+        ts_stop = datetime(2021, 3, 1, 12, 30, tzinfo=utc)
+
+        chunker = TimeRangeChunker(3600)
+        # step at the truncated start time would be before ts_start
+        self.assertEqual(chunker.get_first_step(ts_start), datetime(2021, 3, 1, 11, tzinfo=utc))
+
+        durations = list(TimeRangeChunker(3600).iter_chunks_duration(ts_start, ts_stop, '%H:%M'))
+        self.assertEqual([label for label, _seconds in durations], ['10:00', '11:00', '12:00'])
+        self.assertAlmostEqual(sum(seconds for _label, seconds in durations), (ts_stop - ts_start).total_seconds())
+
+    def test_first_step_dst_change(self):
+        from pytz import timezone
+
+        from statistics.utils.time import TimeRangeChunker
+
+        tz = timezone('Europe/Stockholm')
+        before = tz.localize(datetime(2021, 3, 28, 1, 30))
+        after = tz.localize(datetime(2021, 3, 28, 3, 0))  # same time as step after ``before``
+
+        chunker = TimeRangeChunker(3600)
+        chunker.get_first_step(before)
+
+        # same result as without a cached step from the previous leg
+        self.assertEqual(chunker.get_first_step(after).strftime('%H:%M'), '03:00')
+        self.assertEqual(TimeRangeChunker(3600).get_first_step(after).strftime('%H:%M'), '03:00')
+
+    def test_iter_durations_without_cap(self):
+        from statistics.utils.leg_collection import LegCollection, LegCollectionRelatedData
+        from statistics.utils.report import summarize
+        from statistics.tests.test_leg_columns import get_synthetic_legs
+
+        legs = get_synthetic_legs(10)
+        collection = LegCollection(legs, related_data=LegCollectionRelatedData(units={}, users={}))
+        collection.columns = None
+
+        self.assertEqual(list(collection.iter_durations()), [(leg, leg.duration) for leg in legs])
+        self.assertEqual(summarize(collection).ou_total.participant_count, len(legs))
@@ -1,15 +1,22 @@
+import csv
 from datetime import timedelta
+from tempfile import TemporaryFile
+from unittest.mock import patch
 from urllib.parse import urlencode
 
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils.timezone import now
 from django.test import override_settings
+from openpyxl import load_workbook
 
 from conferencecenter.tests.base import ConferenceBaseTest
 from customer.models import Customer
 from organization.models import OrganizationUnit
 from statistics.models import Server, Call, Leg, ServerTenant, Tenant
+from statistics.utils import leg_collection
+from statistics.utils.leg_collection import LegCollection, iter_populated_legs
+from statistics.utils.report import debug_excel_export, iter_debug_csv_export
 
 
 class StatsViewsBase(ConferenceBaseTest):
@@ -139,6 +146,18 @@ class StatsViewsTestCase(StatsViewsBase):
         )
         self.assertEqual(response.status_code, 200)
 
+    def test_stats_excel_debug_csv(self):
+
+        response = self.client.get(
+            reverse('stats_excel_debug') + '?ts_start=2011-01-01&ts_stop=2050-01-01&format=csv&server={}'.format(self.server.pk)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8').splitlines()))
+        self.assertEqual(len(rows), 1 + Leg.objects.filter(server=self.server).count())
+        self.assertEqual({row[0] for row in rows[1:]}, set(Leg.objects.values_list('target', flat=True)))
+
     def test_stats_debug(self):
 
         response = self.client.get(reverse('stats_debug', args=[self.call.guid]))
@@ -208,3 +227,44 @@ class CallStatsAPITestCase(StatsViewsBase):
         response = self.client.get('/json-api/v1/room_statistics/settings/')
         self.assertEqual(response.status_code, 200)
         self.assertTrue(response.json().get('choices'))
+
+
+class StatsExportStreamTestCase(StatsViewsBase):
+
+    def _create_legs(self, count):
+        ts_start = now() - timedelta(days=30)
+        Leg.objects.bulk_create([
+            Leg(
+                server=self.server,
+                call=self.call,
+                target='user{}@example.org'.format(i % 500),
+                ou='ou{}'.format(i % 5),
+                local='local{}@example.org'.format(i),
+                remote='remote{}@example.org'.format(i),
+                ts_start=ts_start + timedelta(seconds=i * 10),
+                ts_stop=ts_start + timedelta(seconds=i * 10 + 600),
+                duration=600,
+            )
+            for i in range(count)
+        ])
+
+    def _get_legs(self):
+        return Leg.objects.filter(server=self.server).order_by('ts_start', 'id')
+
+    def test_stream_chunks(self):
+        self._create_legs(1200)
+        loaded = list(iter_debug_csv_export(LegCollection.from_legs(self._get_legs())))
+
+        with patch.object(leg_collection, 'populate_legs', wraps=leg_collection.populate_legs) as populate:
+            streamed = list(iter_debug_csv_export(iter_populated_legs(self._get_legs(), chunk_size=500)))
+
+        self.assertEqual(streamed, loaded)
+        self.assertEqual([len(c[0][0]) for c in populate.call_args_list], [500, 500, 204])
+
+    def test_stream_excel(self):
+        self._create_legs(600)
+        legs = iter_populated_legs(self._get_legs(), chunk_size=500)
+        with TemporaryFile() as fd:
+            debug_excel_export(legs, write_only=True).save(fd)
+            fd.seek(0)
+            self.assertEqual(load_workbook(fd).active.max_row, 1 + 604)
@@ -147,7 +147,7 @@ class LegSummaryTempRow(LegSummaryResultRow):
             duration=float('%.02f' % (self.duration / (60 * 60.0))),
             guest_duration=float('%.02f' % (self.duration / (60 * 60.0))),
             participant_count=self.participant_count,
-            call_count=len(self.call_counter or ()),
+            call_count=len(self.call_counter) if self.call_counter is not None else self.call_count,
             related_id=self.related_id,
         )
 
@@ -4,6 +4,7 @@ from typing import Iterable, Sequence, Union, List, Tuple, Optional, Dict, Itera
 
 from django.db import models
 from django.db.models.query import QuerySet
+from django.utils.functional import cached_property
 from django.utils.timezone import get_current_timezone, now
 from django.utils.translation import gettext_lazy as _
 from typing_extensions import Counter
@@ -11,12 +12,17 @@ from typing_extensions import Counter
 from customer.models import CustomerKey, Customer
 from datastore.models import acano as ds
 from organization.models import CoSpaceUnitRelation, UserUnitRelation, OrganizationUnit
+from shared.utils import iter_values_in
 from statistics.parser.utils import rewrite_internal_domains, get_internal_domains, clean_target
 from ..models import Leg, Server
+from . import leg_columns
 from .time import TimeRangeChunker, get_capped_duration
 from ..types import LegData, DurationSecondsResult, LegTimestepDuration, GroupedCallSecondsResult, \
     LegRelatedTitles, ValidCustomerRelations, CallSecondsResult
 
+# Use numpy arrays for grouping collections with at least this many legs
+COLUMNS_MIN_LEGS = 5000
+
 
 class LegCollection:
 
@@ -78,9 +84,17 @@ class LegCollection:
     def __len__(self):
         return len(self.legs)
 
+    @cached_property
+    def columns(self) -> Optional[leg_columns.LegColumns]:
+        """Columnar copy of legs for faster grouping of large collections, if numpy is installed"""
+        if not leg_columns.is_available() or len(self.legs) < COLUMNS_MIN_LEGS:
+            return None
+        return leg_columns.LegColumns(self.legs)
+
     def iter_durations(self, cap_ts_start=None, cap_ts_stop=None):
         if not (cap_ts_start or cap_ts_stop):
-            return ((leg, leg.duration) for leg in self.legs)
+            yield from ((leg, leg.duration) for leg in self.legs)
+            return
 
         for leg in self.legs:
 
@@ -191,6 +205,8 @@ class LegCollection:
         return self.count_and_sum_calls(self.iter_call_seconds_per_time_of_day())
 
     def get_grouped_call_stats_per_day(self) -> Sequence[GroupedCallSecondsResult]:
+        if self.columns is not None:
+            return self.columns.get_grouped_call_stats_per_day()
         return self.count_and_sum_calls(
             self.iter_call_seconds_per_day(),
             ['target', 'ou', 'org_unit', 'tenant', ''],
@@ -198,6 +214,8 @@ class LegCollection:
         )
 
     def get_grouped_call_stats_per__hour(self) -> Sequence[GroupedCallSecondsResult]:
+        if self.columns is not None:
+            return self.columns.get_grouped_call_stats_per__hour()
         return self.count_and_sum_calls(
             self.iter_call_seconds_per_hour(),
             ['target', 'ou', 'org_unit', 'tenant', ''],
@@ -205,6 +223,8 @@ class LegCollection:
         )
 
     def get_grouped_call_stats_per_time_of_day(self) -> Sequence[GroupedCallSecondsResult]:
+        if self.columns is not None:
+            return self.columns.get_grouped_call_stats_per_time_of_day()
         return self.count_and_sum_calls(
             self.iter_call_seconds_per_time_of_day(),
             ['target', 'ou', 'org_unit', 'tenant', ''],
@@ -288,7 +308,20 @@ class LegCollection:
             if include_empty or legs:
                 yield ts, legs
 
-    def grouped_legs_count_for_chunks(self, resolution_seconds=600) -> Sequence[Dict[str, Counter[datetime]]]:
+    def grouped_legs_count_for_chunks(
+        self,
+        resolution_seconds=600,
+        max_concurrent=False,
+    ) -> Sequence[Dict[str, Counter[datetime]]]:
+        """
+        Number of active legs for each ``resolution_seconds`` step, grouped by ou, org_unit, tenant and total.
+        If ``max_concurrent``, use the max number of legs active at the same time during the step instead
+        of the number of legs active at the start of the step
+        """
+        if leg_columns.is_available():
+            columns = self.columns or leg_columns.LegColumns(self.legs)
+            return columns.grouped_legs_count_for_chunks(resolution_seconds, max_concurrent=max_concurrent)
+
         keys = 'ou', 'org_unit', 'tenant', ''
         result: List[DefaultDict[str, Counter[datetime]]] = [defaultdict(Counter) for _k in keys]
 
@@ -300,8 +333,37 @@ class LegCollection:
                 result[2][leg.tenant][ts] += 1
                 result[3][''][ts] += 1
 
+        if max_concurrent:
+            self._add_max_concurrent(result, resolution_seconds)
+
         return [dict(r) for r in result]
 
+    def _add_max_concurrent(self, result: Sequence[DefaultDict[str, Counter[datetime]]], resolution_seconds: int):
+        "Raise counts to the number of active legs after each leg start during the step"
+        events: List[DefaultDict[str, List[Tuple[datetime, bool]]]] = [defaultdict(list) for _r in result]
+        for leg in self.legs:
+            if leg.ts_start > leg.ts_stop:
+                continue
+            for grouped_events, title in zip(events, (leg.titles.ou, leg.titles.org_unit, leg.tenant, '')):
+                grouped_events[title].append((leg.ts_start, False))
+                grouped_events[title].append((leg.ts_stop, True))
+
+        for grouped, grouped_events in zip(result, events):
+            for title, title_events in grouped_events.items():
+                counts = grouped[title]
+                chunker = TimeRangeChunker(resolution_seconds=resolution_seconds)  # cached steps expect sorted times
+                active = 0
+                for ts, is_stop in sorted(title_events):  # starts before stops at the same time
+                    if is_stop:
+                        active -= 1
+                        continue
+                    active += 1
+                    step = chunker.get_first_step(ts, open_begin=True)
+                    if active > counts[step]:
+                        counts[step] = active
+
+                grouped[title] = Counter(dict(sorted(counts.items())))
+
 
 class LegRelatedDataPopulator():
     """
@@ -498,15 +560,7 @@ class LegCollectionRelatedData:
         Get related users for legs
         """
         maybe_users = {l.target for l in legs if not l.is_guest and '@' in l.target}
-
-        TOO_MANY_LEGS = 20000  # TODO temp table or better solutions for large WHERE IN
-
-        if len(legs) > TOO_MANY_LEGS:
-            users = {username: uid for username, uid in ds.User.objects.all().values_list('username', 'uid')}
-        else:
-            users = dict(ds.User.objects.filter(username__in=maybe_users).values_list('username', 'uid'))
-
-        return users
+        return dict(iter_values_in(ds.User.objects.all(), 'username', maybe_users, 'username', 'uid'))
 
     def get_titles(self, leg: LegData) -> LegRelatedTitles:
         tenant_name = leg.overridden_tenant_title or self.tenant_titles.get(leg.tenant) or 'Default'
@@ -566,8 +620,6 @@ class LegsOrgUnitRelations:
     changed after the statistics were written
     """
 
-    TOO_MANY_LEGS = 20000  # TODO temp table or better solutions for large WHERE IN
-
     user_relations: Dict[str, int]
     cospace_owners: Dict[str, str]
     cospace_relations: Dict[str, int]
@@ -602,13 +654,13 @@ class LegsOrgUnitRelations:
 
         cospace_owners = {}
         targets_without_unit = {l.target for l in self.legs if not l.org_unit}
-        if len(self.legs) > self.TOO_MANY_LEGS:
-            user_relations = {jid: unit for jid, unit in UserUnitRelation.objects.all().values_list('user_jid', 'unit') if jid in targets_without_unit}
-            cospace_owners = {cid: username for cid, username in ds.CoSpace.objects.filter(owner__isnull=False).values_list('cid', 'owner__username') if cid in cospace_ids_without_unit}
-        else:
-            if ds.CoSpace.objects.exists():
-                cospace_owners = dict(ds.CoSpace.objects.filter(owner__isnull=False, cid__in=cospace_ids_without_unit).values_list('cid', 'owner__username'))
-            user_relations = dict(UserUnitRelation.objects.filter(user_jid__in=targets_without_unit | set(cospace_owners.values())).values_list('user_jid', 'unit'))
+        if ds.CoSpace.objects.exists():
+            cospace_owners = dict(iter_values_in(
+                ds.CoSpace.objects.filter(owner__isnull=False), 'cid', cospace_ids_without_unit, 'cid', 'owner__username'
+            ))
+        user_relations = dict(iter_values_in(
+            UserUnitRelation.objects.all(), 'user_jid', targets_without_unit | set(cospace_owners.values()), 'user_jid', 'unit'
+        ))
 
         return user_relations, cospace_owners
 
@@ -617,18 +669,38 @@ class LegsOrgUnitRelations:
         if not CoSpaceUnitRelation.objects.exists():
             return {}
 
-        if self.TOO_MANY_LEGS:
-            cospace_relations = {cid: unit_id
-                                 for cid, unit_id in CoSpaceUnitRelation.objects.all().values_list('provider_ref', 'unit')
-                                 if cid in cospace_ids_without_unit}
-        else:
-            cospace_relations = dict(CoSpaceUnitRelation.objects.filter(provider_ref__in=cospace_ids_without_unit).values_list('provider_ref', 'unit'))
-        return cospace_relations
+        return dict(iter_values_in(
+            CoSpaceUnitRelation.objects.all(), 'provider_ref', cospace_ids_without_unit, 'provider_ref', 'unit'
+        ))
 
 
 populate_legs = LegRelatedDataPopulator.populate_legs
 
 
+def iter_populated_legs(
+    leg_qs: models.QuerySet[Leg],
+    valid_relations: 'ValidCustomerRelations' = None,
+    trim_times: Tuple[datetime, datetime] = None,
+    chunk_size=2000,
+) -> Iterator[LegData]:
+    """
+    Same as populate_legs, but fetch and populate ``chunk_size`` legs at a time using a
+    server side cursor, to export any number of legs using constant memory
+    """
+    fields = [field.name for field in LegData.fields()]
+    non_db_values = LegData.non_db_values()
+
+    chunk: List[LegData] = []
+    for row in leg_qs.values_list(*fields).iterator(chunk_size=chunk_size):
+        chunk.append(LegData(*row, *non_db_values))
+        if len(chunk) >= chunk_size:
+            yield from populate_legs(chunk, valid_relations=valid_relations, trim_times=trim_times)[0]
+            chunk = []
+
+    if chunk:
+        yield from populate_legs(chunk, valid_relations=valid_relations, trim_times=trim_times)[0]
+
+
 def get_valid_relations(customers=None, user=None) -> ValidCustomerRelations:
     from organization.models import OrganizationUnit
     from customer.models import Customer
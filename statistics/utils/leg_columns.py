@@ -0,0 +1,343 @@
+"""
+Columnar copy of a LegCollection using numpy arrays, for reports with many legs.
+
+Times are stored as int64 microseconds since epoch and grouping values as categorical
+codes, so splitting legs in time steps and summing per group is done using array
+operations instead of datetime arithmetic for each leg. Results are the same as for
+the corresponding LegCollection methods. Legs must be ordered by ts_start.
+"""
+from calendar import timegm
+from collections import Counter
+from datetime import datetime, timedelta
+from operator import attrgetter
+from typing import Any, Dict, Hashable, Iterable, List, NamedTuple, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ..types import DurationSecondsResult, GroupedCallSecondsResult, LegData, LegSummaryTemp, LegSummaryTempRow
+
+US = 1000000
+EPOCH = datetime(1970, 1, 1)
+
+STATS_GROUP_ATTRS = ('target', 'ou', 'org_unit', 'tenant', '')
+
+
+def is_available():
+    return np is not None
+
+
+def _to_us(dt: datetime) -> int:
+    return timegm(dt.utctimetuple()) * US + dt.microsecond
+
+
+def _offset_us(dt: datetime) -> int:
+    offset = dt.utcoffset()
+    return offset // timedelta(microseconds=1) if offset else 0
+
+
+def _encode(values: Iterable[Hashable]) -> Tuple['np.ndarray', List[Any]]:
+    "Categorical codes for values, and the distinct values in order of first occurrence"
+    index: Dict[Hashable, int] = {}
+    codes = np.fromiter((index.setdefault(value, len(index)) for value in values), dtype=np.int64)
+    return codes, list(index)
+
+
+def _expand(counts: 'np.ndarray') -> Tuple['np.ndarray', 'np.ndarray', 'np.ndarray']:
+    "Leg index and position in leg for each item, when each leg has ``counts`` items"
+    offsets = np.cumsum(counts) - counts
+    legs = np.repeat(np.arange(len(counts)), counts)
+    return legs, np.arange(len(legs)) - offsets[legs], offsets
+
+
+def _ordered_rows(keys: 'np.ndarray', first_index: 'np.ndarray', size: int, *values: 'np.ndarray') -> Iterable[Tuple]:
+    """
+    Split combined ``group * size + subgroup`` keys and yield a tuple of group, subgroup and values
+    for each key, in order of first occurrence. Same order as when populating dicts in a loop
+    """
+    order = np.argsort(first_index)
+    keys = keys[order]
+    return zip((keys // size).tolist(), (keys % size).tolist(), *(value[order].tolist() for value in values))
+
+
+class LegSteps(NamedTuple):
+    counts: 'np.ndarray'  # number of steps for each leg
+    offsets: 'np.ndarray'  # index of first step for each leg
+    legs: 'np.ndarray'
+    wall_time: 'np.ndarray'  # step start in seconds, in local time of leg
+    seconds: 'np.ndarray'
+    is_float: 'np.ndarray'  # seconds is a calculated timedelta instead of the full step
+
+
+class LegColumns:
+
+    def __init__(self, legs: Sequence[LegData]):
+
+        self.legs = legs
+        self.count = len(legs)
+
+        self.ts_start = np.fromiter((_to_us(leg.ts_start) for leg in legs), dtype=np.int64, count=self.count)
+        self.ts_stop = np.fromiter((_to_us(leg.ts_stop) for leg in legs), dtype=np.int64, count=self.count)
+
+        # steps are aligned to local time, using the timezone of ts_start
+        self.utc_offset = np.fromiter((_offset_us(leg.ts_start) for leg in legs), dtype=np.int64, count=self.count)
+        self.tz, self.tzinfos = _encode(leg.ts_start.tzinfo for leg in legs)
+
+        self.call, _call_ids = _encode(leg.call_id for leg in legs)
+
+        self._categories: Dict[str, Tuple['np.ndarray', List[Any]]] = {}
+
+    def get_category(self, attr: str) -> Tuple['np.ndarray', List[Any]]:
+        """Codes and values for leg attribute, e.g. `tenant` or `titles.ou`. Empty attr gives a single group"""
+        if attr not in self._categories:
+            if not attr:
+                self._categories[attr] = np.zeros(self.count, dtype=np.int64), ['']
+            else:
+                self._categories[attr] = _encode(map(attrgetter(attr), self.legs))
+        return self._categories[attr]
+
+    def get_first_steps(self, resolution_seconds: int) -> 'np.ndarray':
+        "First aligned step at or after ts_start in local seconds, same as TimeRangeChunker.get_first_step"
+        seconds = -(-(self.ts_start + self.utc_offset) // US)
+        return -(-seconds // resolution_seconds) * resolution_seconds
+
+    def split_duration(self, resolution_seconds: int) -> LegSteps:
+        "Steps and duration for each leg, same as TimeRangeChunker.iter_chunks_duration"
+        step_us = resolution_seconds * US
+
+        first = self.get_first_steps(resolution_seconds)
+        first_utc = first * US - self.utc_offset
+
+        has_partial = first_utc > self.ts_start
+        partial_stop = np.minimum(self.ts_stop, first_utc)
+
+        full_counts = np.where(first_utc <= self.ts_stop, (self.ts_stop - first_utc) // step_us + 1, 0)
+        full_counts[has_partial & (partial_stop >= self.ts_stop)] = 0
+
+        counts = has_partial + full_counts
+        legs, pos, offsets = _expand(counts)
+
+        step_index = pos - has_partial[legs]  # -1 for part of first step
+        wall_time = first[legs] + step_index * resolution_seconds
+        ts = wall_time * US - self.utc_offset[legs]
+        ts_stop = self.ts_stop[legs]
+
+        is_partial = step_index < 0
+        is_last = ts > ts_stop - step_us
+
+        seconds = np.where(is_last, (ts_stop - ts) / US, float(resolution_seconds))
+        seconds[is_partial] = (partial_stop[legs] - self.ts_start[legs])[is_partial] / US
+
+        return LegSteps(counts, offsets, legs, wall_time, seconds, is_partial | is_last)
+
+    @staticmethod
+    def _format_steps(wall_time: 'np.ndarray', dateformat: str) -> Tuple['np.ndarray', List[str]]:
+        values, inverse = np.unique(wall_time, return_inverse=True)
+        codes, labels = _encode((EPOCH + timedelta(seconds=int(value))).strftime(dateformat) for value in values)
+        return codes[inverse], labels
+
+    def count_and_sum_calls(
+        self,
+        resolution_seconds: int,
+        group_dateformat: str,
+        group_attrs: Sequence[str] = STATS_GROUP_ATTRS,
+    ) -> Sequence[GroupedCallSecondsResult]:
+        "Same as LegCollection.count_and_sum_calls with group_by_titles"
+        steps = self.split_duration(resolution_seconds)
+        label_codes, labels = self._format_steps(steps.wall_time, group_dateformat)
+
+        started_legs = np.flatnonzero(steps.counts)
+
+        result = []
+        for attr in group_attrs:
+            title_codes, titles = self.get_category('titles.{}'.format(attr) if attr else '')
+
+            keys = title_codes[steps.legs] * len(labels) + label_codes
+            unique_keys, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+            seconds = np.bincount(inverse, weights=steps.seconds, minlength=len(unique_keys))
+            is_float = np.bincount(inverse, weights=steps.is_float, minlength=len(unique_keys)) > 0
+
+            # each call is counted once per title, in the first step of its first leg
+            call_titles = self.call[started_legs] * len(titles) + title_codes[started_legs]
+            first_legs = started_legs[np.unique(call_titles, return_index=True)[1]]
+            start_counts = np.bincount(inverse[steps.offsets[first_legs]], minlength=len(unique_keys))
+
+            grouped: Dict[int, Dict[str, DurationSecondsResult]] = {}
+            for title, label, cur_seconds, cur_is_float, start_count in _ordered_rows(
+                unique_keys, first_index, len(labels), seconds, is_float, start_counts
+            ):
+                row = grouped.get(title)
+                if row is None:
+                    row = grouped[title] = {}
+                row[labels[label]] = DurationSecondsResult(
+                    cur_seconds if cur_is_float else int(cur_seconds),
+                    start_count,
+                )
+            result.append({titles[title]: row for title, row in grouped.items()})
+
+        return tuple(result)
+
+    def get_grouped_call_stats_per_day(self) -> Sequence[GroupedCallSecondsResult]:
+        return self.count_and_sum_calls(24 * 60 * 60, '%Y-%m-%d')
+
+    def get_grouped_call_stats_per__hour(self) -> Sequence[GroupedCallSecondsResult]:
+        return self.count_and_sum_calls(60 * 60, '%Y-%m-%d %H:00')
+
+    def get_grouped_call_stats_per_time_of_day(self) -> Sequence[GroupedCallSecondsResult]:
+        return self.count_and_sum_calls(60 * 60, '%H:00')
+
+    def grouped_legs_count_for_chunks(self, resolution_seconds=600, max_concurrent=False) -> Sequence[Dict[str, Counter]]:
+        """
+        Number of active legs at each aligned step, same as LegCollection.grouped_legs_count_for_chunks.
+        If ``max_concurrent``, count the max number of legs active at the same time during each step instead.
+
+        Counts are calculated from sorted start and stop events using cumulative sums, so time
+        depends on the number of legs and steps, not on the duration of each leg
+        """
+        step_us = resolution_seconds * US
+
+        # steps are aligned to local time of each leg. legs with the same remainder share the same steps
+        first_steps = self.get_first_steps(resolution_seconds) * US - self.utc_offset
+        alignments = first_steps % step_us
+
+        if max_concurrent:
+            legs = np.flatnonzero(self.ts_start <= self.ts_stop)
+        else:
+            legs = np.flatnonzero(first_steps <= self.ts_stop)
+
+        if not len(legs):
+            return [{}, {}, {}, {}]
+
+        timestamps: Dict[int, datetime] = {}
+
+        def _get_datetime(ts: int) -> datetime:
+            if ts not in timestamps:
+                timestamps[ts] = self._get_datetime(ts, int(legs[0]))
+            return timestamps[ts]
+
+        result = []
+        for attr in ('titles.ou', 'titles.org_unit', 'tenant', ''):
+            title_codes, titles = self.get_category(attr)
+
+            # titles in order of first leg
+            order = legs[np.argsort(title_codes[legs], kind='stable')]
+            codes, title_index, title_counts = np.unique(title_codes[order], return_index=True, return_counts=True)
+
+            grouped: Dict[str, Counter] = {}
+            for i in np.argsort(order[title_index]):
+                title_legs = order[title_index[i]:title_index[i] + title_counts[i]]
+
+                steps: Dict[int, int] = Counter()
+                for alignment in np.unique(alignments[title_legs]).tolist():
+                    cur_legs = title_legs[alignments[title_legs] == alignment]
+                    for ts, count in self._count_active_legs(cur_legs, alignment, step_us, max_concurrent):
+                        steps[ts] += count
+
+                grouped[titles[codes[i]]] = Counter({_get_datetime(ts): count for ts, count in sorted(steps.items())})
+
+            result.append(grouped)
+
+        return result
+
+    def _count_active_legs(self, legs: 'np.ndarray', origin: int, step_us: int, max_concurrent=False) -> Iterable[Tuple[int, int]]:
+        "Active legs for each step ``origin + n * step_us`` with any active leg"
+        ts_start = self.ts_start[legs] - origin
+        ts_stop = self.ts_stop[legs] - origin
+
+        first = -(-ts_start // step_us)  # first step at or after start
+        last = ts_stop // step_us  # last step before or at stop
+
+        lowest = int((ts_start // step_us).min() if max_concurrent else first.min())
+        size = int(last.max()) - lowest + 1
+
+        # +1 from first step, -1 after last step
+        changes = np.bincount(first - lowest, minlength=size + 1) - np.bincount(last + 1 - lowest, minlength=size + 1)
+        counts = np.cumsum(changes)[:size]
+
+        if max_concurrent:
+            # running count after each start, starts before stops at the same time
+            times = np.concatenate([ts_start, ts_stop])
+            is_stop = np.repeat([False, True], len(legs))
+            order = np.lexsort((is_stop, times))
+            running = np.cumsum(np.where(is_stop[order], -1, 1))
+            is_start = ~is_stop[order]
+            np.maximum.at(counts, times[order][is_start] // step_us - lowest, running[is_start])
+
+        steps = np.flatnonzero(counts)
+        return zip(((steps + lowest) * step_us + origin).tolist(), counts[steps].tolist())
+
+    def _get_datetime(self, ts: int, leg: int) -> datetime:
+        "Datetime for utc microseconds, in the same timezone as ts_start of leg"
+        tzinfo = self.tzinfos[self.tz[leg]]
+        local = EPOCH + timedelta(microseconds=ts + int(self.utc_offset[leg]))
+        if hasattr(tzinfo, 'normalize'):  # pytz, use correct offset if daylight saving time has changed
+            return tzinfo.normalize(local.replace(tzinfo=tzinfo))
+        return local.replace(tzinfo=tzinfo)
+
+    def summarize(self, users: Dict[str, str], ts_start: datetime = None, ts_stop: datetime = None) -> LegSummaryTemp:
+        "Sums for statistics.utils.report.summarize, with durations capped to ts_start and ts_stop"
+        durations = np.fromiter((leg.duration for leg in self.legs), dtype=np.float64, count=self.count)
+        selected = np.ones(self.count, dtype=bool)
+
+        if ts_start or ts_stop:
+            cur_start, cur_stop = self.ts_start, self.ts_stop
+            if ts_start:
+                cap_start = _to_us(ts_start)
+                selected &= self.ts_stop >= cap_start
+                cur_start = np.maximum(cur_start, cap_start)
+            if ts_stop:
+                cap_stop = _to_us(ts_stop)
+                selected &= self.ts_start <= cap_stop
+                cur_stop = np.minimum(cur_stop, cap_stop)
+            is_capped = (cur_start != self.ts_start) | (cur_stop != self.ts_stop)
+            durations = np.where(is_capped, (cur_stop - cur_start) / US, durations)
+
+        selected = np.flatnonzero(selected)
+        is_guest = np.fromiter((bool(self.legs[i].is_guest) for i in selected), dtype=bool, count=len(selected))
+
+        def _rows(attr: str, related_attr: str = None, related_values=None) -> Dict[Any, LegSummaryTempRow]:
+            codes, values = self.get_category(attr)
+            codes = codes[selected]
+            leg_durations = durations[selected]
+
+            duration = np.bincount(codes, weights=leg_durations, minlength=len(values))
+            guest_duration = np.bincount(codes, weights=leg_durations * is_guest, minlength=len(values))
+            participant_count = np.bincount(codes, minlength=len(values))
+
+            call_codes = np.unique(self.call[selected] * len(values) + codes) % len(values)
+            call_count = np.bincount(call_codes, minlength=len(values))
+
+            # last non empty related id wins
+            last_related = np.full(len(values), -1, dtype=np.int64)
+            if related_attr:
+                related_codes, related = self.get_category(related_attr)
+                if related_values:
+                    related = [related_values(value) for value in related]
+                related_codes = related_codes[selected]
+                has_related = np.array([bool(value) for value in related], dtype=bool)[related_codes]
+                legs_with_related = np.flatnonzero(has_related)
+                np.maximum.at(last_related, codes[legs_with_related], legs_with_related)
+                related_ids = [related[related_codes[i]] if i >= 0 else '' for i in last_related]
+            else:
+                related_ids = [''] * len(values)
+
+            return {
+                values[i]: LegSummaryTempRow(
+                    duration=float(duration[i]),
+                    guest_duration=float(guest_duration[i]),
+                    participant_count=int(participant_count[i]),
+                    call_count=int(call_count[i]),
+                    related_id=related_ids[i],
+                )
+                for i in np.flatnonzero(participant_count)
+            }
+
+        return LegSummaryTemp(
+            cospace=_rows('titles.cospace', 'call__cospace_id'),
+            user=_rows('target', 'target', users.get),
+            ou=_rows('titles.ou'),
+            org_unit=_rows('titles.org_unit', 'org_unit'),
+        )
@@ -1,8 +1,9 @@
+import csv
 import json
 from collections import defaultdict, OrderedDict
 from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import Iterable
+from typing import Iterable, Iterator
 
 import requests
 import xlwt
@@ -194,54 +195,91 @@ def excel_export(legs: LegCollection, summary_data: LegSummaryResult = None, inc
     return output
 
 
-def debug_excel_export(legs: Iterable[LegData], **kwargs):
+def get_debug_export_headers():
+    return [
+        str(s)
+        for s in [
+            _('Deltagare'),
+            _('Lokal part'),
+            _('Motstående part'),
+            # _('Protokoll'), # TODO LegData must be extended
+            _n('Mötesrum', 'Mötesrum', 1),
+            _('Starttid'),
+            _('Sluttid'),
+            _('Sekunder'),
+            _('Grupp'),
+            _('Organisationsenhet'),
+        ]
+    ]
+
+
+# Column widths for write only workbooks, where they can't be calculated from the content
+DEBUG_EXPORT_WIDTHS = [40, 40, 40, 40, 20, 20, 10, 40, 40]
+
+
+def get_debug_export_row(leg: LegData):
+    return [
+        leg.target,
+        leg.local,
+        leg.remote,
+        # leg.get_protocol_display(),
+        leg.call__cospace,
+        make_naive(leg.ts_start),
+        make_naive(leg.ts_stop),
+        leg.duration,
+        leg.titles.org_unit,
+        leg.titles.ou,
+    ]
 
+
+def debug_excel_export(legs: Iterable[LegData], write_only=False, **kwargs):
+    """
+    Workbook with a row for each leg. Use ``write_only`` for a lazy iterator of legs,
+    rows are then written to a temporary file instead of being kept in memory
+    """
     from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
 
-    wb = Workbook()
-    ws = wb.active
-
-    ws.append(
-        [
-            str(s)
-            for s in [
-                _('Deltagare'),
-                _('Lokal part'),
-                _('Motstående part'),
-                # _('Protokoll'), # TODO LegData must be extended
-                _n('Mötesrum', 'Mötesrum', 1),
-                _('Starttid'),
-                _('Sluttid'),
-                _('Sekunder'),
-                _('Grupp'),
-                _('Organisationsenhet'),
-            ]
-        ]
-    )
+    if write_only:
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        for i, width in enumerate(DEBUG_EXPORT_WIDTHS, 1):
+            ws.column_dimensions[get_column_letter(i)].width = width
+    else:
+        wb = Workbook()
+        ws = wb.active
+
+    ws.append(get_debug_export_headers())
 
     for leg in legs:
-        ws.append(
-            [
-                leg.target,
-                leg.local,
-                leg.remote,
-                # leg.get_protocol_display(),
-                leg.call__cospace,
-                make_naive(leg.ts_start),
-                make_naive(leg.ts_stop),
-                leg.duration,
-                leg.titles.org_unit,
-                leg.titles.ou,
-            ]
-        )
+        ws.append(get_debug_export_row(leg))
 
-    for column_cells in ws.columns:
-        length = max(len(str(cell.value or '0')) for cell in column_cells)
-        ws.column_dimensions[column_cells[0].column_letter].width = min(60, length)
+    if not write_only:
+        for column_cells in ws.columns:
+            length = max(len(str(cell.value or '0')) for cell in column_cells)
+            ws.column_dimensions[column_cells[0].column_letter].width = min(60, length)
 
     return wb
 
 
+def iter_debug_csv_export(legs: Iterable[LegData]) -> Iterator[str]:
+    """
+    Yield csv lines with the same content as debug_excel_export, e.g. for StreamingHttpResponse
+    """
+    class LoopbackWriter:
+        @staticmethod
+        def write(value):
+            return value
+
+    writer = csv.writer(LoopbackWriter())
+
+    yield writer.writerow(get_debug_export_headers())
+    for leg in legs:
+        row = get_debug_export_row(leg)
+        row[4], row[5] = row[4].isoformat(sep=' '), row[5].isoformat(sep=' ')
+        yield writer.writerow(row)
+
+
 def calculate_stats(usernames, days_back=90):
     if isinstance(usernames, str):
         usernames = [usernames]
@@ -301,12 +339,15 @@ def summarize(legs: LegCollection, ou=None, ts_start=None, ts_stop=None):
 
     related_data = legs.related_data
 
-    for leg, duration in legs.iter_durations(ts_start, ts_stop):
+    if legs.columns is not None:
+        temp = legs.columns.summarize(related_data.users, ts_start, ts_stop)
+    else:
+        for leg, duration in legs.iter_durations(ts_start, ts_stop):
 
-        _add_call(temp.cospace[leg.titles.cospace], leg, duration, leg.call__cospace_id)
-        _add_call(temp.user[leg.target], leg, duration, related_data.users.get(leg.target))
-        _add_call(temp.ou[leg.titles.ou], leg, duration)
-        _add_call(temp.org_unit[leg.titles.org_unit], leg, duration, leg.org_unit)
+            _add_call(temp.cospace[leg.titles.cospace], leg, duration, leg.call__cospace_id)
+            _add_call(temp.user[leg.target], leg, duration, related_data.users.get(leg.target))
+            _add_call(temp.ou[leg.titles.ou], leg, duration)
+            _add_call(temp.org_unit[leg.titles.org_unit], leg, duration, leg.org_unit)
 
     result = temp.finalize()
 
@@ -20,6 +20,9 @@ class TimeRangeChunker:
         if not self._last_started_step:  # first run, no cached value
             return
 
+        if ts_start.utcoffset() != self._last_started_step.utcoffset():  # e.g. dst change, labels would differ
+            return
+
         if open_begin and self._last_started_step and ts_start < self._last_inclusive_step:
             return self._last_started_step
 
@@ -32,14 +35,15 @@ class TimeRangeChunker:
         if last_value:
             return last_value
 
-        if ts_start.microsecond:
-            ts_start = ts_start.replace(microsecond=0)
+        seconds_start = ts_start
+        if ts_start.microsecond:  # round up, a step at the truncated time would be before ts_start
+            seconds_start = ts_start.replace(microsecond=0) + timedelta(seconds=1)
 
-        diff = LegData.timegm(ts_start) % self.resolution_seconds
+        diff = LegData.timegm(seconds_start) % self.resolution_seconds
         if diff:
             diff = self.resolution_seconds - diff
 
-        next_step = ts_start + timedelta(seconds=diff)
+        next_step = seconds_start + timedelta(seconds=diff)
         started_step = next_step - self.step
 
         self._last_inclusive_step = next_step
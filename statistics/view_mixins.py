@@ -55,6 +55,9 @@ class CallStatisticsReportMixin(CustomerMixin):
             'sametime_graph': get_sametime_graph(legs, as_json=as_json, **kwargs),
         }
 
+    def get_summary(self, legs: LegCollection, cleaned: dict):
+        return summarize(legs, ou=cleaned.get('ou'), ts_start=cleaned.get('ts_start'), ts_stop=cleaned.get('ts_stop'))
+
     def get_settings_data(self):
         form = self.form_class(self.request.GET or None, user=self.request.user, customer=self.customer)
         return {
@@ -67,17 +70,18 @@ class CallStatisticsReportMixin(CustomerMixin):
     def get_call_data(self, form) -> Tuple[Sequence[Call], LegCollection]:
         calls, legs = form.get_calls_and_legs()
         print('=========CALLS=====', calls)
-        if self._has_all_customers():
-            valid_relations = None
-        else:
-            valid_relations = get_valid_relations(user=self.request.user)
 
         c = form.cleaned_data if form.is_valid() else {}
-        leg_collection = LegCollection.from_legs(legs, valid_relations=valid_relations,
+        leg_collection = LegCollection.from_legs(legs, valid_relations=self.get_valid_relations(),
                                                  trim_times=(c.get('ts_start'), c.get('ts_stop')))
 
         return calls, leg_collection
 
+    def get_valid_relations(self):
+        if self._has_all_customers():
+            return None
+        return get_valid_relations(user=self.request.user)
+
     def allow_debug_stats(self, form=None):
         if self.request.user.is_staff:
             return True
@@ -119,12 +123,14 @@ class CallStatisticsReportMixin(CustomerMixin):
             if target_graphs:
                 return context, form
 
+        summary = self.get_summary(legs, cleaned)
+
         context.update({
             'calls': [],
             'legs': [],
             'loaded': not form.errors and not defer_load,
-            'has_data': bool(legs),
-            'summary': summarize(legs, ou=cleaned.get('ou'), ts_start=cleaned.get('ts_start'), ts_stop=cleaned.get('ts_stop')),
+            'has_data': bool(legs) or bool(summary.cospace_total.duration),
+            'summary': summary,
             'debug_calls': debug,
             'defer_load': defer_load,
         })
@@ -3,10 +3,11 @@ import csv
 from typing import Sequence, Tuple, Iterator, Optional
 
 from cacheout import fifo_memoize
-from django.http import HttpResponse, JsonResponse, Http404, StreamingHttpResponse
+from django.http import FileResponse, HttpResponse, JsonResponse, Http404, StreamingHttpResponse
 import re
 from os import mkdir
 from os.path import exists
+from tempfile import TemporaryFile
 from django.conf import settings
 import json
 import gzip
@@ -30,7 +31,7 @@ from .parser.acano import Parser
 from .forms import StatsForm
 from .parser.mividas import MividasCSVImportExport
 from .parser.pexip import PexipParser, PexipEventParser
-from statistics.utils.report import excel_export, debug_excel_export
+from statistics.utils.report import excel_export, debug_excel_export, iter_debug_csv_export
 from .graph import get_graph, get_sametime_graph
 from sentry_sdk import capture_exception
 from customer.view_mixins import LoginRequiredMixin, CustomerMixin
@@ -38,7 +39,7 @@ from django.views.generic import TemplateView
 from django_xhtml2pdf.views import PdfMixin
 from collections import OrderedDict, Counter
 from datastore.models import acano as datastore
-from .utils.leg_collection import LegCollection
+from .utils.leg_collection import LegCollection, iter_populated_legs
 from .view_mixins import CallStatisticsReportMixin
 
 
@@ -163,31 +164,47 @@ class StatsExcelView(StatsView):
 
 
 class StatsDebugExcelView(StatsExcelView):
+    """
+    Export of all legs. Legs are fetched and written in chunks, as a csv stream if
+    ``format=csv``, else to a temporary xlsx file
+    """
 
     def dispatch(self, request, *args, **kwargs):
         return super().dispatch(request, *args, **kwargs)
 
-    def render_to_response(self, context, **response_kwargs):
+    def get(self, request, *args, **kwargs):
 
-        if not self.allow_debug_stats(context['form']):
+        form = self.get_form()
+        if not self.allow_debug_stats(form):
             return HttpResponse(_('Din användare har inte behörighet till denna vy'), status=403)
 
-        cleaned = context['form'].cleaned_data if context['form'].is_valid() else {}
-        excel = debug_excel_export(context['legs'],
-                                   ts_start=cleaned.get('ts_start'), ts_stop=cleaned.get('ts_stop'))
+        cleaned = form.cleaned_data if form.is_valid() else {}
+        trim_times = (cleaned['ts_start'], cleaned['ts_stop']) if cleaned.get('ts_start') and cleaned.get('ts_stop') else None
 
-        response = HttpResponse(content_type="application/ms-excel")
-        excel.save(response)
+        legs = iter_populated_legs(
+            form.get_calls_and_legs()[1], valid_relations=self.get_valid_relations(), trim_times=trim_times
+        )
+
+        if request.GET.get('format') == 'csv':
+            response = StreamingHttpResponse(iter_debug_csv_export(legs), content_type='text/csv')
+            extension = 'csv'
+        else:
+            excel_file = TemporaryFile()
+            debug_excel_export(legs, write_only=True).save(excel_file)
+            excel_file.seek(0)
+            response = FileResponse(excel_file, content_type='application/ms-excel')
+            extension = 'xlsx'
 
         def _format_ts(ts: Optional[datetime]):
             if not ts:
                 return 'unknown'
             return localtime(ts).replace(microsecond=0).strftime('%Y-%m-%d_%H%M')
 
-        filename = 'stats-debug_{}-{}_to_{}.xlsx'.format(
+        filename = 'stats-debug_{}-{}_to_{}.{}'.format(
             _format_ts(now()),
             _format_ts(cleaned.get('ts_start')),
             _format_ts(cleaned.get('ts_stop')),
+            extension,
         )
         response['Content-Disposition'] = 'attachment; filename={}'.format(
             filename.replace(':', '')
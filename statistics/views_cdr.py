@@ -61,6 +61,9 @@ def acano_cdr(request, name=None, secret_key=None):
         # TODO remove PossibleSpamLeg
         return HttpResponse('OK')
 
+    if settings.CDR_BATCH_HANDLING and queue_acano_cdr(server, request.body, remote_ip):
+        return HttpResponse('OK')
+
     from .tasks import handle_acano_cdr
     if settings.ASYNC_CDR_HANDLING and not settings.TEST_MODE:
         if b'type="callLegEnd"' in request.body or b'type="callEnd"' in request.body:
@@ -74,12 +77,61 @@ def acano_cdr(request, name=None, secret_key=None):
     return HttpResponse('OK')
 
 
+def _add_to_stream(get_stream, consumer_task, consumer_args, server: Server, payload: bytes, remote_ip: str) -> bool:
+    from . import cdr_stream
+
+    if not cdr_stream.is_enabled():
+        return False
+
+    try:
+        should_schedule = get_stream().add(server.pk, payload, remote_ip)
+    except Exception:
+        if RERAISE_ERRORS:
+            raise
+        capture_exception()
+        return False
+
+    if should_schedule:
+        if settings.TEST_MODE:
+            consumer_task(*consumer_args)
+        else:
+            consumer_task.apply_async(consumer_args, countdown=0.5)  # collect a few more payloads
+    return True
+
+
+def queue_acano_cdr(server: Server, payload: bytes, remote_ip: str) -> bool:
+    """Add payload to redis stream for batch handling. Returns False if not available"""
+    from .cdr_stream import AcanoCDRStream
+    from .tasks import drain_acano_cdr_stream
+
+    return _add_to_stream(AcanoCDRStream, drain_acano_cdr_stream, (), server, payload, remote_ip)
+
+
+def queue_pexip_event(server: Server, payload: bytes, remote_ip: str) -> bool:
+    """Add event to the redis stream for its conference. Returns False if not available"""
+    from .cdr_stream import PexipEventStream
+    from .tasks import drain_pexip_event_stream
+
+    try:
+        event = json.loads(force_text(payload))
+        partition = PexipEventStream.get_partition(event if isinstance(event, dict) else {})
+    except ValueError:
+        partition = 0
+
+    return _add_to_stream(
+        lambda: PexipEventStream(partition), drain_pexip_event_stream, (partition,), server, payload, remote_ip
+    )
+
+
 @csrf_exempt
 def pexip_cdr(request, name=None, secret_key=None):
     server = get_server_by_key(secret_key)
 
     remote_ip = request.META.get('REMOTE_ADDR')
 
+    if settings.CDR_BATCH_HANDLING and queue_pexip_event(server, request.body, remote_ip):
+        return HttpResponse('OK')
+
     # queue for processing
     from .tasks import handle_pexip_cdr
     if settings.ASYNC_CDR_HANDLING and not settings.TEST_MODE: